@@ -0,0 +1,139 @@
+# adc_sampler.py
+"""
+Aquisicao sobreamostrada do ADC do RP2040
+-----------------------------------------
+Faz rajadas de leituras em um array pre-alocado, com acumulacao inteira,
+decimacao e filtro opcional (mediana ou media aparada), e reporta o valor
+e a estimativa de ruido. Tudo dentro de um orcamento fixo de tempo e sem
+alocar no heap por leitura.
+
+O ADC do RP2040 tem 12 bits; read_u16() apenas desloca para 16 bits.
+O resultado e devolvido na mesma escala de read_u16(), mas com a media
+de N amostras (resolucao efetiva de 1/16 de contagem de 12 bits).
+"""
+
+from array import array
+from time import ticks_us, ticks_diff
+
+FILTER_MEAN = 0
+FILTER_MEDIAN = 1
+FILTER_TRIMMED = 2
+
+
+def _isqrt(n):
+    """Raiz quadrada inteira (Newton), sem float."""
+    if n <= 0:
+        return 0
+    x = n
+    y = (x + 1) >> 1
+    while y < x:
+        x = y
+        y = (x + n // x) >> 1
+    return x
+
+
+def _select(buf, lo, hi, k):
+    """
+    Quickselect in-place: apos a chamada, buf[k] e o k-esimo menor de
+    buf[lo:hi+1], com menores a esquerda e maiores a direita.
+    """
+    while lo < hi:
+        pivot = buf[(lo + hi) >> 1]
+        i = lo
+        j = hi
+        while i <= j:
+            while buf[i] < pivot:
+                i += 1
+            while buf[j] > pivot:
+                j -= 1
+            if i <= j:
+                t = buf[i]
+                buf[i] = buf[j]
+                buf[j] = t
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            return
+
+
+class OversampledADC:
+    """Motor de aquisicao com sobreamostragem para um canal ADC."""
+
+    def __init__(self, adc, samples=64, budget_us=2000,
+                 filter_mode=FILTER_MEAN, trim=0):
+        """
+        Args:
+            adc: instancia de machine.ADC
+            samples: tamanho maximo da rajada (array pre-alocado)
+            budget_us: tempo maximo gasto por aquisicao
+            filter_mode: FILTER_MEAN, FILTER_MEDIAN ou FILTER_TRIMMED
+            trim: amostras descartadas em cada extremo (FILTER_TRIMMED)
+        """
+        self.adc = adc
+        self.samples = samples
+        self.budget_us = budget_us
+        self.filter_mode = filter_mode
+        self.trim = trim
+        self._buf = array('H', bytes(2 * samples))
+
+        # Resultado da ultima aquisicao (inteiros, escala read_u16)
+        self.value = 0
+        self.noise = 0
+        self.count = 0
+
+    def acquire(self):
+        """
+        Executa uma rajada e atualiza value/noise/count.
+
+        Returns:
+            valor filtrado na escala de read_u16() (inteiro)
+        """
+        buf = self._buf
+        read = self.adc.read_u16
+        n_max = self.samples
+        budget = self.budget_us
+
+        start = ticks_us()
+        n = 0
+        while n < n_max:
+            buf[n] = read() >> 4
+            n += 1
+            if ticks_diff(ticks_us(), start) >= budget:
+                break
+
+        # Estatisticas em torno da 1a amostra para manter inteiros pequenos
+        x0 = buf[0]
+        s = 0
+        s2 = 0
+        for i in range(n):
+            d = buf[i] - x0
+            s += d
+            s2 += d * d
+
+        # Variancia em contagens^2 * n^2, desvio em contagens * 16
+        var_n2 = n * s2 - s * s
+        self.noise = (_isqrt(var_n2) << 4) // n if n > 1 else 0
+        self.count = n
+
+        mode = self.filter_mode
+        if mode == FILTER_MEDIAN and n > 2:
+            k = n >> 1
+            _select(buf, 0, n - 1, k)
+            self.value = buf[k] << 4
+        elif mode == FILTER_TRIMMED and n > 2 * self.trim + 1:
+            lo = self.trim
+            hi = n - 1 - self.trim
+            _select(buf, 0, n - 1, lo)
+            _select(buf, lo, n - 1, hi)
+            acc = 0
+            for i in range(lo, hi + 1):
+                acc += buf[i]
+            self.value = (acc << 4) // (hi - lo + 1)
+        else:
+            self.value = ((x0 * n + s) << 4) // n
+
+        return self.value
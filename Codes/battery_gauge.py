@@ -1,5 +1,17 @@
 # battery_gauge.py
 import time
+from array import array
+from console import say, WARN
+from event_log import EV_TIME_JUMP
+
+# Passo da tabela OCV compilada (mV) e da dimensao de temperatura (C)
+OCV_LUT_STEP_MV = 5
+OCV_LUT_STEP_C = 5.0
+
+# Salto de tempo: dt acima de JUMP_SAMPLES intervalos de amostragem (e de
+# MIN_JUMP_S) e tratado como reset/pausa longa e reinicializa pela OCV
+JUMP_SAMPLES = 3
+MIN_JUMP_S = 10.0
 
 def lerp(x0, y0, x1, y1, x):
     if x <= x0: return y0
@@ -7,12 +19,24 @@ def lerp(x0, y0, x1, y1, x):
     t = (x - x0) / (x1 - x0)
     return y0 + t * (y1 - y0)
 
+def interp_points(pts, v):
+    """Interpolacao linear por partes em pontos (V, SoC) ordenados por V."""
+    for i in range(len(pts) - 1):
+        v0, s0 = pts[i]
+        v1, s1 = pts[i+1]
+        if v0 <= v <= v1:
+            return lerp(v0, s0, v1, s1, v)
+    if v <= pts[0][0]: return pts[0][1]
+    return pts[-1][1]
+
 class BatteryGauge:
     """
     SoC por coulomb counting + correcao por OCV (Li-ion 1S).
     - Inicializa o SoC pela OCV na 1a atualizacao (evita "queda" artificial).
     - So aplica OCV quando corrente de bateria for muito baixa (repouso).
     - DETECTA RESETS e ajusta automaticamente (compativel com timestamp_manager)
+    - Curva OCV compilada em tabela densa (O(1), sem alocacao) com
+      dimensao opcional de temperatura (ocv_curves = {temp_C: pontos})
     """
     def __init__(self,
                  capacity_mAh=15000.0,
@@ -20,7 +44,9 @@ class BatteryGauge:
                  v_full=3.75,
                  v_empty=2.90,
                  rest_current_thresh_C=0.02,  # repouso: |I| < C/50 (mais rigido)
-                 blend_alpha=0.05):           # OCV puxa devagar
+                 blend_alpha=0.05,            # OCV puxa devagar
+                 ocv_curves=None,             # {temp_C: [(V, SoC), ...]}
+                 sample_interval_s=1.0):      # SAMPLE_INTERVAL do loop
         self.capacity_mAh = capacity_mAh
         self.soc = soc_init
         self.v_full = v_full
@@ -31,8 +57,9 @@ class BatteryGauge:
         self._last_t = None
         self._inited = False
         
-        # NOVO: Para detectar saltos de tempo (resets)
-        self._max_reasonable_dt = 10.0  # segundos (se dt > 10s, provavelmente resetou)
+        # Para detectar saltos de tempo (resets): derivado do intervalo
+        self.set_interval(sample_interval_s)
+        self.events = None   # EventLog (opcional): saltos de tempo viram TIME_JUMP
 
         # Curva OCV (aprox. Li-ion 1S @25C)
         self.ocv_points = [
@@ -54,39 +81,118 @@ class BatteryGauge:
             (2.90,   0.0),
         ]
 
-    def _soc_from_ocv(self, v):
-        pts = sorted(self.ocv_points, key=lambda p: p[0])
-        for i in range(len(pts) - 1):
-            v0, s0 = pts[i]
-            v1, s1 = pts[i+1]
-            if v0 <= v <= v1:
-                return lerp(v0, s0, v1, s1, v)
-        if v <= pts[0][0]: return pts[0][1]
-        return pts[-1][1]
-
-    def update(self, voltage_V, current_mA, now_s=None):
+        # Curvas por temperatura; sem elas, usa ocv_points para qualquer T
+        self.ocv_curves = ocv_curves
+        self.compile_ocv()
+
+    def set_interval(self, sample_interval_s):
+        """
+        Ajusta o limite de salto de tempo ao intervalo de amostragem
+        (chamar tambem quando SAMPLE_INTERVAL muda em funcionamento).
+        """
+        self.sample_interval_s = sample_interval_s
+        self._max_reasonable_dt = max(MIN_JUMP_S, JUMP_SAMPLES * sample_interval_s)
+
+    def compile_ocv(self):
+        """
+        Compila as curvas OCV em uma tabela densa array('H') de SoC*100,
+        indexada por [temperatura][degrau de OCV_LUT_STEP_MV].
+        Chamar novamente se ocv_points/ocv_curves forem alterados.
+        """
+        curves = self.ocv_curves or {25.0: self.ocv_points}
+        temps = sorted(curves)
+        pts_by_t = [sorted(curves[tc], key=lambda p: p[0]) for tc in temps]
+
+        v_min = min(p[0][0] for p in pts_by_t)
+        v_max = max(p[-1][0] for p in pts_by_t)
+        n_v = int(round((v_max - v_min) * 1000.0 / OCV_LUT_STEP_MV)) + 1
+        if len(temps) > 1:
+            n_t = int(round((temps[-1] - temps[0]) / OCV_LUT_STEP_C)) + 1
+        else:
+            n_t = 1
+
+        lut = array('H', bytes(2 * n_t * n_v))
+        for it in range(n_t):
+            tc = temps[0] + it * OCV_LUT_STEP_C
+            # Curvas vizinhas em temperatura e peso entre elas
+            j = 0
+            while j < len(temps) - 2 and tc > temps[j + 1]:
+                j += 1
+            if len(temps) > 1:
+                w = lerp(temps[j], 0.0, temps[j + 1], 1.0, tc)
+                lo, hi = pts_by_t[j], pts_by_t[j + 1]
+            else:
+                w = 0.0
+                lo = hi = pts_by_t[0]
+            for iv in range(n_v):
+                v = v_min + iv * OCV_LUT_STEP_MV / 1000.0
+                soc = (1.0 - w) * interp_points(lo, v) + w * interp_points(hi, v)
+                lut[it * n_v + iv] = int(soc * 100.0 + 0.5)
+
+        self._ocv_lut = lut
+        self._ocv_v_min = v_min
+        self._ocv_inv_step = 1000.0 / OCV_LUT_STEP_MV
+        self._ocv_n_v = n_v
+        self._ocv_t_min = temps[0]
+        self._ocv_n_t = n_t
+
+    def _soc_at_row(self, row, x):
+        """Interpola uma linha da tabela na posicao fracionaria x."""
+        n_v = self._ocv_n_v
+        if x <= 0.0:
+            return self._ocv_lut[row * n_v] * 0.01
+        if x >= n_v - 1:
+            return self._ocv_lut[row * n_v + n_v - 1] * 0.01
+        i = int(x)
+        base = row * n_v + i
+        s0 = self._ocv_lut[base]
+        return (s0 + (x - i) * (self._ocv_lut[base + 1] - s0)) * 0.01
+
+    def _soc_from_ocv(self, v, temp_c=None):
+        x = (v - self._ocv_v_min) * self._ocv_inv_step
+        n_t = self._ocv_n_t
+        if n_t == 1 or temp_c is None or temp_c != temp_c:  # NaN => sem T
+            row = 0
+            if n_t > 1:
+                # Sem temperatura: usa a linha mais proxima de 25 C
+                row = int((25.0 - self._ocv_t_min) / OCV_LUT_STEP_C + 0.5)
+                row = max(0, min(n_t - 1, row))
+            return self._soc_at_row(row, x)
+
+        y = (temp_c - self._ocv_t_min) / OCV_LUT_STEP_C
+        if y <= 0.0:
+            return self._soc_at_row(0, x)
+        if y >= n_t - 1:
+            return self._soc_at_row(n_t - 1, x)
+        j = int(y)
+        s0 = self._soc_at_row(j, x)
+        return s0 + (y - j) * (self._soc_at_row(j + 1, x) - s0)
+
+    def update(self, voltage_V, current_mA, now_s=None, temp_c=None):
         # Tempo robusto
         t = now_s if now_s is not None else (time.ticks_ms() / 1000.0)
 
         # 1a passada: inicializar pelo OCV
         if not self._inited or self.soc is None:
-            self.soc = self._soc_from_ocv(voltage_V)
+            self.soc = self._soc_from_ocv(voltage_V, temp_c)
             self._last_t = t
             self._inited = True
             return self.soc
 
         dt_s = t - (self._last_t or t)
         
-        # NOVO: DETECTAR RESET DE TEMPO
-        # Se dt_s for muito grande (>10s) ou negativo, provavelmente houve reset
+        # DETECTAR RESET DE TEMPO
+        # dt negativo ou maior que alguns intervalos: provavelmente houve reset
         if dt_s < 0 or dt_s > self._max_reasonable_dt:
-            print("AVISO - Battery gauge detectou salto de tempo!")
-            print("  dt = {:.2f}s (esperado: ~1s)".format(dt_s))
-            print("  Provavel causa: reset do sistema ou pause longo")
-            print("  Reinicializando gauge pelo OCV...")
+            say(WARN, "AVISO - Battery gauge detectou salto de tempo!")
+            say(WARN, "  dt = {:.2f}s (esperado: ~{}s)".format(dt_s, self.sample_interval_s))
+            say(WARN, "  Provavel causa: reset do sistema ou pause longo")
+            say(WARN, "  Reinicializando gauge pelo OCV...")
+            if self.events is not None:
+                self.events.log(EV_TIME_JUMP, 0, int(dt_s * 10))
             
             # Reinicializar pelo OCV em vez de usar coulomb counting
-            self.soc = self._soc_from_ocv(voltage_V)
+            self.soc = self._soc_from_ocv(voltage_V, temp_c)
             self._last_t = t
             return self.soc
         
@@ -107,10 +213,153 @@ class BatteryGauge:
         # OCV apenas em repouso verdadeiro (corrente muito baixa)
         use_ocv = abs(current_mA) <= self.rest_thresh_mA
         if use_ocv:
-            soc_ocv = self._soc_from_ocv(voltage_V)
+            soc_ocv = self._soc_from_ocv(voltage_V, temp_c)
             soc_new = (1.0 - self.blend_alpha) * soc_cc + self.blend_alpha * soc_ocv
         else:
             soc_new = soc_cc
 
         self.soc = max(0.0, min(100.0, soc_new))
-        return self.soc
\ No newline at end of file
+        return self.soc
+
+class BatteryGaugeFixed(BatteryGauge):
+    """
+    Mesmo algoritmo do BatteryGauge em inteiros, sem float por amostra.
+    Entradas em uV, uA, decisegundos e centi-graus; SoC em mili-porcento.
+
+    A carga e acumulada em uA*ds com resto exato (sem deriva por
+    truncamento); a diferenca para a versao float fica dentro de
+    FIXED_TOLERANCE_MP.
+    """
+
+    # Diferenca maxima esperada para BatteryGauge.update (0.01 %)
+    FIXED_TOLERANCE_MP = 10
+
+    def __init__(self, *args, **kwargs):
+        self.soc_mp = None
+        self._last_ds = None
+        self._q_acc = 0
+        super().__init__(*args, **kwargs)
+
+    # soc (float, %) e uma visao de soc_mp: leitores da API float veem o
+    # estado inteiro sem conversao por amostra
+    @property
+    def soc(self):
+        return None if self.soc_mp is None else self.soc_mp / 1000.0
+
+    @soc.setter
+    def soc(self, value):
+        self.soc_mp = None if value is None else int(value * 1000.0 + 0.5)
+
+    def set_interval(self, sample_interval_s):
+        """Tambem pre-calcula o limite inteiro (ds) usado por update_fixed."""
+        super().set_interval(sample_interval_s)
+        self._max_dt_ds = int(self._max_reasonable_dt * 10 + 0.5)
+
+    def compile_ocv(self):
+        """Compila a tabela e as constantes inteiras derivadas."""
+        super().compile_ocv()
+        self._v_min_uV = int(self._ocv_v_min * 1000000 + 0.5)
+        self._step_uV = OCV_LUT_STEP_MV * 1000
+        self._t_min_cC = int(round(self._ocv_t_min * 100))
+        self._t_step_cC = int(OCV_LUT_STEP_C * 100)
+        self._row25 = 0
+        if self._ocv_n_t > 1:
+            self._row25 = max(0, min(self._ocv_n_t - 1,
+                                     int((25.0 - self._ocv_t_min) / OCV_LUT_STEP_C + 0.5)))
+        self._v_full_uV = int((self.v_full - 0.02) * 1000000 + 0.5)
+        self._v_empty_uV = int((self.v_empty + 0.02) * 1000000 + 0.5)
+        self._rest_uA = int(self.rest_thresh_mA * 1000 + 0.5)
+        self._alpha_pm = int(self.blend_alpha * 1000 + 0.5)
+        # Carga (uA*ds) equivalente a 1 mili-porcento da capacidade
+        self._q_per_mp = int(self.capacity_mAh * 360 + 0.5)
+
+    def _row_mp(self, row, d_uV):
+        """Interpola uma linha da tabela; d_uV = v - v_min."""
+        n_v = self._ocv_n_v
+        lut = self._ocv_lut
+        step = self._step_uV
+        if d_uV <= 0:
+            return lut[row * n_v] * 10
+        if d_uV >= (n_v - 1) * step:
+            return lut[row * n_v + n_v - 1] * 10
+        i = d_uV // step
+        base = row * n_v + i
+        s0 = lut[base]
+        return (s0 * step + (d_uV - i * step) * (lut[base + 1] - s0)) // (step // 10)
+
+    def soc_mp_from_ocv(self, v_uV, temp_cC=None):
+        """SoC [mili-porcento] pela OCV, com temperatura opcional [cC]."""
+        d = v_uV - self._v_min_uV
+        n_t = self._ocv_n_t
+        if n_t == 1 or temp_cC is None:
+            return self._row_mp(self._row25, d)
+        y = temp_cC - self._t_min_cC
+        step = self._t_step_cC
+        if y <= 0:
+            return self._row_mp(0, d)
+        if y >= (n_t - 1) * step:
+            return self._row_mp(n_t - 1, d)
+        j = y // step
+        s0 = self._row_mp(j, d)
+        return s0 + ((self._row_mp(j + 1, d) - s0) * (y - j * step)) // step
+
+    def update_fixed(self, v_uV, i_uA, now_ds, temp_cC=None):
+        """
+        Atualiza o SoC com entradas inteiras.
+
+        Args:
+            v_uV: tensao da bateria [uV]
+            i_uA: corrente da bateria [uA], positiva = descarga
+            now_ds: timestamp [decisegundos]
+            temp_cC: temperatura [centi-graus] ou None
+
+        Returns:
+            SoC [mili-porcento, 0..100000]
+        """
+        if not self._inited or self.soc_mp is None:
+            self.soc_mp = self.soc_mp_from_ocv(v_uV, temp_cC)
+            self._last_ds = now_ds
+            self._q_acc = 0
+            self._inited = True
+            return self.soc_mp
+
+        dt = now_ds - self._last_ds
+        if dt < 0 or dt > self._max_dt_ds:
+            say(WARN, "AVISO - Battery gauge detectou salto de tempo!")
+            say(WARN, "  dt = {}ds (esperado: ~{}s)".format(dt, self.sample_interval_s))
+            say(WARN, "  Reinicializando gauge pelo OCV...")
+            if self.events is not None:
+                self.events.log(EV_TIME_JUMP, 0, dt)
+            self.soc_mp = self.soc_mp_from_ocv(v_uV, temp_cC)
+            self._last_ds = now_ds
+            self._q_acc = 0
+            return self.soc_mp
+        self._last_ds = now_ds
+
+        # Coulomb counting com resto exato
+        self._q_acc += i_uA * dt
+        steps = self._q_acc // self._q_per_mp
+        self._q_acc -= steps * self._q_per_mp
+        soc = self.soc_mp - steps
+
+        # Regras de ancoragem (tensao extrema)
+        if v_uV >= self._v_full_uV and soc < 99000:
+            soc = 99000
+        if v_uV <= self._v_empty_uV and soc > 1000:
+            soc = 1000
+
+        # OCV apenas em repouso verdadeiro
+        if -self._rest_uA <= i_uA <= self._rest_uA:
+            ocv = self.soc_mp_from_ocv(v_uV, temp_cC)
+            soc += ((ocv - soc) * self._alpha_pm + 500) // 1000
+
+        if soc < 0:
+            soc = 0
+        elif soc > 100000:
+            soc = 100000
+        self.soc_mp = soc
+        return soc
+
+    def soc_percent(self):
+        """SoC em % (float), apenas para exibicao."""
+        return None if self.soc_mp is None else self.soc_mp / 1000.0
@@ -0,0 +1,334 @@
+# burst_capture.py
+"""
+Captura de rajadas (inrush) da corrente de carga
+------------------------------------------------
+Durante o tempo ocioso entre amostras, o INA219 e lido em alta taxa e as
+contagens brutas vao para um anel pre-alocado (array('h')). Quando a
+corrente cruza um limiar, ou muda bruscamente em relacao a linha de base,
+as amostras pre e pos gatilho sao gravadas em um unico bloco binario
+(burst_NNN.bin), com cabecalho apontando para a linha do CSV corrente.
+
+O limiar absoluto dispara so na subida: depois de uma rajada ele so
+rearma quando |corrente| cai abaixo de threshold - hysteresis (uma carga
+que fica ligada acima do limiar gera uma rajada, nao uma por amostra).
+Entre duas rajadas ha pelo menos holdoff_s, e no maximo max_per_hour
+por hora; gatilhos recusados so contam em .suppressed.
+
+Uma captura ocupa post_samples * period_us mais a gravacao: no monitor()
+o gatilho so e aceito se isso cabe antes da proxima amostra; senao o
+anel segue enchendo e o gatilho conta em .late.
+
+Sem evento nao ha alocacao nem escrita em flash.
+"""
+
+import os
+import struct
+from array import array
+from time import ticks_us, ticks_ms, ticks_diff, sleep_us
+from console import say, WARN, INFO
+from write_stats import count_bytes, W_BURST
+
+BURST_MAGIC = b"FBRS"
+BURST_VERSION = 1
+
+# magic, versao, n_pre, n_pos, periodo_us, timestamp_s, lsb_mA,
+# corrente no gatilho [mA], indice do arquivo de log, linha no arquivo
+BURST_HEADER_FMT = "<4sHHHIfffHI"
+BURST_HEADER_SIZE = struct.calcsize(BURST_HEADER_FMT)
+
+
+class BurstCapture:
+    """Monitor de alta taxa com gatilho e buffer circular de pre-gatilho."""
+
+    def __init__(self, ina, logger=None,
+                 pre_samples=256,
+                 post_samples=768,
+                 threshold_mA=300.0,
+                 delta_mA=150.0,
+                 period_us=1000,
+                 base_filename="burst",
+                 ts_scale=1,
+                 hysteresis_mA=50.0,
+                 holdoff_s=10.0,
+                 max_per_hour=12,
+                 dump_margin_ms=200):
+        """
+        Args:
+            ina: instancia de Ina219Sensor
+            logger: DataLogger (opcional) para vincular a rajada ao CSV
+            pre_samples: amostras mantidas antes do gatilho
+            post_samples: amostras gravadas apos o gatilho
+            threshold_mA: limiar absoluto de |corrente|
+            delta_mA: variacao em relacao a linha de base que dispara
+            period_us: periodo alvo entre leituras rapidas
+            base_filename: nome base dos arquivos de rajada
+            ts_scale: timestamps em 1/ts_scale s (10 no modo ponto fixo)
+            hysteresis_mA: o limiar absoluto rearma abaixo de threshold - isso
+            holdoff_s: intervalo minimo entre rajadas
+            max_per_hour: rajadas gravadas por hora, no maximo
+            dump_margin_ms: tempo reservado para gravar a rajada na flash
+        """
+        self.ina = ina
+        self.logger = logger
+        self.pre_samples = pre_samples
+        self.post_samples = post_samples
+        self.threshold_mA = threshold_mA
+        self.delta_mA = delta_mA
+        self.period_us = period_us
+        self.base_filename = base_filename
+
+        # Buffers pre-alocados: anel de pre-gatilho + janela de pos-gatilho
+        self._ring = array('h', bytes(2 * pre_samples))
+        self._post = array('h', bytes(2 * post_samples))
+        self._head = 0
+        self._filled = 0
+
+        self._lsb = ina.current_lsb_mA
+        self._thresh_counts = int(threshold_mA / self._lsb)
+        self._rearm_counts = int(max(0.0, threshold_mA - hysteresis_mA) / self._lsb)
+        self._delta_counts = int(delta_mA / self._lsb)
+        self._baseline = None
+        self._last_slow_mA = None
+        self._thresh_uA = int(threshold_mA * 1000)
+        self._rearm_uA = int(max(0.0, threshold_mA - hysteresis_mA) * 1000)
+        self._delta_uA = int(delta_mA * 1000)
+        self._last_slow_uA = None
+        self._armed = True            # limiar absoluto pronto para disparar
+        self._holdoff_ms = int(holdoff_s * 1000)
+        self.max_per_hour = max_per_hour
+        self._last_ms = None          # ticks da ultima rajada
+        self._window_ms = ticks_ms()  # inicio da hora corrente
+        self._window_count = 0
+        self.suppressed = 0           # gatilhos recusados (holdoff/limite)
+        self.late = 0                 # gatilhos sem tempo antes da amostra
+        # Duracao de uma captura: pos-gatilho + gravacao
+        self._capture_us = post_samples * period_us + dump_margin_ms * 1000
+        # Timestamps recebidos em 1/ts_scale s (10 => decisegundos)
+        self.ts_scale = ts_scale
+
+        self.file_index = 0
+        while self._exists(self._get_filename()):
+            self.file_index += 1
+
+        self.burst_count = 0
+        self.last_file = None
+
+    def _get_filename(self):
+        """Retorna o nome do proximo arquivo de rajada."""
+        return "{:s}_{:03d}.bin".format(self.base_filename, self.file_index)
+
+    def _exists(self, filename):
+        """Verifica se o arquivo ja existe na memoria."""
+        try:
+            os.stat(filename)
+            return True
+        except OSError:
+            return False
+
+    def _is_trigger(self, raw):
+        """
+        Testa a subida pelo limiar absoluto (com rearme por histerese) e o
+        degrau em relacao a linha de base (inteiro).
+        """
+        a = raw if raw >= 0 else -raw
+        if a >= self._thresh_counts:
+            if self._armed:
+                return True
+        elif a < self._rearm_counts:
+            self._armed = True
+        d = raw - self._baseline
+        return d >= self._delta_counts or d <= -self._delta_counts
+
+    def _allowed(self):
+        """Holdoff e limite por hora. Recusado: conta em suppressed."""
+        now = ticks_ms()
+        if ticks_diff(now, self._window_ms) >= 3600000:
+            self._window_ms = now
+            self._window_count = 0
+        if ((self._last_ms is not None and ticks_diff(now, self._last_ms) < self._holdoff_ms)
+                or self._window_count >= self.max_per_hour):
+            self.suppressed += 1
+            return False
+        self._last_ms = now
+        self._window_count += 1
+        return True
+
+    def monitor(self, duration_ms, wdt=None, now_s=0.0, limit_ms=None):
+        """
+        Ocupa o tempo ocioso amostrando em alta taxa.
+        Substitui o sleep() do loop principal.
+
+        Args:
+            duration_ms: tempo de monitoramento (fatia)
+            wdt: watchdog a ser alimentado durante o monitoramento
+            now_s: timestamp da ultima amostra (gravado no cabecalho)
+            limit_ms: tempo ate a proxima amostra (padrao: duration_ms);
+                gatilho sem tempo para a captura inteira e ignorado
+
+        Returns:
+            nome do arquivo gravado, ou None se nao houve gatilho
+        """
+        written = None
+        start = ticks_us()
+        budget_us = duration_ms * 1000
+        # Ultimo instante em que uma captura ainda termina antes do limite
+        last_us = (duration_ms if limit_ms is None else limit_ms) * 1000 - self._capture_us
+        late = False
+        ring = self._ring
+        size = self.pre_samples
+        read = self.ina.read_current_raw
+        period = self.period_us
+
+        previous = self.ina.enter_fast_mode()
+        try:
+            self._head = 0
+            self._filled = 0
+            self._baseline = read()
+            n = 0
+            while ticks_diff(ticks_us(), start) < budget_us:
+                t0 = ticks_us()
+                raw = read()
+                if self._is_trigger(raw):
+                    if ticks_diff(ticks_us(), start) <= last_us:
+                        # Consome o gatilho mesmo se recusado: desarma o
+                        # limiar (se foi ele) e a linha de base recomeca
+                        self._armed = -self._thresh_counts < raw < self._thresh_counts
+                        if self._allowed():
+                            written = self._capture(raw, now_s, wdt) or written
+                            # Reinicia o anel apos a rajada
+                            self._head = 0
+                            self._filled = 0
+                        self._baseline = read()
+                        continue
+                    # Sem tempo para pos-gatilho + gravacao antes da proxima
+                    # amostra: ignora o gatilho e segue enchendo o anel
+                    if not late:
+                        self.late += 1
+                        late = True
+
+                ring[self._head] = raw
+                self._head += 1
+                if self._head == size:
+                    self._head = 0
+                if self._filled < size:
+                    self._filled += 1
+                self._baseline += (raw - self._baseline) >> 4
+
+                n += 1
+                if wdt and (n & 0x3FF) == 0:
+                    wdt.feed()
+
+                wait = period - ticks_diff(ticks_us(), t0)
+                if wait > 0:
+                    sleep_us(wait)
+        finally:
+            self.ina.exit_fast_mode(previous)
+
+        return written
+
+    def check(self, current_mA, now_s=0.0, wdt=None):
+        """
+        Gatilho pelo caminho lento (amostra normal do loop).
+        Captura apenas pos-gatilho, pois o anel nao esta preenchido.
+        """
+        a = abs(current_mA)
+        high = a >= self.threshold_mA
+        triggered = high and self._armed
+        if not high and a * 1000 < self._rearm_uA:
+            self._armed = True
+        if self._last_slow_mA is not None:
+            if abs(current_mA - self._last_slow_mA) >= self.delta_mA:
+                triggered = True
+        self._last_slow_mA = current_mA
+        return self._slow_trigger(triggered, high, now_s, wdt)
+
+    def check_uA(self, current_uA, now_s=0.0, wdt=None):
+        """Mesmo que check(), com corrente inteira em uA (ponto fixo)."""
+        a = current_uA if current_uA >= 0 else -current_uA
+        high = a >= self._thresh_uA
+        triggered = high and self._armed
+        if not high and a < self._rearm_uA:
+            self._armed = True
+        last = self._last_slow_uA
+        if last is not None:
+            d = current_uA - last
+            if d >= self._delta_uA or d <= -self._delta_uA:
+                triggered = True
+        self._last_slow_uA = current_uA
+        return self._slow_trigger(triggered, high, now_s, wdt)
+
+    def _slow_trigger(self, triggered, high, now_s, wdt):
+        if not triggered:
+            return None
+        if high:
+            self._armed = False
+        if not self._allowed():
+            return None
+        return self._capture_now(now_s, wdt)
+
+    def _capture_now(self, now_s, wdt):
+        """Captura imediata (sem pre-gatilho) em modo rapido."""
+        previous = self.ina.enter_fast_mode()
+        try:
+            self._filled = 0
+            return self._capture(self.ina.read_current_raw(), now_s, wdt)
+        finally:
+            self.ina.exit_fast_mode(previous)
+
+    def _capture(self, trigger_raw, now_s, wdt):
+        """Preenche a janela de pos-gatilho e grava a rajada."""
+        post = self._post
+        read = self.ina.read_current_raw
+        period = self.period_us
+
+        post[0] = trigger_raw
+        t_start = ticks_us()
+        for i in range(1, self.post_samples):
+            t0 = ticks_us()
+            post[i] = read()
+            wait = period - ticks_diff(ticks_us(), t0)
+            if wait > 0:
+                sleep_us(wait)
+        elapsed = ticks_diff(ticks_us(), t_start)
+        real_period = elapsed // max(1, self.post_samples - 1)
+
+        if wdt:
+            wdt.feed()
+        return self._dump(trigger_raw, real_period, now_s)
+
+    def _dump(self, trigger_raw, real_period_us, now_s):
+        """Grava cabecalho + pre-gatilho (ordem cronologica) + pos-gatilho."""
+        filename = self._get_filename()
+        n_pre = self._filled
+        if self.logger is not None:
+            log_index = self.logger.current_file_index
+            log_line = self.logger.line_count
+        else:
+            log_index = 0xFFFF
+            log_line = 0
+        header = struct.pack(BURST_HEADER_FMT, BURST_MAGIC, BURST_VERSION,
+                             n_pre, self.post_samples, real_period_us,
+                             now_s / self.ts_scale, self._lsb, trigger_raw * self._lsb,
+                             log_index, log_line)
+        try:
+            ring = memoryview(self._ring)
+            with open(filename, "wb") as f:
+                f.write(header)
+                if n_pre == self.pre_samples:
+                    # Anel cheio: mais antigo esta em _head
+                    f.write(ring[self._head:])
+                    f.write(ring[:self._head])
+                else:
+                    f.write(ring[:n_pre])
+                f.write(memoryview(self._post))
+        except OSError as e:
+            say(WARN, "AVISO - Erro ao gravar rajada: {}".format(e))
+            return None
+        count_bytes(W_BURST, len(header) + 2 * (n_pre + self.post_samples))
+
+        self.file_index += 1
+        self.burst_count += 1
+        self.last_file = filename
+        say(INFO, "Rajada capturada: {} ({} pre + {} pos, {}us/amostra, gatilho {:.1f} mA)".format(
+            filename, n_pre, self.post_samples, real_period_us, trigger_raw * self._lsb))
+        return filename
@@ -0,0 +1,430 @@
+# column_logger.py
+"""
+Backend colunar do logger
+-------------------------
+Alternativa ao CSV do DataLogger: cada canal vai para o seu proprio
+arquivo de blocos, so com acrescimo no fim:
+
+    ina_col_NNN.t      timestamp       ina_col_NNN.soc    SoC
+    ina_col_NNN.vbatt  Vbatt           ina_col_NNN.tint   Temp_int
+    ina_col_NNN.vload  Vload           ina_col_NNN.text   Temp_ext
+    ina_col_NNN.iload  Iload           ina_col_NNN.hum    Humidity
+    ina_col_NNN.ibatt  Ibatt_est
+
+Os valores sao inteiros na resolucao do CSV (10^-casas da coluna), entao
+um export para CSV sai identico ao do DataLogger (so o "-0.00" do modo
+float vira "0.00"). Cada bloco:
+
+    cabecalho (BLOCK_FMT): "CB" | linhas u16 | validas u16
+                           | t_first, t_last (centesimos de s, i64)
+                           | min, max dos valores validos (i32; 0 no canal t,
+                             cujo intervalo ja esta em t_first/t_last)
+                           | bytes u16 | crc32 (cabecalho sem o crc + payload)
+    payload: um varint por linha; 0 = nan, senao zigzag(delta) + 1
+             (delta para o valor valido anterior do bloco)
+
+Os blocos de todos os canais sao gravados juntos (mesmas linhas, mesmo
+t_first). Uma consulta de um canal numa janela de tempo le so os
+cabecalhos e os payloads dos blocos que cruzam a janela, deste canal e
+do canal t; e o resumo (min/max) sai so dos cabecalhos.
+
+As linhas ficam em RAM ate fechar o bloco (block_rows linhas ou
+block_span_s segundos de dados); flush() grava o bloco parcial. Um
+reset perde no maximo esse bloco. Um bloco cortado por queda de energia
+no meio da gravacao nao precisa de reparo no boot (cada boot abre um
+segmento novo): os leitores conferem o CRC e, com cabecalho invalido,
+procuram o proximo "CB" integro.
+"""
+
+import os
+import struct
+from data_logger import DataLogger
+from log_codec import CSV_DECIMALS, put_varint, get_varint, zigzag, unzigzag
+from console import say, INFO
+from write_stats import count_bytes, W_COLUMN
+from event_log import EV_DISK_LOW, EV_DISK_FULL, EV_WRITE_ERROR, source_id, err_code
+
+try:
+    from binascii import crc32
+except ImportError:  # pragma: no cover
+    from zlib import crc32
+
+BLOCK_MAGIC = b"CB"
+BLOCK_FMT = "<2sHHqqiiHI"
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_FMT)
+
+# (extensao, coluna do CSV, chave de append(), chave e escala de append_fixed())
+CHANNELS = (
+    ("t", "timestamp", "timestamp", "timestamp_ds", 10),
+    ("vbatt", "Vbatt[V]", "Vbatt", "Vbatt_uV", 1000000),
+    ("vload", "Vload[V]", "Vload", "Vload_uV", 1000000),
+    ("iload", "Iload[mA]", "Iload_mA", "Iload_uA", 1000),
+    ("ibatt", "Ibatt_est[mA]", "Ibatt_mA", "Ibatt_uA", 1000),
+    ("soc", "SoC[%]", "SoC", "SoC_mp", 1000),
+    ("tint", "Temp_int[C]", "Temp_int", "Temp_int_cC", 100),
+    ("text", "Temp_ext[C]", "Temp_ext", "Temp_ext_cC", 100),
+    ("hum", "Humidity[%]", "Humidity", "Humidity_cp", 100),
+)
+CHANNEL_NAMES = tuple(c[0] for c in CHANNELS)
+# Casas decimais de cada canal (as mesmas do CSV)
+DECIMALS = dict(zip(CHANNEL_NAMES, CSV_DECIMALS))
+
+
+def channel_file(base_filename, index, channel):
+    """ina_col_005.vbatt"""
+    return "{}_{:03d}.{}".format(base_filename, index, channel)
+
+
+def _from_float(value, decimals):
+    if value is None or value != value:
+        return None
+    v = value * (10 ** decimals)
+    return int(v + 0.5) if v >= 0 else -int(-v + 0.5)
+
+
+def _rescale(value, scale, decimals):
+    """Inteiro em 1/scale -> inteiro com 'decimals' casas (arredonda como fmt_fixed)."""
+    if value is None:
+        return None
+    p = 10 ** decimals
+    neg = value < 0
+    if neg:
+        value = -value
+    if p >= scale:
+        r = value * (p // scale)
+    else:
+        q = scale // p
+        r = (value + q // 2) // q
+    return -r if neg else r
+
+
+class ColumnLogger(DataLogger):
+    """DataLogger que grava um arquivo de blocos por canal."""
+
+    def __init__(self, base_filename="ina_col", max_lines=15000,
+                 block_rows=64, block_span_s=600, events=None):
+        """
+        Args:
+            base_filename: prefixo dos arquivos (ex: "ina_col")
+            max_lines: linhas por segmento antes de rotacionar
+            block_rows: linhas por bloco
+            block_span_s: fecha o bloco se cobrir mais que isso (s de dados),
+                          para limitar a perda num reset com amostragem lenta
+            events: EventLog (opcional), como no DataLogger
+        """
+        n = len(CHANNELS)
+        self.block_rows = block_rows
+        self.block_span = int(block_span_s * 100)
+        self._bufs = [bytearray() for _ in range(n)]
+        self._prev = [0] * n
+        self._min = [0] * n
+        self._max = [0] * n
+        self._valid = [0] * n
+        self._rows = 0
+        self._t_first = self._t_last = 0
+        self.blocks_written = 0
+        self.rows_dropped = 0
+        DataLogger.__init__(self, base_filename, max_lines, events=events)
+
+    def _get_filename(self):
+        """Nome do segmento atual (um arquivo por canal: ina_col_NNN.*)."""
+        return "{:s}_{:03d}.*".format(self.base_filename, self.current_file_index)
+
+    def _recover_tail(self, index):
+        """Nada a reparar: os leitores conferem o CRC de cada bloco."""
+
+    def _create_new_file(self):
+        """Novo segmento; os arquivos sao criados no primeiro bloco."""
+        self.filename = self._get_filename()
+        self.line_count = 0
+        say(INFO, "Novo segmento colunar: {}".format(self.filename))
+
+    def append(self, data):
+        """Adiciona uma linha a partir dos valores em float (como append do CSV)."""
+        try:
+            values = [_from_float(data[c[2]], d) for c, d in zip(CHANNELS, CSV_DECIMALS)]
+        except Exception as e:
+            print("AVISO - Erro ao converter linha: {}".format(e))
+            return
+        self._add_row(values)
+
+    def append_fixed(self, data):
+        """Adiciona uma linha a partir dos inteiros do pipeline de ponto fixo."""
+        try:
+            values = [_rescale(data[c[3]], c[4], d) for c, d in zip(CHANNELS, CSV_DECIMALS)]
+        except Exception as e:
+            print("AVISO - Erro ao converter linha: {}".format(e))
+            return
+        self._add_row(values)
+
+    def _add_row(self, values):
+        t = values[0]
+        if t is None:
+            print("AVISO - Linha sem timestamp descartada")
+            return
+        if self.line_count >= self.max_lines:
+            self.rotate()
+        if self._rows == 0:
+            self._t_first = t
+        self._t_last = t
+        for i, v in enumerate(values):
+            buf = self._bufs[i]
+            if v is None:
+                buf.append(0)
+                continue
+            if self._valid[i] == 0:
+                self._min[i] = self._max[i] = v
+            elif v < self._min[i]:
+                self._min[i] = v
+            elif v > self._max[i]:
+                self._max[i] = v
+            put_varint(buf, zigzag(v - self._prev[i]) + 1)
+            self._prev[i] = v
+            self._valid[i] += 1
+        self._rows += 1
+        self.line_count += 1
+        if self._rows >= self.block_rows or t - self._t_first >= self.block_span:
+            self.flush()
+
+    def flush(self):
+        """Grava o bloco atual (mesmo incompleto) em todos os canais."""
+        if self._rows == 0:
+            return
+        rows = self._rows
+        total = 0
+        for buf in self._bufs:
+            total += BLOCK_HEADER_SIZE + len(buf)
+        try:
+            if self._disk_ok(total):
+                for i, (name, _, _, _, _) in enumerate(CHANNELS):
+                    vmin, vmax = (0, 0) if i == 0 else (self._min[i], self._max[i])
+                    header = struct.pack(BLOCK_FMT, BLOCK_MAGIC, rows, self._valid[i],
+                                         self._t_first, self._t_last,
+                                         vmin, vmax, len(self._bufs[i]), 0)
+                    crc = crc32(self._bufs[i], crc32(header[:-4]))
+                    header = header[:-4] + struct.pack("<I", crc)
+                    with open(channel_file(self.base_filename, self.current_file_index, name), "ab") as f:
+                        f.write(header)
+                        f.write(self._bufs[i])
+                    count_bytes(W_COLUMN, len(header) + len(self._bufs[i]))
+                self.blocks_written += 1
+                rows = 0
+        except OSError as e:
+            print("*** ERRO CRITICO ao gravar bloco: {} ***".format(e))
+            print("*** Provavel causa: Disco cheio! ***")
+            self._event(EV_WRITE_ERROR, source_id("Colunar"), err_code(e))
+        if rows:
+            # Bloco descartado: as linhas nao existem no segmento
+            self.rows_dropped += rows
+            self.line_count -= rows
+        for i in range(len(CHANNELS)):
+            self._bufs[i] = bytearray()
+            self._prev[i] = 0
+            self._valid[i] = 0
+        self._rows = 0
+
+    def _disk_ok(self, nbytes):
+        """Mesma checagem de espaco do DataLogger, por bloco."""
+        if self.retention is not None:
+            if not self.retention.reserve(nbytes):
+                if not self._disk_full:
+                    print("*** ERRO CRITICO: Disco cheio e nada mais a apagar! ***")
+                    self._event(EV_DISK_FULL)
+                    self._disk_full = True
+                return False
+            self._disk_full = False
+            return True
+        statvfs = os.statvfs('/')
+        free_kb = (statvfs[0] * statvfs[3]) / 1024
+        if free_kb < 50:
+            print("*** ERRO CRITICO: Espaco em disco MUITO baixo ({:.1f} KB), bloco descartado ***".format(free_kb))
+            self._event(EV_DISK_FULL, 0, int(free_kb))
+            return False
+        if free_kb < 200:
+            print("AVISO - Pouco espaco: {:.1f} KB".format(free_kb))
+            self._event(EV_DISK_LOW, 0, int(free_kb))
+        return True
+
+    def rotate(self):
+        """Grava o bloco pendente e comeca o proximo segmento."""
+        self.flush()
+        DataLogger.rotate(self)
+
+    def get_stats(self):
+        stats = DataLogger.get_stats(self)
+        stats["linhas_totais"] -= self.rows_dropped
+        return stats
+
+
+# ----------------------------------------------------------------------
+# Leitura (dispositivo e PC)
+# ----------------------------------------------------------------------
+
+def _header_ok(fields, remaining):
+    magic, rows, valid = fields[0], fields[1], fields[2]
+    return (magic == BLOCK_MAGIC and 0 < rows and valid <= rows
+            and fields[3] <= fields[4] and fields[7] <= remaining)
+
+
+def _block_crc(f, pos, raw, nbytes):
+    """CRC32 do cabecalho (sem o campo crc) + payload; None se nao ha bytes."""
+    f.seek(pos)
+    payload = f.read(nbytes)
+    if len(payload) != nbytes:
+        return None
+    return crc32(payload, crc32(raw[:-4]))
+
+
+def _resync(f, pos, size):
+    """Procura o proximo bloco integro (magic + cabecalho + CRC) a partir de pos."""
+    step = 512
+    while pos + BLOCK_HEADER_SIZE <= size:
+        f.seek(pos)
+        chunk = f.read(step + 1)
+        i = chunk.find(BLOCK_MAGIC)
+        if i < 0:
+            pos += step
+            continue
+        cand = pos + i
+        f.seek(cand)
+        raw = f.read(BLOCK_HEADER_SIZE)
+        if len(raw) == BLOCK_HEADER_SIZE:
+            fields = struct.unpack(BLOCK_FMT, raw)
+            body = cand + BLOCK_HEADER_SIZE
+            if _header_ok(fields, size - body) and _block_crc(f, body, raw, fields[7]) == fields[8]:
+                return cand
+        pos = cand + 1
+    return size
+
+
+def read_headers(path, damaged=None):
+    """
+    Percorre so os cabecalhos de um arquivo de canal.
+    Gera (offset do payload, linhas, validas, t_first, t_last, min, max,
+    bytes, crc, crc parcial do cabecalho). Um cabecalho invalido (gravacao
+    interrompida) faz procurar o proximo bloco integro; o trecho pulado
+    vai para damaged (lista de (arquivo, offset, bytes)), se dada.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return
+    try:
+        size = f.seek(0, 2)
+        pos = 0
+        while pos < size:
+            f.seek(pos)
+            raw = f.read(BLOCK_HEADER_SIZE)
+            body = pos + BLOCK_HEADER_SIZE
+            ok = len(raw) == BLOCK_HEADER_SIZE
+            if ok:
+                fields = struct.unpack(BLOCK_FMT, raw)
+                ok = _header_ok(fields, size - body)
+            if not ok:
+                nxt = _resync(f, pos + 1, size)
+                if damaged is not None:
+                    damaged.append((path, pos, nxt - pos))
+                pos = nxt
+                continue
+            yield (body,) + fields[1:] + (crc32(raw[:-4]),)
+            pos = body + fields[7]
+    finally:
+        f.close()
+
+
+def read_block(f, hdr):
+    """Payload de um bloco (de read_headers) conferido pelo CRC; None se danificado."""
+    f.seek(hdr[0])
+    payload = f.read(hdr[7])
+    if len(payload) != hdr[7] or crc32(payload, hdr[9]) != hdr[8]:
+        return None
+    return payload
+
+
+def decode_block(payload, rows):
+    """Payload -> lista de inteiros (None para nan)."""
+    values = []
+    prev = 0
+    pos = 0
+    for _ in range(rows):
+        u, pos = get_varint(payload, pos)
+        if u == 0:
+            values.append(None)
+        else:
+            prev += unzigzag(u - 1)
+            values.append(prev)
+    return values
+
+
+def _overlaps(t0, t1, start, end):
+    return (start is None or t1 >= start) and (end is None or t0 <= end)
+
+
+def summary(base_filename, index, channel, start=None, end=None, damaged=None):
+    """
+    min/max/validas de um canal numa janela, so pelos cabecalhos (sem
+    decodificar nem conferir o CRC dos payloads). Blocos parcialmente na
+    janela entram inteiros. Tempos em centesimos de segundo.
+    Retorna (min, max, validas, blocos).
+    """
+    vmin = vmax = None
+    valid = blocks = 0
+    for hdr in read_headers(channel_file(base_filename, index, channel), damaged):
+        if not _overlaps(hdr[3], hdr[4], start, end):
+            continue
+        blocks += 1
+        if hdr[2]:
+            vmin = hdr[5] if vmin is None else min(vmin, hdr[5])
+            vmax = hdr[6] if vmax is None else max(vmax, hdr[6])
+            valid += hdr[2]
+    return vmin, vmax, valid, blocks
+
+
+def query(base_filename, index, channels, start=None, end=None, damaged=None):
+    """
+    Linhas [t, valor, ...] dos canais pedidos dentro da janela [start, end]
+    (centesimos de segundo; None = aberto). Le so os blocos que cruzam a
+    janela: os do canal t e os dos canais pedidos, casados por t_first.
+    Blocos com CRC errado sao pulados (canal t: o bloco inteiro; outro
+    canal: None nas linhas) e anotados em damaged, se dada.
+    """
+    names = ("t",) + tuple(c for c in channels if c != "t")
+    files = []
+    blocks = []
+    try:
+        for name in names:
+            path = channel_file(base_filename, index, name)
+            found = {}
+            for hdr in read_headers(path, damaged):
+                if _overlaps(hdr[3], hdr[4], start, end):
+                    found[hdr[3]] = hdr
+            blocks.append(found)
+            files.append(open(path, "rb") if found else None)
+        for t_first in sorted(blocks[0]):
+            columns = []
+            for name, f, found in zip(names, files, blocks):
+                hdr = found.get(t_first)
+                if hdr is None or hdr[1] != blocks[0][t_first][1]:
+                    columns.append(None)   # bloco perdido neste canal
+                    continue
+                payload = read_block(f, hdr)
+                if payload is None:
+                    if damaged is not None:
+                        damaged.append((channel_file(base_filename, index, name),
+                                        hdr[0] - BLOCK_HEADER_SIZE, BLOCK_HEADER_SIZE + hdr[7]))
+                    columns.append(None)
+                    continue
+                columns.append(decode_block(payload, hdr[1]))
+            if columns[0] is None:
+                continue
+            for r, t in enumerate(columns[0]):
+                if (start is not None and t < start) or (end is not None and t > end):
+                    continue
+                row = [t]
+                for col in columns[1:]:
+                    row.append(None if col is None else col[r])
+                yield row
+    finally:
+        for f in files:
+            if f is not None:
+                f.close()
@@ -0,0 +1,88 @@
+# command_shell.py
+"""
+Interface de comandos em tempo de execucao
+------------------------------------------
+Comandos de texto ("stats", "set interval 30", ...) chegam em quadros
+EXEC pela mesma porta da descarga de logs (log_transfer.py), que ja e
+consultada sem bloqueio dentro do tempo ocioso do loop. A resposta volta
+em quadros TEXT. Nenhum comando interrompe a amostragem.
+
+Os comandos sao registrados pelo main.py, que e quem conhece o estado
+(logger, gauge, contadores):
+
+    shell = CommandShell(transfer)
+    shell.add("gauge", cmd_gauge, "estado do battery gauge")
+
+Cliente do PC: Ferramentas/node_ctl.py.
+"""
+
+from log_transfer import CMD_EXEC, RSP_TEXT, MAX_PAYLOAD
+
+
+class CommandShell:
+    """Tabela de comandos atendida pelos quadros EXEC."""
+
+    def __init__(self, transfer):
+        """
+        Args:
+            transfer: LogTransfer que atende a porta serial
+        """
+        self.transfer = transfer
+        self._commands = {}
+        self.executed = 0
+        self.add("help", self._help, "lista os comandos")
+        transfer.register(CMD_EXEC, self.handle)
+
+    def add(self, name, func, help_text=""):
+        """
+        Registra um comando. func(args) recebe a lista de argumentos
+        (strings) e retorna o texto da resposta.
+        """
+        self._commands[name] = (func, help_text)
+
+    def _help(self, args):
+        lines = []
+        for name in sorted(self._commands):
+            lines.append("{:<10} {}".format(name, self._commands[name][1]))
+        return "\n".join(lines)
+
+    def execute(self, line):
+        """Executa uma linha de comando e retorna o texto da resposta."""
+        parts = line.split()
+        if not parts:
+            return ""
+        entry = self._commands.get(parts[0])
+        if entry is None:
+            return "ERRO comando desconhecido: {} (use help)".format(parts[0])
+        self.executed += 1
+        try:
+            result = entry[0](parts[1:])
+        except (ValueError, IndexError) as e:
+            return "ERRO argumentos invalidos: {}".format(e)
+        except Exception as e:
+            return "ERRO {}: {}".format(parts[0], e)
+        return "" if result is None else str(result)
+
+    def handle(self, payload):
+        """
+        Atende um quadro EXEC (tag + texto). A resposta repete o tag,
+        para o PC descartar respostas atrasadas, e pode ocupar varios
+        quadros.
+        """
+        if not payload:
+            return
+        tag = bytes(payload[:1])
+        try:
+            line = bytes(payload[1:]).decode()
+        except UnicodeError:
+            line = ""
+        data = self.execute(line).encode()
+        step = MAX_PAYLOAD - 2
+        pos = 0
+        while True:
+            chunk = data[pos:pos + step]
+            pos += step
+            last = pos >= len(data)
+            self.transfer.send(RSP_TEXT, b"\x01" if last else b"\x00", tag, chunk)
+            if last:
+                break
@@ -0,0 +1,42 @@
+# console.py
+"""
+Nivel de verbosidade do console
+-------------------------------
+Cada print humano do loop passa por say(nivel, texto). Em producao o
+nivel pode ser reduzido (ou zerado) para nao gastar tempo formatando
+texto nem bloquear no USB quando ninguem le a porta; a telemetria
+binaria (telemetry.py) continua saindo.
+
+    SILENT  (0)  nada
+    WARN    (1)  avisos e erros
+    INFO    (2)  + inicializacao, GC e estatisticas
+    SAMPLES (3)  + uma linha por amostra (padrao)
+"""
+
+SILENT = 0
+WARN = 1
+INFO = 2
+SAMPLES = 3
+
+_level = SAMPLES
+
+
+def set_level(level):
+    """Altera o nivel (limitado a SILENT..SAMPLES)."""
+    global _level
+    _level = max(SILENT, min(SAMPLES, int(level)))
+
+
+def get_level():
+    return _level
+
+
+def enabled(level):
+    """True se mensagens deste nivel devem ser exibidas."""
+    return _level >= level
+
+
+def say(level, text):
+    """Imprime 'text' se o nivel atual permitir."""
+    if _level >= level:
+        print(text)
@@ -1,27 +1,76 @@
 # data_logger.py
 import os
+from fixed_point import fmt_fixed
+from console import say, INFO
+from write_stats import count_bytes, W_CSV
+from event_log import (EV_DISK_LOW, EV_DISK_FULL, EV_WRITE_ERROR, EV_ROTATE,
+                       EV_LOG_RECOVERED, source_id, err_code)
+
+try:
+    from binascii import crc32
+except ImportError:  # pragma: no cover
+    from zlib import crc32
+
+# Marcadores de integridade (linhas de comentario, ignoradas por
+# np.loadtxt e pelos leitores de CSV com comment="#"):
+#   "#B,<crc32 hex>"  fecha um bloco: CRC32 das linhas de dados desde o
+#                     marcador anterior (ou desde o cabecalho)
+#   "#R,<offset>"     gravado na recuperacao: os bytes de <offset> ate
+#                     este marcador sao lixo de uma gravacao interrompida
+BLOCK_MARK = b"#B,"
+RECOVER_MARK = b"#R,"
+CSV_FIELDS = 9
+RECOVERY_TAIL_BYTES = 4096   # so o fim do arquivo e lido no boot
+
+
+def valid_line(line):
+    """True se line (bytes) e uma linha de dados completa do CSV."""
+    if not line.endswith(b"\n"):
+        return False
+    parts = line.split(b",")
+    if len(parts) != CSV_FIELDS:
+        return False
+    try:
+        for p in parts:
+            float(p.decode())   # "nan" tambem passa
+    except (ValueError, UnicodeError):
+        return False
+    return True
+
 
 class DataLogger:
     """
     Gerencia o registro de dados em arquivo CSV com rotacao automatica.
     Cria multiplos arquivos para evitar limites de memoria.
     """
-    def __init__(self, base_filename="ina_log", max_lines=15000):
+    def __init__(self, base_filename="ina_log", max_lines=15000, block_lines=32, events=None):
         """
         Inicializa o logger com rotacao automatica de arquivos.
         
         Args:
             base_filename: nome base dos arquivos (ex: "ina_log")
             max_lines: numero maximo de linhas por arquivo antes de rotacionar
+            block_lines: linhas por bloco com CRC (0 = sem marcadores)
+            events: EventLog (opcional) para disco baixo, erros e rotacoes
         """
         self.base_filename = base_filename
         self.max_lines = max_lines
+        self.block_lines = block_lines
         self.current_file_index = 0
         self.line_count = 0
+        self._short_lines = 0   # linhas que faltaram nos arquivos rotacionados a forca
+        self.retention = None   # RetentionManager (opcional), ver retention.py
+        self.events = events
+        self._disk_full = False
+        self._block_crc = 0
+        self._block_count = 0
+        self.recovered_bytes = 0  # lixo descartado no fim do ultimo arquivo
         
-        # Encontrar o proximo arquivo disponivel
-        while self._exists(self._get_filename()):
-            self.current_file_index += 1
+        # Continuar depois do maior indice existente (.csv ou ja comprimido:
+        # ina_log_NNN.csv.gz / .csv.dv), para nunca sobrescrever um log antigo
+        self.current_file_index = self._next_index()
+        if self.current_file_index > 0:
+            self._recover_tail(self.current_file_index - 1)
         
         self._create_new_file()
         self._print_disk_info()
@@ -30,13 +79,81 @@ class DataLogger:
         """Retorna o nome do arquivo atual com indice."""
         return "{:s}_{:03d}.csv".format(self.base_filename, self.current_file_index)
 
-    def _exists(self, filename):
-        """Verifica se o arquivo ja existe na memoria."""
+    def _next_index(self):
+        """Indice seguinte ao maior ina_log_NNN.* existente."""
+        prefix = self.base_filename + "_"
+        last = -1
+        for name in os.listdir():
+            if not name.startswith(prefix):
+                continue
+            digits = name[len(prefix):].split(".", 1)[0]
+            if digits.isdigit():
+                last = max(last, int(digits))
+        return last + 1
+
+    def _recover_tail(self, index):
+        """
+        Confere o fim do arquivo anterior ao boot (uma gravacao pode ter
+        sido cortada por queda de energia). Le so os ultimos
+        RECOVERY_TAIL_BYTES: volta ate o ultimo marcador e valida as
+        linhas seguintes. O que vier depois da ultima linha boa e
+        cortado (truncate) ou, sem truncate no sistema de arquivos,
+        cercado por um marcador #R. As linhas boas ganham um #B.
+        """
+        name = "{:s}_{:03d}.csv".format(self.base_filename, index)
         try:
-            os.stat(filename)
-            return True
+            f = open(name, "r+b")
         except OSError:
-            return False
+            return   # ja comprimido, resumido ou apagado
+        try:
+            size = f.seek(0, 2)
+            start = max(0, size - RECOVERY_TAIL_BYTES)
+            f.seek(start)
+            tail = f.read()
+            # Inicio do trecho sem marcador: depois do ultimo #B/#R, do
+            # cabecalho, ou da primeira linha inteira da janela
+            pos = max(tail.rfind(b"\n" + BLOCK_MARK), tail.rfind(b"\n" + RECOVER_MARK))
+            if pos >= 0:
+                end = tail.find(b"\n", pos + 1)
+                # Marcador cortado no meio: ele mesmo e o lixo
+                pos = pos + 1 if end < 0 else end + 1
+            else:
+                pos = tail.find(b"\n") + 1
+                if pos <= 0:
+                    return
+            good = pos
+            crc = 0
+            lines = 0
+            while good < len(tail):
+                end = tail.find(b"\n", good)
+                line = tail[good:] if end < 0 else tail[good:end + 1]
+                if not valid_line(line):
+                    break
+                crc = crc32(line, crc)
+                lines += 1
+                good += len(line)
+            bad = len(tail) - good
+            if bad:
+                f.seek(start + good)
+                if hasattr(f, "truncate"):
+                    f.truncate()
+                else:
+                    f.seek(0, 2)
+                    f.write(b"\n" + RECOVER_MARK + str(start + good).encode() + b"\n")
+                self.recovered_bytes = bad
+                print("AVISO - {}: {} bytes danificados no fim descartados".format(name, bad))
+                self._event(EV_LOG_RECOVERED, index, bad)
+            if lines and self.block_lines:
+                f.seek(0, 2)
+                f.write(BLOCK_MARK + "{:08x}\n".format(crc).encode())
+        except OSError as e:
+            print("AVISO - Nao foi possivel conferir {}: {}".format(name, e))
+        finally:
+            f.close()
+
+    def _event(self, code, a=0, b=0):
+        if self.events is not None:
+            self.events.log(code, a, b)
 
     def _print_disk_info(self):
         """Imprime informacoes sobre espaco em disco disponivel."""
@@ -81,8 +198,11 @@ class DataLogger:
         try:
             with open(self.filename, "w") as f:
                 f.write(header)
+            count_bytes(W_CSV, len(header))
             self.line_count = 0
-            print("Novo arquivo criado: {}".format(self.filename))
+            self._block_crc = 0
+            self._block_count = 0
+            say(INFO, "Novo arquivo criado: {}".format(self.filename))
         except Exception as e:
             print("ERRO ao criar arquivo: {}".format(e))
             raise
@@ -95,9 +215,74 @@ class DataLogger:
         Args:
             data: dicionario com os dados a serem gravados
         """
+        try:
+            line = (
+                "{:.2f},"
+                "{:.3f},"
+                "{:.3f},"
+                "{:.3f},"
+                "{:.3f},"
+                "{:.2f},"
+                "{:.2f},"
+                "{:.2f},"
+                "{:.2f}\n"
+            ).format(
+                data['timestamp'],
+                data['Vbatt'],
+                data['Vload'],
+                data['Iload_mA'],
+                data['Ibatt_mA'],
+                data['SoC'],
+                data['Temp_int'],
+                data['Temp_ext'],
+                data['Humidity']
+            )
+        except Exception as e:
+            print("AVISO - Erro ao formatar linha CSV: {}".format(e))
+            return
+        self._write_line(line)
+
+    def append_fixed(self, data):
+        """
+        Adiciona uma linha a partir de valores inteiros (pipeline de ponto
+        fixo). Mesmo formato de CSV de append(), sem float.
+        
+        Args:
+            data: dicionario com timestamp_ds, Vbatt_uV, Vload_uV, Iload_uA,
+                  Ibatt_uA, SoC_mp, Temp_int_cC, Temp_ext_cC, Humidity_cp
+                  (None => "nan")
+        """
+        try:
+            line = "{},{},{},{},{},{},{},{},{}\n".format(
+                fmt_fixed(data['timestamp_ds'], 10, 2),
+                fmt_fixed(data['Vbatt_uV'], 1000000, 3),
+                fmt_fixed(data['Vload_uV'], 1000000, 3),
+                fmt_fixed(data['Iload_uA'], 1000, 3),
+                fmt_fixed(data['Ibatt_uA'], 1000, 3),
+                fmt_fixed(data['SoC_mp'], 1000, 2),
+                fmt_fixed(data['Temp_int_cC'], 100, 2),
+                fmt_fixed(data['Temp_ext_cC'], 100, 2),
+                fmt_fixed(data['Humidity_cp'], 100, 2)
+            )
+        except Exception as e:
+            print("AVISO - Erro ao formatar linha CSV: {}".format(e))
+            return
+        self._write_line(line)
+
+    def _write_line(self, line):
+        """Verifica espaco, rotaciona se preciso e grava uma linha pronta."""
         try:
             # VERIFICAR ESPACO EM DISCO ANTES DE GRAVAR
-            if self.line_count % 100 == 0:  # Verificar a cada 100 linhas
+            if self.retention is not None:
+                # Contabilidade incremental; apaga o mais antigo se preciso
+                if not self.retention.reserve(len(line)):
+                    if not self._disk_full:
+                        print("*** ERRO CRITICO: Disco cheio e nada mais a apagar! ***")
+                        self._event(EV_DISK_FULL)
+                        self._disk_full = True
+                    return
+                self._disk_full = False
+            elif self.line_count % 100 == 0:  # Verificar a cada 100 linhas
                 statvfs = os.statvfs('/')
                 free_kb = (statvfs[0] * statvfs[3]) / 1024
                 
@@ -106,39 +291,26 @@ class DataLogger:
                     print("*** Apenas {:.1f} KB livres ***".format(free_kb))
                     print("*** Sistema vai PARAR de gravar! ***")
                     print("*** Apague CSVs antigos URGENTE! ***")
+                    self._event(EV_DISK_FULL, 0, int(free_kb))
                     return  # NAO gravar para nao travar o sistema
                 elif free_kb < 200:
                     print("AVISO - Pouco espaco: {:.1f} KB".format(free_kb))
+                    self._event(EV_DISK_LOW, 0, int(free_kb))
             
             # Verificar se precisa rotacionar arquivo
             if self.line_count >= self.max_lines:
-                print("Rotacionando arquivo ({} linhas)...".format(self.line_count))
-                self.current_file_index += 1
-                self._create_new_file()
+                self.rotate()
             
-            with open(self.filename, "a") as f:
-                line = (
-                    "{:.2f},"
-                    "{:.3f},"
-                    "{:.3f},"
-                    "{:.3f},"
-                    "{:.3f},"
-                    "{:.2f},"
-                    "{:.2f},"
-                    "{:.2f},"
-                    "{:.2f}\n"
-                ).format(
-                    data['timestamp'],
-                    data['Vbatt'],
-                    data['Vload'],
-                    data['Iload_mA'],
-                    data['Ibatt_mA'],
-                    data['SoC'],
-                    data['Temp_int'],
-                    data['Temp_ext'],
-                    data['Humidity']
-                )
-                f.write(line)
+            data = line.encode()
+            nbytes = len(data)
+            with open(self.filename, "ab") as f:
+                f.write(data)
+                if self.block_lines:
+                    self._block_crc = crc32(data, self._block_crc)
+                    self._block_count += 1
+                    if self._block_count >= self.block_lines:
+                        nbytes += self._write_mark(f)
+            count_bytes(W_CSV, nbytes)
             
             self.line_count += 1
             
@@ -146,16 +318,48 @@ class DataLogger:
             # Erro de I/O - provavelmente disco cheio
             print("*** ERRO CRITICO ao gravar CSV: {} ***".format(e))
             print("*** Provavel causa: Disco cheio! ***")
+            self._event(EV_WRITE_ERROR, source_id("CSV"), err_code(e))
             # Nao levanta excecao para nao parar o sistema
         except Exception as e:
             print("AVISO - Erro ao gravar CSV: {}".format(e))
             # Nao levanta excecao para nao parar o logging
     
+    def _write_mark(self, f):
+        """Fecha o bloco atual com o marcador de CRC. Retorna os bytes gravados."""
+        mark = BLOCK_MARK + "{:08x}\n".format(self._block_crc).encode()
+        f.write(mark)
+        self._block_crc = 0
+        self._block_count = 0
+        return len(mark)
+
+    def flush(self):
+        """
+        Cada linha ja e gravada em append(); aqui so fecha o bloco
+        parcial com o CRC, para ele ja contar como conferido.
+        """
+        if not self._block_count:
+            return
+        try:
+            with open(self.filename, "ab") as f:
+                count_bytes(W_CSV, self._write_mark(f))
+        except OSError as e:
+            print("AVISO - Marcador de bloco nao gravado: {}".format(e))
+
+    def rotate(self):
+        """Fecha o arquivo atual e comeca o proximo (forcado)."""
+        say(INFO, "Rotacionando arquivo ({} linhas)...".format(self.line_count))
+        self.flush()
+        self._short_lines += max(0, self.max_lines - self.line_count)
+        lines = self.line_count
+        self.current_file_index += 1
+        self._create_new_file()
+        self._event(EV_ROTATE, self.current_file_index, lines)
+
     def get_stats(self):
         """Retorna estatisticas do logger."""
         return {
             "arquivo_atual": self.filename,
             "linhas_arquivo": self.line_count,
             "total_arquivos": self.current_file_index + 1,
-            "linhas_totais": (self.current_file_index * self.max_lines) + self.line_count
+            "linhas_totais": (self.current_file_index * self.max_lines) + self.line_count - self._short_lines
         }
\ No newline at end of file
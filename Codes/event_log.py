@@ -0,0 +1,382 @@
+# event_log.py
+"""
+Registro de eventos em anel (events.bin)
+----------------------------------------
+Resets, saltos de tempo do gauge, erros de I2C, disco baixo, rotacoes...
+viram registros binarios de tamanho fixo num arquivo circular: gravar e
+O(1) (um seek para a posicao do registro), ler os ultimos N tambem (seek
+para tras), e o cabecalho guarda um contador por tipo de evento, entao da
+para diagnosticar um no remotamente sem baixar nem ler tudo.
+
+Formato:
+    cabecalho: "FEV1" | versao (u8) | tamanho do registro (u8)
+               | capacidade (u16) | contadores (N_CODES x u32)
+    registro (16 bytes): seq (u32) | t_ds (u32) | codigo (u8)
+               | soma (u8) | a (i16) | b (i32)
+    O registro seq fica na posicao (seq - 1) % capacidade; seq 0 = vazio.
+    A soma (bytes do registro ^ 0xA5) descarta posicoes nunca escritas ou
+    corrompidas.
+
+Eventos repetidos (mesmo codigo e mesmo a) ate holdoff_ds depois da
+ultima gravacao nao sao gravados de novo, so contados: um sensor morto
+nao enche o anel nem gasta a flash a cada amostra. Se o evento volta logo
+depois do holdoff (falha persistente, mesmo com amostras mais espacadas
+que o holdoff), o holdoff daquele evento dobra, ate HOLDOFF_MAX_DS; um
+intervalo sem o evento o devolve ao valor inicial.
+
+Tambem roda no PC (Ferramentas/event_view.py): so usa struct.
+"""
+
+import struct
+from write_stats import count_bytes, W_EVENTS
+
+EVENT_FILE = "events.bin"
+EVENT_MAGIC = b"FEV1"
+EVENT_VERSION = 1
+N_CODES = 32
+HEADER_FMT = "<4sBBH"
+COUNTERS_OFFSET = struct.calcsize(HEADER_FMT)
+HEADER_SIZE = COUNTERS_OFFSET + 4 * N_CODES
+REC_FMT = "<IIBBhi"
+REC_SIZE = struct.calcsize(REC_FMT)
+DEFAULT_CAPACITY = 256
+HOLDOFF_DS = 600
+HOLDOFF_MAX_DS = 36000   # falha persistente: no maximo um registro por hora
+
+# Codigos (a, b)
+EV_BOOT = 1            # causa do reset (machine.reset_cause), timestamp retomado (s)
+EV_TIME_JUMP = 2       # -, dt (ds) visto pelo battery gauge
+EV_I2C_ERROR = 3       # fonte (SOURCES), errno
+EV_SENSOR_ERROR = 4    # fonte, -
+EV_DISK_LOW = 5        # -, KB livres
+EV_DISK_FULL = 6       # -, KB livres (0 = nada mais a apagar)
+EV_WRITE_ERROR = 7     # fonte, errno
+EV_ROTATE = 8          # novo indice, linhas do arquivo anterior
+EV_LOG_RECOVERED = 9   # indice, bytes descartados no fim
+EV_LOOP_SLOW = 10      # -, duracao do loop (ms)
+EV_ERROR = 11          # erros consecutivos, -
+EV_CRITICAL = 12       # erros consecutivos, -
+EV_FILE_DELETED = 13   # -, bytes liberados (retencao)
+EV_COMPRESS_FAIL = 14  # -, - (CRC da compressao nao conferiu)
+EV_LOAD_SWITCH = 15    # carga (indice), motivo << 20 | ligada << 16 | SoC (cp)
+EV_QUALITY = 16        # canal (QUALITY_CHANNELS), detectores ativos (0 = normalizou)
+EV_TIME_SYNC = 17      # incerteza (ms), correcao do relogio UTC (ms; 0 = primeira)
+
+EVENT_NAMES = {
+    EV_BOOT: "BOOT",
+    EV_TIME_JUMP: "TIME_JUMP",
+    EV_I2C_ERROR: "I2C_ERROR",
+    EV_SENSOR_ERROR: "SENSOR_ERROR",
+    EV_DISK_LOW: "DISK_LOW",
+    EV_DISK_FULL: "DISK_FULL",
+    EV_WRITE_ERROR: "WRITE_ERROR",
+    EV_ROTATE: "ROTATE",
+    EV_LOG_RECOVERED: "LOG_RECOVERED",
+    EV_LOOP_SLOW: "LOOP_SLOW",
+    EV_ERROR: "ERROR",
+    EV_CRITICAL: "CRITICAL",
+    EV_FILE_DELETED: "FILE_DELETED",
+    EV_COMPRESS_FAIL: "COMPRESS_FAIL",
+    EV_LOAD_SWITCH: "LOAD_SWITCH",
+    EV_QUALITY: "QUALITY",
+    EV_TIME_SYNC: "TIME_SYNC",
+}
+
+# Fontes (campo a de I2C_ERROR, SENSOR_ERROR e WRITE_ERROR)
+SOURCES = ("?", "INA219", "HDC1080", "Descarga", "Retencao", "Rajada", "CSV", "Colunar")
+
+# Canais e detectores de QUALITY (ver sensor_quality.py); detector i = bit i
+QUALITY_CHANNELS = ("Vbatt", "Vload", "Iload", "Temp_int", "Temp_ext", "Humidity")
+QUALITY_DETECTORS = ("LEITURA", "FAIXA", "TRAVADO", "DEGRAU", "CRUZADO")
+
+# Motivos de LOAD_SWITCH (ver load_scheduler.py)
+LOAD_REASONS = ("?", "boot", "soc_baixo", "soc_ok", "cota", "sobrecarga", "previsao", "manual")
+
+_I32_MAX = 0x7FFFFFFF
+
+
+def source_id(name):
+    """Indice de name em SOURCES (0 se desconhecido)."""
+    try:
+        return SOURCES.index(name)
+    except ValueError:
+        return 0
+
+
+def err_code(e):
+    """errno de um OSError (0 se nao houver ou se nao e OSError)."""
+    if e.args and isinstance(e.args[0], int):
+        return e.args[0]
+    return 0
+
+
+def _checksum(buf):
+    s = 0
+    for i in range(REC_SIZE):
+        if i != 9:
+            s += buf[i]
+    return (s ^ 0xA5) & 0xFF
+
+
+def decode(buf, pos=0):
+    """(seq, t_ds, codigo, a, b) do registro em buf[pos:]; None se vazio ou invalido."""
+    rec = buf[pos:pos + REC_SIZE]
+    if len(rec) < REC_SIZE:
+        return None
+    seq, t_ds, code, chk, a, b = struct.unpack(REC_FMT, rec)
+    if seq == 0 or chk != _checksum(rec):
+        return None
+    return seq, t_ds, code, a, b
+
+
+def format_event(rec):
+    """'#12 t=3600.5s I2C_ERROR HDC1080 errno=110'"""
+    seq, t_ds, code, a, b = rec
+    name = EVENT_NAMES.get(code, "EV{}".format(code))
+    if code in (EV_I2C_ERROR, EV_SENSOR_ERROR, EV_WRITE_ERROR):
+        detail = SOURCES[a] if 0 <= a < len(SOURCES) else str(a)
+        if code != EV_SENSOR_ERROR:
+            detail += " errno={}".format(b)
+    elif code == EV_BOOT:
+        detail = "causa={} retomado={}s".format(a, b)
+    elif code == EV_TIME_JUMP:
+        detail = "dt={}ds".format(b)
+    elif code in (EV_DISK_LOW, EV_DISK_FULL):
+        detail = "{} KB livres".format(b)
+    elif code == EV_ROTATE:
+        detail = "arquivo {} ({} linhas no anterior)".format(a, b)
+    elif code == EV_LOG_RECOVERED:
+        detail = "arquivo {} ({} bytes descartados)".format(a, b)
+    elif code == EV_LOOP_SLOW:
+        detail = "{} ms".format(b)
+    elif code in (EV_ERROR, EV_CRITICAL):
+        detail = "{} consecutivos".format(a)
+    elif code == EV_FILE_DELETED:
+        detail = "{} bytes".format(b)
+    elif code == EV_QUALITY:
+        detail = QUALITY_CHANNELS[a] if 0 <= a < len(QUALITY_CHANNELS) else str(a)
+        names = [n for i, n in enumerate(QUALITY_DETECTORS) if b & (1 << i)]
+        detail += " " + ("|".join(names) if names else "ok")
+    elif code == EV_TIME_SYNC:
+        detail = "+-{} ms correcao={} ms".format(a, b)
+    elif code == EV_LOAD_SWITCH:
+        reason = b >> 20
+        detail = "carga {} {} ({}) SoC={}.{:02d}%".format(
+            a, "ON" if (b >> 16) & 1 else "OFF",
+            LOAD_REASONS[reason] if 0 <= reason < len(LOAD_REASONS) else reason,
+            (b & 0xFFFF) // 100, (b & 0xFFFF) % 100)
+    else:
+        detail = "a={} b={}".format(a, b)
+    return "#{} t={}.{}s {} {}".format(seq, t_ds // 10, t_ds % 10, name, detail)
+
+
+class EventLog:
+    """Anel de eventos de tamanho fixo com contadores por codigo."""
+
+    def __init__(self, filename=EVENT_FILE, capacity=DEFAULT_CAPACITY,
+                 clock=None, holdoff_ds=HOLDOFF_DS):
+        """
+        Args:
+            filename: arquivo do anel
+            capacity: registros no anel (so vale ao criar o arquivo; um
+                      arquivo existente mantem a sua capacidade)
+            clock: funcao que retorna o timestamp em decisegundos
+                   (TimestampManager.get_timestamp_ds); None => 0
+            holdoff_ds: intervalo minimo entre gravacoes do mesmo evento
+        """
+        self.filename = filename
+        self.clock = clock
+        self.holdoff_ds = holdoff_ds
+        self.capacity = capacity
+        self.counts = [0] * N_CODES
+        self.seq = 1            # proximo numero de sequencia
+        self.suppressed = 0     # eventos so contados (holdoff)
+        self._dirty = False     # contadores mudaram desde a ultima gravacao
+        self._last = {}         # (codigo, a) -> (t_ds da ultima gravacao, holdoff atual)
+        self._rec = bytearray(REC_SIZE)
+        try:
+            self._load()
+        except (OSError, ValueError):
+            self._create()
+
+    # -- arquivo -------------------------------------------------------
+
+    def _load(self):
+        """Le o cabecalho e acha o maior seq (uma leitura do anel no boot)."""
+        with open(self.filename, "rb") as f:
+            head = f.read(HEADER_SIZE)
+            if len(head) < HEADER_SIZE:
+                raise ValueError("cabecalho curto")
+            magic, version, rec_size, capacity = struct.unpack_from(HEADER_FMT, head)
+            if magic != EVENT_MAGIC or rec_size != REC_SIZE or capacity == 0:
+                raise ValueError("nao e um anel de eventos")
+            self.capacity = capacity
+            self.counts = list(struct.unpack_from("<{}I".format(N_CODES), head, COUNTERS_OFFSET))
+            last = 0
+            buf = bytearray(REC_SIZE * 16)
+            slot = 0
+            while slot < capacity:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                for pos in range(0, n - REC_SIZE + 1, REC_SIZE):
+                    rec = decode(buf, pos)
+                    if rec is not None and (rec[0] - 1) % capacity == slot and rec[0] > last:
+                        last = rec[0]
+                    slot += 1
+            self.seq = last + 1
+
+    def _create(self):
+        """Cria o arquivo com o anel vazio (zeros)."""
+        with open(self.filename, "wb") as f:
+            f.write(struct.pack(HEADER_FMT, EVENT_MAGIC, EVENT_VERSION, REC_SIZE, self.capacity))
+            f.write(struct.pack("<{}I".format(N_CODES), *self.counts))
+            zeros = bytes(REC_SIZE * 16)
+            left = self.capacity
+            while left > 0:
+                k = min(16, left)
+                f.write(zeros[:REC_SIZE * k])
+                left -= k
+        count_bytes(W_EVENTS, HEADER_SIZE + REC_SIZE * self.capacity)
+        self.seq = 1
+
+    def _write_counts(self, f):
+        f.seek(COUNTERS_OFFSET)
+        f.write(struct.pack("<{}I".format(N_CODES), *self.counts))
+        self._dirty = False
+
+    # -- gravacao ------------------------------------------------------
+
+    def log(self, code, a=0, b=0, force=False):
+        """
+        Registra um evento. Returns True se foi gravado no anel (False se
+        so contado pelo holdoff ou se a gravacao falhou). force=True grava
+        mesmo dentro do holdoff (decisoes que precisam de registro completo).
+        """
+        if 0 <= code < N_CODES:
+            self.counts[code] += 1
+            self._dirty = True
+        t = self.clock() if self.clock is not None else 0
+        key = (code, a)
+        prev = self._last.get(key)
+        hold = self.holdoff_ds
+        if not force and prev is not None and self.clock is not None:
+            dt = t - prev[0]
+            if 0 <= dt <= prev[1]:
+                self.suppressed += 1
+                return False
+            if 0 <= dt <= 2 * prev[1]:
+                # Voltou logo apos o holdoff: falha persistente, espaca mais
+                hold = min(2 * prev[1], HOLDOFF_MAX_DS)
+        self._last[key] = (t, hold)
+        a = max(-0x8000, min(0x7FFF, int(a)))
+        b = max(-_I32_MAX - 1, min(_I32_MAX, int(b)))
+        rec = self._rec
+        struct.pack_into(REC_FMT, rec, 0, self.seq, t & 0xFFFFFFFF, code & 0xFF, 0, a, b)
+        rec[9] = _checksum(rec)
+        try:
+            with open(self.filename, "r+b") as f:
+                f.seek(HEADER_SIZE + ((self.seq - 1) % self.capacity) * REC_SIZE)
+                f.write(rec)
+                self._write_counts(f)
+        except OSError as e:
+            print("AVISO - Evento nao gravado: {}".format(e))
+            return False
+        count_bytes(W_EVENTS, REC_SIZE + HEADER_SIZE - COUNTERS_OFFSET)
+        self.seq += 1
+        return True
+
+    def sync(self):
+        """Grava os contadores (eventos so contados desde a ultima gravacao)."""
+        if not self._dirty:
+            return
+        try:
+            with open(self.filename, "r+b") as f:
+                self._write_counts(f)
+        except OSError as e:
+            print("AVISO - Contadores de eventos nao gravados: {}".format(e))
+            return
+        count_bytes(W_EVENTS, HEADER_SIZE - COUNTERS_OFFSET)
+
+    def clear(self):
+        """Zera o anel e os contadores."""
+        self.counts = [0] * N_CODES
+        self._last = {}
+        self.suppressed = 0
+        self._create()
+
+    # -- consulta ------------------------------------------------------
+
+    def _read(self, f, first, last):
+        """Registros validos com seq em [first, last], em ordem crescente."""
+        out = []
+        seq = first
+        while seq <= last:
+            slot = (seq - 1) % self.capacity
+            k = min(last - seq + 1, self.capacity - slot, 16)
+            f.seek(HEADER_SIZE + slot * REC_SIZE)
+            buf = f.read(k * REC_SIZE)
+            for i in range(k):
+                rec = decode(buf, i * REC_SIZE)
+                if rec is not None and rec[0] == seq + i:
+                    out.append(rec)
+            seq += k
+        return out
+
+    def tail(self, n=10, code=None):
+        """
+        Ultimos n eventos (todos ou so do codigo dado), do mais antigo ao
+        mais recente. Le para tras em blocos de 16 registros.
+        """
+        out = []
+        last = self.seq - 1
+        oldest = max(1, self.seq - self.capacity)
+        try:
+            with open(self.filename, "rb") as f:
+                while last >= oldest and len(out) < n:
+                    first = max(oldest, last - 15)
+                    recs = self._read(f, first, last)
+                    for rec in reversed(recs):
+                        if code is None or rec[2] == code:
+                            out.append(rec)
+                            if len(out) >= n:
+                                break
+                    last = first - 1
+        except OSError:
+            return []
+        out.reverse()
+        return out
+
+    def since(self, seq, n=32):
+        """Ate n eventos com numero de sequencia maior que seq (leitura incremental)."""
+        first = max(seq + 1, self.seq - self.capacity, 1)
+        last = min(self.seq - 1, first + n - 1)
+        if last < first:
+            return []
+        try:
+            with open(self.filename, "rb") as f:
+                return self._read(f, first, last)
+        except OSError:
+            return []
+
+
+def read_file(path):
+    """
+    Le um events.bin inteiro (PC). Returns (contadores, registros em
+    ordem de seq).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        raise ValueError("{}: cabecalho curto".format(path))
+    magic, version, rec_size, capacity = struct.unpack_from(HEADER_FMT, data)
+    if magic != EVENT_MAGIC or rec_size != REC_SIZE:
+        raise ValueError("{}: nao e um anel de eventos".format(path))
+    counts = list(struct.unpack_from("<{}I".format(N_CODES), data, COUNTERS_OFFSET))
+    recs = []
+    for slot in range(capacity):
+        rec = decode(data, HEADER_SIZE + slot * REC_SIZE)
+        if rec is not None and (rec[0] - 1) % capacity == slot:
+            recs.append(rec)
+    recs.sort()
+    return counts, recs
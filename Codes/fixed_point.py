@@ -0,0 +1,71 @@
+# fixed_point.py
+"""
+Utilitarios de ponto fixo
+-------------------------
+No MicroPython cada float intermediario e um objeto no heap; inteiros
+ate 2**30 (small int) nao alocam. O pipeline inteiro usa as unidades:
+
+    uV  - microvolts          uA  - microamperes
+    mp  - mili-porcento       cC  - centi-graus Celsius
+    cp  - centi-porcento      ds  - decisegundos
+
+Conversao para float/texto so na exibicao ou exportacao.
+"""
+
+SMALL_INT_LIMIT = 1 << 30
+
+
+def scale_factor(factor, max_input):
+    """
+    Calcula (k, shift) tal que x * factor ~= (x * k) >> shift, com
+    max_input * k ainda abaixo do limite de small int.
+    Calcular uma vez na inicializacao (usa float).
+    """
+    shift = 0
+    while max_input * factor * (1 << (shift + 1)) < SMALL_INT_LIMIT and shift < 24:
+        shift += 1
+    return int(factor * (1 << shift) + 0.5), shift
+
+
+def fmt_fixed(value, scale, decimals):
+    """
+    Formata inteiro em unidades 1/scale com 'decimals' casas, sem float.
+    Ex.: fmt_fixed(3756123, 1000000, 3) -> "3.756"
+    None => "nan" (leitura indisponivel).
+    """
+    if value is None:
+        return "nan"
+    p = 10 ** decimals
+    if value < 0:
+        sign = "-"
+        value = -value
+    else:
+        sign = ""
+    if p >= scale:
+        # Mais casas que a resolucao: completa com zeros
+        r = value * (p // scale)
+    else:
+        q = scale // p
+        r = (value + q // 2) // q
+    if decimals == 0:
+        return "{}{}".format(sign, r)
+    frac = str(r % p)
+    return "{}{}.{}{}".format(sign, r // p, "0" * (decimals - len(frac)), frac)
+
+
+def to_float(value, scale):
+    """Converte para float (apenas exibicao/exportacao)."""
+    if value is None:
+        return float('nan')
+    return value / scale
+
+
+def mul_shift(x, k, shift, split=7):
+    """
+    (x * k) >> shift sem passar de small int quando x * k e grande:
+    divide x em parte alta/baixa de 'split' bits. Erro <= 1 LSB.
+    Requer shift >= split.
+    """
+    hi = x >> split
+    lo = x - (hi << split)
+    return ((hi * k) >> (shift - split)) + ((lo * k) >> shift)
@@ -5,6 +5,10 @@ class HDC1080:
     def __init__(self, i2c=None, addr=0x40):
         self.i2c = i2c or I2C(1, scl=Pin(5), sda=Pin(4), freq=100_000)
         self.addr = addr
+        self._buf = bytearray(4)
+        # Ultima leitura inteira (ver read_fixed)
+        self.temp_cC = None
+        self.hum_cp = None
 
     def reset(self):
         """Comando de reset interno do HDC1080."""
@@ -20,4 +24,20 @@ class HDC1080:
         raw_hum  = (data[2] << 8) | data[3]
         temperature = (raw_temp / 65536.0) * 165.0 - 40.0
         humidity    = (raw_hum  / 65536.0) * 100.0
-        return temperature, humidity
\ No newline at end of file
+        return temperature, humidity
+
+    def read_fixed(self):
+        """
+        Le em inteiros, sem float: self.temp_cC (centi-graus) e
+        self.hum_cp (centi-porcento). Retorna True.
+        """
+        self.i2c.writeto(self.addr, b'\x00')
+        sleep(0.02)  # tempo de conversão
+        buf = self._buf
+        self.i2c.readfrom_into(self.addr, buf)
+        raw_temp = (buf[0] << 8) | buf[1]
+        raw_hum  = (buf[2] << 8) | buf[3]
+        # 16500 / 65536 == 4125 / 16384 (mantem small int)
+        self.temp_cC = ((raw_temp * 4125) >> 14) - 4000
+        self.hum_cp = (raw_hum * 10000) >> 16
+        return True
\ No newline at end of file
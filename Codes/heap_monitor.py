@@ -0,0 +1,262 @@
+# heap_monitor.py
+"""
+Coleta de lixo no tempo ocioso e telemetria do heap
+---------------------------------------------------
+Em vez de gc.collect() no meio do loop a cada GC_INTERVAL amostras, a
+coleta roda na folga antes do proximo prazo, so se a pausa estimada
+(media das pausas medidas, com margem) couber no tempo que falta:
+
+    heap.sample()              # a cada amostra: pico e coletas automaticas
+    heap.service(folga_ms)     # no tempo ocioso: coleta se devida e se couber
+    if heap.overdue():         # nenhuma folga serviu por max_samples amostras
+        heap.collect(forced=True)
+
+A taxa de alocacao (bytes/s entre coletas) ajusta gc.threshold para
+HEADROOM_SLOTS intervalos de amostragem de alocacao: a coleta automatica
+do MicroPython (no meio de uma alocacao qualquer) vira rede de seguranca
+e so dispara se a alocacao subir muito ou as folgas sumirem. O limite
+nunca passa de metade do heap livre.
+
+Medidas: pausa de cada coleta (ultima, maxima), pico de mem_alloc, heap
+vivo logo apos a coleta, coletas automaticas (mem_alloc caiu sem coleta
+nossa) e, a cada probe_every coletas, o maior bloco livre (fragmentacao),
+por busca binaria com bytearray. A tendencia do heap vivo (regressao
+exponencial, tau TREND_TAU_S) da o crescimento em bytes/hora e o tempo
+ate esgotar: um vazamento aparece como tendencia, nao como MemoryError.
+"""
+
+import gc
+from time import ticks_ms, ticks_us, ticks_diff
+
+HEADROOM_SLOTS = 4        # gc.threshold = alocacao de 4 intervalos
+THRESHOLD_MIN = 4096      # bytes
+PAUSE_MARGIN = 1.5        # a folga precisa de 1.5x a pausa estimada
+PROBE_EVERY = 10          # coletas entre medidas do maior bloco livre
+PROBE_RESOLUTION = 256    # bytes
+TREND_TAU_S = 6 * 3600
+TREND_MIN_COLLECTIONS = 5
+
+
+def _kb(n):
+    return "{:.1f} KB".format(n / 1024)
+
+
+class HeapMonitor:
+    """Agenda o gc.collect() nas folgas e acompanha o heap."""
+
+    def __init__(self, interval_s, max_samples=100, auto_threshold=True,
+                 probe_every=PROBE_EVERY):
+        """
+        Args:
+            interval_s: intervalo de amostragem [s] (dimensiona o threshold)
+            max_samples: amostras sem coleta antes de forcar no loop
+            auto_threshold: ajusta gc.threshold pela taxa de alocacao
+            probe_every: coletas entre medidas do maior bloco livre (0 = nunca)
+        """
+        self.interval_s = interval_s
+        self.max_samples = max_samples
+        self.auto_threshold = auto_threshold
+        self.probe_every = probe_every
+
+        self.collections = 0     # no tempo ocioso
+        self.forced = 0          # no loop (nenhuma folga serviu)
+        self.auto = 0            # disparadas pelo MicroPython (threshold ou falta)
+        self.skipped = 0         # folgas curtas demais para a pausa
+        self.pause_us = 0        # ultima pausa
+        self.pause_max_us = 0
+        self.pause_est_us = 0    # media exponencial (dimensiona a folga)
+        self.peak = 0            # maior mem_alloc visto
+        self.live = 0            # mem_alloc logo apos a ultima coleta
+        self.free = 0            # mem_free logo apos a ultima coleta
+        self.largest = None      # maior bloco livre [bytes]
+        self.threshold = None    # gc.threshold atual (None = do firmware)
+        self.rate_Bps = None     # taxa de alocacao
+        self.trend_Bph = None    # crescimento do heap vivo
+        self.exhaust_s = None    # tempo ate esgotar, pela tendencia
+
+        self._t_ms = ticks_ms()
+        self._t_s = 0.0          # tempo acumulado (sobrevive ao wrap do ticks_ms)
+        self._samples = 0        # amostras desde a ultima coleta
+        self._base = 0           # mem_alloc apos a ultima coleta (ou automatica)
+        self._last_alloc = 0
+        self._allocated = 0      # bytes alocados antes de coletas automaticas
+        self._t_collect = None
+        self._tr_n = 0
+        self._tr_last = 0.0
+        self._tr_t = self._tr_y = self._tr_tv = self._tr_cov = 0.0
+        self.collect(forced=True)
+        self.forced = 0
+
+    def _now_s(self):
+        now = ticks_ms()
+        self._t_s += ticks_diff(now, self._t_ms) / 1000.0
+        self._t_ms = now
+        return self._t_s
+
+    # -- por amostra ---------------------------------------------------
+
+    def sample(self):
+        """Uma vez por amostra: pico e deteccao de coletas automaticas."""
+        a = gc.mem_alloc()
+        if a < self._last_alloc:
+            # Coleta que nao foi nossa: conta o que foi alocado ate ela
+            self.auto += 1
+            self._allocated += self._last_alloc - self._base
+            self._base = a
+        self._last_alloc = a
+        if a > self.peak:
+            self.peak = a
+        self._samples += 1
+
+    def due(self):
+        """True se ha lixo suficiente (ou tempo demais) para coletar."""
+        limit = (self.threshold or THRESHOLD_MIN * 2) // 2
+        return (self._last_alloc - self._base >= limit
+                or self._samples >= self.max_samples // 2)
+
+    def overdue(self):
+        """True se nenhuma folga serviu por max_samples amostras."""
+        return self._samples >= self.max_samples
+
+    def service(self, slack_ms):
+        """
+        Coleta na folga se devida e se a pausa estimada couber.
+
+        Returns:
+            True se coletou
+        """
+        if not self.due():
+            return False
+        if self.pause_est_us * PAUSE_MARGIN > slack_ms * 1000:
+            self.skipped += 1
+            return False
+        t0 = ticks_us()
+        self.collect()
+        if self.probe_every and self.collections % self.probe_every == 0:
+            # A sonda deixa lixo e custa ~2 pausas: so com folga para isso
+            left_us = slack_ms * 1000 - ticks_diff(ticks_us(), t0)
+            if left_us > 3 * self.pause_est_us * PAUSE_MARGIN:
+                self.probe()
+        return True
+
+    # -- coleta ----------------------------------------------------------
+
+    def collect(self, forced=False):
+        """gc.collect() medido; atualiza taxa, tendencia e threshold."""
+        before = gc.mem_alloc()
+        if before > self.peak:
+            self.peak = before
+        t0 = ticks_us()
+        gc.collect()
+        us = ticks_diff(ticks_us(), t0)
+        after = gc.mem_alloc()
+        self.free = gc.mem_free()
+        now = self._now_s()
+
+        if forced:
+            self.forced += 1
+        else:
+            self.collections += 1
+        self.pause_us = us
+        if us > self.pause_max_us:
+            self.pause_max_us = us
+        if self.pause_est_us == 0:
+            self.pause_est_us = us
+        else:
+            self.pause_est_us += (us - self.pause_est_us) // 4
+
+        allocated = self._allocated + max(0, before - self._base)
+        if self._t_collect is not None and now > self._t_collect:
+            r = allocated / (now - self._t_collect)
+            self.rate_Bps = r if self.rate_Bps is None else self.rate_Bps + (r - self.rate_Bps) / 4
+        self._t_collect = now
+        self._allocated = 0
+        self._base = self._last_alloc = after
+        self._samples = 0
+        self.live = after
+        self._trend(now, after)
+        if self.auto_threshold and self.rate_Bps is not None:
+            self._set_threshold()
+
+    def _set_threshold(self):
+        want = int(self.rate_Bps * self.interval_s * HEADROOM_SLOTS)
+        n = max(THRESHOLD_MIN, min(want, self.free // 2))
+        if self.threshold is not None and abs(n - self.threshold) < self.threshold // 8:
+            return   # mudanca pequena: nao mexe
+        try:
+            gc.threshold(n)
+        except (AttributeError, TypeError):
+            self.auto_threshold = False   # port sem gc.threshold
+            return
+        self.threshold = n
+
+    def probe(self):
+        """
+        Maior bloco livre por busca binaria com bytearray. Alocacao que
+        falha faz o MicroPython coletar e tentar de novo, entao o lixo
+        das tentativas anteriores nao atrapalha; no fim coleta mais uma vez.
+        """
+        lo, hi = 0, gc.mem_free()
+        while hi - lo > PROBE_RESOLUTION:
+            mid = (lo + hi) // 2
+            try:
+                bytearray(mid)      # sem nome: vira lixo na hora
+                lo = mid
+            except MemoryError:
+                hi = mid
+        self.largest = lo
+        gc.collect()
+        self._base = self._last_alloc = gc.mem_alloc()
+
+    def _trend(self, now, live):
+        """Regressao exponencial do heap vivo no tempo (como soc_forecast)."""
+        if self._tr_n == 0:
+            self._tr_t = 0.0
+            self._tr_y = live
+            self._tr_tv = self._tr_cov = 0.0
+        else:
+            dt = now - self._tr_last
+            if dt <= 0.0:
+                return
+            a = dt / (TREND_TAU_S + dt)
+            b = 1.0 - a
+            dx = dt - self._tr_t
+            dy = live - self._tr_y
+            self._tr_t += a * dx - dt
+            self._tr_y += a * dy
+            self._tr_tv = b * (self._tr_tv + a * dx * dx)
+            self._tr_cov = b * (self._tr_cov + a * dx * dy)
+        self._tr_last = now
+        self._tr_n += 1
+        if self._tr_n >= TREND_MIN_COLLECTIONS and self._tr_tv > 0.0:
+            slope = self._tr_cov / self._tr_tv
+            self.trend_Bph = slope * 3600.0
+            self.exhaust_s = self.free / slope if slope > 0.0 else None
+
+    # -- relatorio -------------------------------------------------------
+
+    def fragmentation(self):
+        """Fracao do heap livre fora do maior bloco (None sem sonda)."""
+        if self.largest is None or self.free <= 0:
+            return None
+        return max(0.0, 1.0 - self.largest / self.free)
+
+    def summary(self):
+        """Tres linhas: heap, coletas e tendencia."""
+        frag = self.fragmentation()
+        lines = ["heap: {} vivos, pico {}, livre {}, maior bloco {}".format(
+            _kb(self.live), _kb(self.peak), _kb(self.free),
+            "?" if self.largest is None else "{} (frag {:.0f}%)".format(_kb(self.largest), frag * 100))]
+        lines.append("gc: {} ociosas, {} forcadas, {} automaticas, {} folgas curtas; "
+                     "pausa {:.1f} ms (max {:.1f}); threshold {}; alocacao {}".format(
+                         self.collections, self.forced, self.auto, self.skipped,
+                         self.pause_us / 1000, self.pause_max_us / 1000,
+                         "firmware" if self.threshold is None else _kb(self.threshold),
+                         "?" if self.rate_Bps is None else "{:.0f} B/s".format(self.rate_Bps)))
+        if self.trend_Bph is None:
+            lines.append("tendencia: sem dados")
+        else:
+            lines.append("tendencia: {:+.0f} B/h{}".format(
+                self.trend_Bph, "" if self.exhaust_s is None
+                else " (esgota em {:.1f} d)".format(self.exhaust_s / 86400)))
+        return "\n".join(lines)
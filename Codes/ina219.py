@@ -160,6 +160,50 @@ class INA219:
         raw_current = _to_signed(self._read_register(_REG_CURRENT))
         return raw_current * self._current_lsb
 
+    @property
+    def bus_voltage_mv(self):
+        """The bus voltage in integer millivolts (no float)."""
+        return _to_signed(self._read_register(_REG_BUSVOLTAGE) >> 3) * 4
+
+    def recalibrate(self):
+        """Rewrites the calibration register (see ``current``)."""
+        self._write_register(_REG_CALIBRATION, self._cal_value)
+
+    @property
+    def raw_current(self):
+        """The signed CURRENT register count, without rewriting calibration.
+
+           Intended for fast continuous sampling; multiply by
+           ``current_lsb`` to get milliamps."""
+        return _to_signed(self._read_register(_REG_CURRENT))
+
+    @property
+    def current_lsb(self):
+        """Milliamps per bit of the CURRENT register."""
+        return self._current_lsb
+
+    @property
+    def config(self):
+        """The raw CONFIG register value."""
+        return self._read_register(_REG_CONFIG)
+
+    @config.setter
+    def config(self, value):
+        self._write_register(_REG_CONFIG, value)
+
+    def set_fast_shunt_continuous(self):
+        """Switches to continuous shunt-only conversion at 12 bits / 532us.
+
+           Bus voltage is not updated in this mode.  Returns the previous
+           CONFIG value so the caller can restore it."""
+        previous = self.config
+        config = ((previous & ~(_CONFIG_SADCRES_MASK | _CONFIG_MODE_MASK)) |
+                  _CONFIG_SADCRES_12BIT_1S_532US |
+                  _CONFIG_MODE_SVOLT_CONTINUOUS)
+        self._write_register(_REG_CALIBRATION, self._cal_value)
+        self._write_register(_REG_CONFIG, config)
+        return previous
+
     def set_calibration_32V_2A(self):  # pylint: disable=invalid-name
         """Configures to INA219 to be able to measure up to 32V and 2A
             of current. Counter overflow occurs at 3.2A.
@@ -32,6 +32,11 @@ class Ina219Sensor:
         # Configuração padrão: 16V / 400mA para melhor resolução
         self._ina.set_calibration_16V_400mA()
 
+        # Leituras inteiras (ver average_fixed)
+        self._lsb_uA = int(self._ina.current_lsb * 1000 + 0.5)
+        self.vbus_uV = 0
+        self.current_uA = 0
+
     def read(self):
         """
         Realiza uma leitura completa do sensor.
@@ -54,6 +59,51 @@ class Ina219Sensor:
             "power": power
         }
 
+    @property
+    def current_lsb_mA(self):
+        """Valor em mA de cada contagem retornada por read_current_raw()."""
+        return self._ina.current_lsb
+
+    def enter_fast_mode(self):
+        """
+        Coloca o INA219 em conversao continua rapida (somente shunt).
+        :return: configuracao anterior, para ser passada a exit_fast_mode()
+        """
+        return self._ina.set_fast_shunt_continuous()
+
+    def exit_fast_mode(self, previous_config):
+        """Restaura a configuracao salva por enter_fast_mode()."""
+        self._ina.config = previous_config
+
+    def read_current_raw(self):
+        """
+        Leitura rapida do registro de corrente, sem alocar float.
+        :return: contagem inteira com sinal (ja com polaridade aplicada)
+        """
+        raw = self._ina.raw_current
+        return -raw if self._invert else raw
+
+    def average_fixed(self, n=5, delay=0.05):
+        """
+        Media de n leituras em inteiros, sem alocar float.
+        Resultado em self.vbus_uV e self.current_uA.
+        :return: True
+        """
+        ina = self._ina
+        sum_mv = 0
+        sum_raw = 0
+        for _ in range(n):
+            sum_mv += ina.bus_voltage_mv
+            ina.recalibrate()
+            sum_raw += ina.raw_current
+            sleep(delay)
+
+        if self._invert:
+            sum_raw = -sum_raw
+        self.vbus_uV = (sum_mv * 1000) // n
+        self.current_uA = (sum_raw * self._lsb_uA) // n
+        return True
+
     def average(self, n=5, delay=0.05):
         """
         Faz média móvel de n leituras para reduzir ruído.
@@ -0,0 +1,236 @@
+# load_scheduler.py
+"""
+Escalonador de cargas pelo estado da bateria
+--------------------------------------------
+Liga e desliga, por chaves de carga em GPIO, os equipamentos alimentados
+pelo no (camera, mini-computador...), para que o proprio no sobreviva a
+dias nublados em vez de entrar em brownout e no ciclo de resets.
+
+Regras por carga, avaliadas a cada amostra:
+
+    - histerese de SoC: desliga abaixo de soc_off, so religa acima de soc_on
+    - cota de uso: no maximo duty * window_s segundos ligada por janela
+    - reserva (opcional): desliga se o pior caso de autonomia do
+      SocForecaster (tte_lo_s) ficar abaixo de reserve_s; religa so
+      depois de o SoC subir mais uma faixa (soc_on - soc_off)
+    - sobrecarga: Iload medido acima de max_load_mA por overload_s
+      desliga a carga ligada de menor prioridade
+    - permanencia: depois de desligada, so religa apos min_off_s
+      (desligar e sempre imediato)
+    - manual (comando "load"): "off" vale sempre; "on" ignora cota e
+      reserva, mas nao o SoC minimo
+
+No boot as cargas partem desligadas e so ligam com SoC >= soc_on: apos um
+brownout a tensao em vazio engana e religar tudo repetiria o ciclo.
+
+Cada decisao vira um evento LOAD_SWITCH (gravado mesmo dentro do holdoff).
+Roda tambem no PC contra perfis simulados: Ferramentas/load_sim.py.
+"""
+
+from console import say, INFO
+from event_log import EV_LOAD_SWITCH, LOAD_REASONS
+
+# Motivos (indices de LOAD_REASONS)
+R_BOOT = 1
+R_SOC_LOW = 2
+R_SOC_OK = 3
+R_QUOTA = 4
+R_OVERLOAD = 5
+R_FORECAST = 6
+R_MANUAL = 7
+
+
+class Load:
+    """Uma carga chaveada e sua politica."""
+
+    def __init__(self, name, pin=None, priority=0, soc_off=30.0, soc_on=40.0,
+                 duty=1.0, window_s=3600, min_off_s=60, reserve_s=0,
+                 active_high=True):
+        """
+        Args:
+            name: nome curto (comandos e estatisticas)
+            pin: objeto com value(v) (machine.Pin de saida) ou None
+            priority: maior = mantida por mais tempo numa sobrecarga
+            soc_off: SoC [%] abaixo do qual desliga
+            soc_on: SoC [%] acima do qual pode religar (> soc_off)
+            duty: fracao maxima de cada janela com a carga ligada
+            window_s: tamanho da janela da cota [s]
+            min_off_s: tempo minimo desligada antes de religar [s]
+            reserve_s: autonomia minima prevista para manter ligada (0 = ignora)
+            active_high: nivel do pino que liga a chave
+        """
+        if soc_on < soc_off:
+            raise ValueError("{}: soc_on menor que soc_off".format(name))
+        self.name = name
+        self.pin = pin
+        self.priority = priority
+        self.soc_off = soc_off
+        self.soc_on = soc_on
+        self.duty = duty
+        self.window_s = window_s
+        self.min_off_s = min_off_s
+        self.reserve_s = reserve_s
+        self.active_high = active_high
+
+        self.on = False
+        self.reason = R_BOOT
+        self.manual = None       # None (automatico), True ou False
+        self.on_s = 0.0          # tempo ligada na janela atual
+        self.total_on_s = 0.0
+        self.switches = 0
+        self.resume_soc = soc_on  # SoC para religar (sobe apos corte pela previsao)
+        self._window = None
+        self._changed_t = None   # ultima troca de estado
+        self._drive(False)
+
+    def _drive(self, on):
+        if self.pin is not None:
+            self.pin.value(1 if on == self.active_high else 0)
+
+    def quota_left(self):
+        """Segundos de uso restantes na janela atual."""
+        return max(0.0, self.duty * self.window_s - self.on_s)
+
+    def status(self):
+        """'camera ON (soc_ok, cota 540/900s)'"""
+        return "{} {} ({}{}, cota {:.0f}/{:.0f}s)".format(
+            self.name, "ON" if self.on else "OFF", LOAD_REASONS[self.reason],
+            "" if self.manual is None else ", manual", self.on_s, self.duty * self.window_s)
+
+
+class LoadScheduler:
+    """Decide o estado das cargas a partir do SoC e da corrente medida."""
+
+    def __init__(self, loads, events=None, forecast=None, max_load_mA=None,
+                 overload_s=5.0):
+        """
+        Args:
+            loads: lista de Load
+            events: EventLog (opcional) para registrar as trocas
+            forecast: SocForecaster (opcional) para a reserva de autonomia
+            max_load_mA: limite do Iload medido (None = sem limite)
+            overload_s: tempo acima do limite antes de cortar uma carga
+        """
+        self.loads = list(loads)
+        self.events = events
+        self.forecast = forecast
+        self.max_load_mA = max_load_mA
+        self.overload_s = overload_s
+        self.switches = 0
+        self._last_t = None
+        self._over_since = None
+
+    def find(self, name):
+        for ld in self.loads:
+            if ld.name == name:
+                return ld
+        raise ValueError("carga desconhecida: {}".format(name))
+
+    def set_manual(self, name, mode):
+        """mode: "on", "off" ou "auto". Vale a partir da proxima amostra."""
+        ld = self.find(name)
+        if mode not in ("on", "off", "auto"):
+            raise ValueError("use on, off ou auto")
+        ld.manual = None if mode == "auto" else (mode == "on")
+        return ld
+
+    def _switch(self, ld, on, reason, soc, now_s):
+        ld.on = on
+        ld.reason = reason
+        ld._changed_t = now_s
+        ld.switches += 1
+        self.switches += 1
+        ld._drive(on)
+        say(INFO, "Carga {} {} ({}), SoC {:.1f}%".format(
+            ld.name, "ligada" if on else "desligada", LOAD_REASONS[reason], soc))
+        if self.events is not None:
+            soc_cp = max(0, min(0xFFFF, int(soc * 100)))
+            self.events.log(EV_LOAD_SWITCH, self.loads.index(ld),
+                            (reason << 20) | ((1 if on else 0) << 16) | soc_cp, force=True)
+
+    def update(self, soc_pct, iload_mA, now_s):
+        """
+        Avalia as regras com a amostra atual e aciona os pinos.
+
+        Args:
+            soc_pct: SoC do gauge [%] (None => mantem tudo como esta)
+            iload_mA: corrente medida das cargas [mA]
+            now_s: timestamp [s]
+
+        Returns:
+            numero de trocas feitas nesta amostra
+        """
+        if soc_pct is None or soc_pct != soc_pct:
+            return 0
+        dt = 0.0 if self._last_t is None else now_s - self._last_t
+        if dt < 0.0:
+            dt = 0.0
+        self._last_t = now_s
+        before = self.switches
+
+        # Sobrecarga sustentada
+        shed = None
+        if self.max_load_mA is not None and iload_mA == iload_mA and iload_mA > self.max_load_mA:
+            if self._over_since is None:
+                self._over_since = now_s
+            elif now_s - self._over_since >= self.overload_s:
+                for ld in self.loads:
+                    if ld.on and (shed is None or ld.priority < shed.priority):
+                        shed = ld
+                self._over_since = None
+        else:
+            self._over_since = None
+
+        fc = self.forecast
+        tte_lo = None if fc is None or fc.rate_mA is None else fc.tte_lo_s
+
+        for ld in self.loads:
+            # Cota: tempo ligado desde a amostra anterior, janela fixa no relogio
+            if ld.on:
+                ld.on_s += dt
+                ld.total_on_s += dt
+            window = int(now_s // ld.window_s)
+            if window != ld._window:
+                ld._window = window
+                ld.on_s = 0.0
+
+            if ld is shed:
+                self._switch(ld, False, R_OVERLOAD, soc_pct, now_s)
+                continue
+            low_reserve = (ld.reserve_s and tte_lo is not None and tte_lo < ld.reserve_s)
+            if ld.on:
+                if soc_pct < ld.soc_off:
+                    self._switch(ld, False, R_SOC_LOW, soc_pct, now_s)
+                elif ld.manual is False:
+                    self._switch(ld, False, R_MANUAL, soc_pct, now_s)
+                elif ld.manual is None and ld.quota_left() <= 0.0:
+                    self._switch(ld, False, R_QUOTA, soc_pct, now_s)
+                elif ld.manual is None and low_reserve:
+                    self._switch(ld, False, R_FORECAST, soc_pct, now_s)
+                    # Sem a carga a previsao melhora na hora: exige que o SoC
+                    # suba uma faixa de histerese antes de religar
+                    ld.resume_soc = min(100.0, max(ld.soc_on, soc_pct + ld.soc_on - ld.soc_off))
+                continue
+
+            if ld.manual is False:
+                continue
+            if ld._changed_t is not None and now_s - ld._changed_t < ld.min_off_s:
+                continue
+            if ld.manual:
+                if soc_pct >= ld.soc_off:
+                    self._switch(ld, True, R_MANUAL, soc_pct, now_s)
+            elif soc_pct >= ld.resume_soc and ld.quota_left() > 0.0 and not low_reserve:
+                self._switch(ld, True, R_BOOT if ld.switches == 0 else R_SOC_OK, soc_pct, now_s)
+                ld.resume_soc = ld.soc_on
+        return self.switches - before
+
+    def update_fixed(self, soc_mp, iload_uA, now_ds):
+        """Mesmo que update() com as unidades do pipeline inteiro."""
+        if soc_mp is None:
+            return 0
+        iload = float('nan') if iload_uA is None else iload_uA / 1000.0
+        return self.update(soc_mp / 1000.0, iload, now_ds / 10.0)
+
+    def summary(self):
+        """Uma linha por carga."""
+        return "\n".join(ld.status() for ld in self.loads)
@@ -0,0 +1,342 @@
+# log_codec.py
+"""
+Codec delta + varint para os CSVs do logger (.csv.dv)
+-----------------------------------------------------
+Alternativa ao deflate para firmwares sem compressao: cada coluna vira
+inteiro na sua escala decimal (o CSV e gravado com casas fixas), e cada
+linha guarda so a diferenca para a linha anterior, em varint zigzag.
+Sem tabelas nem janela: RAM constante, ~4x menor que o texto.
+
+Formato:
+    "FDV1" | n_colunas (u8) | casas decimais por coluna (u8 cada)
+    | tamanho do cabecalho (varint) | cabecalho CSV (texto)
+    linhas: mascara (varint) + deltas (varint zigzag) das colunas nao-NaN
+        bit i da mascara  => coluna i e "nan"
+        bit n_colunas     => linha crua: tamanho (varint) + texto
+
+A reconstrucao e exata byte a byte (linhas que nao seguem o formato
+viajam cruas), entao o CRC32 do texto confere depois de descomprimir.
+Usado pelo dispositivo (retention.py) e pelas ferramentas do PC.
+
+Tambem mantem o manifesto dos logs comprimidos (log_manifest.csv): uma
+linha por arquivo com tamanho e CRC32 do CSV original e o intervalo de
+tempo coberto, para listar sem descomprimir.
+"""
+
+import os
+from fixed_point import fmt_fixed
+from write_stats import count_bytes, W_MANIFEST
+
+DV_MAGIC = b"FDV1"
+DV_SUFFIX = ".dv"
+GZIP_SUFFIX = ".gz"
+
+MANIFEST_NAME = "log_manifest.csv"
+MANIFEST_HEADER = "file,raw_size,crc32,t_first,t_last\n"
+
+# Casas decimais das colunas do DataLogger (append e append_fixed)
+CSV_DECIMALS = (2, 3, 3, 3, 3, 2, 2, 2, 2)
+
+
+def _parse_fixed(text, decimals):
+    """'3.756' -> 3756 com 'decimals' casas; None para nan."""
+    if text == "nan":
+        return None
+    neg = text.startswith("-")
+    if neg:
+        text = text[1:]
+    if decimals:
+        ip, _, fp = text.partition(".")
+    else:
+        ip, fp = text, ""
+    if len(fp) != decimals or not ip.isdigit() or (fp and not fp.isdigit()):
+        raise ValueError(text)
+    if len(ip) > 1 and ip[0] == "0":
+        raise ValueError(text)       # zero a esquerda nao volta igual
+    value = int(ip + fp)
+    if neg:
+        if value == 0:
+            raise ValueError(text)   # "-0.00" nao volta igual
+        value = -value
+    return value
+
+
+def put_varint(out, v):
+    """Acrescenta o inteiro v >= 0 em varint (7 bits por byte) a out."""
+    while v > 0x7F:
+        out.append((v & 0x7F) | 0x80)
+        v >>= 7
+    out.append(v)
+
+
+def get_varint(buf, pos):
+    """Le um varint de buf a partir de pos. Retorna (valor, nova posicao)."""
+    shift = 0
+    v = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        v |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return v, pos
+        shift += 7
+
+
+def zigzag(v):
+    return v << 1 if v >= 0 else ((-v) << 1) - 1
+
+
+def unzigzag(u):
+    return u >> 1 if not u & 1 else -((u + 1) >> 1)
+
+
+class DvWriter:
+    """Codificador em fluxo: write() recebe o texto do CSV em pedacos."""
+
+    def __init__(self, stream, decimals=CSV_DECIMALS, close=True):
+        self.s = stream
+        self.decimals = decimals
+        self.close_stream = close
+        self._n = len(decimals)
+        self._prev = [0] * self._n
+        self._pending = b""
+        self._header_done = False
+
+    def write(self, data):
+        buf = self._pending + bytes(data)
+        start = 0
+        while True:
+            i = buf.find(b"\n", start)
+            if i < 0:
+                break
+            self._line(buf[start:i + 1])
+            start = i + 1
+        self._pending = buf[start:]
+        return len(data)
+
+    def _line(self, line):
+        out = bytearray()
+        if not self._header_done:
+            out.extend(DV_MAGIC)
+            out.append(self._n)
+            out.extend(bytes(self.decimals))
+            put_varint(out, len(line))
+            out.extend(line)
+            self._header_done = True
+            self.s.write(out)
+            return
+        values = None
+        if line.endswith(b"\n"):
+            try:
+                parts = line[:-1].decode().split(",")
+                if len(parts) == self._n:
+                    values = [_parse_fixed(p, d) for p, d in zip(parts, self.decimals)]
+            except (ValueError, UnicodeError):
+                values = None
+        if values is None:
+            put_varint(out, 1 << self._n)
+            put_varint(out, len(line))
+            out.extend(line)
+        else:
+            mask = 0
+            for i, v in enumerate(values):
+                if v is None:
+                    mask |= 1 << i
+            put_varint(out, mask)
+            prev = self._prev
+            for i, v in enumerate(values):
+                if v is not None:
+                    put_varint(out, zigzag(v - prev[i]))
+                    prev[i] = v
+        self.s.write(out)
+
+    def close(self):
+        if self._pending:
+            # Ultima linha sem '\n' (arquivo cortado): vai crua
+            self._line(self._pending)
+            self._pending = b""
+        if self.close_stream:
+            self.s.close()
+
+
+class DvReader:
+    """Decodificador com a mesma interface de leitura de um arquivo texto."""
+
+    def __init__(self, stream, close=True):
+        self.s = stream
+        self.close_stream = close
+        self._buf = b""
+        self._pos = 0
+        self._out = b""
+        if self._read_exact(4) != DV_MAGIC:
+            raise ValueError("arquivo .dv invalido")
+        self._n = self._read_exact(1)[0]
+        self.decimals = tuple(self._read_exact(self._n))
+        self._scales = [10 ** d for d in self.decimals]
+        self._prev = [0] * self._n
+        self._out = self._read_exact(self._varint())
+
+    def _fill(self):
+        chunk = self.s.read(512)
+        if not chunk:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _byte(self):
+        if self._pos >= len(self._buf) and not self._fill():
+            raise EOFError
+        b = self._buf[self._pos]
+        self._pos += 1
+        return b
+
+    def _read_exact(self, n):
+        while len(self._buf) - self._pos < n:
+            if not self._fill():
+                raise EOFError
+        data = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return data
+
+    def _varint(self):
+        shift = 0
+        v = 0
+        while True:
+            b = self._byte()
+            v |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return v
+            shift += 7
+
+    def _next_line(self):
+        try:
+            mask = self._varint()
+        except EOFError:
+            return b""
+        if mask >> self._n:
+            return self._read_exact(self._varint())
+        fields = []
+        prev = self._prev
+        for i in range(self._n):
+            if mask & (1 << i):
+                fields.append("nan")
+            else:
+                prev[i] += unzigzag(self._varint())
+                fields.append(fmt_fixed(prev[i], self._scales[i], self.decimals[i]))
+        return (",".join(fields) + "\n").encode()
+
+    def readline(self):
+        if self._out:
+            line, self._out = self._out, b""
+            return line
+        return self._next_line()
+
+    def read(self, n=-1):
+        out = bytearray()
+        while n < 0 or len(out) < n:
+            if not self._out:
+                self._out = self._next_line()
+                if not self._out:
+                    break
+            take = len(self._out) if n < 0 else n - len(out)
+            out.extend(self._out[:take])
+            self._out = self._out[take:]
+        return bytes(out)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.close_stream:
+            self.s.close()
+
+
+# ----------------------------------------------------------------------
+# Intervalo de tempo e manifesto
+# ----------------------------------------------------------------------
+
+def csv_time_range(name):
+    """Primeiro e ultimo timestamp de um CSV (le so o inicio e o fim)."""
+    first = last = ""
+    if not name.endswith(".csv"):
+        return first, last
+    try:
+        with open(name, "rb") as f:
+            f.readline()
+            line = f.readline()
+            while line.startswith(b"#"):   # marcadores de bloco (data_logger.py)
+                line = f.readline()
+            if line:
+                first = line.split(b",", 1)[0].decode()
+                size = f.seek(0, 2)
+                f.seek(max(0, size - 160))
+                for line in reversed(f.read().strip().split(b"\n")):
+                    if not line.startswith(b"#"):
+                        last = line.split(b",", 1)[0].decode()
+                        break
+    except (OSError, ValueError):
+        pass
+    return first, last
+
+
+def read_manifest(path=MANIFEST_NAME):
+    """
+    Le o manifesto. Retorna {arquivo: (raw_size, crc32, t_first, t_last)};
+    vazio se nao existe. A ultima entrada de um nome vale.
+    """
+    entries = {}
+    try:
+        with open(path, "r") as f:
+            f.readline()
+            for line in f:
+                parts = line.strip().split(",")
+                if len(parts) != 5:
+                    continue
+                try:
+                    entries[parts[0]] = (int(parts[1]), int(parts[2]), parts[3], parts[4])
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+def append_manifest(name, raw_size, crc, t_first, t_last, path=MANIFEST_NAME):
+    """Acrescenta uma entrada (cria o arquivo com cabecalho se preciso)."""
+    try:
+        f = open(path, "r")
+        f.close()
+        mode = "a"
+    except OSError:
+        mode = "w"
+    line = "{},{},{},{},{}\n".format(name, raw_size, crc, t_first, t_last)
+    with open(path, mode) as f:
+        if mode == "w":
+            f.write(MANIFEST_HEADER)
+        f.write(line)
+    count_bytes(W_MANIFEST, len(line) + (len(MANIFEST_HEADER) if mode == "w" else 0))
+
+
+def write_manifest(entries, path=MANIFEST_NAME):
+    """
+    Regrava o manifesto inteiro (compactacao). O arquivo pode encolher:
+    o PC o baixa de novo pelo CRC32 do LIST (log_transfer.REWRITTEN_PREFIXES).
+    """
+    tmp = path + ".tmp"
+    nbytes = len(MANIFEST_HEADER)
+    with open(tmp, "w") as f:
+        f.write(MANIFEST_HEADER)
+        for name in sorted(entries):
+            raw_size, crc, t_first, t_last = entries[name]
+            line = "{},{},{},{},{}\n".format(name, raw_size, crc, t_first, t_last)
+            f.write(line)
+            nbytes += len(line)
+    count_bytes(W_MANIFEST, nbytes)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(tmp, path)
@@ -0,0 +1,565 @@
+# log_transfer.py
+"""
+Descarga de logs pela serial (USB ou UART)
+------------------------------------------
+Servico de transferencia de arquivos em quadros com CRC32, confirmacao
+por janela com reenvio seletivo e retomada a partir de um offset. E
+atendido em fatias de tempo pelo loop principal, sem parar a amostragem.
+
+Perdas: o PC guarda os quadros fora de ordem e repete o ACK do buraco;
+so o quadro que falta e reenviado (nao a janela inteira). Sem ACK, o
+reenvio espera um timeout adaptado ao RTT medido (RFC 6298, com
+backoff), entre min_ack_timeout_ms e ack_timeout_ms.
+
+Quadro (little-endian):
+    A5 5A | tipo (u8) | tamanho (u16) | payload | crc32 (u32)
+    crc32 cobre tipo + tamanho + payload.
+
+Comandos do PC:
+    LIST                        -> FILES (nome,tamanho,t_ini,t_fim,crc32 por
+                                linha; crc32 so nos arquivos reescritos,
+                                vazio nos que so crescem)
+    GET   offset(u32) + nome    -> DATA ... EOF
+    TAIL  offset(u32) + nome    -> DATA ... EOF, CRC so do trecho lido
+    ACK   offset(u32)           proximo byte esperado (duplicado => reenvia
+                                so o quadro desse offset)
+    ABORT                       encerra a sessao
+    EXEC  tag(u8) + texto       comando de console (command_shell.py)
+
+Respostas do dispositivo:
+    FILES ultimo(u8) + texto
+    DATA  offset(u32) + bytes
+    EOF   tamanho(u32) + crc32 do arquivo inteiro (u32); no TAIL, dos
+          bytes de offset a tamanho (o arquivo ativo nao e relido)
+    TEXT  ultimo(u8) + tag(u8) + texto   resposta de EXEC (mesmo tag)
+    ERR   texto
+
+O cliente do PC esta em Ferramentas/offload_client.py; o acompanhamento
+do log ativo (TAIL), em Ferramentas/log_tail.py.
+"""
+
+import os
+import struct
+from log_codec import csv_time_range, read_manifest
+
+try:
+    from binascii import crc32
+except ImportError:  # pragma: no cover - portas sem crc32 no binascii
+    from zlib import crc32
+
+try:
+    from time import ticks_ms, ticks_diff, sleep_ms
+except ImportError:  # CPython (teste pelo par de pty)
+    from time import monotonic, sleep
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def sleep_ms(ms):
+        sleep(ms / 1000.0)
+
+SYNC = b"\xA5\x5A"
+FRAME_HEADER_FMT = "<2sBH"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FMT)
+MAX_PAYLOAD = 2048
+
+# Comandos (PC -> dispositivo)
+CMD_LIST = 0x11
+CMD_GET = 0x12
+CMD_ACK = 0x13
+CMD_ABORT = 0x14
+CMD_EXEC = 0x15
+CMD_TAIL = 0x16
+
+# Respostas (dispositivo -> PC)
+RSP_FILES = 0x91
+RSP_DATA = 0x92
+RSP_EOF = 0x93
+RSP_TEXT = 0x94
+RSP_ERR = 0x9F
+
+DEFAULT_PREFIXES = ("ina_log_", "ina_col_", "ina_roll_", "burst_", "events", "reset_log", "log_manifest", "time_sync")
+
+# Arquivos reescritos no lugar (anel de tamanho fixo, compactacao que
+# encolhe): o tamanho nao diz se mudaram, entao o LIST leva o CRC32 e o
+# PC baixa de novo se diferir
+REWRITTEN_PREFIXES = ("events", "time_sync", "log_manifest")
+
+
+def encode_frame(ftype, payload=b""):
+    """Monta um quadro completo (usado pelos dois lados)."""
+    head = struct.pack(FRAME_HEADER_FMT, SYNC, ftype, len(payload))
+    crc = crc32(head[2:])
+    crc = crc32(payload, crc) & 0xFFFFFFFF
+    return head + payload + struct.pack("<I", crc)
+
+
+def write_frame(port, ftype, *parts):
+    """Escreve um quadro em partes, sem concatenar o payload na RAM."""
+    length = 0
+    for p in parts:
+        length += len(p)
+    head = struct.pack(FRAME_HEADER_FMT, SYNC, ftype, length)
+    crc = crc32(head[2:])
+    for p in parts:
+        crc = crc32(p, crc)
+    port.write(head)
+    for p in parts:
+        port.write(p)
+    port.write(struct.pack("<I", crc & 0xFFFFFFFF))
+
+
+class FrameParser:
+    """
+    Parser incremental: recebe bytes soltos, descarta lixo (ex.: prints
+    do console no meio do fluxo) e devolve quadros com CRC valido.
+    """
+
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self.max_payload = max_payload
+        self._buf = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """Adiciona bytes; retorna lista de (tipo, payload) completos."""
+        self._buf.extend(data)
+        frames = []
+        buf = self._buf
+        while True:
+            i = buf.find(SYNC)
+            if i < 0:
+                # Mantem o ultimo byte caso seja metade do SYNC
+                del buf[:max(0, len(buf) - 1)]
+                break
+            if i:
+                del buf[:i]
+            if len(buf) < FRAME_HEADER_SIZE:
+                break
+            _, ftype, length = struct.unpack(FRAME_HEADER_FMT, buf[:FRAME_HEADER_SIZE])
+            if length > self.max_payload:
+                del buf[:2]
+                continue
+            total = FRAME_HEADER_SIZE + length + 4
+            if len(buf) < total:
+                break
+            payload = bytes(buf[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + length])
+            crc = crc32(bytes(buf[2:FRAME_HEADER_SIZE]))
+            crc = crc32(payload, crc) & 0xFFFFFFFF
+            if struct.unpack("<I", buf[total - 4:total])[0] == crc:
+                frames.append((ftype, payload))
+                del buf[:total]
+            else:
+                self.crc_errors += 1
+                del buf[:2]
+        return frames
+
+
+class UsbPort:
+    """
+    Porta sobre o USB CDC (stdin/stdout), leitura sem bloqueio.
+
+    Enquanto a porta existe o Ctrl-C (0x03) fica desligado: ele aparece
+    em qualquer quadro binario (offset do ACK, CRC, texto do EXEC) e
+    levantaria KeyboardInterrupt no meio do loop. close() religa; para
+    parar o logger pelo console use o comando "stop".
+    """
+
+    def __init__(self):
+        import sys
+        import select
+        self._in = sys.stdin.buffer if hasattr(sys.stdin, "buffer") else sys.stdin
+        # CPython: sem o buffer de leitura, senao poll() nao ve o que ficou nele
+        self._in = getattr(self._in, "raw", self._in)
+        self._out = sys.stdout.buffer if hasattr(sys.stdout, "buffer") else sys.stdout
+        self._poll = select.poll()
+        self._poll.register(sys.stdin, select.POLLIN)
+        self._poll_out = select.poll()
+        self._poll_out.register(sys.stdout, select.POLLOUT)
+        self.is_console = True
+        self._set_kbd_intr(-1)
+
+    @staticmethod
+    def _set_kbd_intr(ch):
+        try:
+            import micropython
+            micropython.kbd_intr(ch)
+        except (ImportError, AttributeError):
+            pass
+
+    def close(self):
+        """Religa o Ctrl-C do REPL."""
+        self._set_kbd_intr(3)
+
+    def read_available(self, limit=256):
+        data = bytearray()
+        while len(data) < limit and self._poll.poll(0):
+            b = self._in.read(1)
+            if not b:
+                break
+            data.extend(b)
+        return data
+
+    def can_write(self):
+        """True se ha espaco no buffer do USB (host conectado e lendo)."""
+        return bool(self._poll_out.poll(0))
+
+    def write(self, data):
+        self._out.write(data)
+
+
+class UartPort:
+    """Porta sobre machine.UART dedicada."""
+
+    def __init__(self, uart):
+        self.uart = uart
+        self.is_console = False
+        import select
+        self._poll_out = select.poll()
+        self._poll_out.register(uart, select.POLLOUT)
+
+    def read_available(self, limit=256):
+        n = self.uart.any()
+        if not n:
+            return b""
+        return self.uart.read(min(n, limit)) or b""
+
+    def can_write(self):
+        return bool(self._poll_out.poll(0))
+
+    def write(self, data):
+        self.uart.write(data)
+
+    def close(self):
+        pass
+
+
+class LogTransfer:
+    """Servico de descarga de arquivos, atendido em fatias de tempo."""
+
+    def __init__(self, port, prefixes=DEFAULT_PREFIXES, chunk_size=1024,
+                 window=8, ack_timeout_ms=2000, session_timeout_ms=30000,
+                 min_ack_timeout_ms=100, rewritten=REWRITTEN_PREFIXES):
+        """
+        Args:
+            port: UsbPort, UartPort ou objeto com read_available/write
+            prefixes: prefixos de arquivo que podem ser listados/baixados
+            chunk_size: bytes de dados por quadro DATA
+            window: quadros enviados sem confirmacao
+            ack_timeout_ms: timeout inicial e maximo sem ACK (reenvia o
+                primeiro quadro nao confirmado)
+            session_timeout_ms: sessao ociosa e encerrada apos este tempo
+            min_ack_timeout_ms: piso do timeout adaptativo
+            rewritten: prefixos de arquivos reescritos no lugar (CRC32
+                no LIST; devem ser pequenos, o LIST le o arquivo todo)
+        """
+        self.port = port
+        self.prefixes = prefixes
+        self.chunk_size = chunk_size
+        self.window = window
+        self.ack_timeout_ms = ack_timeout_ms
+        self.min_ack_timeout_ms = min_ack_timeout_ms
+        self.session_timeout_ms = session_timeout_ms
+        self.rewritten = rewritten
+
+        self._parser = FrameParser()
+        self._chunk = bytearray(chunk_size)
+        self._file = None
+        self._name = None
+        self._size = 0
+        self._sent = 0
+        self._acked = 0
+        self._crc = 0
+        self._crc_pos = 0
+        self._last_rx = ticks_ms()
+        self._last_ack_ms = self._last_rx
+        self._resent_at = -1
+        self._resent_ms = 0
+        self._eof_sent = False
+        # RTT (ms): estimativa suavizada, variacao e timeout corrente.
+        # Uma medida por vez (_probe_end = fim do quadro cronometrado)
+        self._srtt = 0
+        self._rttvar = 0
+        self.rto_ms = ack_timeout_ms
+        self._probe_end = -1
+        self._probe_ms = 0
+        self._handlers = {}
+
+        self.bytes_sent = 0
+        self.files_sent = 0
+        self.resends = 0
+
+    @property
+    def active(self):
+        """True durante uma transferencia."""
+        return self._file is not None
+
+    @property
+    def current_file(self):
+        """Nome do arquivo em transferencia (ou None)."""
+        return self._name
+
+    def _allowed(self, name):
+        if "/" in name or ".." in name:
+            return False
+        for p in self.prefixes:
+            if name.startswith(p):
+                return True
+        return False
+
+    def _send(self, ftype, *parts):
+        write_frame(self.port, ftype, *parts)
+
+    def send(self, ftype, *parts):
+        """Envia um quadro (usado pelos servicos registrados)."""
+        write_frame(self.port, ftype, *parts)
+
+    def register(self, ftype, handler):
+        """Atende outros tipos de quadro na mesma porta: handler(payload)."""
+        self._handlers[ftype] = handler
+
+    # ------------------------------------------------------------------
+    # Comandos
+    # ------------------------------------------------------------------
+
+    def _cmd_list(self):
+        text = bytearray()
+        # Comprimidos: intervalo de tempo vem do manifesto
+        manifest = read_manifest()
+        for name in sorted(os.listdir()):
+            if not self._allowed(name):
+                continue
+            try:
+                size = os.stat(name)[6]
+            except OSError:
+                continue
+            if name in manifest:
+                t0, t1 = manifest[name][2:]
+            else:
+                t0, t1 = csv_time_range(name)
+            crc = self._list_crc(name) if name.startswith(self.rewritten) else ""
+            line = "{},{},{},{},{}\n".format(name, size, t0, t1, crc).encode()
+            if len(text) + len(line) > MAX_PAYLOAD - 1:
+                self._send(RSP_FILES, b"\x00", text)
+                text = bytearray()
+            text.extend(line)
+        self._send(RSP_FILES, b"\x01", text)
+
+    def _list_crc(self, name):
+        """CRC32 do arquivo inteiro (so arquivos pequenos reescritos)."""
+        # _chunk e relido a cada quadro enviado: pode ser usado aqui
+        crc = 0
+        mv = memoryview(self._chunk)
+        try:
+            with open(name, "rb") as f:
+                while True:
+                    n = f.readinto(self._chunk)
+                    if not n:
+                        break
+                    crc = crc32(mv[:n], crc)
+        except OSError:
+            return ""
+        return crc & 0xFFFFFFFF
+
+    def _cmd_get(self, payload, tail=False):
+        self._close()
+        offset = struct.unpack("<I", payload[:4])[0]
+        name = payload[4:].decode()
+        if not self._allowed(name):
+            self._send(RSP_ERR, "arquivo nao permitido: {}".format(name).encode())
+            return
+        try:
+            f = open(name, "rb")
+            size = f.seek(0, 2)
+        except OSError as e:
+            self._send(RSP_ERR, "erro ao abrir {}: {}".format(name, e).encode())
+            return
+        if offset > size:
+            offset = size
+        self._file = f
+        self._name = name
+        self._size = size          # retrato do tamanho no inicio da sessao
+        self._sent = offset
+        self._acked = offset
+        self._resent_at = -1
+        self._probe_end = -1
+        self._eof_sent = False
+        # CRC do arquivo inteiro e calculado na passagem; comeca do zero.
+        # No TAIL so o trecho novo entra: custo proporcional ao que falta
+        self._crc = 0
+        self._crc_pos = offset if tail else 0
+        self._last_ack_ms = ticks_ms()
+
+    def _cmd_ack(self, payload):
+        if not self.active:
+            return
+        offset = struct.unpack("<I", payload[:4])[0]
+        now = ticks_ms()
+        self._last_ack_ms = now
+        if offset >= self._size and self._eof_sent:
+            self.files_sent += 1
+            self._close()
+            return
+        if offset > self._acked:
+            # So o ACK exato do quadro cronometrado mede o RTT
+            if offset == self._probe_end:
+                self._rtt_sample(ticks_diff(now, self._probe_ms))
+            else:
+                if offset > self._probe_end:
+                    self._probe_end = -1
+                if self._srtt:
+                    # Progresso: desfaz o backoff dos timeouts
+                    self.rto_ms = self._rto()
+            self._acked = min(offset, self._sent)
+        elif offset == self._acked and offset < self._sent:
+            # ACK duplicado: o PC perdeu o quadro deste offset e guardou os
+            # seguintes; reenvia so ele (de novo so apos um timeout)
+            if offset != self._resent_at or ticks_diff(now, self._resent_ms) > self.rto_ms:
+                self._resend(offset, now)
+
+    def _rtt_sample(self, rtt):
+        """Atualiza SRTT/RTTVAR e o timeout (RFC 6298, inteiro em ms)."""
+        self._probe_end = -1
+        if self._srtt == 0:
+            self._srtt = max(1, rtt)
+            self._rttvar = rtt // 2
+        else:
+            d = self._srtt - rtt
+            self._rttvar = (3 * self._rttvar + (d if d >= 0 else -d)) // 4
+            self._srtt = max(1, (7 * self._srtt + rtt) // 8)
+        self.rto_ms = self._rto()
+
+    def _rto(self):
+        rto = self._srtt + max(4 * self._rttvar, 10)
+        return min(self.ack_timeout_ms, max(self.min_ack_timeout_ms, rto))
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._name = None
+
+    def _handle(self, ftype, payload):
+        self._last_rx = ticks_ms()
+        if ftype == CMD_LIST:
+            self._cmd_list()
+        elif ftype == CMD_GET and len(payload) > 4:
+            self._cmd_get(payload)
+        elif ftype == CMD_TAIL and len(payload) > 4:
+            self._cmd_get(payload, tail=True)
+        elif ftype == CMD_ACK and len(payload) >= 4:
+            self._cmd_ack(payload)
+        elif ftype == CMD_ABORT:
+            self._close()
+        elif ftype in self._handlers:
+            self._handlers[ftype](payload)
+
+    # ------------------------------------------------------------------
+    # Envio
+    # ------------------------------------------------------------------
+
+    def _advance_crc(self, max_chunks=4):
+        """
+        Avanca o CRC32 do arquivo inteiro (necessario ao retomar de um
+        offset). Limitado por chamada para respeitar o orcamento de tempo.
+        Retorna True quando o CRC cobre todo o arquivo.
+        """
+        f = self._file
+        mv = memoryview(self._chunk)
+        f.seek(self._crc_pos)
+        while self._crc_pos < self._size and max_chunks > 0:
+            n = f.readinto(mv[:min(self.chunk_size, self._size - self._crc_pos)])
+            if not n:
+                self._size = self._crc_pos
+                break
+            self._crc = crc32(mv[:n], self._crc)
+            self._crc_pos += n
+            max_chunks -= 1
+        return self._crc_pos >= self._size
+
+    def _read_chunk(self, pos):
+        """Le o quadro de dados que comeca em pos. Retorna o tamanho lido."""
+        f = self._file
+        f.seek(pos)
+        return f.readinto(memoryview(self._chunk)[:min(self.chunk_size, self._size - pos)])
+
+    def _resend(self, pos, now):
+        """Reenvia um unico quadro ja enviado (ou o EOF, se pos == tamanho)."""
+        self.resends += 1
+        self._resent_at = pos
+        self._resent_ms = now
+        self._last_ack_ms = now
+        if pos < self._probe_end:
+            # Karn: o ACK do quadro cronometrado passaria a incluir o reenvio
+            self._probe_end = -1
+        if pos >= self._size:
+            self._eof_sent = False
+            return
+        n = self._read_chunk(pos)
+        if n:
+            self._send(RSP_DATA, struct.pack("<I", pos), memoryview(self._chunk)[:n])
+
+    def _send_next(self):
+        """Envia um quadro DATA (ou EOF). Retorna True se enviou algo."""
+        if self._sent >= self._size:
+            if not self._eof_sent:
+                if not self._advance_crc():
+                    return True
+                self._send(RSP_EOF, struct.pack("<II", self._size, self._crc & 0xFFFFFFFF))
+                self._eof_sent = True
+                return True
+            return False
+        if self._sent - self._acked >= self.window * self.chunk_size:
+            return False
+        mv = memoryview(self._chunk)
+        n = self._read_chunk(self._sent)
+        if not n:
+            self._size = self._sent
+            return False
+        # CRC incremental enquanto os dados passam em ordem
+        if self._crc_pos == self._sent:
+            self._crc = crc32(mv[:n], self._crc)
+            self._crc_pos += n
+        self._send(RSP_DATA, struct.pack("<I", self._sent), mv[:n])
+        self._sent += n
+        self.bytes_sent += n
+        if self._probe_end < 0:
+            self._probe_end = self._sent
+            self._probe_ms = ticks_ms()
+        return True
+
+    def poll(self, budget_ms=0):
+        """
+        Atende a porta por ate budget_ms. Retorna rapido se nada acontece.
+
+        Returns:
+            True se ha sessao ativa (o chamador deve continuar chamando)
+        """
+        start = ticks_ms()
+        while True:
+            data = self.port.read_available()
+            if data:
+                for ftype, payload in self._parser.feed(data):
+                    self._handle(ftype, payload)
+
+            if self.active:
+                now = ticks_ms()
+                if ticks_diff(now, self._last_rx) > self.session_timeout_ms:
+                    self._close()
+                elif not self._send_next():
+                    if ticks_diff(now, self._last_ack_ms) > self.rto_ms:
+                        # Sem confirmacao: reenvia o primeiro quadro nao
+                        # confirmado (ou o EOF) e dobra o timeout
+                        self.rto_ms = min(self.ack_timeout_ms, 2 * self.rto_ms)
+                        self._resend(self._acked if self._acked < self._sent else self._size, now)
+                    elif budget_ms:
+                        sleep_ms(1)
+
+            if ticks_diff(ticks_ms(), start) >= budget_ms or not (self.active or data):
+                break
+        return self.active
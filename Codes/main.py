@@ -11,18 +11,36 @@ Versao FINAL otimizada com:
 - Timing preciso (exatamente 1 amostra/segundo)
 """
 
-from machine import I2C, Pin, ADC, WDT
-from time import sleep, ticks_ms
+from machine import I2C, Pin, ADC, WDT, RTC
+from time import sleep, ticks_ms, ticks_diff, ticks_add
+from array import array
 from ina_sensor import Ina219Sensor
 from data_logger import DataLogger
-from battery_gauge import BatteryGauge
+from column_logger import ColumnLogger
+from battery_gauge import BatteryGauge, BatteryGaugeFixed
+from soc_forecast import SocForecaster
+from load_scheduler import Load, LoadScheduler
+from sensor_quality import (QualityMonitor, CH_VLOAD, CH_ILOAD, CH_TEMP_EXT, CH_HUM,
+                            SUPPRESS_DEFAULT)
 from rp2040_temp import Rp2040Temp
 from hdc1080_sensor import HDC1080
 from timestamp_manager import TimestampManager
 import gc
 from reset_log import ResetLogger
-
-reset_logger = ResetLogger()
+from event_log import (EventLog, EVENT_NAMES, format_event, source_id, err_code,
+                       EV_I2C_ERROR, EV_SENSOR_ERROR, EV_LOOP_SLOW, EV_ERROR, EV_CRITICAL)
+from burst_capture import BurstCapture
+from adc_sampler import OversampledADC, FILTER_TRIMMED
+from fixed_point import scale_factor, mul_shift, fmt_fixed
+from log_transfer import LogTransfer, UsbPort, UartPort, DEFAULT_PREFIXES
+from telemetry import (Telemetry, ALARM_LOOP_SLOW, ALARM_SENSOR, ALARM_ERROR,
+                       ALARM_CRITICAL, ALARM_LOW_SOC)
+from console import say, enabled, set_level, get_level, WARN, INFO, SAMPLES
+from command_shell import CommandShell
+from retention import RetentionManager
+import write_stats
+from heap_monitor import HeapMonitor
+from time_sync import TimeSync
 
 # =============================================================================
 # CONFIGURACOES
@@ -37,12 +55,49 @@ CAL_FACTOR = 1.052
 BOOST_ETA = 0.90
 BATTERY_CAPACITY_MAH = 15000
 
+# Curvas OCV por temperatura para o battery gauge: {temp_C: [(V, SoC), ...]}
+# None => curva unica de 25 C definida em battery_gauge.py
+OCV_CURVES = None
+
+# Previsao de autonomia (tempo ate vazio/cheio, ver soc_forecast.py)
+FORECAST_ENABLED = True
+FORECAST_HORIZONS_S = (300, 1800, 7200)   # constantes de tempo dos estimadores
+FORECAST_MAX_GAP_S = 900                  # intervalo maior que isso reinicia
+
+# Chaves de carga (GPIO) dos equipamentos alimentados pelo no, ver
+# load_scheduler.py. Histerese de SoC (desliga < soc_off, religa >= soc_on),
+# cota por janela (duty * window_s), reserva de autonomia prevista (s).
+# Simular antes de mudar: Ferramentas/load_sim.py
+LOADS_ENABLED = True
+LOADS = (
+    {"name": "camera", "pin": 16, "priority": 0, "soc_off": 40, "soc_on": 50,
+     "duty": 0.25, "window_s": 3600},
+    {"name": "pc", "pin": 17, "priority": 1, "soc_off": 25, "soc_on": 35},
+)
+LOAD_MAX_MA = 2000           # Iload acima disso por LOAD_OVERLOAD_S corta a de menor prioridade
+LOAD_OVERLOAD_S = 5
+
+# Qualidade das leituras (ver sensor_quality.py): canais travados, fora da
+# faixa, com degrau ou incoerentes sao marcados (telemetria + eventos QUALITY)
+QUALITY_ENABLED = True
+QUALITY_SUPPRESS = SUPPRESS_DEFAULT  # detectores que gravam nan no log (0 = so marca)
+QUALITY_BUDGET_US = 500              # tempo maximo dos detectores por amostra
+
+# Pipeline inteiro (uV, uA, mili-porcento): sem float por amostra.
+# Resultado equivalente ao float dentro de BatteryGaugeFixed.FIXED_TOLERANCE_MP
+FIXED_POINT = False
+
 # Intervalo entre leituras (segundos)
 SAMPLE_INTERVAL = 60.0  # Exatamente 1 segundo entre amostras
 
-# Intervalo para liberar memoria (numero de amostras)
+# Intervalo do checkpoint e prazo maximo sem coleta de lixo (numero de amostras)
 GC_INTERVAL = 100
 
+# Coleta de lixo na folga antes do proximo prazo (heap_monitor.py);
+# False => gc.collect() no meio do loop a cada GC_INTERVAL amostras
+GC_IDLE = True
+GC_AUTO_THRESHOLD = True     # ajusta gc.threshold pela taxa de alocacao
+
 # Intervalo para mostrar estatisticas (numero de amostras)
 STATS_INTERVAL = 500
 
@@ -53,77 +108,282 @@ WATCHDOG_TIMEOUT_MS = 60000
 INA_SAMPLES = 3  # Reduzido de 5 para 3 (mais rapido)
 INA_DELAY = 0.01  # Reduzido de 0.02 para 0.01
 
+# Sobreamostragem dos ADCs (bateria e temperatura interna)
+ADC_OVERSAMPLE = 128         # tamanho maximo da rajada
+ADC_BUDGET_US = 4000         # tempo maximo por rajada
+ADC_TRIM = 8                 # amostras descartadas em cada extremo
+TEMP_OVERSAMPLE = 32
+
+# Captura de rajadas (inrush) da corrente de carga no tempo ocioso
+BURST_ENABLED = True
+BURST_THRESHOLD_MA = 300.0   # |Iload| acima disso dispara
+BURST_DELTA_MA = 150.0       # degrau em relacao a linha de base dispara
+BURST_PRE_SAMPLES = 256      # amostras antes do gatilho
+BURST_POST_SAMPLES = 768     # amostras apos o gatilho
+BURST_PERIOD_US = 1000       # ~1 kHz
+BURST_HYSTERESIS_MA = 50.0   # limiar rearma abaixo de THRESHOLD - isso
+BURST_HOLDOFF_S = 10         # intervalo minimo entre rajadas
+BURST_MAX_PER_HOUR = 12      # limite de rajadas gravadas por hora
+BURST_DUMP_MARGIN_MS = 200   # reservado para gravar a rajada antes da amostra
+
+# Formato dos logs: "csv" (ina_log_NNN.csv, uma linha por amostra) ou
+# "columns" (ina_col_NNN.<canal>, um arquivo de blocos por canal; ver
+# column_logger.py e Ferramentas/column_query.py)
+LOG_FORMAT = "csv"
+LOG_MAX_LINES = 15000
+LOG_BLOCK_LINES = 32         # CSV: linhas por bloco com CRC (marcador "#B,")
+COLUMN_BLOCK_ROWS = 64       # linhas por bloco
+COLUMN_BLOCK_SPAN_S = 600    # fecha o bloco apos isso (limita a perda num reset)
+
+# Retencao: com pouco espaco, libera os arquivos mais antigos em vez de
+# parar de gravar. Politicas em ordem: "compress", "rollup", "delete"
+RETENTION_ENABLED = True
+RETENTION_POLICY = ("compress", "rollup", "delete")
+RETENTION_MIN_FREE_KB = 200      # abaixo disso comeca a liberar
+RETENTION_TARGET_FREE_KB = 400   # libera ate aqui
+RETENTION_COMPRESS_ON_ROTATE = True  # comprime cada arquivo logo apos a rotacao
+LOG_CODEC = "auto"               # "auto" (deflate se houver), "deflate" ou "dv"
+
+# Porta dos quadros binarios (descarga e telemetria)
+SERIAL_UART = None           # None => USB; ou (id, tx, rx, baudrate)
+IDLE_SLICE_MS = 1000         # fatia do tempo ocioso entre consultas a porta
+
+# Descarga de logs pela serial (cliente: Ferramentas/offload_client.py)
+TRANSFER_ENABLED = True
+
+# Comandos em tempo de execucao (cliente: Ferramentas/node_ctl.py)
+COMMANDS_ENABLED = True
+
+# Telemetria binaria (receptor: Ferramentas/telemetry_client.py)
+TELEMETRY_ENABLED = True
+TELEMETRY_QUEUE = 16         # quadros guardados se o PC nao le (descarta antigos)
+TELEMETRY_HEALTH_INTERVAL = 10   # amostras entre registros de saude
+LOW_SOC_ALARM_PCT = 10       # alarme quando o SoC cai abaixo disso
+
+# Relogio UTC: pontos de sincronia do mini-computador (time_sync.csv;
+# cliente: Ferramentas/node_ctl.py --sync-time, conversao: time_align.py)
+TIME_SYNC_ENABLED = True
+
+# Registro de eventos em anel (events.bin; leitor: Ferramentas/event_view.py)
+EVENT_CAPACITY = 256         # registros de 16 bytes
+EVENT_HOLDOFF_S = 60         # o mesmo evento so e gravado de novo apos isso (so contado)
+
+# Console: SILENT (0), WARN (1), INFO (2), SAMPLES (3, uma linha por amostra)
+VERBOSITY = SAMPLES
+
+set_level(VERBOSITY)
+
 # =============================================================================
 # INICIALIZACAO
 # =============================================================================
 
-print("\n" + "="*60)
-print("SISTEMA DE MONITORAMENTO - VERSAO FINAL OTIMIZADA")
-print("="*60 + "\n")
+say(INFO, "\n" + "="*60)
+say(INFO, "SISTEMA DE MONITORAMENTO - VERSAO FINAL OTIMIZADA")
+say(INFO, "="*60 + "\n")
 
 # Watchdog
-print("Inicializando Watchdog...")
+say(INFO, "Inicializando Watchdog...")
 try:
     wdt = WDT(timeout=WATCHDOG_TIMEOUT_MS)
-    print("OK - Watchdog habilitado (timeout: {}ms)".format(WATCHDOG_TIMEOUT_MS))
+    say(INFO, "OK - Watchdog habilitado (timeout: {}ms)".format(WATCHDOG_TIMEOUT_MS))
 except Exception as e:
-    print("AVISO - Watchdog nao disponivel: {}".format(e))
+    say(WARN, "AVISO - Watchdog nao disponivel: {}".format(e))
     wdt = None
 
+# Timestamp manager
+say(INFO, "Inicializando timestamp manager...")
+ts_manager = TimestampManager()
+say(INFO, "OK - Timestamp manager")
+
+# Registro de eventos (antes dos sensores e do logger, para ja registrar
+# as falhas de inicializacao e a recuperacao do log)
+say(INFO, "Inicializando registro de eventos...")
+events = EventLog(capacity=EVENT_CAPACITY, clock=ts_manager.get_timestamp_ds,
+                  holdoff_ds=EVENT_HOLDOFF_S * 10)
+reset_logger = ResetLogger(events, ts_manager.offset)
+say(INFO, "OK - Eventos ({} registrados)".format(events.seq - 1))
+
 # LED de status
 led = Pin(LED_PIN, Pin.OUT)
 led.off()
 
 # INA219
-print("Inicializando INA219...")
+say(INFO, "Inicializando INA219...")
 try:
     i2c_ina = I2C(0, sda=Pin(8), scl=Pin(9), freq=400000)
     ina = Ina219Sensor(i2c_ina, invert_polarity=True)
-    print("OK - INA219")
+    say(INFO, "OK - INA219")
 except Exception as e:
-    print("ERRO ao inicializar INA219: {}".format(e))
+    say(WARN, "ERRO ao inicializar INA219: {}".format(e))
+    events.log(EV_SENSOR_ERROR, source_id("INA219"))
     if wdt:
-        print("Aguardando watchdog reiniciar...")
+        say(WARN, "Aguardando watchdog reiniciar...")
         while True:
             sleep(1)
     raise
 
 # HDC1080
-print("Inicializando HDC1080...")
+say(INFO, "Inicializando HDC1080...")
 try:
     i2c_hdc = I2C(1, scl=Pin(15), sda=Pin(14), freq=100_000)
     hdc = HDC1080(i2c_hdc)
-    print("OK - HDC1080")
+    say(INFO, "OK - HDC1080")
 except Exception as e:
-    print("AVISO - HDC1080 nao disponivel: {}".format(e))
+    say(WARN, "AVISO - HDC1080 nao disponivel: {}".format(e))
+    events.log(EV_SENSOR_ERROR, source_id("HDC1080"))
     hdc = None
 
 # ADC bateria
-print("Inicializando ADC da bateria...")
+say(INFO, "Inicializando ADC da bateria...")
 adc_batt = ADC(26)
-print("OK - ADC")
+vbatt_adc = OversampledADC(adc_batt, samples=ADC_OVERSAMPLE,
+                           budget_us=ADC_BUDGET_US,
+                           filter_mode=FILTER_TRIMMED, trim=ADC_TRIM)
+say(INFO, "OK - ADC")
 
 # Sensor temperatura interno
-print("Inicializando sensor interno...")
-temp = Rp2040Temp(vref=VREF, offset_c=0.0)
-print("OK - Sensor interno")
+say(INFO, "Inicializando sensor interno...")
+temp = Rp2040Temp(vref=VREF, offset_c=0.0, samples=TEMP_OVERSAMPLE)
+say(INFO, "OK - Sensor interno")
 
 # Battery gauge
-print("Inicializando battery gauge...")
-gauge = BatteryGauge(capacity_mAh=BATTERY_CAPACITY_MAH)
+say(INFO, "Inicializando battery gauge...")
+if FIXED_POINT:
+    gauge = BatteryGaugeFixed(capacity_mAh=BATTERY_CAPACITY_MAH, ocv_curves=OCV_CURVES,
+                              sample_interval_s=SAMPLE_INTERVAL)
+else:
+    gauge = BatteryGauge(capacity_mAh=BATTERY_CAPACITY_MAH, ocv_curves=OCV_CURVES,
+                         sample_interval_s=SAMPLE_INTERVAL)
 gauge._inited = False
 gauge.soc = None
-print("OK - Battery gauge")
+gauge.events = events
+forecast = None
+if FORECAST_ENABLED:
+    forecast = SocForecaster(capacity_mAh=BATTERY_CAPACITY_MAH,
+                             horizons_s=FORECAST_HORIZONS_S,
+                             max_gap_s=FORECAST_MAX_GAP_S)
+say(INFO, "OK - Battery gauge")
+
+# Qualidade das leituras
+quality = None
+if QUALITY_ENABLED:
+    quality = QualityMonitor(fixed=FIXED_POINT, budget_us=QUALITY_BUDGET_US,
+                             suppress_mask=QUALITY_SUPPRESS, events=events)
+
+# Chaves de carga
+scheduler = None
+if LOADS_ENABLED:
+    say(INFO, "Inicializando chaves de carga...")
+    try:
+        loads = []
+        for cfg in LOADS:
+            cfg = dict(cfg)
+            cfg["pin"] = Pin(cfg["pin"], Pin.OUT)
+            loads.append(Load(**cfg))
+        scheduler = LoadScheduler(loads, events=events, forecast=forecast,
+                                  max_load_mA=LOAD_MAX_MA, overload_s=LOAD_OVERLOAD_S)
+        say(INFO, "OK - {} cargas (desligadas ate o primeiro SoC)".format(len(loads)))
+    except Exception as e:
+        say(WARN, "AVISO - Chaves de carga nao disponiveis: {}".format(e))
+        scheduler = None
 
 # Data logger
-print("Inicializando data logger...")
-logger = DataLogger("ina_log", max_lines=15000)
-print("OK - Data logger")
+say(INFO, "Inicializando data logger...")
+if LOG_FORMAT == "columns":
+    logger = ColumnLogger("ina_col", max_lines=LOG_MAX_LINES,
+                          block_rows=COLUMN_BLOCK_ROWS, block_span_s=COLUMN_BLOCK_SPAN_S,
+                          events=events)
+else:
+    logger = DataLogger("ina_log", max_lines=LOG_MAX_LINES, block_lines=LOG_BLOCK_LINES,
+                        events=events)
+say(INFO, "OK - Data logger")
 
-# Timestamp manager
-print("Inicializando timestamp manager...")
-ts_manager = TimestampManager()
-print("OK - Timestamp manager\n")
+# Relogio UTC (depois do logger: cada boot registra o arquivo em que comeca)
+timesync = None
+if TIME_SYNC_ENABLED:
+    try:
+        timesync = TimeSync(ts_manager.get_timestamp_ds, log_index=logger.current_file_index,
+                            boot_seq=reset_logger.boot_seq, rtc=RTC(), events=events)
+        say(INFO, "OK - Relogio: {}".format(timesync.summary()))
+    except Exception as e:
+        say(WARN, "AVISO - Relogio UTC nao disponivel: {}".format(e))
+        timesync = None
+
+# Captura de rajadas
+burst = None
+if BURST_ENABLED:
+    say(INFO, "Inicializando captura de rajadas...")
+    try:
+        burst = BurstCapture(ina, logger=logger,
+                             pre_samples=BURST_PRE_SAMPLES,
+                             post_samples=BURST_POST_SAMPLES,
+                             threshold_mA=BURST_THRESHOLD_MA,
+                             delta_mA=BURST_DELTA_MA,
+                             period_us=BURST_PERIOD_US,
+                             ts_scale=10 if FIXED_POINT else 1,
+                             hysteresis_mA=BURST_HYSTERESIS_MA,
+                             holdoff_s=BURST_HOLDOFF_S,
+                             max_per_hour=BURST_MAX_PER_HOUR,
+                             dump_margin_ms=BURST_DUMP_MARGIN_MS)
+        say(INFO, "OK - Captura de rajadas\n")
+    except Exception as e:
+        say(WARN, "AVISO - Captura de rajadas nao disponivel: {}\n".format(e))
+        burst = None
+else:
+    say(INFO, "")
+
+# Porta serial dos quadros binarios (compartilhada)
+port = None
+if TRANSFER_ENABLED or TELEMETRY_ENABLED or COMMANDS_ENABLED:
+    say(INFO, "Inicializando porta serial...")
+    try:
+        if SERIAL_UART is None:
+            port = UsbPort()
+        else:
+            from machine import UART
+            uart_id, uart_tx, uart_rx, uart_baud = SERIAL_UART
+            port = UartPort(UART(uart_id, baudrate=uart_baud, tx=Pin(uart_tx), rx=Pin(uart_rx)))
+        say(INFO, "OK - Porta serial")
+    except Exception as e:
+        say(WARN, "AVISO - Porta serial nao disponivel: {}".format(e))
+
+# Descarga de logs (tambem atende os quadros de comando)
+transfer = None
+if (TRANSFER_ENABLED or COMMANDS_ENABLED) and port is not None:
+    transfer = LogTransfer(port, prefixes=DEFAULT_PREFIXES if TRANSFER_ENABLED else ())
+    if TRANSFER_ENABLED:
+        say(INFO, "OK - Descarga de logs")
+
+# Retencao de logs
+retention = None
+if RETENTION_ENABLED:
+    say(INFO, "Inicializando retencao de logs...")
+    try:
+        retention = RetentionManager(
+            logger, min_free_kb=RETENTION_MIN_FREE_KB,
+            target_free_kb=RETENTION_TARGET_FREE_KB, policy=RETENTION_POLICY,
+            protect=lambda: (transfer.current_file,) if transfer is not None else (),
+            codec=LOG_CODEC, compress_rotated=RETENTION_COMPRESS_ON_ROTATE)
+        logger.retention = retention
+        retention.events = events
+        say(INFO, "OK - Retencao ({} KB livres, codec {})".format(retention.free_kb, retention.codec))
+    except Exception as e:
+        say(WARN, "AVISO - Retencao nao disponivel: {}".format(e))
+        retention = None
+
+# Telemetria
+tlm = None
+if TELEMETRY_ENABLED and port is not None:
+    tlm = Telemetry(port, queue_len=TELEMETRY_QUEUE)
+    say(INFO, "OK - Telemetria")
+
+# Coleta de lixo nas folgas
+heap = None
+if GC_IDLE:
+    heap = HeapMonitor(SAMPLE_INTERVAL, max_samples=GC_INTERVAL, auto_threshold=GC_AUTO_THRESHOLD)
+    say(INFO, "OK - Coleta de lixo nas folgas (pausa {:.1f} ms, {} vivos)".format(
+        heap.pause_us / 1000, heap.live))
+say(INFO, "")
 
 if wdt:
     wdt.feed()
@@ -133,11 +393,233 @@ if wdt:
 # =============================================================================
 
 def read_vbatt():
-    """Le tensao real da bateria."""
-    raw = adc_batt.read_u16()
+    """Le tensao real da bateria (rajada sobreamostrada, media aparada)."""
+    raw = vbatt_adc.acquire()
     v_adc = VREF * raw / 65535.0
     return v_adc * DIV_GAIN * CAL_FACTOR
 
+# Linha reutilizada a cada amostra (pipeline float)
+row = {
+    "timestamp": 0.0,
+    "Vbatt": 0.0,
+    "Vload": 0.0,
+    "Iload_mA": 0.0,
+    "Ibatt_mA": 0.0,
+    "SoC": 0.0,
+    "Temp_int": 0.0,
+    "Temp_ext": float('nan'),
+    "Humidity": float('nan'),
+}
+
+# Padroes devolvidos por safe_i2c_read quando a leitura falha
+INA_FAILED = {'vbus': 0.0, 'current': 0.0, 'vshunt': 0.0, 'power': 0.0}
+HDC_FAILED = (float('nan'), float('nan'))
+
+def sample_float():
+    """
+    Uma amostra completa em float: sensores -> qualidade -> gauge -> logger.
+    Preenche row e retorna o timestamp em segundos.
+    """
+    # --- Leituras do INA (otimizado: 3 amostras x 0.01s) ---
+    def read_ina():
+        return ina.average(n=INA_SAMPLES, delay=INA_DELAY)
+    
+    d = safe_i2c_read(read_ina, "INA219", INA_FAILED)
+    if d is INA_FAILED and quality is not None:
+        quality.read_failed(CH_VLOAD, CH_ILOAD)
+    
+    Vload = d['vbus']
+    Iload_mA = d['current']
+
+    # --- Leitura da bateria ---
+    Vbatt = read_vbatt()
+
+    # --- Corrente da bateria estimada ---
+    if Vbatt < 2.5:
+        Ibatt_mA = 0.0
+    else:
+        Ibatt_mA = (Vload * Iload_mA) / (BOOST_ETA * Vbatt)
+
+    # --- Tempo e temperatura interna ---
+    ts = ts_manager.get_timestamp()
+    TempC_int = temp.read_c()
+
+    # --- HDC1080 ---
+    if hdc is not None:
+        def read_hdc():
+            return hdc.read()
+        
+        result = safe_i2c_read(read_hdc, "HDC1080", HDC_FAILED)
+        if result is HDC_FAILED and quality is not None:
+            quality.read_failed(CH_TEMP_EXT, CH_HUM)
+        TempC_ext, Humidity = result
+    else:
+        TempC_ext, Humidity = float('nan'), float('nan')
+
+    row["timestamp"] = ts
+    row["Vbatt"] = Vbatt
+    row["Vload"] = Vload
+    row["Iload_mA"] = Iload_mA
+    row["Ibatt_mA"] = Ibatt_mA
+    row["Temp_int"] = TempC_int
+    row["Temp_ext"] = TempC_ext
+    row["Humidity"] = Humidity
+
+    # --- Qualidade: canais suspeitos viram nan na linha ---
+    if quality is not None:
+        quality.check(row)
+
+    # --- Estado de carga ---
+    # Gauge com as leituras brutas (ja trata saltos e repouso); previsao
+    # e cargas com as filtradas (nan e ignorado)
+    # Temperatura da bateria: HDC1080 (ambiente) ou, na falta, interna
+    temp_batt = TempC_ext if TempC_ext == TempC_ext else TempC_int
+    SoC = gauge.update(voltage_V=Vbatt, current_mA=Ibatt_mA, now_s=ts,
+                       temp_c=temp_batt)
+    if forecast is not None:
+        forecast.update(SoC, row["Ibatt_mA"], ts)
+    if scheduler is not None:
+        scheduler.update(SoC, row["Iload_mA"], ts)
+
+    # --- Gravacao ---
+    row["SoC"] = SoC
+    logger.append(row)
+    return ts
+
+# Constantes do pipeline inteiro (calculadas uma vez)
+VBATT_K, VBATT_SHIFT = scale_factor(VREF * DIV_GAIN * CAL_FACTOR * 1000000 / 65535.0, 65535)
+ETA_INV_K = int((1 << 14) / BOOST_ETA + 0.5)   # 1/eta em Q14
+VBATT_MIN_UV = 2500000
+
+# Linha reutilizada a cada amostra (atribuir chaves existentes nao aloca)
+row_fixed = {
+    "timestamp_ds": 0,
+    "Vbatt_uV": 0,
+    "Vload_uV": 0,
+    "Iload_uA": 0,
+    "Ibatt_uA": 0,
+    "SoC_mp": 0,
+    "Temp_int_cC": 0,
+    "Temp_ext_cC": None,
+    "Humidity_cp": None,
+}
+
+def read_ina_fixed():
+    return ina.average_fixed(n=INA_SAMPLES, delay=INA_DELAY)
+
+def read_hdc_fixed():
+    return hdc.read_fixed()
+
+def sample_fixed():
+    """
+    Uma amostra completa em inteiros: sensores -> qualidade -> gauge -> logger.
+    Preenche row_fixed e retorna o timestamp em decisegundos.
+    """
+    if not safe_i2c_read(read_ina_fixed, "INA219", False):
+        ina.vbus_uV = 0
+        ina.current_uA = 0
+        if quality is not None:
+            quality.read_failed(CH_VLOAD, CH_ILOAD)
+    vload_uV = ina.vbus_uV
+    iload_uA = ina.current_uA
+
+    vbatt_uV = (vbatt_adc.acquire() * VBATT_K) >> VBATT_SHIFT
+
+    # Ibatt = Vload * Iload / (eta * Vbatt), razao em Q14
+    if vbatt_uV < VBATT_MIN_UV:
+        ibatt_uA = 0
+    else:
+        ratio = ((vload_uV // 1000) * ETA_INV_K) // (vbatt_uV // 1000)
+        ibatt_uA = mul_shift(iload_uA, ratio, 14)
+
+    ts_ds = ts_manager.get_timestamp_ds()
+    temp_int_cC = temp.read_cc()
+
+    temp_ext_cC = None
+    hum_cp = None
+    if hdc is not None:
+        if safe_i2c_read(read_hdc_fixed, "HDC1080", False):
+            temp_ext_cC = hdc.temp_cC
+            hum_cp = hdc.hum_cp
+        elif quality is not None:
+            quality.read_failed(CH_TEMP_EXT, CH_HUM)
+
+    row_fixed["timestamp_ds"] = ts_ds
+    row_fixed["Vbatt_uV"] = vbatt_uV
+    row_fixed["Vload_uV"] = vload_uV
+    row_fixed["Iload_uA"] = iload_uA
+    row_fixed["Ibatt_uA"] = ibatt_uA
+    row_fixed["Temp_int_cC"] = temp_int_cC
+    row_fixed["Temp_ext_cC"] = temp_ext_cC
+    row_fixed["Humidity_cp"] = hum_cp
+    if quality is not None:
+        quality.check(row_fixed)
+
+    temp_batt = temp_ext_cC if temp_ext_cC is not None else temp_int_cC
+    soc_mp = gauge.update_fixed(vbatt_uV, ibatt_uA, ts_ds, temp_batt)
+    if forecast is not None:
+        forecast.update_fixed(soc_mp, row_fixed["Ibatt_uA"], ts_ds)
+    if scheduler is not None:
+        scheduler.update_fixed(soc_mp, row_fixed["Iload_uA"], ts_ds)
+
+    row_fixed["SoC_mp"] = soc_mp
+    logger.append_fixed(row_fixed)
+    return ts_ds
+
+def print_fixed_row(loop_ms):
+    """Exibe a linha inteira formatada (conversao so para texto)."""
+    r = row_fixed
+    print("{:>8} | {:>7} | {:>7} | {:>9} | {:>11} | {:>6} | {:>10} | {:>10} | {:>6} | {:>5}".format(
+        fmt_fixed(r["timestamp_ds"], 10, 2), fmt_fixed(r["Vbatt_uV"], 1000000, 3),
+        fmt_fixed(r["Vload_uV"], 1000000, 3), fmt_fixed(r["Iload_uA"], 1000, 3),
+        fmt_fixed(r["Ibatt_uA"], 1000, 3), fmt_fixed(r["SoC_mp"], 1000, 2),
+        fmt_fixed(r["Temp_int_cC"], 100, 2), fmt_fixed(r["Temp_ext_cC"], 100, 2),
+        fmt_fixed(r["Humidity_cp"], 100, 2), fmt_fixed(loop_ms, 1000, 3)))
+
+def _to_fixed(value, scale):
+    """Float -> inteiro na escala dada; NaN => None (telemetria)."""
+    if value != value:
+        return None
+    return int(value * scale + (0.5 if value >= 0 else -0.5))
+
+def send_telemetry(ts):
+    """Enfileira amostra, estado do gauge e, periodicamente, saude."""
+    qflags = 0 if quality is None else quality.flags
+    if FIXED_POINT:
+        ts_ds = ts
+        r = row_fixed
+        tlm.sample(ts_ds, r["Vbatt_uV"], r["Vload_uV"], r["Iload_uA"], r["Ibatt_uA"],
+                   r["SoC_mp"], r["Temp_int_cC"], r["Temp_ext_cC"], r["Humidity_cp"], qflags)
+        soc_mp = r["SoC_mp"]
+    else:
+        ts_ds = _to_fixed(ts, 10)
+        r = row
+        soc_mp = None if r["SoC"] is None else _to_fixed(r["SoC"], 1000)
+        tlm.sample(ts_ds, _to_fixed(r["Vbatt"], 1000000), _to_fixed(r["Vload"], 1000000),
+                   _to_fixed(r["Iload_mA"], 1000), _to_fixed(r["Ibatt_mA"], 1000), soc_mp,
+                   _to_fixed(r["Temp_int"], 100), _to_fixed(r["Temp_ext"], 100),
+                   _to_fixed(r["Humidity"], 100), qflags)
+    tlm.gauge(ts_ds, soc_mp, BATTERY_CAPACITY_MAH, gauge._inited)
+    if forecast is not None:
+        tlm.forecast(ts_ds, forecast)
+    if sample_count % TELEMETRY_HEALTH_INTERVAL == 0:
+        tlm.health(ts_ds, sample_count, error_count, gc.mem_free(),
+                   loop_ms_sum // loop_ms_count if loop_ms_count else 0,
+                   logger.current_file_index, logger.line_count)
+        if heap is not None:
+            tlm.heap(ts_ds, heap)
+    return soc_mp
+
+def send_alarm(code, value=0, text=""):
+    """Alarme na telemetria (se habilitada)."""
+    if tlm is not None:
+        tlm.alarm(ts_manager.get_timestamp_ds(), code, value, text)
+        tlm.flush()
+
+def get_avg_loop_time():
+    """Media dos ultimos MAX_LOOP_TIMES loops, em segundos."""
+    return (loop_ms_sum / loop_ms_count) / 1000.0 if loop_ms_count else 0.0
+
 def blink_error(times=3):
     """Pisca LED para indicar erro."""
     for _ in range(times):
@@ -163,11 +645,60 @@ def print_stats(sample_count, error_count, ts, wdt_feeds, avg_loop_time):
     print("Total de arquivos: {}".format(stats['total_arquivos']))
     print("Total de linhas: {}".format(stats['linhas_totais']))
     print("Erros: {}".format(error_count))
+    if forecast is not None:
+        print("Autonomia: {}".format(forecast.summary()))
+    if quality is not None:
+        print("Qualidade: {}".format(quality.summary()))
+    if scheduler is not None:
+        for ld in scheduler.loads:
+            print("Carga: {}, {} trocas".format(ld.status(), ld.switches))
+    print("Eventos: {} registrados, {} so contados".format(events.seq - 1, events.suppressed))
     print("Memoria livre: {} bytes".format(gc.mem_free()))
+    if heap is not None:
+        for line in heap.summary().split("\n"):
+            print(line[0].upper() + line[1:])
+    print("ADC bateria: {} amostras, ruido {:.2f} mV".format(
+        vbatt_adc.count, vbatt_adc.noise * VREF / 65.535 * DIV_GAIN * CAL_FACTOR))
+    if transfer is not None:
+        print("Descarga: {} arquivos, {} bytes, {} reenvios".format(
+            transfer.files_sent, transfer.bytes_sent, transfer.resends))
+    if tlm is not None:
+        print("Telemetria: {} quadros enviados, {} descartados".format(tlm.sent, tlm.dropped))
+    if timesync is not None:
+        print("Relogio: {}".format(timesync.summary()))
+    if retention is not None:
+        print("Retencao: {} KB livres, {} KB liberados".format(
+            retention.free_kb, retention.freed_bytes // 1024))
+    print("Flash gravada: {}".format(write_stats.summary(ts - ts_manager.offset)))
     if wdt:
         print("Watchdog alimentado: {} vezes".format(wdt_feeds))
     print("="*60 + "\n")
 
+def idle_until(deadline, ts):
+    """
+    Ocupa o tempo ocioso ate 'deadline' (ticks_ms) em fatias:
+    atende a descarga de logs quando ha sessao; senao monitora rajadas
+    ou dorme. A amostragem nunca espera pela transferencia.
+    Prioridade: descarga > retencao > rajadas > sleep.
+    """
+    while True:
+        remaining = ticks_diff(deadline, ticks_ms())
+        if remaining <= 50:
+            break
+        slice_ms = min(remaining, IDLE_SLICE_MS)
+        if wdt:
+            wdt.feed()
+        if tlm is not None:
+            tlm.flush()
+        if transfer is not None and safe_i2c_read(lambda: transfer.poll(0), "Descarga", False):
+            safe_i2c_read(lambda: transfer.poll(slice_ms), "Descarga", False)
+        elif retention is not None and retention.pending:
+            safe_i2c_read(lambda: retention.service(slice_ms), "Retencao", False)
+        elif burst is not None:
+            safe_i2c_read(lambda: burst.monitor(slice_ms, wdt, ts, remaining), "Rajada", None)
+        else:
+            sleep(slice_ms / 1000.0)
+
 def safe_i2c_read(sensor_func, sensor_name, default_value):
     """Le sensor I2C com protecao."""
     try:
@@ -176,18 +707,221 @@ def safe_i2c_read(sensor_func, sensor_name, default_value):
         result = sensor_func()
         return result
     except OSError as e:
-        print("AVISO - Erro I2C em {}: {}".format(sensor_name, e))
+        say(WARN, "AVISO - Erro I2C em {}: {}".format(sensor_name, e))
+        events.log(EV_I2C_ERROR, source_id(sensor_name), err_code(e))
+        send_alarm(ALARM_SENSOR, 0, sensor_name)
         return default_value
     except Exception as e:
-        print("AVISO - Erro em {}: {}".format(sensor_name, e))
+        say(WARN, "AVISO - Erro em {}: {}".format(sensor_name, e))
+        events.log(EV_SENSOR_ERROR, source_id(sensor_name))
+        send_alarm(ALARM_SENSOR, 0, sensor_name)
         return default_value
 
+# =============================================================================
+# COMANDOS EM TEMPO DE EXECUCAO
+# =============================================================================
+
+def set_cal_factor(factor):
+    """Troca o fator de calibracao do ADC (float e ponto fixo)."""
+    global CAL_FACTOR, VBATT_K, VBATT_SHIFT
+    CAL_FACTOR = factor
+    VBATT_K, VBATT_SHIFT = scale_factor(VREF * DIV_GAIN * CAL_FACTOR * 1000000 / 65535.0, 65535)
+
+def cmd_stats(args):
+    st = logger.get_stats()
+    return "\n".join((
+        "arquivo_atual: {}".format(st['arquivo_atual']),
+        "linhas_arquivo: {}/{}".format(st['linhas_arquivo'], logger.max_lines),
+        "total_arquivos: {}".format(st['total_arquivos']),
+        "linhas_totais: {}".format(st['linhas_totais']),
+        "amostras: {}".format(sample_count),
+        "erros: {}".format(error_count),
+        "intervalo: {}s".format(SAMPLE_INTERVAL),
+        "verbosidade: {}".format(get_level()),
+        "memoria_livre: {}".format(gc.mem_free()),
+    ))
+
+def cmd_resets(args):
+    n = int(args[0]) if args else 20
+    lines = reset_logger.read_log(n)
+    return "".join(lines) if lines else "Nenhum reset registrado"
+
+def cmd_events(args):
+    n = int(args[0]) if args else 20
+    code = None
+    if len(args) > 1:
+        names = dict((v, k) for k, v in EVENT_NAMES.items())
+        if args[1].upper() not in names:
+            raise ValueError("evento desconhecido: {}".format(args[1]))
+        code = names[args[1].upper()]
+    recs = events.tail(n, code)
+    return "\n".join(format_event(r) for r in recs) if recs else "Nenhum evento registrado"
+
+def cmd_counts(args):
+    lines = ["{}: {}".format(EVENT_NAMES[c], events.counts[c])
+             for c in sorted(EVENT_NAMES) if events.counts[c]]
+    lines.append("registrados: {} (anel de {}), so contados: {}".format(
+        events.seq - 1, events.capacity, events.suppressed))
+    return "\n".join(lines)
+
+def cmd_prof(args):
+    loop_max = max(loop_times[:loop_ms_count]) if loop_ms_count else 0
+    lines = [
+        "loop_medio_ms: {}".format(loop_ms_sum // loop_ms_count if loop_ms_count else 0),
+        "loop_max_ms: {} (ultimos {})".format(loop_max, loop_ms_count),
+        "adc_amostras: {} ruido_u16: {}".format(vbatt_adc.count, vbatt_adc.noise),
+        "watchdog_feeds: {}".format(wdt_feeds),
+        "comandos: {}".format(shell.executed),
+    ]
+    if heap is not None:
+        lines.append("gc: pausa max {} us, {} ociosas, {} forcadas, {} automaticas".format(
+            heap.pause_max_us, heap.collections, heap.forced, heap.auto))
+    if quality is not None:
+        lines.append("qualidade: max {} us, {} estouros de {} us".format(
+            quality.max_us, quality.overruns, quality.budget_us))
+    if burst is not None:
+        lines.append("rajadas: {} (ultima: {}), {} suprimidas, {} sem tempo".format(
+            burst.burst_count, burst.last_file, burst.suppressed, burst.late))
+    if transfer is not None:
+        lines.append("descarga: {} arquivos, {} bytes, {} reenvios".format(
+            transfer.files_sent, transfer.bytes_sent, transfer.resends))
+    if tlm is not None:
+        lines.append("telemetria: {} enviados, {} descartados".format(tlm.sent, tlm.dropped))
+    if retention is not None:
+        lines.append("retencao: {} KB livres, {} comprimidos, {} resumidos, {} apagados".format(
+            retention.free_kb, retention.files_compressed, retention.files_rolled,
+            retention.files_deleted))
+    lines.append("flash: {}".format(write_stats.summary(ts_manager.get_timestamp() - ts_manager.offset)))
+    return "\n".join(lines)
+
+def cmd_gauge(args):
+    if FIXED_POINT:
+        soc = fmt_fixed(gauge.soc_mp, 1000, 3)
+        last = gauge._last_ds
+    else:
+        soc = "nan" if gauge.soc is None else "{:.3f}".format(gauge.soc)
+        last = gauge._last_t
+    return "\n".join((
+        "modo: {}".format("ponto fixo" if FIXED_POINT else "float"),
+        "soc: {} %".format(soc),
+        "inicializado: {}".format(gauge._inited),
+        "ultimo_t: {}".format(last),
+        "capacidade_mAh: {}".format(gauge.capacity_mAh),
+        "v_full/v_empty: {}/{}".format(gauge.v_full, gauge.v_empty),
+        "previsao: {}".format("desligada" if forecast is None else forecast.summary()),
+    ))
+
+def cmd_quality(args):
+    if quality is None:
+        return "verificacao de qualidade desligada"
+    return "\n".join((quality.summary().replace(", ", "\n"),
+                      "flags: 0x{:04x}".format(quality.flags)))
+
+def cmd_heap(args):
+    if heap is None:
+        return "heap: {} livres (GC_IDLE desligado)".format(gc.mem_free())
+    return heap.summary()
+
+def cmd_loads(args):
+    if scheduler is None:
+        return "chaves de carga desligadas"
+    return scheduler.summary()
+
+def cmd_load(args):
+    if scheduler is None:
+        raise ValueError("chaves de carga desligadas")
+    ld = scheduler.set_manual(args[0], args[1])
+    return "{}: {} (vale na proxima amostra)".format(ld.name, args[1])
+
+def cmd_set(args):
+    global SAMPLE_INTERVAL
+    name, value = args[0], args[1]
+    if name == "interval":
+        v = float(value)
+        if not 1.0 <= v <= 3600.0:
+            raise ValueError("intervalo fora de 1..3600 s")
+        SAMPLE_INTERVAL = v
+        gauge.set_interval(v)
+        if heap is not None:
+            heap.interval_s = v
+        return "SAMPLE_INTERVAL = {}".format(SAMPLE_INTERVAL)
+    if name == "verbosity":
+        set_level(int(value))
+        return "VERBOSITY = {}".format(get_level())
+    raise ValueError("parametro desconhecido: {}".format(name))
+
+def cmd_flush(args):
+    ts_s = ts_manager.get_timestamp()
+    ts_manager.save_checkpoint(ts_s)
+    logger.flush()
+    events.sync()
+    if heap is not None:
+        heap.collect()
+    else:
+        gc.collect()
+    return "checkpoint {:.2f}s gravado, log em disco".format(ts_s)
+
+def cmd_clock(args):
+    if timesync is None:
+        raise ValueError("relogio UTC desligado")
+    if not args:
+        return timesync.summary()
+    if args[0] == "now":
+        return str(ts_manager.get_timestamp_ds())
+    if args[0] == "sync":
+        return timesync.sync(int(args[1]), int(args[2]), int(args[3]))
+    raise ValueError("use: clock | clock now | clock sync <ts_ds> <utc_ms> <erro_ms>")
+
+def cmd_stop(args):
+    # Substitui o Ctrl-C, desligado enquanto o USB carrega quadros binarios
+    global stop_requested
+    stop_requested = True
+    return "parando o logger"
+
+def cmd_rotate(args):
+    logger.rotate()
+    return "novo arquivo: {}".format(logger.filename)
+
+def cmd_cal(args):
+    what, value = args[0], float(args[1])
+    if what == "vbatt":
+        reading = read_vbatt()
+        if reading <= 0:
+            raise ValueError("leitura invalida: {}".format(reading))
+        set_cal_factor(CAL_FACTOR * value / reading)
+        return "CAL_FACTOR = {:.4f} (ate o proximo reset)".format(CAL_FACTOR)
+    if what == "temp":
+        offset = temp.calibrate_to(value)
+        return "offset do sensor interno = {:.2f} C".format(offset)
+    raise ValueError("use: cal vbatt <V> | cal temp <C>")
+
+shell = None
+if COMMANDS_ENABLED and transfer is not None:
+    shell = CommandShell(transfer)
+    shell.add("stats", cmd_stats, "estatisticas do logger e do loop")
+    shell.add("resets", cmd_resets, "[n] ultimos resets registrados")
+    shell.add("events", cmd_events, "[n] [nome] ultimos eventos (ex.: events 10 I2C_ERROR)")
+    shell.add("counts", cmd_counts, "contadores de eventos por tipo")
+    shell.add("prof", cmd_prof, "contadores de tempo e de servicos")
+    shell.add("gauge", cmd_gauge, "estado do battery gauge")
+    shell.add("heap", cmd_heap, "heap vivo, pico, fragmentacao, pausas de GC e tendencia")
+    shell.add("quality", cmd_quality, "estado dos detectores por canal (amostras marcadas)")
+    shell.add("loads", cmd_loads, "estado das chaves de carga")
+    shell.add("load", cmd_load, "<nome> on|off|auto (auto = volta ao escalonador)")
+    shell.add("set", cmd_set, "interval <s> | verbosity <0-3>")
+    shell.add("flush", cmd_flush, "grava checkpoint do timestamp e o bloco pendente do log")
+    shell.add("clock", cmd_clock, "[now | sync <ts_ds> <utc_ms> <erro_ms>] relogio UTC")
+    shell.add("rotate", cmd_rotate, "forca a rotacao do CSV")
+    shell.add("stop", cmd_stop, "encerra o logger (o Ctrl-C fica desligado no USB)")
+    shell.add("cal", cmd_cal, "vbatt <V medido> | temp <C ambiente>")
+    say(INFO, "OK - Comandos\n")
+
 # =============================================================================
 # LOOP PRINCIPAL
 # =============================================================================
 
-print("timestamp | Vbatt[V] | Vload[V] | Iload[mA] | Ibatt_est[mA] | SoC[%] | Temp_int[C] | Temp_ext[C] | Hum[%] | Loop[s]")
-print("-" * 130)
+say(SAMPLES, "timestamp | Vbatt[V] | Vload[V] | Iload[mA] | Ibatt_est[mA] | SoC[%] | Temp_int[C] | Temp_ext[C] | Hum[%] | Loop[s]")
+say(SAMPLES, "-" * 130)
 
 # Contadores
 error_count = 0
@@ -196,14 +930,22 @@ consecutive_errors = 0
 wdt_feeds = 0
 MAX_CONSECUTIVE_ERRORS = 10
 
-# Timing
-loop_times = []
+# Timing (anel de inteiros em ms, sem float por amostra)
 MAX_LOOP_TIMES = 50  # Manter ultimos 50 loops para calcular media
+loop_times = array('I', bytes(4 * MAX_LOOP_TIMES))
+loop_ms_idx = 0
+loop_ms_count = 0
+loop_ms_sum = 0
+low_soc_alarmed = False
+stop_requested = False
 
 while True:
     loop_start = ticks_ms()
     
     try:
+        if stop_requested:
+            raise KeyboardInterrupt
+        
         # Alimentar watchdog
         if wdt:
             wdt.feed()
@@ -211,94 +953,89 @@ while True:
         
         led.on()
         
-        # --- Leituras do INA (otimizado: 3 amostras x 0.01s) ---
-        def read_ina():
-            return ina.average(n=INA_SAMPLES, delay=INA_DELAY)
-        
-        d = safe_i2c_read(read_ina, "INA219", 
-                         {'vbus': 0.0, 'current': 0.0, 'vshunt': 0.0, 'power': 0.0})
-        
-        Vload = d['vbus']
-        Iload_mA = d['current']
-
-        # --- Leitura da bateria ---
-        Vbatt = read_vbatt()
-
-        # --- Corrente da bateria estimada ---
-        if Vbatt < 2.5:
-            Ibatt_mA = 0.0
-        else:
-            Ibatt_mA = (Vload * Iload_mA) / (BOOST_ETA * Vbatt)
-
-        # --- Tempo e temperatura interna ---
-        ts = ts_manager.get_timestamp()
-        TempC_int = temp.read_c()
-
-        # --- HDC1080 ---
-        if hdc is not None:
-            def read_hdc():
-                return hdc.read()
-            
-            result = safe_i2c_read(read_hdc, "HDC1080", (float('nan'), float('nan')))
-            TempC_ext, Humidity = result
+        if FIXED_POINT:
+            ts = sample_fixed()
         else:
-            TempC_ext, Humidity = float('nan'), float('nan')
-
-        # --- Estado de carga ---
-        SoC = gauge.update(voltage_V=Vbatt, current_mA=Ibatt_mA, now_s=ts)
-
-        # --- Gravacao ---
-        row = {
-            "timestamp": ts,
-            "Vbatt": Vbatt,
-            "Vload": Vload,
-            "Iload_mA": Iload_mA,
-            "Ibatt_mA": Ibatt_mA,
-            "SoC": SoC,
-            "Temp_int": TempC_int,
-            "Temp_ext": TempC_ext,
-            "Humidity": Humidity
-        }
-
-        logger.append(row)
+            ts = sample_float()
         sample_count += 1
+        if heap is not None:
+            heap.sample()
+
+        # Gatilho pelo caminho lento (degrau entre amostras normais)
+        if burst is not None:
+            if FIXED_POINT:
+                safe_i2c_read(lambda: burst.check_uA(row_fixed["Iload_uA"], ts, wdt),
+                              "Rajada", None)
+            else:
+                safe_i2c_read(lambda: burst.check(row["Iload_mA"], ts, wdt),
+                              "Rajada", None)
         consecutive_errors = 0
         
         # Calcular tempo do loop
-        loop_time = (ticks_ms() - loop_start) / 1000.0
-        loop_times.append(loop_time)
-        if len(loop_times) > MAX_LOOP_TIMES:
-            loop_times.pop(0)
-        avg_loop_time = sum(loop_times) / len(loop_times)
+        loop_ms = ticks_diff(ticks_ms(), loop_start)
+        loop_ms_sum += loop_ms - loop_times[loop_ms_idx]
+        loop_times[loop_ms_idx] = loop_ms
+        loop_ms_idx = (loop_ms_idx + 1) % MAX_LOOP_TIMES
+        if loop_ms_count < MAX_LOOP_TIMES:
+            loop_ms_count += 1
         
+        # --- Telemetria ---
+        if tlm is not None:
+            soc_mp = send_telemetry(ts)
+            if soc_mp is not None:
+                if not low_soc_alarmed and soc_mp < LOW_SOC_ALARM_PCT * 1000:
+                    send_alarm(ALARM_LOW_SOC, soc_mp, "SoC baixo")
+                    low_soc_alarmed = True
+                elif soc_mp > (LOW_SOC_ALARM_PCT + 2) * 1000:
+                    low_soc_alarmed = False
+            tlm.flush()
+
         # --- Exibicao ---
-        print("{:8.2f} | {:7.3f} | {:7.3f} | {:9.3f} | {:11.3f} | {:6.2f} | {:10.2f} | {:10.2f} | {:6.2f} | {:5.3f}".format(
-            ts, Vbatt, Vload, Iload_mA, Ibatt_mA, SoC, TempC_int, TempC_ext, Humidity, loop_time))
+        if enabled(SAMPLES):
+            if FIXED_POINT:
+                print_fixed_row(loop_ms)
+            else:
+                print("{:8.2f} | {:7.3f} | {:7.3f} | {:9.3f} | {:11.3f} | {:6.2f} | {:10.2f} | {:10.2f} | {:6.2f} | {:5.3f}".format(
+                    row["timestamp"], row["Vbatt"], row["Vload"], row["Iload_mA"], row["Ibatt_mA"],
+                    row["SoC"], row["Temp_int"], row["Temp_ext"], row["Humidity"], loop_ms / 1000.0))
         
         # Avisar se loop demorou muito
-        if loop_time > 1.5:
-            print("AVISO - Loop demorou {:.2f}s (esperado: <1.0s)".format(loop_time))
+        if loop_ms > 1500:
+            say(WARN, "AVISO - Loop demorou {:.2f}s (esperado: <1.0s)".format(loop_ms / 1000.0))
+            events.log(EV_LOOP_SLOW, 0, loop_ms)
+            send_alarm(ALARM_LOOP_SLOW, loop_ms, "loop lento")
 
         # --- Gerenciamento de memoria ---
         if sample_count % GC_INTERVAL == 0:
-            gc.collect()
+            if heap is None:
+                gc.collect()
+            elif heap.overdue():
+                heap.collect(forced=True)
             if wdt:
                 wdt.feed()
-            ts_manager.save_checkpoint(ts)
-            print("GC: {} bytes | Checkpoint: {:.2f}h | Loop medio: {:.3f}s".format(
-                gc.mem_free(), ts/3600, avg_loop_time))
+            ts_s = ts / 10.0 if FIXED_POINT else ts
+            ts_manager.save_checkpoint(ts_s)
+            events.sync()
+            if enabled(INFO):
+                print("GC: {} bytes | Checkpoint: {:.2f}h | Loop medio: {:.3f}s".format(
+                    gc.mem_free(), ts_s/3600, get_avg_loop_time()))
         
         # --- Estatisticas periodicas ---
-        if sample_count % STATS_INTERVAL == 0:
-            print_stats(sample_count, error_count, ts, wdt_feeds, avg_loop_time)
+        if sample_count % STATS_INTERVAL == 0 and enabled(INFO):
+            print_stats(sample_count, error_count, ts / 10.0 if FIXED_POINT else ts,
+                        wdt_feeds, get_avg_loop_time())
             if wdt:
                 wdt.feed()
         
         led.off()
         
+        # --- Coleta de lixo na folga (antes de dormir ou atender a porta) ---
+        if heap is not None:
+            heap.service(int(SAMPLE_INTERVAL * 1000) - ticks_diff(ticks_ms(), loop_start) - 50)
+
         # --- SLEEP AJUSTADO PARA TIMING PRECISO ---
         # Calcular quanto tempo ja passou no loop
-        elapsed = (ticks_ms() - loop_start) / 1000.0
+        elapsed = ticks_diff(ticks_ms(), loop_start) / 1000.0
         
         # Calcular quanto tempo falta para completar SAMPLE_INTERVAL
         sleep_time = SAMPLE_INTERVAL - elapsed
@@ -309,19 +1046,31 @@ while True:
         if wdt:
             wdt.feed()
         
-        sleep(sleep_time)
+        if burst is not None or port is not None or retention is not None:
+            # Tempo ocioso: descarga de logs / monitoramento de alta taxa
+            idle_until(ticks_add(loop_start, int(SAMPLE_INTERVAL * 1000)), ts)
+            # Se a ultima fatia abortou cedo (erro I2C), completa o intervalo
+            remaining = SAMPLE_INTERVAL - ticks_diff(ticks_ms(), loop_start) / 1000.0
+            if remaining > 0.05:
+                sleep(remaining)
+        else:
+            sleep(sleep_time)
         
     except KeyboardInterrupt:
-        print("\n\nInterrompido pelo usuario")
+        say(INFO, "\n\nInterrompido pelo usuario")
         ts_manager.save_checkpoint(ts_manager.get_timestamp())
-        print_stats(sample_count, error_count, ts_manager.get_timestamp(), wdt_feeds, avg_loop_time)
+        logger.flush()
+        events.sync()
+        print_stats(sample_count, error_count, ts_manager.get_timestamp(), wdt_feeds, get_avg_loop_time())
         break
         
     except Exception as e:
         error_count += 1
         consecutive_errors += 1
         
-        print("\nERRO #{} (consecutivos: {}): {}".format(error_count, consecutive_errors, e))
+        say(WARN, "\nERRO #{} (consecutivos: {}): {}".format(error_count, consecutive_errors, e))
+        events.log(EV_ERROR, consecutive_errors)
+        send_alarm(ALARM_ERROR, consecutive_errors, str(e))
         
         if wdt:
             wdt.feed()
@@ -329,10 +1078,13 @@ while True:
         blink_error()
         
         if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
-            print("ERRO CRITICO: {} erros consecutivos!".format(MAX_CONSECUTIVE_ERRORS))
+            say(WARN, "ERRO CRITICO: {} erros consecutivos!".format(MAX_CONSECUTIVE_ERRORS))
+            events.log(EV_CRITICAL, consecutive_errors)
+            events.sync()
+            send_alarm(ALARM_CRITICAL, consecutive_errors, "erros consecutivos")
             
             if wdt:
-                print("Watchdog vai reiniciar o sistema...")
+                say(WARN, "Watchdog vai reiniciar o sistema...")
                 while True:
                     blink_error(1)
                     sleep(1)
@@ -345,4 +1097,6 @@ while True:
         
         continue
 
-print("\nSistema finalizado.")
\ No newline at end of file
+if port is not None:
+    port.close()
+say(INFO, "\nSistema finalizado.")
@@ -1,84 +1,71 @@
 """
 reset_log.py - Registro de causas de reset
 -------------------------------------------
-Registra a causa do reset do sistema de forma segura,
-compatível com diferentes versões do MicroPython.
+Registra a causa do reset do sistema como evento BOOT no anel de eventos
+(event_log.py), compativel com diferentes versoes do MicroPython.
+O antigo reset_log.txt deixa de ser gravado.
 """
 
 import machine
-from time import localtime
+from event_log import EV_BOOT, format_event
+
+# Mapeamento dos codigos numericos de machine.reset_cause() para nomes
+RESET_CAUSES = {
+    0: 'PWRON_RESET',      # Power-on reset
+    1: 'HARD_RESET',       # Hard reset
+    2: 'WDT_RESET',        # Watchdog reset
+    3: 'DEEPSLEEP_RESET',  # Deep sleep reset
+    4: 'SOFT_RESET',       # Soft reset (Ctrl+D)
+}
+
 
 class ResetLogger:
     """Registra a causa do último reset do sistema."""
     
-    def __init__(self, filename="reset_log.txt"):
-        self.filename = filename
-        self._log_reset()
+    def __init__(self, events, resumed_s=0):
+        """
+        Args:
+            events: EventLog onde o BOOT e gravado
+            resumed_s: timestamp retomado do checkpoint (TimestampManager.offset)
+        """
+        self.events = events
+        self.boot_seq = 0       # seq do BOOT deste boot no anel (0 = nao gravado)
+        self._log_reset(int(resumed_s))
     
-    def get_reset_cause_name(self):
-        """Retorna o nome da causa do reset de forma segura."""
+    def get_reset_cause(self):
+        """Codigo de machine.reset_cause() (-1 se indisponivel)."""
         try:
-            cause = machine.reset_cause()
-            
-            # Mapeamento dos códigos numéricos para nomes
-            causes = {
-                0: 'PWRON_RESET',      # Power-on reset
-                1: 'HARD_RESET',       # Hard reset
-                2: 'WDT_RESET',        # Watchdog reset
-                3: 'DEEPSLEEP_RESET',  # Deep sleep reset
-                4: 'SOFT_RESET',       # Soft reset (Ctrl+D)
-            }
-            
-            return causes.get(cause, 'UNKNOWN({})'.format(cause))
-        except Exception as e:
-            return 'UNAVAILABLE (erro: {})'.format(e)
+            return machine.reset_cause()
+        except Exception:
+            return -1
+
+    def get_reset_cause_name(self, cause=None):
+        """Retorna o nome da causa do reset de forma segura."""
+        if cause is None:
+            cause = self.get_reset_cause()
+        if cause < 0:
+            return 'UNAVAILABLE'
+        return RESET_CAUSES.get(cause, 'UNKNOWN({})'.format(cause))
     
-    def _log_reset(self):
-        """Registra a causa do reset no arquivo."""
-        try:
-            cause_name = self.get_reset_cause_name()
-            
-            # Pega timestamp atual (pode não ser preciso se RTC não configurado)
-            try:
-                t = localtime()
-                timestamp = "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
-                    t[0], t[1], t[2], t[3], t[4], t[5])
-            except:
-                timestamp = "N/A"
-            
-            # Escreve no arquivo
-            with open(self.filename, 'a') as f:
-                f.write("{} | Reset: {}\n".format(timestamp, cause_name))
-            
-            print("Reset registrado: {}".format(cause_name))
-            
-        except Exception as e:
-            print("AVISO - Não foi possível registrar reset: {}".format(e))
+    def _log_reset(self, resumed_s):
+        """Registra a causa do reset no anel de eventos."""
+        cause = self.get_reset_cause()
+        seq = self.events.seq
+        if self.events.log(EV_BOOT, cause, resumed_s):
+            self.boot_seq = seq
+        print("Reset registrado: {}".format(self.get_reset_cause_name(cause)))
     
     def read_log(self, max_lines=20):
-        """Lê as últimas entradas do log de reset."""
-        try:
-            with open(self.filename, 'r') as f:
-                lines = f.readlines()
-            
-            # Retorna as últimas max_lines linhas
-            return lines[-max_lines:] if len(lines) > max_lines else lines
-            
-        except OSError:
-            print("Arquivo de log não encontrado")
-            return []
-        except Exception as e:
-            print("Erro ao ler log: {}".format(e))
-            return []
+        """Últimas entradas de reset (lidas do fim do anel, sem ler tudo)."""
+        lines = []
+        for rec in self.events.tail(max_lines, EV_BOOT):
+            lines.append("{} | Reset: {}\n".format(format_event(rec), self.get_reset_cause_name(rec[3])))
+        return lines
     
     def clear_log(self):
-        """Limpa o arquivo de log de reset."""
-        try:
-            with open(self.filename, 'w') as f:
-                f.write("=== Log de Reset Limpo ===\n")
-            print("Log de reset limpo")
-        except Exception as e:
-            print("Erro ao limpar log: {}".format(e))
+        """Limpa o anel de eventos (todos os tipos)."""
+        self.events.clear()
+        print("Log de eventos limpo")
     
     def print_log(self, max_lines=20):
         """Imprime as últimas entradas do log."""
@@ -89,4 +76,4 @@ class ResetLogger:
                 print(line.strip())
             print("=" * 40)
         else:
-            print("Nenhum reset registrado")
\ No newline at end of file
+            print("Nenhum reset registrado")
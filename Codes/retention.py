@@ -0,0 +1,514 @@
+# retention.py
+"""
+Politica de retencao dos logs
+-----------------------------
+Em vez de parar de gravar com o disco cheio, libera espaco nos arquivos
+mais antigos segundo uma lista de politicas, tentadas em ordem:
+
+    "compress" comprime o CSV rotacionado mais antigo: ina_log_NNN.csv.gz
+               (modulo deflate do MicroPython) ou, sem deflate,
+               ina_log_NNN.csv.dv (delta + varint, log_codec.py); o
+               original so e apagado depois de conferir o CRC32 do
+               conteudo descomprimido ("deflate" e aceito como sinonimo)
+    "rollup"   troca o log bruto mais antigo (.csv, .csv.gz ou .csv.dv)
+               por um resumo horario (ina_roll_NNN.csv)
+    "delete"   apaga o mais antigo: logs brutos, depois rajadas, por
+               ultimo os resumos
+
+Com compress_rotated, cada arquivo rotacionado e comprimido logo em
+seguida, mesmo com o disco folgado. Cada compressao conferida ganha uma
+entrada no manifesto (log_manifest.csv, ver log_codec.py).
+
+O trabalho pesado roda em passos pequenos no tempo ocioso (service()).
+O espaco livre e contabilizado de forma incremental (bytes gravados),
+com statvfs so na inicializacao, a cada resync_kb gravados e ao fim de
+cada tarefa. Se o espaco chegar ao nivel critico antes da tarefa
+terminar, o arquivo mais antigo e apagado na hora (emergencia).
+"""
+
+import os
+from time import ticks_ms, ticks_diff
+from console import say, WARN, INFO
+from write_stats import count_bytes, W_RETENTION
+from event_log import EV_FILE_DELETED, EV_COMPRESS_FAIL, EV_WRITE_ERROR, source_id, err_code
+from log_codec import (DvWriter, DvReader, DV_SUFFIX, GZIP_SUFFIX, MANIFEST_NAME,
+                       csv_time_range, read_manifest, append_manifest, write_manifest)
+
+try:
+    from binascii import crc32
+except ImportError:  # pragma: no cover
+    from zlib import crc32
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+POLICY_COMPRESS = "compress"
+POLICY_DEFLATE = "deflate"      # nome antigo de "compress"
+POLICY_ROLLUP = "rollup"
+POLICY_DELETE = "delete"
+DEFAULT_POLICY = (POLICY_COMPRESS, POLICY_ROLLUP, POLICY_DELETE)
+
+CODEC_AUTO = "auto"             # deflate se disponivel, senao dv
+CODEC_DEFLATE = "deflate"
+CODEC_DV = "dv"
+
+ROLLUP_PREFIX = "ina_roll_"
+ROLLUP_HEADER = ("hour_start,n,Vbatt[V],Vload[V],Iload[mA],Ibatt_est[mA],SoC[%],"
+                 "Temp_int[C],Temp_ext[C],Humidity[%],Vbatt_min[V],Vbatt_max[V],"
+                 "Iload_max[mA]\n")
+DEFLATE_WBITS = 10   # janela de 1 KB (RAM do compressor)
+MANIFEST_MAX_BYTES = 4096   # acima disso o manifesto e compactado
+
+
+def _index_of(name, prefix):
+    """NNN de prefixoNNN.ext, ou -1."""
+    if not name.startswith(prefix):
+        return -1
+    digits = name[len(prefix):].split(".", 1)[0]
+    try:
+        return int(digits)
+    except ValueError:
+        return -1
+
+
+def _file_size(name):
+    try:
+        return os.stat(name)[6]
+    except OSError:
+        return 0
+
+
+def open_log(name):
+    """Abre um log para leitura em texto, comprimido ou nao."""
+    if name.endswith(GZIP_SUFFIX):
+        if deflate is None:
+            raise OSError("modulo deflate indisponivel")
+        return deflate.DeflateIO(open(name, "rb"), deflate.GZIP, 0, True)
+    if name.endswith(DV_SUFFIX):
+        return DvReader(open(name, "rb"))
+    return open(name, "rb")
+
+
+class _CompressJob:
+    """Comprime src em src.gz/src.dv, confere o CRC e apaga src."""
+
+    def __init__(self, src, chunk_size, codec):
+        self.src = src
+        self.chunk_size = chunk_size
+        self._buf = bytearray(chunk_size)
+        self.times = csv_time_range(src)
+        self.raw_size = _file_size(src)
+        self._in = open(src, "rb")
+        self._out = None
+        if codec == CODEC_DEFLATE:
+            self.dst = src + GZIP_SUFFIX
+            self._out = deflate.DeflateIO(open(self.dst, "wb"), deflate.GZIP,
+                                          DEFLATE_WBITS, True)
+        else:
+            self.dst = src + DV_SUFFIX
+            self._out = DvWriter(open(self.dst, "wb"))
+        self._crc = 0
+        self._check = None
+        self._check_crc = 0
+        self.freed = 0
+        self.ok = False
+
+    def step(self):
+        """Um pedaco de trabalho. Retorna True quando termina."""
+        mv = memoryview(self._buf)
+        if self._check is None:
+            n = self._in.readinto(mv)
+            if n:
+                self._crc = crc32(mv[:n], self._crc)
+                self._out.write(mv[:n])
+                return False
+            self._in.close()
+            self._out.close()
+            self._check = open_log(self.dst)
+            return False
+        n = self._check.readinto(mv)
+        if n:
+            self._check_crc = crc32(mv[:n], self._check_crc)
+            return False
+        self._check.close()
+        if self._check_crc == self._crc:
+            self.freed = self.raw_size - _file_size(self.dst)
+            os.remove(self.src)
+            self.ok = True
+        else:
+            say(WARN, "AVISO - Compressao de {} nao confere, mantendo original".format(self.src))
+            os.remove(self.dst)
+        return True
+
+    def abort(self):
+        for f in (self._in, self._out, self._check):
+            try:
+                if f is not None:
+                    f.close()
+            except OSError:
+                pass
+        try:
+            os.remove(self.dst)
+        except OSError:
+            pass
+
+
+class _RollupJob:
+    """Resume src por hora em ina_roll_NNN.csv e apaga src."""
+
+    # Colunas do CSV: timestamp + 8 valores
+    N_VALUES = 8
+
+    def __init__(self, src, index, lines_per_step=50):
+        self.src = src
+        self.dst = "{}{:03d}.csv".format(ROLLUP_PREFIX, index)
+        self.lines_per_step = lines_per_step
+        self._in = open_log(src)
+        self._in.readline()  # cabecalho
+        self._out = open(self.dst, "w")
+        self._out.write(ROLLUP_HEADER)
+        self._hour = None
+        self._sums = [0.0] * self.N_VALUES
+        self._counts = [0] * self.N_VALUES
+        self._n = 0
+        self._vmin = self._vmax = self._imax = 0.0
+        self.freed = 0
+
+    def _flush_hour(self):
+        if self._n == 0:
+            return
+        means = []
+        for s, c in zip(self._sums, self._counts):
+            means.append("{:.3f}".format(s / c) if c else "nan")
+        self._out.write("{},{},{},{:.3f},{:.3f},{:.3f}\n".format(
+            self._hour * 3600, self._n, ",".join(means),
+            self._vmin, self._vmax, self._imax))
+        for i in range(self.N_VALUES):
+            self._sums[i] = 0.0
+            self._counts[i] = 0
+        self._n = 0
+
+    def step(self):
+        for _ in range(self.lines_per_step):
+            line = self._in.readline()
+            if not line:
+                self._flush_hour()
+                self._in.close()
+                self._out.close()
+                self.freed = _file_size(self.src) - _file_size(self.dst)
+                os.remove(self.src)
+                return True
+            parts = line.decode().split(",")
+            if len(parts) < 1 + self.N_VALUES:
+                continue
+            try:
+                hour = int(float(parts[0])) // 3600
+                values = [float(p) for p in parts[1:1 + self.N_VALUES]]
+            except ValueError:
+                continue
+            if hour != self._hour:
+                self._flush_hour()
+                self._hour = hour
+            if self._n == 0:
+                self._vmin = self._vmax = values[0]
+                self._imax = values[2]
+            for i, v in enumerate(values):
+                if v == v:
+                    self._sums[i] += v
+                    self._counts[i] += 1
+            self._vmin = min(self._vmin, values[0])
+            self._vmax = max(self._vmax, values[0])
+            self._imax = max(self._imax, values[2])
+            self._n += 1
+        return False
+
+    def abort(self):
+        for f in (self._in, self._out):
+            try:
+                f.close()
+            except OSError:
+                pass
+        try:
+            os.remove(self.dst)
+        except OSError:
+            pass
+
+
+class RetentionManager:
+    """Contabilidade de espaco e liberacao em segundo plano."""
+
+    def __init__(self, logger, min_free_kb=200, target_free_kb=400,
+                 critical_free_kb=50, policy=DEFAULT_POLICY,
+                 resync_kb=256, chunk_size=1024, protect=None,
+                 codec=CODEC_AUTO, compress_rotated=True):
+        """
+        Args:
+            logger: DataLogger (arquivo atual nunca e mexido)
+            min_free_kb: abaixo disso comeca a liberar espaco
+            target_free_kb: libera ate chegar aqui
+            critical_free_kb: abaixo disso apaga na hora (sem esperar)
+            policy: politicas em ordem de preferencia
+            resync_kb: bytes gravados entre consultas ao statvfs
+            chunk_size: bytes por passo de compressao
+            protect: funcao que retorna nomes que nao podem ser mexidos
+                     (ex.: arquivo sendo descarregado)
+            codec: "auto", "deflate" ou "dv"
+            compress_rotated: comprime cada arquivo logo apos a rotacao
+        """
+        self.logger = logger
+        self.events = None   # EventLog (opcional): apagados e falhas
+        self.min_free = min_free_kb * 1024
+        self.target_free = target_free_kb * 1024
+        self.critical_free = critical_free_kb * 1024
+        if codec == CODEC_AUTO:
+            codec = CODEC_DEFLATE if deflate is not None else CODEC_DV
+        elif codec == CODEC_DEFLATE and deflate is None:
+            say(WARN, "AVISO - Modulo deflate indisponivel, usando codec dv")
+            codec = CODEC_DV
+        self.codec = codec
+        self.policy = tuple(POLICY_COMPRESS if p == POLICY_DEFLATE else p for p in policy)
+        self.compress_rotated = compress_rotated and POLICY_COMPRESS in self.policy
+        self.resync_bytes = resync_kb * 1024
+        self.chunk_size = chunk_size
+        self.protect = protect
+
+        self._job = None
+        self._reclaiming = False
+        self._exhausted_index = -1   # nada a liberar ate a proxima rotacao
+        self._compressed_index = -1  # rotacionados ja comprimidos ate aqui
+        self._failed = []            # compressoes que falharam (nao repetir)
+        self._since_sync = 0
+        self._free = 0
+        self.sync()
+
+        self.freed_bytes = 0
+        self.files_compressed = 0
+        self.files_rolled = 0
+        self.files_deleted = 0
+
+    # ------------------------------------------------------------------
+    # Contabilidade
+    # ------------------------------------------------------------------
+
+    def sync(self):
+        """Le o espaco livre real (statvfs)."""
+        try:
+            st = os.statvfs('/')
+            self._free = st[0] * st[3]
+        except OSError:
+            pass
+        self._since_sync = 0
+
+    @property
+    def free_kb(self):
+        return self._free // 1024
+
+    @property
+    def pending(self):
+        """True se ha trabalho para service()."""
+        if self._job is not None:
+            return True
+        if self.compress_rotated and self._compressed_index != self.logger.current_file_index:
+            return True
+        if self._exhausted_index == self.logger.current_file_index:
+            return False
+        return self._free < self.min_free or self._reclaiming
+
+    def reserve(self, nbytes):
+        """
+        Chamado pelo logger antes de gravar nbytes.
+        Retorna False apenas se nao ha nada mais que possa ser apagado.
+        """
+        if self._free - nbytes < self.critical_free:
+            self.sync()
+            while self._free - nbytes < self.critical_free:
+                if not self._emergency_delete():
+                    return False
+        self._free -= nbytes
+        self._since_sync += nbytes
+        if self._since_sync >= self.resync_bytes:
+            self.sync()
+        return True
+
+    # ------------------------------------------------------------------
+    # Candidatos
+    # ------------------------------------------------------------------
+
+    def _protected(self):
+        names = [self.logger.filename]
+        if self.protect is not None:
+            names.extend(self.protect())
+        return names
+
+    def _scan(self):
+        """Lista (logs brutos, rajadas, resumos), cada um do mais antigo ao mais novo."""
+        raw, bursts, rolls = [], [], []
+        skip = self._protected()
+        base = self.logger.base_filename + "_"
+        for name in os.listdir():
+            if name in skip or (self._job is not None and name in (self._job.src, self._job.dst)):
+                continue
+            i = _index_of(name, base)
+            if i >= 0:
+                if i != self.logger.current_file_index:
+                    raw.append((i, name))
+                continue
+            i = _index_of(name, "burst_")
+            if i >= 0:
+                bursts.append((i, name))
+                continue
+            i = _index_of(name, ROLLUP_PREFIX)
+            if i >= 0:
+                rolls.append((i, name))
+        raw.sort()
+        bursts.sort()
+        rolls.sort()
+        return raw, bursts, rolls
+
+    def _start_compress(self, raw):
+        """Comprime o log bruto rotacionado mais antigo ainda em texto."""
+        for i, name in raw:
+            if name.endswith(".csv") and name not in self._failed:
+                self._job = _CompressJob(name, self.chunk_size, self.codec)
+                return True
+        return False
+
+    def _start_job(self):
+        """Escolhe a proxima tarefa pela ordem das politicas."""
+        raw, bursts, rolls = self._scan()
+        for p in self.policy:
+            if p == POLICY_COMPRESS:
+                if self._start_compress(raw):
+                    return True
+            elif p == POLICY_ROLLUP:
+                for i, name in raw:
+                    if ".csv" not in name:
+                        continue   # backend colunar: sem resumo, so "delete"
+                    if deflate is not None or not name.endswith(GZIP_SUFFIX):
+                        self._job = _RollupJob(name, i)
+                        return True
+            elif p == POLICY_DELETE:
+                for group in (raw, bursts, rolls):
+                    if group:
+                        self._delete(group[0][1])
+                        return True
+        return False
+
+    def _delete(self, name):
+        size = _file_size(name)
+        try:
+            os.remove(name)
+        except OSError as e:
+            say(WARN, "AVISO - Nao foi possivel apagar {}: {}".format(name, e))
+            return False
+        self._free += size
+        self.freed_bytes += size
+        self.files_deleted += 1
+        if self.events is not None:
+            self.events.log(EV_FILE_DELETED, 0, size)
+        say(INFO, "Retencao: {} apagado ({} bytes)".format(name, size))
+        return True
+
+    def _emergency_delete(self):
+        """Apaga o arquivo mais antigo na hora (espaco critico)."""
+        if self._job is not None:
+            self._job.abort()
+            self._job = None
+        raw, bursts, rolls = self._scan()
+        for group in (raw, bursts, rolls):
+            if group:
+                return self._delete(group[0][1])
+        return False
+
+    # ------------------------------------------------------------------
+    # Trabalho em segundo plano
+    # ------------------------------------------------------------------
+
+    def _record(self, job):
+        """Registra no manifesto uma compressao conferida."""
+        try:
+            append_manifest(job.dst, job.raw_size, job._crc, job.times[0], job.times[1])
+            if _file_size(MANIFEST_NAME) > MANIFEST_MAX_BYTES:
+                # Tira entradas de arquivos ja apagados ou resumidos
+                entries = read_manifest()
+                for name in list(entries):
+                    if _file_size(name) == 0:
+                        del entries[name]
+                write_manifest(entries)
+        except OSError as e:
+            say(WARN, "AVISO - Manifesto nao atualizado: {}".format(e))
+
+    def _finish(self, job):
+        self.freed_bytes += max(0, job.freed)
+        count_bytes(W_RETENTION, _file_size(job.dst))
+        if isinstance(job, _CompressJob):
+            if not job.ok:
+                self._failed.append(job.src)
+                if self.events is not None:
+                    self.events.log(EV_COMPRESS_FAIL)
+                return
+            self.files_compressed += 1
+            self._record(job)
+        else:
+            self.files_rolled += 1
+        say(INFO, "Retencao: {} -> {} ({} bytes liberados)".format(job.src, job.dst, job.freed))
+
+    def service(self, budget_ms):
+        """
+        Avanca a liberacao de espaco (ou a compressao dos rotacionados)
+        por ate budget_ms.
+
+        Returns:
+            True se ainda ha trabalho pendente
+        """
+        start = ticks_ms()
+        index = self.logger.current_file_index
+        if self._job is None:
+            reclaim = ((self._free < self.min_free or self._reclaiming)
+                       and self._exhausted_index != index)
+            if reclaim:
+                self._reclaiming = True
+            elif not self.compress_rotated or self._compressed_index == index:
+                return False
+            try:
+                if reclaim:
+                    started = self._start_job()
+                else:
+                    started = self._start_compress(self._scan()[0])
+            except Exception as e:
+                say(WARN, "AVISO - Retencao nao conseguiu iniciar tarefa: {}".format(e))
+                started = False
+            if not started:
+                if reclaim:
+                    self._reclaiming = False
+                    self._exhausted_index = index
+                else:
+                    self._compressed_index = index
+                return self.pending
+        while self._job is not None and ticks_diff(ticks_ms(), start) < budget_ms:
+            if self._job.src in self._protected():
+                # Comecou a ser descarregado: tenta de novo depois
+                self._job.abort()
+                self._job = None
+                break
+            try:
+                done = self._job.step()
+            except Exception as e:
+                say(WARN, "AVISO - Retencao falhou em {}: {}".format(self._job.src, e))
+                if self.events is not None:
+                    self.events.log(EV_WRITE_ERROR, source_id("Retencao"), err_code(e))
+                self._failed.append(self._job.src)
+                self._job.abort()
+                self._job = None
+                self._reclaiming = False
+                return self.pending
+            if done:
+                job = self._job
+                self._job = None
+                self._finish(job)
+                self.sync()
+        if self._job is None and self._free >= self.target_free:
+            self._reclaiming = False
+        return self.pending
@@ -1,22 +1,45 @@
 from machine import ADC
+from adc_sampler import OversampledADC, FILTER_MEAN
+from fixed_point import scale_factor
 
 class Rp2040Temp:
-    def __init__(self, vref=3.30, offset_c=0.0):
+    def __init__(self, vref=3.30, offset_c=0.0, samples=1, budget_us=1000,
+                 filter_mode=FILTER_MEAN, trim=0):
         self.adc = ADC(4)
         self.vref = vref
         self.offset_c = offset_c
+        # Conversao inteira contagem -> uV: (raw * k) >> shift
+        self._uv_k, self._uv_shift = scale_factor(vref * 1000000 / 65535.0, 65535)
+        self._offset_cC = int(round(offset_c * 100))
+        # samples > 1 => rajada sobreamostrada em vez de leitura unica
+        self.sampler = None
+        if samples > 1:
+            self.sampler = OversampledADC(self.adc, samples=samples,
+                                          budget_us=budget_us,
+                                          filter_mode=filter_mode, trim=trim)
+
+    def _read_raw(self):
+        if self.sampler is not None:
+            return self.sampler.acquire()
+        return self.adc.read_u16()
 
     def read_c(self):
-        v = self.adc.read_u16() * self.vref / 65535.0
+        v = self._read_raw() * self.vref / 65535.0
         t = 27.0 - (v - 0.706) / 0.001721
         return t + self.offset_c
 
+    def read_cc(self):
+        """Temperatura em centi-graus (inteiro, sem float)."""
+        v_uV = (self._read_raw() * self._uv_k) >> self._uv_shift
+        return 2700 - ((v_uV - 706000) * 100) // 1721 + self._offset_cC
+
     def calibrate_to(self, ambient_c, samples=20):
         s = 0.0
         for _ in range(samples):
-            v = self.adc.read_u16() * self.vref / 65535.0
+            v = self._read_raw() * self.vref / 65535.0
             t = 27.0 - (v - 0.706) / 0.001721
             s += t
         avg = s / samples
         self.offset_c = ambient_c - avg
+        self._offset_cC = int(round(self.offset_c * 100))
         return self.offset_c
@@ -0,0 +1,260 @@
+# sensor_quality.py
+"""
+Qualidade das leituras na origem
+--------------------------------
+Detectores de memoria constante, por amostra, para cada canal medido:
+
+    LEITURA  a leitura I2C falhou (safe_i2c_read devolveu o padrao)
+    FAIXA    valor fora dos limites fisicos do canal
+    TRAVADO  mesmo valor exato por stuck_n amostras seguidas (HDC1080 travado)
+    DEGRAU   variacao entre amostras maior que max_step (pico ou mau contato)
+    CRUZADO  canais incoerentes entre si:
+             - Vload abaixo de Vbatt com carga ligada (o boost so eleva a
+               tensao; divisor do ADC derivando ou INA errado)
+             - Temp_int longe de Temp_ext (sensor interno/ADC suspeito)
+
+Cada canal guarda o valor anterior, um contador e a mascara de detectores
+ativos; nada cresce com o tempo. As verificacoes rodam dentro de
+budget_us: o que nao couber fica para a proxima amostra, comecando de
+onde parou (rodizio), e conta em overruns. LEITURA e CRUZADO valem
+sempre na amostra atual, mesmo nos canais adiados.
+
+Saidas, por amostra:
+    - flags (u16): bit do canal (0..5) se ele tem algum detector ativo,
+      bit 6 se Ibatt_est foi suprimido, bits 8..12 = detectores ativos
+      em qualquer canal. Vai no registro SAMPLE da telemetria.
+    - supressao: canais com detectores em suppress_mask viram nan (float)
+      ou None (ponto fixo) na linha gravada; Ibatt_est tambem, se uma de
+      suas entradas (Vbatt, Vload, Iload) foi suprimida
+    - eventos QUALITY so nas transicoes (canal, mascara; 0 = normalizou)
+
+Limites em unidades de engenharia (V, mA, C, %); no modo ponto fixo sao
+convertidos uma vez para uV, uA, cC e cp.
+"""
+
+from array import array
+from time import ticks_us, ticks_diff
+from event_log import EV_QUALITY, QUALITY_CHANNELS, QUALITY_DETECTORS
+
+CH_VBATT = 0
+CH_VLOAD = 1
+CH_ILOAD = 2
+CH_TEMP_INT = 3
+CH_TEMP_EXT = 4
+CH_HUM = 5
+N_CHANNELS = len(QUALITY_CHANNELS)
+
+# Detectores (bits da mascara de cada canal)
+Q_READ = 0x01
+Q_RANGE = 0x02
+Q_STUCK = 0x04
+Q_STEP = 0x08
+Q_CROSS = 0x10
+
+FLAG_IBATT = 0x40
+DETECTOR_SHIFT = 8
+
+# Detectores que apagam o valor gravado (DEGRAU e CRUZADO podem ser reais)
+SUPPRESS_DEFAULT = Q_READ | Q_RANGE | Q_STUCK
+
+# Chaves das linhas de main.py, na ordem dos canais
+FLOAT_KEYS = ("Vbatt", "Vload", "Iload_mA", "Temp_int", "Temp_ext", "Humidity")
+FIXED_KEYS = ("Vbatt_uV", "Vload_uV", "Iload_uA", "Temp_int_cC", "Temp_ext_cC", "Humidity_cp")
+FLOAT_IBATT = "Ibatt_mA"
+FIXED_IBATT = "Ibatt_uA"
+FIXED_SCALES = (1000000, 1000000, 1000, 100, 100, 100)
+
+# (minimo, maximo, degrau maximo por amostra ou None, amostras iguais
+#  para TRAVADO ou 0 = desligado). Vload/Iload nao tem TRAVADO: o INA
+# repete valores legitimamente com a carga parada.
+DEFAULT_LIMITS = (
+    (2.5, 4.5, 0.3, 30),       # Vbatt [V] (ADC sobreamostrado nunca repete por muito tempo)
+    (1.0, 6.5, None, 0),       # Vload [V] (0 V = INA sem resposta)
+    (-100.0, 3000.0, None, 0),  # Iload [mA]
+    (-40.0, 85.0, 5.0, 0),     # Temp_int [C]
+    (-40.0, 85.0, 5.0, 60),    # Temp_ext [C]
+    (0.0, 100.0, 20.0, 60),    # Humidity [%]
+)
+CROSS_MARGIN_V = 0.2     # Vload pode ficar ate isso abaixo de Vbatt
+CROSS_MIN_MA = 10.0      # so compara Vload x Vbatt com carga acima disso
+CROSS_TEMP_C = 20.0      # diferenca maxima Temp_int x Temp_ext
+
+
+class QualityMonitor:
+    """Detectores por canal sobre a linha de main.py antes da gravacao."""
+
+    def __init__(self, fixed=False, limits=DEFAULT_LIMITS, budget_us=500,
+                 suppress_mask=SUPPRESS_DEFAULT, events=None):
+        """
+        Args:
+            fixed: True para as linhas do pipeline inteiro (row_fixed)
+            limits: tupla por canal, ver DEFAULT_LIMITS
+            budget_us: tempo maximo de verificacao por amostra
+            suppress_mask: detectores que apagam o valor gravado (0 = so marca)
+            events: EventLog (opcional) para as transicoes
+        """
+        self.fixed = fixed
+        self.budget_us = budget_us
+        self.suppress_mask = suppress_mask
+        self.events = events
+        self.keys = FIXED_KEYS if fixed else FLOAT_KEYS
+        self.ibatt_key = FIXED_IBATT if fixed else FLOAT_IBATT
+        self.missing = None if fixed else float('nan')
+
+        # Limites na unidade da linha (inteiros no modo ponto fixo)
+        self._lo = []
+        self._hi = []
+        self._step = []
+        self._stuck_n = array('H', [lim[3] for lim in limits])
+        for i, (lo, hi, step, _) in enumerate(limits):
+            k = FIXED_SCALES[i] if fixed else 1
+            self._lo.append(int(lo * k) if fixed else lo)
+            self._hi.append(int(hi * k) if fixed else hi)
+            self._step.append(None if step is None else (int(step * k) if fixed else step))
+        k = FIXED_SCALES[CH_VBATT] if fixed else 1
+        self._cross_v = int(CROSS_MARGIN_V * k) if fixed else CROSS_MARGIN_V
+        self._cross_i = int(CROSS_MIN_MA * 1000) if fixed else CROSS_MIN_MA
+        self._cross_t = int(CROSS_TEMP_C * 100) if fixed else CROSS_TEMP_C
+
+        self._prev = [None] * N_CHANNELS
+        self._same = array('H', bytes(2 * N_CHANNELS))
+        self.masks = bytearray(N_CHANNELS)     # detectores ativos por canal
+        self._cross = bytearray(N_CHANNELS)    # CRUZADO da amostra atual
+        self.faults = array('I', bytes(4 * N_CHANNELS))  # amostras com algum detector
+        self._failed = 0                       # canais com leitura falha nesta amostra
+        self._next = 0                         # rodizio quando o orcamento estoura
+        self.flags = 0
+        self.overruns = 0
+        self.max_us = 0
+
+    def read_failed(self, *channels):
+        """Marca canais cuja leitura falhou nesta amostra (antes de check)."""
+        for ch in channels:
+            self._failed |= 1 << ch
+
+    def _value(self, row, ch):
+        v = row[self.keys[ch]]
+        if v is None or v != v:
+            return None
+        return v
+
+    def _check_channel(self, row, ch):
+        """Mascara do canal ch, sem o detector cruzado."""
+        mask = 0
+        if self._failed & (1 << ch):
+            mask |= Q_READ
+            self._same[ch] = 0
+            self._prev[ch] = None
+            return mask
+        v = self._value(row, ch)
+        if v is None:
+            # Indisponivel (ex.: sem HDC1080): nao e falha, zera o historico
+            self._same[ch] = 0
+            self._prev[ch] = None
+            return 0
+        if v < self._lo[ch] or v > self._hi[ch]:
+            mask |= Q_RANGE
+        prev = self._prev[ch]
+        if prev is not None:
+            step = self._step[ch]
+            if step is not None and (v - prev > step or prev - v > step):
+                mask |= Q_STEP
+            if v == prev:
+                if self._same[ch] < 0xFFFF:
+                    self._same[ch] += 1
+            else:
+                self._same[ch] = 0
+            n = self._stuck_n[ch]
+            if n and self._same[ch] >= n:
+                mask |= Q_STUCK
+        self._prev[ch] = v
+        return mask
+
+    def _set_mask(self, ch, mask):
+        """Atualiza a mascara do canal; evento QUALITY so na transicao."""
+        if mask != self.masks[ch]:
+            self.masks[ch] = mask
+            if self.events is not None:
+                self.events.log(EV_QUALITY, ch, mask)
+
+    def _check_cross(self, row):
+        """Coerencia entre canais; marca Vbatt e Temp_int."""
+        vb = self._value(row, CH_VBATT)
+        vl = self._value(row, CH_VLOAD)
+        il = self._value(row, CH_ILOAD)
+        bad = (vb is not None and vl is not None and il is not None
+               and il > self._cross_i and vl < vb - self._cross_v)
+        self._cross[CH_VBATT] = Q_CROSS if bad else 0
+        ti = self._value(row, CH_TEMP_INT)
+        te = self._value(row, CH_TEMP_EXT)
+        bad = (ti is not None and te is not None
+               and (ti - te > self._cross_t or te - ti > self._cross_t))
+        self._cross[CH_TEMP_INT] = Q_CROSS if bad else 0
+
+    def check(self, row):
+        """
+        Roda os detectores sobre a linha e suprime os canais suspeitos.
+
+        Args:
+            row: dict da amostra (row ou row_fixed de main.py), alterado
+
+        Returns:
+            flags (u16) da amostra
+        """
+        t0 = ticks_us()
+        self._check_cross(row)
+        ch = self._next
+        done = 0
+        checked = 0
+        while done < N_CHANNELS:
+            self._set_mask(ch, self._check_channel(row, ch) | self._cross[ch])
+            checked |= 1 << ch
+            ch = (ch + 1) % N_CHANNELS
+            done += 1
+            if done < N_CHANNELS and ticks_diff(ticks_us(), t0) > self.budget_us:
+                self.overruns += 1
+                break
+        self._next = ch
+        # Canais que ficaram para a proxima amostra: leitura falha e
+        # CRUZADO sao desta amostra e custam pouco, entao valem ja (o
+        # valor padrao de uma leitura falha nunca sai sem marca); LEITURA
+        # da amostra anterior nao vale mais se a leitura desta deu certo
+        while done < N_CHANNELS:
+            if self._failed & (1 << ch):
+                self._set_mask(ch, self._check_channel(row, ch) | self._cross[ch])
+                checked |= 1 << ch
+            else:
+                self._set_mask(ch, (self.masks[ch] & ~(Q_READ | Q_CROSS)) | self._cross[ch])
+            ch = (ch + 1) % N_CHANNELS
+            done += 1
+        self._failed &= ~checked
+
+        flags = 0
+        suppressed_inputs = False
+        for ch in range(N_CHANNELS):
+            mask = self.masks[ch]
+            if not mask:
+                continue
+            self.faults[ch] += 1
+            flags |= (1 << ch) | (mask << DETECTOR_SHIFT)
+            if mask & self.suppress_mask:
+                row[self.keys[ch]] = self.missing
+                if ch <= CH_ILOAD:
+                    suppressed_inputs = True
+        if suppressed_inputs:
+            row[self.ibatt_key] = self.missing
+            flags |= FLAG_IBATT
+        self.flags = flags
+        us = ticks_diff(ticks_us(), t0)
+        if us > self.max_us:
+            self.max_us = us
+        return flags
+
+    def summary(self):
+        """'Vbatt ok (0), Temp_ext TRAVADO (120), ...' (amostras marcadas)"""
+        parts = []
+        for ch in range(N_CHANNELS):
+            mask = self.masks[ch]
+            state = "|".join(n for i, n in enumerate(QUALITY_DETECTORS) if mask & (1 << i)) or "ok"
+            parts.append("{} {} ({})".format(QUALITY_CHANNELS[ch], state, self.faults[ch]))
+        return ", ".join(parts)
@@ -0,0 +1,201 @@
+# soc_forecast.py
+"""
+Previsao de autonomia (time-to-empty / time-to-full)
+----------------------------------------------------
+Estimadores incrementais, O(1) por amostra, sobre a saida do
+BatteryGauge. Para cada horizonte (constante de tempo tau) mantem:
+
+    - media e variancia exponenciais da corrente liquida da bateria
+    - regressao linear exponencial do SoC no tempo (inclinacao %/s)
+
+Todo o estado fica em um array('f') de tamanho fixo (6 valores por
+horizonte); nada cresce com o tempo de operacao. O peso de cada
+amostra e a = dt / (tau + dt), entao intervalos irregulares e
+mudancas de SAMPLE_INTERVAL sao tratados sem reconfigurar.
+
+Previsao pontual: corrente media do horizonte principal. Faixa de
+confianca: envelope de todos os horizontes (media +- z * erro padrao
+da media) e das taxas implicitas pelas inclinacoes do SoC, que
+incluem as correcoes de OCV. Sem limite (corrente podendo ser zero
+ou de sinal oposto) a borda fica None ("inf"); valores nao finitos
+(corrente inf/NaN, estado saturado) tambem viram None, nunca inf.
+
+    fc = SocForecaster(capacity_mAh=15000)
+    fc.update(soc_pct, ibatt_mA, now_s)     # a cada amostra
+    fc.tte_s, fc.tte_lo_s, fc.tte_hi_s      # segundos ou None
+"""
+
+from array import array
+from math import sqrt
+
+# Constantes de tempo dos horizontes [s]
+HORIZONS_S = (300, 1800, 7200)
+PRIMARY = 1                 # horizonte da previsao pontual
+CONFIDENCE_Z = 2.0          # largura da faixa (~95% para ruido gaussiano)
+MAX_FORECAST_S = 30 * 86400  # acima disso a previsao vira None
+MIN_SAMPLES = 3             # amostras antes de usar as inclinacoes
+
+_INF = float("inf")
+
+# Posicoes no bloco de cada horizonte
+_I_MEAN = 0   # corrente media [mA], positiva = descarga
+_I_VAR = 1    # variancia da corrente [mA^2]
+_T_MEAN = 2   # tempo medio ponderado relativo a ultima amostra [s] (<= 0)
+_S_MEAN = 3   # SoC medio ponderado [%]
+_T_VAR = 4    # variancia do tempo [s^2]
+_TS_COV = 5   # covariancia tempo x SoC [s*%]
+_STRIDE = 6
+
+
+def fmt_duration(seconds):
+    """Segundos -> texto curto (min, h ou dias); None => "inf"."""
+    if seconds is None:
+        return "inf"
+    if seconds < 3600:
+        return "{:.0f} min".format(seconds / 60.0)
+    if seconds < 172800:
+        return "{:.1f} h".format(seconds / 3600.0)
+    return "{:.1f} d".format(seconds / 86400.0)
+
+
+class SocForecaster:
+    """
+    Tempo ate vazio/cheio com faixa de confianca, atualizado a cada amostra.
+    """
+
+    def __init__(self, capacity_mAh=15000.0, horizons_s=HORIZONS_S, primary=PRIMARY,
+                 z=CONFIDENCE_Z, max_gap_s=900.0):
+        """
+        Args:
+            capacity_mAh: capacidade usada para converter SoC em carga
+            horizons_s: constantes de tempo dos estimadores [s]
+            primary: indice do horizonte da previsao pontual
+            z: multiplicador do erro padrao na faixa de confianca
+            max_gap_s: intervalo acima disso (ou tempo voltando) reinicia
+        """
+        self.capacity_mAh = capacity_mAh
+        self.horizons = array('f', horizons_s)
+        self.primary = min(primary, len(horizons_s) - 1)
+        self.z = z
+        self.max_gap_s = max_gap_s
+        self._state = array('f', bytes(4 * _STRIDE * len(horizons_s)))
+        self._alpha = array('f', bytes(4 * len(horizons_s)))
+        self.reset()
+
+    def reset(self):
+        """Esquece o historico (reset, salto de tempo)."""
+        self._last_t = None
+        self.samples = 0
+        self.rate_mA = None       # corrente media do horizonte principal
+        self.slope_pct_h = None   # inclinacao do SoC no horizonte principal
+        self.tte_s = self.tte_lo_s = self.tte_hi_s = None
+        self.ttf_s = self.ttf_lo_s = self.ttf_hi_s = None
+
+    def update(self, soc_pct, current_mA, now_s):
+        """
+        Incorpora uma amostra e recalcula as previsoes.
+
+        Args:
+            soc_pct: SoC do gauge [%] (None/NaN => amostra ignorada)
+            current_mA: corrente liquida da bateria [mA], positiva = descarga
+                (NaN/inf => amostra ignorada)
+            now_s: timestamp [s]
+        """
+        if soc_pct is None or soc_pct != soc_pct or current_mA != current_mA \
+                or abs(current_mA) == _INF:
+            return
+        s = self._state
+        dt = 0.0 if self._last_t is None else now_s - self._last_t
+        if self._last_t is None or dt <= 0.0 or dt > self.max_gap_s:
+            if self._last_t is not None and dt == 0.0:
+                return   # mesma amostra repetida
+            self.reset()
+            for h in range(len(self.horizons)):
+                k = h * _STRIDE
+                s[k + _I_MEAN] = current_mA
+                s[k + _I_VAR] = 0.0
+                s[k + _T_MEAN] = 0.0
+                s[k + _S_MEAN] = soc_pct
+                s[k + _T_VAR] = 0.0
+                s[k + _TS_COV] = 0.0
+                self._alpha[h] = 1.0
+        else:
+            for h in range(len(self.horizons)):
+                k = h * _STRIDE
+                a = dt / (self.horizons[h] + dt)
+                b = 1.0 - a
+                self._alpha[h] = a
+                d = current_mA - s[k + _I_MEAN]
+                s[k + _I_MEAN] += a * d
+                s[k + _I_VAR] = b * (s[k + _I_VAR] + a * d * d)
+                # Eixo do tempo acompanha a ultima amostra (t = 0): os
+                # valores ficam na escala de tau, sem perder precisao em float32
+                dx = dt - s[k + _T_MEAN]
+                dy = soc_pct - s[k + _S_MEAN]
+                s[k + _T_MEAN] += a * dx - dt
+                s[k + _S_MEAN] += a * dy
+                s[k + _T_VAR] = b * (s[k + _T_VAR] + a * dx * dx)
+                s[k + _TS_COV] = b * (s[k + _TS_COV] + a * dx * dy)
+        self._last_t = now_s
+        self.samples += 1
+        self._forecast(soc_pct)
+
+    def update_fixed(self, soc_mp, i_uA, now_ds):
+        """Mesmo que update() com as unidades do pipeline inteiro (None = ignora)."""
+        if soc_mp is None or i_uA is None:
+            return
+        self.update(soc_mp / 1000.0, i_uA / 1000.0, now_ds / 10.0)
+
+    def _forecast(self, soc_pct):
+        s = self._state
+        pct_to_mA = self.capacity_mAh * 36.0   # %/s -> mA
+        k = self.primary * _STRIDE
+        rate = s[k + _I_MEAN]
+        lo = hi = rate
+        slope = None
+        for h in range(len(self.horizons)):
+            k = h * _STRIDE
+            a = self._alpha[h]
+            # Erro padrao da media exponencial: var * a / (2 - a)
+            margin = self.z * sqrt(max(0.0, s[k + _I_VAR]) * a / (2.0 - a))
+            m = s[k + _I_MEAN]
+            lo = min(lo, m - margin)
+            hi = max(hi, m + margin)
+            if self.samples >= MIN_SAMPLES and s[k + _T_VAR] > 0.0:
+                sl = s[k + _TS_COV] / s[k + _T_VAR]
+                if h == self.primary:
+                    slope = sl
+                lo = min(lo, -sl * pct_to_mA)
+                hi = max(hi, -sl * pct_to_mA)
+        self.rate_mA = rate
+        self.slope_pct_h = None if slope is None else slope * 3600.0
+
+        remaining = max(0.0, soc_pct) * self.capacity_mAh / 100.0
+        room = max(0.0, self.capacity_mAh - remaining)
+        # Descarga: maior corrente => menor tempo
+        self.tte_s = self._hours(remaining, rate)
+        self.tte_lo_s = self._hours(remaining, hi)
+        self.tte_hi_s = self._hours(remaining, lo)
+        self.ttf_s = self._hours(room, -rate)
+        self.ttf_lo_s = self._hours(room, -lo)
+        self.ttf_hi_s = self._hours(room, -hi)
+
+    @staticmethod
+    def _hours(charge_mAh, rate_mA):
+        """Tempo [s] para consumir charge_mAh a rate_mA; None sem limite."""
+        if not rate_mA > 0.0:
+            return None
+        t = charge_mAh * 3600.0 / rate_mA
+        # Comparacao invertida: NaN e inf tambem viram None
+        return t if t <= MAX_FORECAST_S else None
+
+    def summary(self):
+        """Uma linha para estatisticas e comandos."""
+        if self.rate_mA is None:
+            return "sem dados"
+        if self.rate_mA >= 0.0:
+            what, t, lo, hi = "vazio", self.tte_s, self.tte_lo_s, self.tte_hi_s
+        else:
+            what, t, lo, hi = "cheio", self.ttf_s, self.ttf_lo_s, self.ttf_hi_s
+        return "{} em {} ({} .. {}), {:.1f} mA".format(
+            what, fmt_duration(t), fmt_duration(lo), fmt_duration(hi), self.rate_mA)
@@ -0,0 +1,225 @@
+# telemetry.py
+"""
+Telemetria binaria para o computador de bordo
+---------------------------------------------
+Registros compactos em inteiros (unidades de fixed_point.py), enviados
+nos mesmos quadros com CRC32 de log_transfer.py. A fila de transmissao
+e limitada: se o PC nao le, os quadros mais antigos sao descartados e
+o loop nunca espera pela porta.
+
+Todo payload comeca com seq (u16) para o PC detectar perdas.
+
+    SAMPLE  seq, ts_ds, Vbatt_uV, Vload_uV, Iload_uA, Ibatt_uA, SoC_mp,
+            Temp_int_cC, Temp_ext_cC, Humidity_cp, flags de qualidade
+            (sensor_quality.py; canais suprimidos chegam como None)
+    GAUGE   seq, ts_ds, SoC_mp, capacidade_mAh, carga_restante_mAh, flags
+    HEALTH  seq, ts_ds, amostras, erros, mem_livre, loop_medio_ms,
+            quadros_descartados, arquivo_atual, linhas_no_arquivo
+    ALARM   seq, ts_ds, codigo, valor + texto
+    FORECAST seq, ts_ds, tte_s, tte_lo_s, tte_hi_s, ttf_s, ttf_lo_s,
+            ttf_hi_s, corrente_media_uA, inclinacao_SoC_mp_h
+            (ver soc_forecast.py; sem previsao ou borda nao finita
+            => NAN_U32)
+    HEAP    seq, ts_ds, vivo, pico, livre, maior_bloco, pausa_us,
+            pausa_max_us, coletas, forcadas, automaticas, threshold,
+            tendencia_B_h (ver heap_monitor.py; bytes)
+
+Valores indisponiveis usam sentinelas (NAN_I32/NAN_I16/NAN_U16) e
+voltam como None em decode().
+
+O receptor do PC esta em Ferramentas/telemetry_client.py.
+"""
+
+import struct
+from log_transfer import encode_frame
+
+TLM_SAMPLE = 0x21
+TLM_GAUGE = 0x22
+TLM_HEALTH = 0x23
+TLM_ALARM = 0x24
+TLM_FORECAST = 0x25
+TLM_HEAP = 0x26
+
+SAMPLE_FMT = "<HIiiiiihhHH"
+GAUGE_FMT = "<HIiIiB"
+HEALTH_FMT = "<HIIHIHHHI"
+ALARM_FMT = "<HIBi"
+FORECAST_FMT = "<HIIIIIIIii"
+HEAP_FMT = "<HIIIIIIIHHHIi"
+
+NAN_I32 = -0x80000000
+NAN_I16 = -0x8000
+NAN_U16 = 0xFFFF
+NAN_U32 = 0xFFFFFFFF
+
+_INF = float("inf")
+
+GAUGE_FLAG_INITED = 0x01
+
+# Codigos de alarme
+ALARM_LOOP_SLOW = 1
+ALARM_SENSOR = 2
+ALARM_ERROR = 3
+ALARM_CRITICAL = 4
+ALARM_LOW_SOC = 5
+
+RECORDS = {
+    TLM_SAMPLE: ("sample", SAMPLE_FMT,
+                 ("seq", "timestamp_ds", "Vbatt_uV", "Vload_uV", "Iload_uA",
+                  "Ibatt_uA", "SoC_mp", "Temp_int_cC", "Temp_ext_cC", "Humidity_cp",
+                  "quality")),
+    TLM_GAUGE: ("gauge", GAUGE_FMT,
+                ("seq", "timestamp_ds", "SoC_mp", "capacity_mAh", "remaining_mAh", "flags")),
+    TLM_HEALTH: ("health", HEALTH_FMT,
+                 ("seq", "timestamp_ds", "samples", "errors", "mem_free", "loop_avg_ms",
+                  "dropped", "file_index", "line_count")),
+    TLM_ALARM: ("alarm", ALARM_FMT, ("seq", "timestamp_ds", "code", "value")),
+    TLM_FORECAST: ("forecast", FORECAST_FMT,
+                   ("seq", "timestamp_ds", "tte_s", "tte_lo_s", "tte_hi_s", "ttf_s",
+                    "ttf_lo_s", "ttf_hi_s", "rate_uA", "slope_mp_h")),
+    TLM_HEAP: ("heap", HEAP_FMT,
+               ("seq", "timestamp_ds", "live", "peak", "free", "largest", "pause_us",
+                "pause_max_us", "collections", "forced", "auto", "threshold", "trend_B_h")),
+}
+
+_SENTINELS = {"i": NAN_I32, "h": NAN_I16, "H": NAN_U16, "I": NAN_U32}
+
+
+def _clip16(value, nan):
+    if value is None:
+        return nan
+    if nan == NAN_U16:
+        return max(0, min(0xFFFE, value))
+    return max(-0x7FFF, min(0x7FFF, value))
+
+
+def _secs(value):
+    # None, NaN e inf => sentinela (nunca publicar "inf" como numero)
+    if value is None or value != value or value == _INF:
+        return NAN_U32
+    return max(0, min(int(value), NAN_U32 - 1))
+
+
+def _i32(value):
+    if value is None or value != value or abs(value) == _INF:
+        return NAN_I32
+    return max(-0x7FFFFFFF, min(0x7FFFFFFF, int(value)))
+
+
+def decode(ftype, payload):
+    """
+    Converte um quadro de telemetria em dict (lado do PC).
+    Retorna None para tipos desconhecidos.
+    """
+    spec = RECORDS.get(ftype)
+    if spec is None:
+        return None
+    kind, fmt, names = spec
+    size = struct.calcsize(fmt)
+    values = struct.unpack(fmt, payload[:size])
+    record = {"type": kind}
+    for name, code, value in zip(names, fmt[1:], values):
+        record[name] = None if _SENTINELS.get(code) == value else value
+    if ftype == TLM_ALARM:
+        record["text"] = bytes(payload[size:]).decode()
+    return record
+
+
+class Telemetry:
+    """Fila de quadros limitada, descartando os mais antigos."""
+
+    def __init__(self, port, queue_len=16, max_per_flush=8):
+        """
+        Args:
+            port: porta de log_transfer (UsbPort/UartPort) com can_write()
+            queue_len: quadros mantidos enquanto o PC nao le
+            max_per_flush: quadros enviados por chamada de flush()
+        """
+        self.port = port
+        self.max_per_flush = max_per_flush
+        self._queue = [None] * queue_len
+        self._head = 0
+        self._count = 0
+        self._seq = 0
+
+        self.sent = 0
+        self.dropped = 0
+
+    def _push(self, ftype, payload):
+        q = self._queue
+        n = len(q)
+        if self._count == n:
+            # Fila cheia: descarta o mais antigo
+            q[self._head] = None
+            self._head = (self._head + 1) % n
+            self._count -= 1
+            self.dropped += 1
+        q[(self._head + self._count) % n] = encode_frame(ftype, payload)
+        self._count += 1
+        self._seq = (self._seq + 1) & 0xFFFF
+
+    def sample(self, ts_ds, vbatt_uV, vload_uV, iload_uA, ibatt_uA, soc_mp,
+               temp_int_cC, temp_ext_cC, hum_cp, quality=0):
+        """Registro de uma amostra (None => indisponivel)."""
+        self._push(TLM_SAMPLE, struct.pack(
+            SAMPLE_FMT, self._seq, ts_ds, _i32(vbatt_uV), _i32(vload_uV),
+            _i32(iload_uA), _i32(ibatt_uA), _i32(soc_mp),
+            _clip16(temp_int_cC, NAN_I16), _clip16(temp_ext_cC, NAN_I16),
+            _clip16(hum_cp, NAN_U16), quality & 0xFFFF))
+
+    def gauge(self, ts_ds, soc_mp, capacity_mAh, inited):
+        """Estado do battery gauge."""
+        if soc_mp is None:
+            soc_mp = remaining = NAN_I32
+        else:
+            remaining = (soc_mp * capacity_mAh) // 100000
+        self._push(TLM_GAUGE, struct.pack(
+            GAUGE_FMT, self._seq, ts_ds, soc_mp, capacity_mAh, remaining,
+            GAUGE_FLAG_INITED if inited else 0))
+
+    def health(self, ts_ds, samples, errors, mem_free, loop_avg_ms, file_index, line_count):
+        """Saude do sistema."""
+        self._push(TLM_HEALTH, struct.pack(
+            HEALTH_FMT, self._seq, ts_ds, samples, min(errors, 0xFFFF), mem_free,
+            min(loop_avg_ms, 0xFFFF), min(self.dropped, 0xFFFF), file_index, line_count))
+
+    def alarm(self, ts_ds, code, value=0, text=""):
+        """Alarme com codigo, valor e texto curto."""
+        self._push(TLM_ALARM, struct.pack(ALARM_FMT, self._seq, ts_ds, code, value)
+                   + text[:60].encode())
+
+    def forecast(self, ts_ds, fc):
+        """Previsao de autonomia de um SocForecaster."""
+        self._push(TLM_FORECAST, struct.pack(
+            FORECAST_FMT, self._seq, ts_ds,
+            _secs(fc.tte_s), _secs(fc.tte_lo_s), _secs(fc.tte_hi_s),
+            _secs(fc.ttf_s), _secs(fc.ttf_lo_s), _secs(fc.ttf_hi_s),
+            _i32(None if fc.rate_mA is None else fc.rate_mA * 1000),
+            _i32(None if fc.slope_pct_h is None else fc.slope_pct_h * 1000)))
+
+    def heap(self, ts_ds, hm):
+        """Estado do heap de um HeapMonitor."""
+        self._push(TLM_HEAP, struct.pack(
+            HEAP_FMT, self._seq, ts_ds, hm.live, hm.peak, hm.free, _secs(hm.largest),
+            _secs(hm.pause_us), _secs(hm.pause_max_us), min(hm.collections, 0xFFFF),
+            min(hm.forced, 0xFFFF), min(hm.auto, 0xFFFF), _secs(hm.threshold),
+            _i32(hm.trend_Bph)))
+
+    def flush(self):
+        """
+        Envia quadros enquanto a porta aceita, sem bloquear.
+
+        Returns:
+            quadros ainda na fila
+        """
+        q = self._queue
+        n = len(q)
+        budget = self.max_per_flush
+        while self._count and budget and self.port.can_write():
+            self.port.write(q[self._head])
+            q[self._head] = None
+            self._head = (self._head + 1) % n
+            self._count -= 1
+            self.sent += 1
+            budget -= 1
+        return self._count
@@ -0,0 +1,275 @@
+# time_sync.py
+"""
+Relogio UTC a partir do tempo relativo do Pico
+----------------------------------------------
+O TimestampManager conta segundos desde o primeiro boot e so atravessa
+resets pelo checkpoint: depois de uma queda o tempo retoma do ultimo
+checkpoint e o tempo desligado some. Para casar as medidas com a hora
+das imagens, o mini-computador (relogio por NTP) manda pontos de
+sincronia, numa troca de ida e volta como a do NTP
+(Ferramentas/node_ctl.py --sync-time):
+
+    PC: "clock now"   t1 -> t4   o Pico responde ts (ds, get_timestamp_ds)
+    PC: "clock sync <ts_ds> <utc_ms = (t1+t4)/2> <erro_ms = (t4-t1)/2 + 50>"
+
+Cada ponto vai para time_sync.csv com o indice do arquivo de log e o seq
+do evento BOOT do boot atual: cada boot abre uma "epoca" com o seu
+deslocamento, e o PC (Ferramentas/time_align.py) ajusta cada epoca por
+minimos quadrados. No Pico, o modelo da epoca atual converte:
+
+    utc = utc_ref + (ts - ts_ref) * (1 + deriva)
+
+A deriva do cristal (ppm) sai de dois pontos de sincronia da mesma epoca
+separados o bastante para a incerteza somada valer menos que
+DRIFT_TOL_PPM; ela sobrevive aos resets (ultima linha do arquivo). Cada
+sincronia acerta o RTC; no boot, um RTC ainda valido (ano >=
+RTC_MIN_YEAR, ex.: reset por watchdog) vira o primeiro ponto da epoca.
+
+Tudo em inteiros (ds, ms): o float do RP2040 tem 24 bits de mantissa e
+nao representa segundos Unix.
+"""
+
+import os
+from fixed_point import fmt_fixed
+from event_log import EV_TIME_SYNC
+from write_stats import count_bytes, W_TIME
+
+SYNC_FILE = "time_sync.csv"
+SYNC_HEADER = "kind,log_index,boot_seq,ts,utc,err_ms,drift_ppm\n"
+SYNC_MAX_BYTES = 8192     # acima disso, compacta mantendo a metade final
+DRIFT_TOL_PPM = 10        # incerteza maxima aceita na estimativa da deriva
+DRIFT_MAX_PPM = 500       # cristal bom fica em +-50; alem disso e erro
+RTC_MIN_YEAR = 2024
+RTC_ERR_MS = 1000         # incerteza do ponto tirado do RTC no boot
+
+
+# -- calendario (algoritmo de H. Hinnant, so inteiros) ------------------
+
+def days_from_civil(y, m, d):
+    """Dias desde 1970-01-01."""
+    if m <= 2:
+        y -= 1
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m - 3 if m > 2 else m + 9) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def civil_from_days(z):
+    """(ano, mes, dia) de dias desde 1970-01-01."""
+    z += 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    y = yoe + era * 400
+    return (y + 1 if m <= 2 else y), m, d
+
+
+def utc_to_datetime(utc_ms):
+    """Tupla de machine.RTC.datetime(): (a, m, d, dia da semana, h, min, s, 0)."""
+    s = utc_ms // 1000
+    days = s // 86400
+    s -= days * 86400
+    y, m, d = civil_from_days(days)
+    return (y, m, d, (days + 3) % 7, s // 3600, (s // 60) % 60, s % 60, 0)
+
+
+def datetime_to_utc(dt):
+    """ms Unix de uma tupla de machine.RTC.datetime()."""
+    return ((days_from_civil(dt[0], dt[1], dt[2]) * 86400
+             + dt[4] * 3600 + dt[5] * 60 + dt[6]) * 1000)
+
+
+def fmt_utc(utc_ms):
+    """'2026-10-19T12:00:00.250Z'"""
+    dt = utc_to_datetime(utc_ms)
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.{:03d}Z".format(
+        dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], utc_ms % 1000)
+
+
+class TimeSync:
+    """Pontos de sincronia, modelo de deriva e conversao para UTC."""
+
+    def __init__(self, clock, log_index=0, boot_seq=0, rtc=None, events=None,
+                 filename=SYNC_FILE):
+        """
+        Args:
+            clock: funcao sem argumentos -> ts em ds (TimestampManager.get_timestamp_ds)
+            log_index: indice do arquivo de log aberto neste boot
+            boot_seq: seq do evento BOOT deste boot (ResetLogger.boot_seq)
+            rtc: machine.RTC() (None = sem RTC)
+            events: EventLog para TIME_SYNC (opcional)
+        """
+        self.clock = clock
+        self.log_index = log_index
+        self.boot_seq = boot_seq
+        self.rtc = rtc
+        self.events = events
+        self.filename = filename
+        self.drift_ppm = 0.0
+        self.syncs = 0            # sincronias neste boot
+        self.err_ms = None        # incerteza do ultimo ponto
+        self.correction_ms = None  # erro do modelo na ultima sincronia
+        self._ref = None          # (ts_ds, utc_ms) ultimo ponto da epoca
+        self._anchor = None       # (ts_ds, utc_ms, err_ms) primeira sincronia da epoca
+
+        self._load_drift()
+        now = clock()
+        self._append("boot", now, None, 0)
+        utc = self._rtc_utc()
+        if utc is not None:
+            self._ref = (now, utc)
+            self.err_ms = RTC_ERR_MS
+            self._append("rtc", now, utc, RTC_ERR_MS)
+
+    # -- arquivo ---------------------------------------------------------
+
+    def _load_drift(self):
+        """Deriva da ultima linha do arquivo (o cristal e o mesmo entre boots)."""
+        try:
+            with open(self.filename, "rb") as f:
+                f.seek(0, 2)
+                size = f.tell()
+                f.seek(max(0, size - 256))
+                tail = f.read()
+        except OSError:
+            return
+        for line in reversed(tail.split(b"\n")):
+            parts = line.split(b",")
+            if len(parts) == 7 and parts[0] != b"kind":
+                try:
+                    d = float(parts[6])
+                except ValueError:
+                    continue
+                if abs(d) <= DRIFT_MAX_PPM:
+                    self.drift_ppm = d
+                return
+
+    def _append(self, kind, ts_ds, utc_ms, err_ms):
+        line = "{},{},{},{},{},{},{:.3f}\n".format(
+            kind, self.log_index, self.boot_seq, fmt_fixed(ts_ds, 10, 1),
+            fmt_fixed(utc_ms, 1000, 3), err_ms, self.drift_ppm)
+        try:
+            size = os.stat(self.filename)[6]
+        except OSError:
+            size = 0
+        try:
+            if size > SYNC_MAX_BYTES:
+                self._compact()   # ja grava o cabecalho
+            with open(self.filename, "a") as f:
+                if size == 0:
+                    f.write(SYNC_HEADER)
+                f.write(line)
+        except OSError as e:
+            print("AVISO - Sincronia nao gravada: {}".format(e))
+            return
+        count_bytes(W_TIME, len(line))
+
+    def _compact(self):
+        """
+        Reescreve so a metade final (linhas inteiras) com cabecalho.
+        O arquivo encolhe: o offload_client o reconhece pelo CRC32 do
+        LIST (log_transfer.REWRITTEN_PREFIXES) e troca a copia local.
+        """
+        tmp = self.filename + ".tmp"
+        with open(self.filename, "rb") as f:
+            f.seek(0, 2)
+            f.seek(f.tell() - SYNC_MAX_BYTES // 2)
+            tail = f.read()
+        tail = tail[tail.find(b"\n") + 1:]
+        with open(tmp, "wb") as f:
+            f.write(SYNC_HEADER.encode())
+            f.write(tail)
+        os.rename(tmp, self.filename)
+        count_bytes(W_TIME, len(SYNC_HEADER) + len(tail))
+
+    # -- sincronia -------------------------------------------------------
+
+    def sync(self, ts_ds, utc_ms, err_ms):
+        """
+        Registra um ponto (ts do Pico em ds, UTC em ms Unix, incerteza em
+        ms), atualiza a deriva e acerta o RTC.
+
+        Returns:
+            texto de estado para o comando clock
+        """
+        if err_ms < 0:
+            raise ValueError("incerteza negativa")
+        correction = 0
+        model = self.to_utc(ts_ds)
+        if model is not None:
+            correction = utc_ms - model
+        self.correction_ms = correction
+        if self._anchor is None:
+            self._anchor = (ts_ds, utc_ms, err_ms)
+        else:
+            self._estimate_drift(ts_ds, utc_ms, err_ms)
+        self._ref = (ts_ds, utc_ms)
+        self.err_ms = err_ms
+        self.syncs += 1
+        self._append("sync", ts_ds, utc_ms, err_ms)
+        self.set_rtc()
+        if self.events is not None:
+            self.events.log(EV_TIME_SYNC, err_ms, correction, force=True)
+        return "ok correcao {} ms, deriva {:.1f} ppm".format(correction, self.drift_ppm)
+
+    def _estimate_drift(self, ts_ds, utc_ms, err_ms):
+        t0, u0, e0 = self._anchor
+        span_ms = (ts_ds - t0) * 100
+        if span_ms <= 0 or (e0 + err_ms) * 1000000 > DRIFT_TOL_PPM * span_ms:
+            return   # pontos proximos demais para a incerteza
+        d = ((utc_ms - u0) - span_ms) * 1000000 / span_ms
+        if abs(d) > DRIFT_MAX_PPM:
+            print("AVISO - Deriva de {:.0f} ppm descartada (relogio do PC?)".format(d))
+            return
+        self.drift_ppm = d
+
+    def to_utc(self, ts_ds):
+        """UTC (ms Unix) de um ts deste boot; None sem ponto de referencia."""
+        if self._ref is None:
+            return None
+        t0, u0 = self._ref
+        dt = ts_ds - t0
+        return u0 + dt * 100 + int(dt * self.drift_ppm / 10000.0)
+
+    def now(self):
+        """UTC atual (ms Unix) ou None."""
+        return self.to_utc(self.clock())
+
+    # -- RTC -------------------------------------------------------------
+
+    def _rtc_utc(self):
+        if self.rtc is None:
+            return None
+        try:
+            dt = self.rtc.datetime()
+        except Exception:
+            return None
+        if dt[0] < RTC_MIN_YEAR:
+            return None   # RTC zerado (queda de energia)
+        return datetime_to_utc(dt)
+
+    def set_rtc(self):
+        """Acerta o RTC pelo modelo (resolucao de 1 s)."""
+        utc = self.now()
+        if self.rtc is None or utc is None:
+            return
+        try:
+            self.rtc.datetime(utc_to_datetime(utc))
+        except Exception as e:
+            print("AVISO - RTC nao acertado: {}".format(e))
+
+    # -- relatorio -------------------------------------------------------
+
+    def summary(self):
+        """'2026-10-19T12:00:00.250Z +-35 ms, deriva 3.2 ppm, 2 sincronias'"""
+        utc = self.now()
+        if utc is None:
+            return "sem sincronia neste boot (deriva {:.1f} ppm)".format(self.drift_ppm)
+        return "{} +-{} ms, deriva {:.1f} ppm, {} sincronias".format(
+            fmt_utc(utc), self.err_ms, self.drift_ppm, self.syncs)
@@ -5,7 +5,8 @@ Salva o ultimo timestamp em arquivo para continuar de onde parou.
 """
 
 import os
-from time import ticks_ms
+from time import ticks_ms, ticks_diff
+from write_stats import count_bytes, W_CHECKPOINT
 
 class TimestampManager:
     """Gerencia timestamp contínuo mesmo após resets."""
@@ -16,6 +17,7 @@ class TimestampManager:
         """Inicializa o gerenciador de timestamp."""
         self.start_ticks = ticks_ms()
         self.offset = self._load_last_timestamp()
+        self._init_fixed()
         
         if self.offset > 0:
             print("AVISO - Sistema foi resetado!")
@@ -52,14 +54,37 @@ class TimestampManager:
         elapsed = (ticks_ms() - self.start_ticks) / 1000.0
         return self.offset + elapsed
     
+    def _init_fixed(self):
+        """Estado do relogio inteiro em decisegundos."""
+        self._offset_ds = int(self.offset * 10)
+        self._elapsed_ds = 0
+        self._rem_ms = 0
+        self._last_ticks = self.start_ticks
+
+    def get_timestamp_ds(self):
+        """
+        Retorna timestamp atual em decisegundos (inteiro, sem float).
+        Acumula ticks_diff a cada chamada, entao sobrevive ao wrap do
+        ticks_ms (chamar ao menos uma vez a cada poucos dias).
+        """
+        now = ticks_ms()
+        self._rem_ms += ticks_diff(now, self._last_ticks)
+        self._last_ticks = now
+        step = self._rem_ms // 100
+        self._elapsed_ds += step
+        self._rem_ms -= step * 100
+        return self._offset_ds + self._elapsed_ds
+
     def save_checkpoint(self, current_timestamp):
         """
         Salva checkpoint do timestamp atual.
         Chame periodicamente para não perder muito tempo em caso de reset.
         """
         try:
+            text = "{:.2f}".format(current_timestamp)
             with open(self.TIMESTAMP_FILE, "w") as f:
-                f.write("{:.2f}".format(current_timestamp))
+                f.write(text)
+            count_bytes(W_CHECKPOINT, len(text))
         except Exception as e:
             print("AVISO - Erro ao salvar checkpoint: {}".format(e))
     
@@ -73,6 +98,7 @@ class TimestampManager:
                 os.remove(self.TIMESTAMP_FILE)
             self.offset = 0.0
             self.start_ticks = ticks_ms()
+            self._init_fixed()
             print("Timestamp resetado para zero")
         except Exception as e:
             print("ERRO ao resetar timestamp: {}".format(e))
\ No newline at end of file
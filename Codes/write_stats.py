@@ -0,0 +1,67 @@
+# write_stats.py
+"""
+Bytes gravados na flash por subsistema
+--------------------------------------
+Cada ponto que grava arquivo chama count_bytes(subsistema, n) uma vez
+por abertura (sessao de gravacao). Os contadores vivem so na RAM e
+recomecam a cada boot; servem para saber quem gasta a flash e com que
+frequencia. O littlefs apaga blocos por sessao, nao por byte: um
+registro de 60 bytes pode custar um bloco de 4 KB copiado, entao
+"gravacoes" importa tanto quanto "bytes". A conta em blocos apagados
+vem da emulacao no PC (Ferramentas/flash_wear.py).
+
+    count_bytes(W_CSV, len(data))
+    summary(segundos_desde_o_boot)  -> "csv 12.3 KB/205, ... | total 14.0 KB (1.2 MB/dia)"
+"""
+
+W_CSV = 0
+W_COLUMN = 1
+W_CHECKPOINT = 2
+W_EVENTS = 3
+W_RETENTION = 4
+W_BURST = 5
+W_MANIFEST = 6
+W_TIME = 7
+
+NAMES = ("csv", "colunar", "checkpoint", "eventos", "retencao", "rajada", "manifesto", "relogio")
+
+bytes_written = [0] * len(NAMES)
+writes = [0] * len(NAMES)
+
+
+def count_bytes(subsystem, nbytes):
+    """Soma uma sessao de gravacao de nbytes ao subsistema."""
+    bytes_written[subsystem] += nbytes
+    writes[subsystem] += 1
+
+
+def reset():
+    for i in range(len(NAMES)):
+        bytes_written[i] = 0
+        writes[i] = 0
+
+
+def total():
+    """Bytes gravados por todos os subsistemas desde o boot (ou reset)."""
+    return sum(bytes_written)
+
+
+def _kb(n):
+    if n < 1024:
+        return "{:.0f} B".format(n)
+    if n >= 1048576:
+        return "{:.1f} MB".format(n / 1048576)
+    return "{:.1f} KB".format(n / 1024)
+
+
+def summary(elapsed_s=None):
+    """
+    'csv 12.3 KB/205, eventos 1.1 KB/70 | total 13.4 KB (1.2 MB/dia)'
+    (bytes/sessoes por subsistema; taxa diaria se elapsed_s for dado)
+    """
+    parts = ["{} {}/{}".format(NAMES[i], _kb(bytes_written[i]), writes[i])
+             for i in range(len(NAMES)) if writes[i]]
+    text = "{} | total {}".format(", ".join(parts) or "nada", _kb(total()))
+    if elapsed_s:
+        text += " ({}/dia)".format(_kb(total() * 86400 / elapsed_s))
+    return text
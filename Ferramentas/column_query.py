@@ -0,0 +1,162 @@
+# column_query.py
+"""
+Consulta dos logs colunares (PC)
+--------------------------------
+Le os arquivos ina_col_NNN.<canal> gravados pelo backend colunar
+(Codes/column_logger.py, LOG_FORMAT = "columns"). So os blocos que
+cruzam a janela pedida sao lidos, e so dos canais pedidos (mais o t).
+
+Uso como biblioteca:
+
+    from column_query import load_channels
+    cols = load_channels("dados/", ["vbatt", "soc"], start=3600, end=7200)
+    cols["t"], cols["vbatt"]          # np.ndarray float64 (s, V, %...)
+
+Pela linha de comando:
+    python column_query.py dados/ vbatt soc --start 3600 --end 7200
+    python column_query.py dados/ vbatt iload --summary   # so cabecalhos
+    python column_query.py dados/ --csv tudo.csv           # export igual ao CSV
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import column_logger as cl  # noqa: E402
+from fixed_point import fmt_fixed  # noqa: E402
+
+DEFAULT_BASE = "ina_col"
+
+
+def segments(directory, base=DEFAULT_BASE):
+    """Indices dos segmentos presentes (pelo arquivo do canal t), em ordem."""
+    found = []
+    suffix = ".t"
+    prefix = base + "_"
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            digits = name[len(prefix):-len(suffix)]
+            if digits.isdigit():
+                found.append(int(digits))
+    return sorted(found)
+
+
+def _check(channels):
+    for c in channels:
+        if c not in cl.DECIMALS:
+            raise ValueError("canal desconhecido: {} (use {})".format(c, ", ".join(cl.CHANNEL_NAMES)))
+    return channels
+
+
+def _to_cs(seconds):
+    return None if seconds is None else int(round(seconds * 100))
+
+
+def load_channels(directory, channels, start=None, end=None, base=DEFAULT_BASE, damaged=None):
+    """
+    Le os canais pedidos de todos os segmentos dentro de [start, end] (s).
+    Blocos danificados (CRC) sao pulados e anotados em damaged
+    ((arquivo, offset, bytes)), sem abortar.
+
+    Returns:
+        dict {canal: np.ndarray float64} com "t" em segundos; nan onde o
+        valor e nan ou o bloco do canal se perdeu
+    """
+    channels = _check([c for c in channels if c != "t"])
+    prefix = os.path.join(directory, base)
+    rows = []
+    for index in segments(directory, base):
+        rows.extend(cl.query(prefix, index, channels, _to_cs(start), _to_cs(end), damaged))
+    names = ["t"] + channels
+    data = np.array([[np.nan if v is None else v for v in r] for r in rows],
+                    dtype=np.float64).reshape(-1, len(names))
+    return {name: data[:, i] / 10.0 ** cl.DECIMALS[name] for i, name in enumerate(names)}
+
+
+def summarize(directory, channels, start=None, end=None, base=DEFAULT_BASE, damaged=None):
+    """min/max por canal so pelos cabecalhos. Retorna {canal: (min, max, validas, blocos)}."""
+    out = {}
+    prefix = os.path.join(directory, base)
+    indices = segments(directory, base)
+    for c in _check(channels):
+        scale = 10.0 ** cl.DECIMALS[c]
+        vmin = vmax = None
+        valid = blocks = 0
+        for index in indices:
+            bmin, bmax, n, nb = cl.summary(prefix, index, c, _to_cs(start), _to_cs(end), damaged)
+            blocks += nb
+            valid += n
+            if n:
+                vmin = bmin if vmin is None else min(vmin, bmin)
+                vmax = bmax if vmax is None else max(vmax, bmax)
+        out[c] = (None if vmin is None else vmin / scale,
+                  None if vmax is None else vmax / scale, valid, blocks)
+    return out
+
+
+def export_csv(directory, path, start=None, end=None, base=DEFAULT_BASE, damaged=None):
+    """Exporta todos os canais no mesmo formato do ina_log_NNN.csv."""
+    channels = list(cl.CHANNEL_NAMES[1:])
+    decimals = [cl.DECIMALS[c] for c in cl.CHANNEL_NAMES]
+    header = ",".join(c[1] for c in cl.CHANNELS) + "\n"
+    prefix = os.path.join(directory, base)
+    n = 0
+    with open(path, "w") as f:
+        f.write(header)
+        for index in segments(directory, base):
+            for row in cl.query(prefix, index, channels, _to_cs(start), _to_cs(end), damaged):
+                f.write(",".join(fmt_fixed(v, 10 ** d, d) for v, d in zip(row, decimals)) + "\n")
+                n += 1
+    return n
+
+
+def report_damage(damaged):
+    """AVISO no stderr para cada trecho danificado pulado."""
+    for path, offset, nbytes in damaged:
+        print("AVISO - {}: {} bytes danificados no offset {} ignorados".format(path, nbytes, offset),
+              file=sys.stderr)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Consulta dos logs colunares do Pico")
+    ap.add_argument("directory")
+    ap.add_argument("channels", nargs="*", help="canais ({})".format(", ".join(cl.CHANNEL_NAMES[1:])))
+    ap.add_argument("--start", type=float, help="inicio da janela (s)")
+    ap.add_argument("--end", type=float, help="fim da janela (s)")
+    ap.add_argument("--base", default=DEFAULT_BASE)
+    ap.add_argument("--summary", action="store_true", help="min/max so pelos cabecalhos")
+    ap.add_argument("--csv", help="exporta todos os canais para este CSV")
+    args = ap.parse_args(argv)
+
+    damaged = []
+    if args.csv:
+        n = export_csv(args.directory, args.csv, args.start, args.end, args.base, damaged)
+        report_damage(damaged)
+        print("{} linhas -> {}".format(n, args.csv))
+        return 0
+    if not args.channels:
+        ap.error("informe ao menos um canal (ou --csv)")
+    try:
+        if args.summary:
+            result = summarize(args.directory, args.channels, args.start, args.end, args.base, damaged)
+            report_damage(damaged)
+            for c, (vmin, vmax, valid, blocks) in result.items():
+                print("{:<6} min {} max {} ({} valores, {} blocos)".format(c, vmin, vmax, valid, blocks))
+            return 0
+        cols = load_channels(args.directory, args.channels, args.start, args.end, args.base, damaged)
+        report_damage(damaged)
+    except ValueError as e:
+        print("ERRO {}".format(e))
+        return 1
+    names = ["t"] + [c for c in args.channels if c != "t"]
+    print(",".join(names))
+    for row in zip(*(cols[n] for n in names)):
+        print(",".join("{:g}".format(v) for v in row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
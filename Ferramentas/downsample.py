@@ -0,0 +1,370 @@
+# downsample.py
+"""
+Reducao de series para graficos (PC)
+------------------------------------
+Meses de log sao milhoes de pontos por canal: nenhuma biblioteca de
+graficos desenha isso com zoom interativo. Este modulo pre-calcula, por
+no, uma piramide de envelopes min/max de todos os canais e responde a
+uma janela [start, end] com ~points pontos em milissegundos:
+
+- nivel 0: as amostras (tempo corrigido dos resets), uma coluna por .npy;
+- nivel k: blocos de FACTOR**k amostras com o minimo e o maximo de cada
+  canal e os instantes onde ocorreram (tmin/ymin/tmax/ymax, (m, canais)).
+  Cada nivel sai do anterior por reshape + argmin/argmax, todos os canais
+  de uma vez (NaN ignorado, como sensor ausente).
+
+view() escolhe o nivel mais grosso que ainda tem points/2 blocos na
+janela e junta os blocos em points/2 baldes:
+- "minmax": min e max de cada balde, em ordem de tempo (picos nunca somem);
+- "lttb": Largest-Triangle-Three-Buckets sobre os candidatos do envelope
+  (MINMAX_RATIO * points pontos), o que mantem a forma da curva com
+  custo independente do tamanho da janela.
+
+Cache em disco: <pasta>/.cache/pyramid_<chave>/ para uma pasta de
+descarga (LogSet) ou <armazenamento>/.cache/<no>.pyramid_<chave>/ para o
+fleet_ingest.py. A chave e o CRC32 da lista de arquivos de origem com o
+tamanho (ou do index.csv do no): log novo => piramide nova (a antiga e
+apagada), senao so memmaps abertos.
+
+    pyr = open_logset("offload/no07")
+    series = pyr.view(["Vbatt", "SoC"], start=0, end=365 * 86400, points=2000)
+    t, v = series["Vbatt"]
+
+Pela linha de comando:
+    python downsample.py offload/ --build                  # pre-calcula todos os nos
+    python downsample.py offload/ --nodes no07 --columns Vbatt Iload_mA \\
+        --start 0 --end 2592000 --points 2000 --method lttb --out no07.csv
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+
+from fleet_ingest import FleetStore, find_nodes
+from log_reader import CACHE_DIR, COLUMNS, LogSet
+
+FACTOR = 8              # amostras por bloco de um nivel para o seguinte
+MIN_BLOCKS = 64         # o ultimo nivel tem pelo menos isso de blocos
+MINMAX_RATIO = 4        # candidatos do envelope por ponto do LTTB
+DEFAULT_POINTS = 2000
+CHANNELS = COLUMNS[1:]
+LEVEL_PARTS = ("tmin", "ymin", "tmax", "ymax")
+
+
+# ----------------------------------------------------------------------
+# Algoritmos
+# ----------------------------------------------------------------------
+
+def _pad(a, n, fill):
+    if not n:
+        return a
+    return np.concatenate((a, np.full((n,) + a.shape[1:], fill, dtype=a.dtype)))
+
+
+def reduce_blocks(tmin, ymin, tmax, ymax, group):
+    """
+    Junta 'group' linhas consecutivas (a ultima pode ficar incompleta).
+    y: (m, canais); t: (m, canais) ou (m,) quando comum a todos (amostras).
+
+    Returns:
+        (tmin, ymin, tmax, ymax) com ceil(m / group) linhas
+    """
+    m, c = ymin.shape
+    pad = (-m) % group
+    ymin = _pad(ymin, pad, np.nan).reshape(-1, group, c)
+    ymax = _pad(ymax, pad, np.nan).reshape(-1, group, c)
+    kmin = np.where(np.isnan(ymin), np.inf, ymin).argmin(axis=1)[:, None, :]
+    kmax = np.where(np.isnan(ymax), -np.inf, ymax).argmax(axis=1)[:, None, :]
+    if tmin.ndim == 1:
+        tmin = tmax = _pad(tmin, pad, np.nan).reshape(-1, group, 1).repeat(c, axis=2)
+    else:
+        tmin = _pad(tmin, pad, np.nan).reshape(-1, group, c)
+        tmax = _pad(tmax, pad, np.nan).reshape(-1, group, c)
+    take = np.take_along_axis
+    return (take(tmin, kmin, 1)[:, 0], take(ymin, kmin, 1)[:, 0],
+            take(tmax, kmax, 1)[:, 0], take(ymax, kmax, 1)[:, 0])
+
+
+def envelope_points(tmin, ymin, tmax, ymax):
+    """Um canal: (t, y) com o min e o max de cada balde em ordem de tempo."""
+    first = tmin <= tmax
+    t = np.column_stack((np.where(first, tmin, tmax), np.where(first, tmax, tmin))).ravel()
+    y = np.column_stack((np.where(first, ymin, ymax), np.where(first, ymax, ymin))).ravel()
+    keep = ~np.isnan(y)
+    keep[1:] &= t[1:] != t[:-1]     # balde de uma amostra: min == max
+    return t[keep], y[keep]
+
+
+def lttb(t, y, points):
+    """
+    Largest-Triangle-Three-Buckets: 'points' pontos de (t, y), primeiro e
+    ultimo fixos. As medias dos baldes saem de somas acumuladas; o laco e
+    so sobre os baldes (a escolha de cada um depende da anterior).
+    """
+    keep = ~np.isnan(y)
+    t, y = t[keep], y[keep]
+    n = t.size
+    if points >= n or points < 3:
+        return t, y
+    x = t - t[0]
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    size = np.diff(edges)
+    mean_x = (cx[edges[1:]] - cx[edges[:-1]]) / size
+    mean_y = (cy[edges[1:]] - cy[edges[:-1]]) / size
+    # O "terceiro ponto" do ultimo balde e o ultimo ponto da serie
+    mean_x = np.append(mean_x[1:], x[-1])
+    mean_y = np.append(mean_y[1:], y[-1])
+    out = np.empty(points, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for j in range(points - 2):
+        lo, hi = edges[j], edges[j + 1]
+        area = np.abs((x[a] - mean_x[j]) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (mean_y[j] - y[a]))
+        a = lo + int(area.argmax())
+        out[j + 1] = a
+    return t[out], y[out]
+
+
+# ----------------------------------------------------------------------
+# Piramide
+# ----------------------------------------------------------------------
+
+def build(path, cols):
+    """
+    Grava a piramide de cols ({coluna: array}, "timestamp" em ordem) em
+    path (pasta nova, trocada de uma vez) e a devolve aberta.
+    """
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    t = np.ascontiguousarray(cols["timestamp"], dtype=np.float64)
+    y = np.column_stack([np.asarray(cols[c], dtype=np.float64) for c in CHANNELS]) \
+        if t.size else np.empty((0, len(CHANNELS)))
+    np.save(os.path.join(tmp, "timestamp.npy"), t)
+    for i, c in enumerate(CHANNELS):
+        np.save(os.path.join(tmp, c + ".npy"), np.ascontiguousarray(y[:, i]))
+    level = (t, y, t, y)
+    k = 0
+    while level[1].shape[0] >= MIN_BLOCKS * FACTOR:
+        level = reduce_blocks(*level, FACTOR)
+        k += 1
+        for name, a in zip(LEVEL_PARTS, level):
+            np.save(os.path.join(tmp, "L{}_{}.npy".format(k, name)), a)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return Pyramid(path)
+
+
+class Pyramid:
+    """Piramide gravada: memmaps somente leitura e consultas por janela."""
+
+    def __init__(self, path):
+        self.path = path
+        self.t = np.load(os.path.join(path, "timestamp.npy"), mmap_mode="r")
+        self.raw = {c: np.load(os.path.join(path, c + ".npy"), mmap_mode="r") for c in CHANNELS}
+        self.levels = [None]
+        k = 1
+        while os.path.exists(os.path.join(path, "L{}_ymin.npy".format(k))):
+            self.levels.append(tuple(
+                np.load(os.path.join(path, "L{}_{}.npy".format(k, p)), mmap_mode="r")
+                for p in LEVEL_PARTS))
+            k += 1
+
+    def __len__(self):
+        return self.t.size
+
+    def time_range(self):
+        return (float(self.t[0]), float(self.t[-1])) if self.t.size else None
+
+    def view(self, columns=None, start=None, end=None, points=DEFAULT_POINTS, method="minmax"):
+        """
+        Args:
+            columns: canais (COLUMNS sem "timestamp"); None = todos
+            start, end: janela (tempo corrigido, s); None = sem limite
+            points: pontos por canal (aprox.: o envelope da 2 por balde)
+            method: "minmax" ou "lttb"
+
+        Returns:
+            {coluna: (t, y)}
+        """
+        columns = [c for c in (columns or CHANNELS) if c != "timestamp"]
+        idx = [CHANNELS.index(c) for c in columns]
+        lo = 0 if start is None else int(np.searchsorted(self.t, start, "left"))
+        hi = self.t.size if end is None else int(np.searchsorted(self.t, end, "right"))
+        target = points * MINMAX_RATIO if method == "lttb" else points
+        if method not in ("minmax", "lttb"):
+            raise ValueError("metodo desconhecido: {}".format(method))
+
+        if hi - lo <= target:
+            t = np.array(self.t[lo:hi])
+            out = {c: (t, np.array(self.raw[c][lo:hi])) for c in columns}
+        else:
+            out = self._envelope(idx, columns, lo, hi, max(1, target // 2), start, end)
+        if method == "lttb":
+            out = {c: lttb(t, y, points) for c, (t, y) in out.items()}
+        return out
+
+    def _envelope(self, idx, columns, lo, hi, buckets, start, end):
+        # Nivel mais grosso com pelo menos 'buckets' blocos na janela
+        k = 0
+        while k + 1 < len(self.levels) and (hi - lo) // FACTOR ** (k + 1) >= buckets:
+            k += 1
+        if k == 0:
+            t = np.array(self.t[lo:hi])
+            y = np.column_stack([self.raw[c][lo:hi] for c in columns])
+            level = (t, y, t, y)
+        else:
+            size = FACTOR ** k
+            a, b = lo // size, -(-hi // size)
+            level = tuple(np.array(p[a:b][:, idx]) for p in self.levels[k])
+        # Grupos inteiros de blocos: entre 3/4 e 3/2 dos baldes pedidos
+        group = max(1, int(round(level[1].shape[0] / float(buckets))))
+        tmin, ymin, tmax, ymax = reduce_blocks(*level, group)
+        out = {}
+        for j, c in enumerate(columns):
+            t, y = envelope_points(tmin[:, j], ymin[:, j], tmax[:, j], ymax[:, j])
+            # Blocos das bordas podem ter amostras fora da janela
+            inside = np.ones(t.size, dtype=bool)
+            if start is not None:
+                inside &= t >= start
+            if end is not None:
+                inside &= t <= end
+            out[c] = (t[inside], y[inside])
+        return out
+
+
+# ----------------------------------------------------------------------
+# Cache por origem
+# ----------------------------------------------------------------------
+
+def _open_cached(folder, stem, key, load):
+    """Abre folder/<stem><chave> ou constroi com load() (apaga versoes antigas)."""
+    path = os.path.join(folder, "{}{:08x}".format(stem, key))
+    if os.path.exists(os.path.join(path, "timestamp.npy")):
+        return Pyramid(path)
+    os.makedirs(folder, exist_ok=True)
+    for name in os.listdir(folder):
+        if name.startswith(stem) and os.path.join(folder, name) != path:
+            shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    return build(path, load())
+
+
+def open_logset(directory, base=None, reset_gap_s=None):
+    """Piramide de uma pasta de descarga (ou lista de pastas do mesmo no)."""
+    logs = LogSet(directory, base, reset_gap_s=reset_gap_s)
+    ident = ";".join("{}/{}:{}".format(s["dir"], s["name"], s["size"]) for s in logs.segments)
+    key = zlib.crc32("{}|{}|{}".format(ident, reset_gap_s, FACTOR).encode())
+    folder = os.path.join(logs.directories[0], CACHE_DIR)
+    return _open_cached(folder, "pyramid_", key, lambda: logs.load(list(CHANNELS)))
+
+
+def open_store(store, node):
+    """Piramide de um no do armazenamento do fleet_ingest.py."""
+    fleet = FleetStore(store)
+    parts = fleet.partitions([node])
+    if not parts:
+        raise ValueError("no sem dados: {}".format(node))
+    key = zlib.crc32("{}|{}".format(parts, FACTOR).encode())
+
+    def load():
+        return fleet.query(list(CHANNELS), nodes=[node])[node]
+    return _open_cached(os.path.join(store, CACHE_DIR), node + ".pyramid_", key, load)
+
+
+def _open(node, source):
+    if isinstance(source, str):   # pasta do armazenamento
+        return open_store(source, node)
+    return open_logset(source)
+
+
+def build_node(task):
+    """Um no (roda num processo). Returns (no, amostras, niveis, s, erro)."""
+    node, source = task
+    t0 = time.monotonic()
+    try:
+        pyr = _open(node, source)
+    except (OSError, ValueError) as e:
+        return node, 0, 0, 0.0, str(e)
+    return node, len(pyr), len(pyr.levels) - 1, time.monotonic() - t0, None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Piramides min/max e LTTB para graficos")
+    ap.add_argument("roots", nargs="*", help="pastas de descarga (um no ou uma subpasta por no)")
+    ap.add_argument("--store", help="armazenamento do fleet_ingest.py (em vez das pastas)")
+    ap.add_argument("--nodes", nargs="*", help="so estes nos")
+    ap.add_argument("--build", action="store_true", help="so pre-calcula as piramides")
+    ap.add_argument("--workers", type=int, default=None, help="processos (padrao: todos os nucleos)")
+    ap.add_argument("--columns", nargs="+", default=["Vbatt", "Iload_mA", "SoC"])
+    ap.add_argument("--start", type=float, default=None, help="inicio da janela (s)")
+    ap.add_argument("--end", type=float, default=None, help="fim da janela (s)")
+    ap.add_argument("--points", type=int, default=DEFAULT_POINTS, help="pontos por canal")
+    ap.add_argument("--method", choices=("minmax", "lttb"), default="minmax")
+    ap.add_argument("--out", help="CSV node,column,t,value com as series reduzidas")
+    args = ap.parse_args(argv)
+
+    if args.store:
+        nodes = {n: args.store for n in FleetStore(args.store).nodes()}
+    elif args.roots:
+        nodes = find_nodes(args.roots)
+    else:
+        ap.error("informe as pastas de descarga ou --store")
+    if args.nodes:
+        nodes = {n: s for n, s in nodes.items() if n in args.nodes}
+    unknown = [c for c in args.columns if c not in CHANNELS]
+    if unknown:
+        ap.error("colunas desconhecidas: {}".format(", ".join(unknown)))
+
+    tasks = sorted(nodes.items())
+    if args.workers == 1 or len(tasks) < 2:
+        results = [build_node(t) for t in tasks]
+    else:
+        with Pool(processes=args.workers) as pool:
+            results = list(pool.imap_unordered(build_node, tasks))
+    results.sort(key=lambda r: r[0])
+
+    status = 0
+    ok = []
+    for node, n, levels, dt, error in results:
+        if error:
+            print("ERRO {}: {}".format(node, error))
+            status = 1
+            continue
+        print("{:<12} {:>10} amostras, {} niveis ({:.2f} s)".format(node, n, levels, dt))
+        ok.append(node)
+    if args.build:
+        return status
+
+    out = open(args.out, "w") if args.out else None
+    try:
+        if out:
+            out.write("node,column,t,value\n")
+        for node in ok:
+            pyr = _open(node, nodes[node])   # ja no cache: so memmaps
+            t0 = time.monotonic()
+            series = pyr.view(args.columns, args.start, args.end, args.points, args.method)
+            dt = time.monotonic() - t0
+            for c, (t, y) in series.items():
+                print("  {} {}: {} pontos em {:.1f} ms".format(node, c, t.size, dt * 1000.0))
+                if out:
+                    out.writelines("{},{},{:.1f},{:.6g}\n".format(node, c, a, b)
+                                   for a, b in zip(t, y))
+    finally:
+        if out:
+            out.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
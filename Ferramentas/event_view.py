@@ -0,0 +1,71 @@
+# event_view.py
+"""
+Leitor do registro de eventos (PC)
+----------------------------------
+Mostra o events.bin baixado do Pico (anel de Codes/event_log.py): os
+eventos em ordem, so de um tipo, os ultimos N ou so os contadores.
+
+    python event_view.py offload/ttyACM0/events.bin
+    python event_view.py events.bin --code I2C_ERROR --tail 20
+    python event_view.py offload/*/events.bin --counts
+
+No dispositivo, sem baixar nada: node_ctl.py ... events 20 / counts
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+from event_log import EVENT_NAMES, format_event, read_file  # noqa: E402
+
+
+def code_of(name):
+    """Codigo do evento pelo nome (BOOT, I2C_ERROR...)."""
+    for code, n in EVENT_NAMES.items():
+        if n == name.upper():
+            return code
+    raise ValueError("evento desconhecido: {} (use {})".format(
+        name, ", ".join(EVENT_NAMES[c] for c in sorted(EVENT_NAMES))))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Eventos gravados pelo Pico (events.bin)")
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--code", help="so eventos deste tipo (ex.: BOOT, I2C_ERROR)")
+    ap.add_argument("--tail", type=int, help="so os ultimos N")
+    ap.add_argument("--counts", action="store_true", help="so os contadores por tipo")
+    args = ap.parse_args(argv)
+
+    try:
+        code = code_of(args.code) if args.code else None
+    except ValueError as e:
+        print("ERRO {}".format(e))
+        return 1
+    status = 0
+    for path in args.files:
+        try:
+            counts, recs = read_file(path)
+        except (OSError, ValueError) as e:
+            print("ERRO {}: {}".format(path, e))
+            status = 1
+            continue
+        if len(args.files) > 1:
+            print("== {}".format(path))
+        if args.counts:
+            for c in sorted(EVENT_NAMES):
+                if counts[c]:
+                    print("{:<14} {}".format(EVENT_NAMES[c], counts[c]))
+            print("{:<14} {} no anel".format("registros", len(recs)))
+            continue
+        if code is not None:
+            recs = [r for r in recs if r[2] == code]
+        if args.tail:
+            recs = recs[-args.tail:]
+        for rec in recs:
+            print(format_event(rec))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,672 @@
+# flash_wear.py
+"""
+Desgaste da flash com dispositivo de blocos emulado (PC)
+--------------------------------------------------------
+Roda o codigo de gravacao do dispositivo (Codes/) sobre uma flash
+emulada e conta programacoes e apagamentos por bloco, para estimar
+quantos ciclos por dia cada configuracao gasta e quanto tempo a flash
+dura. Os modulos usados sao os mesmos do Pico: DataLogger/ColumnLogger,
+TimestampManager.save_checkpoint, EventLog (o ResetLogger so grava o
+evento BOOT nele; aqui o BOOT e gravado direto, sem machine), o
+BatteryGauge (cada salto de tempo que ele ve e um TIME_JUMP no anel) e o
+RetentionManager (codec dv, sem deflate no PC).
+
+Pausas do loop (--pauses-per-day de --pause-s: I2C travado, servico
+longo, REPL) avancam o relogio sem amostras; passando de
+battery_gauge.JUMP_SAMPLES intervalos o gauge registra TIME_JUMP.
+
+Modelo do littlefs (aproximado, suficiente para contar apagamentos):
+    - blocos de --block-size, programados em unidades de --prog-size
+    - arquivos ate --inline-max bytes ficam dentro dos metadados
+    - arquivos maiores: lista de blocos (skip-list CTZ, sem contar os
+      ponteiros). Nada e regravado no lugar: ao fechar, os blocos a
+      partir do primeiro byte alterado sao copiados para blocos novos.
+      Um append num arquivo com o ultimo bloco pela metade copia esse
+      bloco inteiro (como lfs_ctz_extend)
+    - cada fechamento com gravacao e um commit no par de metadados do
+      diretorio (>= prog_size bytes); bloco cheio => compactacao no
+      outro bloco do par (1 apagamento); a cada --block-cycles
+      compactacoes o par muda de bloco (nivelamento dos metadados).
+      Se o estado compactado passar de meio bloco, os maiores arquivos
+      inline saem para blocos proprios
+    - alocacao circular a partir do ultimo bloco usado (lookahead):
+      nivelamento dinamico, so entre os blocos livres. Por isso a vida
+      e estimada de dois jeitos: apagamentos espalhados por todos os
+      blocos (ideal) e so pela media de blocos livres da simulacao
+      (arquivos parados nao se desgastam, mas tambem nao ajudam)
+
+Os apagamentos de metadados contam para o subsistema cujo commit os
+causou. "gravado" vem dos contadores do proprio dispositivo
+(Codes/write_stats.py); amplificacao = bytes programados / gravados.
+
+O relogio e virtual: um dia de amostras a 1 s roda em segundos.
+
+Uso:
+    python flash_wear.py                       # csv e colunar, 1 s e 60 s
+    python flash_wear.py --format csv --interval 1 --days 2 --boots-per-day 4
+    python flash_wear.py --interval 10 --gc-interval 100,1000 --no-retention
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import math
+import os
+import random
+import sys
+import time
+
+
+class VirtualClock:
+    """ticks_* do MicroPython sobre um tempo que so anda com advance()."""
+
+    def __init__(self):
+        self.now_ms = 0
+
+    def ticks_ms(self):
+        return self.now_ms
+
+    def ticks_us(self):
+        return self.now_ms * 1000
+
+    @staticmethod
+    def ticks_diff(a, b):
+        return a - b
+
+    @staticmethod
+    def ticks_add(a, b):
+        return a + b
+
+    def advance(self, seconds):
+        self.now_ms += int(round(seconds * 1000))
+
+
+CLOCK = VirtualClock()
+# O firmware importa ticks_* de time (so existem no MicroPython); os
+# nomes sao ligados no import, entao precisam existir antes dele
+for _name in ("ticks_ms", "ticks_us", "ticks_diff", "ticks_add"):
+    if not hasattr(time, _name):
+        setattr(time, _name, getattr(CLOCK, _name))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import write_stats  # noqa: E402
+import battery_gauge  # noqa: E402
+import column_logger  # noqa: E402
+import data_logger  # noqa: E402
+import event_log  # noqa: E402
+import log_codec  # noqa: E402
+import retention  # noqa: E402
+import time_sync  # noqa: E402
+import timestamp_manager  # noqa: E402
+from console import set_level, SILENT  # noqa: E402
+
+# Modulos cujo open/os passam a usar a flash emulada
+DEVICE_MODULES = (data_logger, column_logger, event_log, log_codec, retention, timestamp_manager)
+
+# Padroes do RP2040 (Pico, MicroPython): 1408 KB de littlefs em 4 KB,
+# progsize 256, cache 1 KB => inline ate 512 bytes, block_cycles 100
+BLOCK_SIZE = 4096
+BLOCK_COUNT = 352
+PROG_SIZE = 256
+INLINE_MAX = 512
+BLOCK_CYCLES = 100
+ENDURANCE = 100000       # ciclos de apagamento da NOR (W25Q16JV)
+
+COMMIT_BYTES = 20        # tags + CRC de um commit de arquivo
+SUPERBLOCK_BYTES = 48
+OTHER = len(write_stats.NAMES)        # arquivo de nenhum subsistema conhecido
+TAG_NAMES = write_stats.NAMES + ("outros",)
+
+ENOENT = 2
+ENOSPC = 28
+
+
+def subsystem(name):
+    """Subsistema (indice de write_stats.NAMES) dono do arquivo."""
+    if name == timestamp_manager.TimestampManager.TIMESTAMP_FILE:
+        return write_stats.W_CHECKPOINT
+    if name == event_log.EVENT_FILE:
+        return write_stats.W_EVENTS
+    if name.startswith(time_sync.SYNC_FILE):
+        return write_stats.W_TIME
+    if name.startswith(log_codec.MANIFEST_NAME):
+        return write_stats.W_MANIFEST
+    if name.startswith(retention.ROLLUP_PREFIX) or name.endswith(
+            (log_codec.DV_SUFFIX, log_codec.GZIP_SUFFIX)):
+        return write_stats.W_RETENTION
+    if name.startswith("ina_col_"):
+        return write_stats.W_COLUMN
+    if name.startswith("ina_log_"):
+        return write_stats.W_CSV
+    if name.startswith("burst_"):
+        return write_stats.W_BURST
+    return OTHER
+
+
+class BlockDevice:
+    """Flash NOR: contadores de apagamento por bloco e por subsistema."""
+
+    def __init__(self, block_size=BLOCK_SIZE, block_count=BLOCK_COUNT, prog_size=PROG_SIZE):
+        self.block_size = block_size
+        self.block_count = block_count
+        self.prog_size = prog_size
+        self.erases = [0] * block_count
+        self.tag_erases = [0] * len(TAG_NAMES)
+        self.tag_prog = [0] * len(TAG_NAMES)
+
+    def erase(self, block, tag):
+        self.erases[block] += 1
+        self.tag_erases[tag] += 1
+
+    def prog(self, nbytes, tag):
+        """Programa nbytes (arredondado para prog_size); retorna o tamanho real."""
+        n = -(-nbytes // self.prog_size) * self.prog_size
+        self.tag_prog[tag] += n
+        return n
+
+
+class _Node:
+    def __init__(self):
+        self.data = bytearray()
+        self.blocks = None      # None = inline nos metadados
+
+
+class EmulatedFile:
+    """Arquivo aberto (subconjunto do objeto de arquivo do MicroPython, sem truncate)."""
+
+    def __init__(self, fs, name, node, mode, created):
+        self.fs = fs
+        self.name = name
+        self.node = node
+        self.binary = "b" in mode
+        self.append = "a" in mode
+        self.writable = "w" in mode or "a" in mode or "+" in mode
+        self.pos = 0
+        self.created = created
+        # Commit obrigatorio no fechamento se o arquivo foi criado ou truncado
+        self.dirty_from = 0 if created or "w" in mode else None
+        self.closed = False
+
+    def _out(self, data):
+        return bytes(data) if self.binary else bytes(data).decode()
+
+    def write(self, buf):
+        if not self.writable:
+            raise OSError(9, "EBADF")
+        buf = buf.encode() if isinstance(buf, str) else bytes(buf)
+        data = self.node.data
+        if self.append:
+            self.pos = len(data)
+        if self.pos > len(data):
+            data.extend(bytes(self.pos - len(data)))
+        data[self.pos:self.pos + len(buf)] = buf
+        if self.dirty_from is None or self.pos < self.dirty_from:
+            self.dirty_from = self.pos
+        self.pos += len(buf)
+        return len(buf)
+
+    def read(self, n=-1):
+        data = self.node.data
+        end = len(data) if n is None or n < 0 else min(len(data), self.pos + n)
+        chunk = data[self.pos:end]
+        self.pos = max(self.pos, end)
+        return self._out(chunk)
+
+    def readinto(self, buf):
+        data = self.node.data
+        n = max(0, min(len(buf), len(data) - self.pos))
+        buf[:n] = data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def readline(self):
+        data = self.node.data
+        end = data.find(b"\n", self.pos)
+        end = len(data) if end < 0 else end + 1
+        chunk = data[self.pos:end]
+        self.pos = max(self.pos, end)
+        return self._out(chunk)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def seek(self, offset, whence=0):
+        base = (0, self.pos, len(self.node.data))[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        self.fs.sync(self)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.fs.sync(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LittleFsModel:
+    """Sistema de arquivos plano (so a raiz) no estilo do littlefs."""
+
+    file_class = EmulatedFile
+
+    def __init__(self, bd, inline_max=INLINE_MAX, block_cycles=BLOCK_CYCLES):
+        self.bd = bd
+        self.inline_max = inline_max
+        self.block_cycles = block_cycles
+        self.files = {}
+        self.meta_overflows = 0
+        self._used = set()
+        self._cursor = 0
+        # Par de metadados da raiz (com o superbloco)
+        self._pair = [self._alloc(OTHER), self._alloc(OTHER)]
+        self._active = 0
+        self._meta_rev = 0
+        self._meta_used = bd.prog(SUPERBLOCK_BYTES, OTHER)
+
+    # -- blocos ----------------------------------------------------------
+
+    def _alloc(self, tag):
+        n = self.bd.block_count
+        for i in range(n):
+            b = (self._cursor + i) % n
+            if b not in self._used:
+                self._used.add(b)
+                self._cursor = (b + 1) % n
+                self.bd.erase(b, tag)
+                return b
+        raise OSError(ENOSPC, "ENOSPC")
+
+    def free_blocks(self):
+        return self.bd.block_count - len(self._used)
+
+    # -- metadados -------------------------------------------------------
+
+    def _meta_state(self):
+        size = SUPERBLOCK_BYTES
+        for name, node in self.files.items():
+            size += 8 + len(name) + (len(node.data) if node.blocks is None else 8)
+        return size
+
+    def _commit(self, tag, nbytes):
+        bs = self.bd.block_size
+        need = -(-(nbytes + COMMIT_BYTES) // self.bd.prog_size) * self.bd.prog_size
+        if self._meta_used + need > bs:
+            self._compact(tag)
+        self._meta_used += self.bd.prog(nbytes + COMMIT_BYTES, tag)
+
+    def _compact(self, tag):
+        """Regrava o estado vivo no outro bloco do par (ou num bloco novo)."""
+        self._meta_rev += 1
+        other = 1 - self._active
+        if self.block_cycles and self._meta_rev % (self.block_cycles + 1) == 0:
+            old = self._pair[other]
+            self._pair[other] = self._alloc(tag)
+            self._used.discard(old)
+        else:
+            self.bd.erase(self._pair[other], tag)
+        state = self._meta_state()
+        while state > self.bd.block_size // 2 and self._outline_largest():
+            state = self._meta_state()
+        if state > self.bd.block_size // 2:
+            # O littlefs dividiria o diretorio em mais pares; aqui so conta
+            self.meta_overflows += 1
+            state = self.bd.block_size // 2
+        self._active = other
+        self._meta_used = self.bd.prog(state, tag)
+
+    def _outline_largest(self):
+        """Tira dos metadados o maior arquivo inline (vai para um bloco proprio)."""
+        best = None
+        for name, node in self.files.items():
+            if node.blocks is None and node.data and (
+                    best is None or len(node.data) > len(self.files[best].data)):
+                best = name
+        if best is None:
+            return False
+        node = self.files[best]
+        tag = subsystem(best)
+        node.blocks = [self._alloc(tag)]
+        self.bd.prog(len(node.data), tag)
+        return True
+
+    # -- arquivos --------------------------------------------------------
+
+    def open(self, name, mode="r"):
+        node = self.files.get(name)
+        created = False
+        if node is None:
+            if "w" not in mode and "a" not in mode:
+                raise OSError(ENOENT, "ENOENT")
+            node = self.files[name] = _Node()
+            created = True
+        elif "w" in mode:
+            self._release(node)
+            node.data = bytearray()
+        return self.file_class(self, name, node, mode, created)
+
+    def _release(self, node):
+        for b in node.blocks or ():
+            self._used.discard(b)
+        node.blocks = None
+
+    def sync(self, f):
+        """Fechamento/flush: copia os blocos alterados e faz o commit."""
+        if f.dirty_from is None:
+            return
+        tag = subsystem(f.name)
+        node = f.node
+        size = len(node.data)
+        extra = 4 + len(f.name) if f.created else 0
+        if node.blocks is None and size <= self.inline_max:
+            self._commit(tag, extra + size)
+        else:
+            bs = self.bd.block_size
+            old = node.blocks or []
+            first = 0 if node.blocks is None else min(len(old), f.dirty_from // bs)
+            for b in old[first:]:
+                self._used.discard(b)
+            blocks = old[:first]
+            for k in range(first, -(-size // bs)):
+                blocks.append(self._alloc(tag))
+                self.bd.prog(min(bs, size - k * bs), tag)
+            node.blocks = blocks
+            self._commit(tag, extra)
+        f.created = False
+        f.dirty_from = None
+
+    def remove(self, name):
+        node = self.files.pop(name, None)
+        if node is None:
+            raise OSError(ENOENT, "ENOENT")
+        self._release(node)
+        self._commit(subsystem(name), 4)
+
+    def rename(self, src, dst):
+        if src not in self.files:
+            raise OSError(ENOENT, "ENOENT")
+        if dst in self.files:
+            self._release(self.files.pop(dst))
+        self.files[dst] = self.files.pop(src)
+        self._commit(subsystem(dst), 8 + len(dst))
+
+
+class EmulatedOs:
+    """As funcoes de os que o firmware usa, sobre o LittleFsModel."""
+
+    def __init__(self, fs):
+        self.fs = fs
+
+    def listdir(self, path=None):
+        return sorted(self.fs.files)
+
+    def stat(self, name):
+        node = self.fs.files.get(name)
+        if node is None:
+            raise OSError(ENOENT, "ENOENT")
+        return (0x8000, 0, 0, 0, 0, 0, len(node.data), 0, 0, 0)
+
+    def statvfs(self, path="/"):
+        bs = self.fs.bd.block_size
+        free = self.fs.free_blocks()
+        return (bs, bs, self.fs.bd.block_count, free, free, 0, 0, 0, 0, 255)
+
+    def remove(self, name):
+        self.fs.remove(name)
+
+    def rename(self, src, dst):
+        self.fs.rename(src, dst)
+
+
+def mount(fs):
+    """Liga open/os dos modulos do firmware a flash emulada."""
+    shim = EmulatedOs(fs)
+    for mod in DEVICE_MODULES:
+        mod.os = shim
+        mod.open = fs.open
+
+
+class SyntheticNode:
+    """Linhas com variacao realista (os codecs nao podem comprimir demais)."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.vbatt = 3.7
+        self.soc = 60.0
+        self.temp = 25.0
+        self.hum = 60.0
+
+    def row(self, t):
+        g = self.rng.gauss
+        self.vbatt = min(4.1, max(3.2, self.vbatt + g(0, 0.002)))
+        self.soc = min(100.0, max(0.0, self.soc + g(0, 0.02)))
+        self.temp += g(0, 0.05) + (25.0 - self.temp) * 0.001
+        self.hum = min(100.0, max(0.0, self.hum + g(0, 0.1)))
+        iload = max(0.0, 180.0 + g(0, 25.0))
+        vload = 5.0 + g(0, 0.01)
+        return {
+            "timestamp": t, "Vbatt": self.vbatt, "Vload": vload, "Iload_mA": iload,
+            "Ibatt_mA": iload * vload / self.vbatt / 0.9, "SoC": self.soc,
+            "Temp_int": self.temp + 3.0 + g(0, 0.2), "Temp_ext": self.temp,
+            "Humidity": self.hum,
+        }
+
+
+def simulate(cfg):
+    """
+    Roda cfg["days"] dias de amostras e devolve os contadores.
+
+    cfg: dict com format, interval, gc_interval, block_lines, column_rows,
+         max_lines, event_capacity, events_per_day, boots_per_day,
+         pauses_per_day, pause_s, retention, geometria da flash e seed
+    """
+    CLOCK.now_ms = 0
+    write_stats.reset()
+    bd = BlockDevice(cfg["block_size"], cfg["blocks"], cfg["prog_size"])
+    fs = LittleFsModel(bd, cfg["inline_max"], cfg["block_cycles"])
+    mount(fs)
+    rng = random.Random(cfg["seed"])
+    node = SyntheticNode(rng)
+    interval = cfg["interval"]
+    p_event = cfg["events_per_day"] * interval / 86400.0
+    p_boot = cfg["boots_per_day"] * interval / 86400.0
+    p_pause = cfg["pauses_per_day"] * interval / 86400.0
+
+    def boot():
+        ts = timestamp_manager.TimestampManager()
+        events = event_log.EventLog(capacity=cfg["event_capacity"], clock=ts.get_timestamp_ds,
+                                    holdoff_ds=600)
+        events.log(event_log.EV_BOOT, -1, int(ts.offset))   # o que o ResetLogger grava
+        gauge = battery_gauge.BatteryGauge(sample_interval_s=interval)
+        gauge.events = events
+        if cfg["format"] == "columns":
+            logger = column_logger.ColumnLogger("ina_col", max_lines=cfg["max_lines"],
+                                                block_rows=cfg["column_rows"], events=events)
+        else:
+            logger = data_logger.DataLogger("ina_log", max_lines=cfg["max_lines"],
+                                            block_lines=cfg["block_lines"], events=events)
+        ret = None
+        if cfg["retention"]:
+            ret = retention.RetentionManager(logger, codec=retention.CODEC_DV)
+            logger.retention = ret
+            ret.events = events
+        return ts, events, gauge, logger, ret
+
+    boots = 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        ts, events, gauge, logger, ret = boot()
+        samples = 0
+        free_sum = 0
+        steps = int(cfg["days"] * 86400 / interval)
+        for _ in range(steps):
+            CLOCK.advance(interval)
+            if rng.random() < p_pause:
+                CLOCK.advance(cfg["pause_s"])
+            t = ts.get_timestamp()
+            row = node.row(t)
+            gauge.update(row["Vbatt"], row["Ibatt_mA"], t)
+            logger.append(row)
+            samples += 1
+            if samples % cfg["gc_interval"] == 0:
+                ts.save_checkpoint(t)
+                events.sync()
+            if rng.random() < p_event:
+                events.log(event_log.EV_LOOP_SLOW, 0, 1600)
+            if ret is not None and ret.pending:
+                ret.service(1000)
+            free_sum += fs.free_blocks()
+            if rng.random() < p_boot:
+                # Queda de energia: nada e fechado, tudo recomeca do disco
+                ts, events, gauge, logger, ret = boot()
+                boots += 1
+                samples = 0
+
+    return {"bd": bd, "fs": fs, "boots": boots, "free_mean": free_sum / max(1, steps),
+            "time_jumps": events.counts[event_log.EV_TIME_JUMP],
+            "events_suppressed": events.suppressed,
+            "bytes": list(write_stats.bytes_written), "writes": list(write_stats.writes)}
+
+
+def _kb(n):
+    return "{:.1f}".format(n / 1024.0)
+
+
+def _years(endurance, per_day):
+    return float("inf") if per_day <= 0 else endurance / per_day / 365.0
+
+
+def lifetime(cfg, res):
+    """(apagamentos/dia, anos com todos os blocos, anos so com os livres)"""
+    bd = res["bd"]
+    per_day = sum(bd.erases) / cfg["days"]
+    return (per_day, _years(cfg["endurance"] * bd.block_count, per_day),
+            _years(cfg["endurance"] * res["free_mean"], per_day))
+
+
+def title(cfg):
+    return "{}, intervalo {:g} s, checkpoint a cada {} amostras".format(
+        cfg["format"], cfg["interval"], cfg["gc_interval"])
+
+
+def report(cfg, res):
+    bd = res["bd"]
+    days = cfg["days"]
+    print("\n== {} ({:g} dias, {} boots, {} saltos de tempo no gauge)".format(
+        title(cfg), days, res["boots"], res["time_jumps"]))
+    print("{:<11} {:>12} {:>12} {:>14} {:>12} {:>8}".format(
+        "subsistema", "KB/dia", "sessoes/dia", "programado/dia", "apagam./dia", "amplif."))
+    for i, name in enumerate(TAG_NAMES):
+        app = res["bytes"][i] if i < OTHER else 0
+        sessions = res["writes"][i] if i < OTHER else 0
+        if not (app or bd.tag_prog[i] or bd.tag_erases[i]):
+            continue
+        amp = "{:.1f}x".format(bd.tag_prog[i] / app) if app else "-"
+        print("{:<11} {:>12} {:>12.0f} {:>14} {:>12.1f} {:>8}".format(
+            name, _kb(app / days), sessions / days, _kb(bd.tag_prog[i] / days) + " KB",
+            bd.tag_erases[i] / days, amp))
+    app = sum(res["bytes"])
+    prog = sum(bd.tag_prog)
+    print("{:<11} {:>12} {:>12.0f} {:>14} {:>12.1f} {:>8}".format(
+        "total", _kb(app / days), sum(res["writes"]) / days, _kb(prog / days) + " KB",
+        sum(bd.erases) / days, "{:.1f}x".format(prog / app) if app else "-"))
+    per_day, ideal, dynamic = lifetime(cfg, res)
+    print("flash: {} blocos de {} KB, {:.0f} livres em media; {:.2f} apagamentos/bloco/dia, "
+          "bloco mais gasto {} na simulacao".format(
+              bd.block_count, bd.block_size // 1024, res["free_mean"],
+              per_day / bd.block_count, max(bd.erases)))
+    print("vida ({} ciclos): {:.1f} anos com nivelamento ideal, {:.1f} anos so nos blocos livres".format(
+        cfg["endurance"], ideal, dynamic))
+    if res["fs"].meta_overflows:
+        print("AVISO - metadados passaram de meio bloco {} vezes (o littlefs dividiria o "
+              "diretorio; apagamentos de metadados subestimados)".format(res["fs"].meta_overflows))
+
+
+def _floats(text):
+    return [float(v) for v in text.split(",")]
+
+
+def _ints(text):
+    return [int(v) for v in text.split(",")]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Apagamentos da flash por configuracao (littlefs emulado)")
+    ap.add_argument("--days", type=float, default=1.0)
+    ap.add_argument("--format", default="csv,columns", help="csv e/ou columns (lista)")
+    ap.add_argument("--interval", default="1,60", help="SAMPLE_INTERVAL [s] (lista)")
+    ap.add_argument("--gc-interval", default="100", help="amostras entre checkpoints (GC_INTERVAL, lista)")
+    ap.add_argument("--block-lines", type=int, default=32, help="LOG_BLOCK_LINES")
+    ap.add_argument("--column-rows", type=int, default=64, help="COLUMN_BLOCK_ROWS")
+    ap.add_argument("--max-lines", type=int, default=15000, help="LOG_MAX_LINES")
+    ap.add_argument("--event-capacity", type=int, default=256, help="EVENT_CAPACITY")
+    ap.add_argument("--events-per-day", type=float, default=24.0, help="eventos avulsos (LOOP_SLOW)")
+    ap.add_argument("--boots-per-day", type=float, default=0.0, help="resets por queda de energia")
+    ap.add_argument("--pauses-per-day", type=float, default=4.0,
+                    help="pausas do loop sem amostras (o gauge ve um salto de tempo)")
+    ap.add_argument("--pause-s", type=float, default=30.0, help="duracao de cada pausa [s]")
+    ap.add_argument("--no-retention", action="store_true", help="sem RetentionManager")
+    ap.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    ap.add_argument("--blocks", type=int, default=BLOCK_COUNT)
+    ap.add_argument("--prog-size", type=int, default=PROG_SIZE)
+    ap.add_argument("--inline-max", type=int, default=INLINE_MAX)
+    ap.add_argument("--block-cycles", type=int, default=BLOCK_CYCLES)
+    ap.add_argument("--endurance", type=int, default=ENDURANCE, help="ciclos de apagamento por bloco")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    set_level(SILENT)
+    try:
+        formats = args.format.split(",")
+        for f in formats:
+            if f not in ("csv", "columns"):
+                raise ValueError("formato invalido: {}".format(f))
+        combos = list(itertools.product(formats, _floats(args.interval), _ints(args.gc_interval)))
+    except ValueError as e:
+        print("ERRO {}".format(e))
+        return 1
+
+    rows = []
+    for fmt, interval, gc_interval in combos:
+        cfg = {
+            "format": fmt, "interval": interval, "gc_interval": gc_interval,
+            "days": args.days, "block_lines": args.block_lines, "column_rows": args.column_rows,
+            "max_lines": args.max_lines, "event_capacity": args.event_capacity,
+            "events_per_day": args.events_per_day, "boots_per_day": args.boots_per_day,
+            "pauses_per_day": args.pauses_per_day, "pause_s": args.pause_s,
+            "retention": not args.no_retention, "block_size": args.block_size,
+            "blocks": args.blocks, "prog_size": args.prog_size, "inline_max": args.inline_max,
+            "block_cycles": args.block_cycles, "endurance": args.endurance, "seed": args.seed,
+        }
+        res = simulate(cfg)
+        report(cfg, res)
+        rows.append((cfg, res))
+
+    if len(rows) > 1:
+        print("\n== Resumo")
+        print("{:<58} {:>10} {:>10} {:>9} {:>10} {:>10}".format(
+            "configuracao", "KB/dia", "apag./dia", "amplif.", "vida_ideal", "vida_livres"))
+        for cfg, res in rows:
+            app = sum(res["bytes"])
+            prog = sum(res["bd"].tag_prog)
+            per_day, ideal, dynamic = lifetime(cfg, res)
+            print("{:<58} {:>10} {:>10.0f} {:>8.1f}x {:>9.1f}a {:>10.1f}a".format(
+                title(cfg), _kb(app / cfg["days"]), per_day,
+                prog / app if app else math.nan, ideal, dynamic))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+# fleet_ingest.py
+"""
+Ingestao dos logs de varias armadilhas (PC)
+-------------------------------------------
+Junta as descargas de todos os nos (offload_client.py grava uma pasta por
+dispositivo) num armazenamento colunar unico, particionado por no e dia:
+
+    frota/
+        index.csv                 no, dia, linhas, t_first, t_last
+        ingested.csv              arquivos ja processados (tamanho, mtime, crc,
+                                  deslocamento e t_last corrigido)
+        no07/
+            day_00012/timestamp.npy, Vbatt.npy, ... (uma coluna por arquivo)
+            events.csv            uniao dos events.bin baixados (event_view.py)
+            reset_log.txt         uniao dos reset_log.txt (firmware antigo)
+            resets.csv            resets detectados pelo timestamp (log_reader),
+                                  acumulados entre ingestoes
+
+- Um processo por no (multiprocessing.Pool); cada no so escreve na sua pasta.
+- Descargas que se sobrepoem (a mesma porta baixada em sessoes diferentes,
+  .csv e .csv.gz do mesmo arquivo) entram uma vez: o arquivo repetido e
+  escolhido pelo log_reader.LogSet e as linhas repetidas (mesmo timestamp
+  corrigido) sao descartadas ao juntar na particao.
+- Reingestao incremental: um arquivo com o mesmo tamanho e mtime, ou com o
+  mesmo CRC32 (do log_manifest.csv, para os comprimidos, ou do conteudo),
+  nao e lido de novo.
+- O deslocamento de cada arquivo (resets) fica no ingested.csv: um arquivo
+  ja visto mantem o seu e um novo continua do ultimo t_last corrigido do
+  no, mesmo depois que a retencao do Pico apagou os anteriores. Linhas
+  repetidas com valores diferentes (tempo corrigido errado) nao sao
+  perdidas em silencio: o arquivo nao entra no ingested.csv e aparece como
+  conflito no resumo.
+- O dia e o do tempo do dispositivo (timestamp // 86400), ja corrigido dos
+  resets: os nos nao tem relogio de parede.
+
+Uso:
+    python fleet_ingest.py offload/ --store frota/
+    python fleet_ingest.py offload/ descarga_antiga/ --store frota/ --workers 4
+    python fleet_ingest.py --store frota/ --summary
+
+Consulta como biblioteca:
+    from fleet_ingest import FleetStore
+    store = FleetStore("frota/")
+    cols = store.query(["Vbatt", "SoC"], nodes=["no07"], start=86400, end=2 * 86400)
+    cols["no07"]["timestamp"], cols["no07"]["Vbatt"]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+
+from log_io import original_name
+from log_reader import COLUMNS, LogSet, _index_of
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import column_logger as cl  # noqa: E402
+from event_log import EVENT_NAMES, read_file as read_events  # noqa: E402
+
+INDEX_NAME = "index.csv"
+INDEX_HEADER = "node,day,rows,t_first,t_last\n"
+STATE_NAME = "ingested.csv"
+STATE_HEADER = "node,file,size,mtime,crc32,offset_s,t_last\n"
+DAY_S = 86400
+BASES = ("ina_log", "ina_col")
+RESET_LOG = "reset_log.txt"
+EVENT_FILE = "events.bin"
+EVENTS_NAME = "events.csv"
+EVENTS_HEADER = "seq,t_ds,code,name,a,b\n"
+RESETS_NAME = "resets.csv"
+RESETS_HEADER = "file,t_start,shift_s\n"
+
+
+# ----------------------------------------------------------------------
+# Arquivos do armazenamento
+# ----------------------------------------------------------------------
+
+def _read_table(path, n_fields):
+    """Linhas (listas de str) de um CSV pequeno do armazenamento."""
+    rows = []
+    try:
+        with open(path, "r") as f:
+            f.readline()
+            for line in f:
+                parts = line.strip().split(",")
+                if len(parts) == n_fields:
+                    rows.append(parts)
+    except OSError:
+        pass
+    return rows
+
+
+def _write_table(path, header, rows):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(header)
+        for row in rows:
+            f.write(",".join(str(v) for v in row) + "\n")
+    os.replace(tmp, path)
+
+
+def read_index(store):
+    """{(no, dia): (linhas, t_first, t_last)}"""
+    out = {}
+    for node, day, rows, t0, t1 in _read_table(os.path.join(store, INDEX_NAME), 5):
+        out[(node, int(day))] = (int(rows), float(t0), float(t1))
+    return out
+
+
+def read_state(store):
+    """
+    {no: {arquivo: (tamanho, mtime, crc32, deslocamento, t_last)}};
+    deslocamento e t_last sao None nas entradas antigas (5 campos).
+    """
+    path = os.path.join(store, STATE_NAME)
+    out = {}
+    for node, name, size, mtime, crc, offset, t_last in (
+            _read_table(path, 7) + [r + ["", ""] for r in _read_table(path, 5)]):
+        out.setdefault(node, {})[name] = (
+            int(size), int(mtime), int(crc),
+            float(offset) if offset else None, float(t_last) if t_last else None)
+    return out
+
+
+def _resume(state, base):
+    """{indice: (deslocamento, t_last)} dos arquivos ja ingeridos de uma base."""
+    out = {}
+    for key, entry in state.items():
+        i = _index_of(key, base + "_")
+        if i >= 0 and entry[3] is not None:
+            out[i] = (entry[3], entry[4])
+    return out
+
+
+def partition_dir(store, node, day):
+    return os.path.join(store, node, "day_{:05d}".format(day))
+
+
+def read_partition(path, columns=None):
+    """{coluna: np.memmap} de uma particao (somente leitura, sem copia)."""
+    return {c: np.load(os.path.join(path, c + ".npy"), mmap_mode="r")
+            for c in (columns or COLUMNS)}
+
+
+def _write_partition(path, data):
+    """Grava a particao numa pasta nova e troca de uma vez com a antiga."""
+    tmp = path + ".tmp"
+    old = path + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for i, c in enumerate(COLUMNS):
+        np.save(os.path.join(tmp, c + ".npy"), np.ascontiguousarray(data[:, i]))
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _recover(node_dir):
+    """Desfaz uma troca de particao interrompida (ingestao abortada)."""
+    if not os.path.isdir(node_dir):
+        return
+    for name in os.listdir(node_dir):
+        path = os.path.join(node_dir, name)
+        if name.endswith(".tmp"):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.endswith(".old"):
+            final = path[:-len(".old")]
+            if os.path.exists(final):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.replace(path, final)
+
+
+# ----------------------------------------------------------------------
+# Ingestao de um no
+# ----------------------------------------------------------------------
+
+def _seg_files(seg):
+    """Arquivos do disco que formam um segmento (colunar: um por canal)."""
+    if seg["kind"] != "col":
+        return [os.path.join(seg["dir"], seg["name"])]
+    prefix = os.path.join(seg["dir"], seg["name"].rsplit("_", 1)[0])
+    return [p for p in (cl.channel_file(prefix, seg["index"], c) for c in cl.CHANNEL_NAMES)
+            if os.path.exists(p)]
+
+
+def _segment_key(seg):
+    if seg["kind"] == "col":
+        return seg["name"][:-len(".t")]
+    return original_name(seg["name"])
+
+
+def _identity_crc(logs, seg, files):
+    """CRC32 do CSV original (manifesto) ou do conteudo dos arquivos."""
+    entry = logs.manifest.get(seg["name"])
+    if entry is not None and seg["name"] != original_name(seg["name"]):
+        return entry[1]
+    crc = 0
+    for path in files:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _merge(existing, new):
+    """
+    Junta, ordena pelo tempo e descarta timestamps repetidos (fica o antigo).
+
+    Returns:
+        (dados, repetidas, mascara das linhas de new repetidas com valores
+         diferentes da que ficou)
+    """
+    data = new if existing is None else np.concatenate([existing, new])
+    key = np.round(data[:, 0] * 100).astype(np.int64)
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    kept = data[first]
+    dropped = np.ones(len(data), dtype=bool)
+    dropped[first] = False
+    other = kept[inverse.ravel()]
+    differ = (data != other) & ~(np.isnan(data) & np.isnan(other))
+    conflict = dropped & differ.any(axis=1)
+    return kept, len(data) - len(first), conflict[len(data) - len(new):]
+
+
+def _merge_text(dirs, name, dest):
+    """
+    reset_log.txt so cresce no dispositivo: cada descarga e um prefixo da
+    outra. Fica a mais longa; uma que nao continua a atual (log apagado
+    no Pico) e acrescentada no fim.
+    """
+    try:
+        with open(dest, "r") as f:
+            current = f.read()
+    except OSError:
+        current = ""
+    merged = current
+    for d in dirs:
+        try:
+            with open(os.path.join(d, name), "r") as f:
+                text = f.read()
+        except OSError:
+            continue
+        if text.startswith(merged):
+            merged = text
+        elif not merged.startswith(text):
+            merged += text if text.endswith("\n") else text + "\n"
+    if merged != current:
+        with open(dest + ".tmp", "w") as f:
+            f.write(merged)
+        os.replace(dest + ".tmp", dest)
+
+
+def _merge_events(dirs, dest):
+    """
+    Junta os registros dos events.bin baixados com os ja guardados: o anel
+    do Pico sobrescreve os antigos, o events.csv do no guarda todos.
+    """
+    rows = set()
+    for seq, t_ds, code, _, a, b in _read_table(dest, 6):
+        rows.add((int(seq), int(t_ds), int(code), int(a), int(b)))
+    for d in dirs:
+        path = os.path.join(d, EVENT_FILE)
+        if not os.path.exists(path):
+            continue
+        try:
+            rows.update(read_events(path)[1])
+        except ValueError as e:
+            print("AVISO - {}".format(e), file=sys.stderr)
+    _write_table(dest, EVENTS_HEADER,
+                 [(seq, t, code, EVENT_NAMES.get(code, code), a, b)
+                  for seq, t, code, a, b in sorted(rows)])
+
+
+def _merge_resets(resets, dest):
+    """
+    Acrescenta os resets novos ao resets.csv do no. Os de arquivos ja
+    ingeridos nao sao recalculados (o deslocamento vem do ingested.csv),
+    entao os antigos so existem aqui.
+    """
+    rows = {row[0]: row for row in _read_table(dest, 3)}
+    for name, t, shift in resets:
+        rows[name] = [name, "{:.2f}".format(t), "{:.2f}".format(shift)]
+    _write_table(dest, RESETS_HEADER, sorted(rows.values(), key=lambda r: float(r[1])))
+
+
+def ingest_node(task):
+    """
+    Processa as pastas de um no (roda num processo do Pool).
+
+    Args:
+        task: (no, pastas, armazenamento, {arquivo: (tamanho, mtime, crc,
+              deslocamento, t_last)} ja ingeridos, reset_gap_s)
+
+    Returns:
+        (no, {dia: (linhas, t_first, t_last)}, {arquivo: (tamanho, mtime, crc,
+         deslocamento, t_last)}, estatisticas, erro ou None)
+    """
+    node, dirs, store, state, reset_gap_s = task
+    node_dir = os.path.join(store, node)
+    parts = {}
+    files = {}
+    stats = {"new": 0, "skipped": 0, "rows": 0, "dups": 0, "resets": 0, "conflicts": 0}
+    pending = {}   # dia -> [(arquivo, matriz)]
+    conflicted = set()
+
+    def flush(before=None):
+        for day in sorted(pending):
+            if before is not None and day >= before:
+                continue
+            path = partition_dir(store, node, day)
+            existing = None
+            if os.path.isdir(path):
+                cols = read_partition(path)
+                existing = np.column_stack([cols[c] for c in COLUMNS])
+            chunks = pending.pop(day)
+            data, dups, conflict = _merge(existing, np.concatenate([m for _, m in chunks]))
+            _write_partition(path, data)
+            stats["dups"] += dups
+            stats["conflicts"] += int(conflict.sum())
+            pos = 0
+            for key, m in chunks:
+                if conflict[pos:pos + len(m)].any():
+                    conflicted.add(key)
+                pos += len(m)
+            parts[day] = (len(data), float(data[0, 0]), float(data[-1, 0]))
+
+    try:
+        os.makedirs(node_dir, exist_ok=True)
+        _recover(node_dir)
+        resets = []
+        for base in BASES:
+            if not any(n.startswith(base + "_") for d in dirs for n in os.listdir(d)):
+                continue
+            logs = LogSet(dirs, base, cache=False, reset_gap_s=reset_gap_s,
+                          resume=_resume(state, base))
+            resets.extend(logs.resets)
+            for seg in logs.segments:
+                key = _segment_key(seg)
+                seg_files = _seg_files(seg)
+                stat = (sum(os.path.getsize(p) for p in seg_files),
+                        int(max(os.path.getmtime(p) for p in seg_files)))
+                old = state.get(key)
+                placed = (float(seg["offset"]), float(seg["t_last"]))
+                if old is not None and old[:2] == stat:
+                    files[key] = old[:3] + placed
+                    stats["skipped"] += 1
+                    continue
+                crc = _identity_crc(logs, seg, seg_files)
+                files[key] = stat + (crc,) + placed
+                if old is not None and old[2] == crc:
+                    stats["skipped"] += 1
+                    continue
+                data = logs.read_segment(seg)
+                stats["new"] += 1
+                if not len(data):
+                    continue
+                stats["rows"] += len(data)
+                days = np.floor(data[:, 0] / DAY_S).astype(np.int64)
+                for day in np.unique(days):
+                    pending.setdefault(int(day), []).append((key, data[days == day]))
+                # Tempo corrigido so avanca: dias anteriores ja estao completos
+                flush(before=int(days[-1]))
+            flush()
+        # Com conflito o arquivo nao entra no estado: volta na proxima vez
+        for key in conflicted:
+            files.pop(key, None)
+        stats["resets"] = len(resets)
+        _merge_resets(resets, os.path.join(node_dir, RESETS_NAME))
+        _merge_text(dirs, RESET_LOG, os.path.join(node_dir, RESET_LOG))
+        _merge_events(dirs, os.path.join(node_dir, EVENTS_NAME))
+    except (OSError, ValueError, EOFError) as e:
+        # Particoes gravadas antes do erro valem; os arquivos nao entram no
+        # estado e sao reprocessados na proxima vez (repetidos sao descartados)
+        return node, parts, {}, stats, str(e)
+    return node, parts, files, stats, None
+
+
+# ----------------------------------------------------------------------
+# Frota
+# ----------------------------------------------------------------------
+
+def _has_logs(directory):
+    try:
+        return any(n.startswith(tuple(b + "_" for b in BASES)) for n in os.listdir(directory))
+    except OSError:
+        return False
+
+
+def find_nodes(roots):
+    """
+    {no: [pastas]}. Uma raiz com logs e um no (nome da pasta); senao cada
+    subpasta com logs e um no. O mesmo nome em raizes diferentes junta.
+    """
+    nodes = {}
+    for root in roots:
+        root = os.path.normpath(root)
+        if _has_logs(root):
+            nodes.setdefault(os.path.basename(os.path.abspath(root)), []).append(root)
+            continue
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isdir(path) and _has_logs(path):
+                nodes.setdefault(name, []).append(path)
+    return nodes
+
+
+def ingest(roots, store, workers=None, reset_gap_s=None):
+    """
+    Ingere as descargas de todas as raizes em store.
+
+    Returns:
+        lista de (no, estatisticas, erro ou None), na ordem dos nos
+    """
+    os.makedirs(store, exist_ok=True)
+    nodes = find_nodes(roots)
+    state = read_state(store)
+    index = read_index(store)
+    tasks = [(node, dirs, store, state.get(node, {}), reset_gap_s)
+             for node, dirs in sorted(nodes.items())]
+    if workers == 1 or len(tasks) < 2:
+        results = [ingest_node(t) for t in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            results = list(pool.imap_unordered(ingest_node, tasks))
+
+    report = []
+    for node, parts, files, stats, error in sorted(results, key=lambda r: r[0]):
+        for day, entry in parts.items():
+            index[(node, day)] = entry
+        state.setdefault(node, {}).update(files)
+        report.append((node, stats, error))
+    _write_table(os.path.join(store, INDEX_NAME), INDEX_HEADER,
+                 [(node, day, rows, "{:.2f}".format(t0), "{:.2f}".format(t1))
+                  for (node, day), (rows, t0, t1) in sorted(index.items())])
+    _write_table(os.path.join(store, STATE_NAME), STATE_HEADER,
+                 [(node, name) + entry[:3] + tuple("" if v is None else "{:.2f}".format(v)
+                                                   for v in entry[3:])
+                  for node in sorted(state) for name, entry in sorted(state[node].items())])
+    return report
+
+
+class FleetStore:
+    """Consulta ao armazenamento: so as particoes que cruzam a janela."""
+
+    def __init__(self, store):
+        self.store = store
+        self.index = read_index(store)
+
+    def nodes(self):
+        return sorted(set(node for node, _ in self.index))
+
+    def partitions(self, nodes=None, start=None, end=None):
+        """[(no, dia, linhas, t_first, t_last)] em ordem de no e tempo."""
+        out = []
+        for (node, day), (rows, t0, t1) in sorted(self.index.items()):
+            if nodes is not None and node not in nodes:
+                continue
+            if (start is not None and t1 < start) or (end is not None and t0 > end):
+                continue
+            out.append((node, day, rows, t0, t1))
+        return out
+
+    def query(self, columns=None, nodes=None, start=None, end=None):
+        """
+        Returns:
+            {no: {coluna: np.ndarray}} com "timestamp" sempre presente; so a
+            janela [start, end] e copiada das particoes (memmap)
+        """
+        names = ["timestamp"] + [c for c in (columns or COLUMNS) if c != "timestamp"]
+        parts = {}
+        for node, day, _, _, _ in self.partitions(nodes, start, end):
+            cols = read_partition(partition_dir(self.store, node, day), names)
+            t = cols["timestamp"]
+            lo = 0 if start is None else int(np.searchsorted(t, start, "left"))
+            hi = len(t) if end is None else int(np.searchsorted(t, end, "right"))
+            if hi > lo:
+                dest = parts.setdefault(node, {c: [] for c in names})
+                for c in names:
+                    dest[c].append(cols[c][lo:hi])
+        return {node: {c: np.concatenate(v) for c, v in cols.items()}
+                for node, cols in parts.items()}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Ingestao dos logs de varios nos num armazenamento colunar")
+    ap.add_argument("roots", nargs="*", help="pastas de descarga (uma subpasta por no)")
+    ap.add_argument("--store", required=True, help="pasta do armazenamento")
+    ap.add_argument("--workers", type=int, default=None, help="processos (padrao: todos os nucleos)")
+    ap.add_argument("--reset-gap", type=float, default=None,
+                    help="intervalo (s) inserido num reset; padrao: o de amostragem")
+    ap.add_argument("--summary", action="store_true", help="so mostra o que ja esta no armazenamento")
+    args = ap.parse_args(argv)
+
+    status = 0
+    if not args.summary:
+        if not args.roots:
+            ap.error("informe as pastas de descarga (ou --summary)")
+        for node, stats, error in ingest(args.roots, args.store, args.workers, args.reset_gap):
+            print("{}: {} arquivos novos, {} sem mudanca, {} linhas ({} repetidas), {} resets".format(
+                node, stats["new"], stats["skipped"], stats["rows"], stats["dups"], stats["resets"]))
+            if stats["conflicts"]:
+                print("AVISO - {}: {} linhas com o timestamp de outra e valores diferentes "
+                      "nao foram gravadas; os arquivos serao lidos de novo".format(
+                          node, stats["conflicts"]))
+            if error:
+                print("ERRO {}: {}".format(node, error))
+                status = 1
+    store = FleetStore(args.store)
+    for node in store.nodes():
+        parts = store.partitions([node])
+        print("{:<12} {:>4} dias {:>10} linhas  {:.2f} s .. {:.2f} s".format(
+            node, len(parts), sum(p[2] for p in parts), parts[0][3], parts[-1][4]))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
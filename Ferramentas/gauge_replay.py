@@ -0,0 +1,371 @@
+# gauge_replay.py
+"""
+Replay vetorizado do BatteryGauge (PC)
+--------------------------------------
+Reimplementa em NumPy o mesmo algoritmo de Codes/battery_gauge.py
+(coulomb counting + ancoragem + mistura OCV em repouso + deteccao de
+salto de tempo), para reprocessar meses de CSV em milissegundos e
+varrer milhares de conjuntos de parametros em paralelo.
+
+Como funciona: cada passo do gauge e uma funcao monotona da forma
+    f(x) = min(max(a*x + b, L), H)      com a >= 0
+e essa familia e fechada por composicao. O SoC em cada amostra e a
+composicao acumulada dessas funcoes, calculada com um scan associativo
+(log2(N) passadas NumPy), sem laco Python por amostra.
+
+A tabela OCV e a mesma compilada pelo BatteryGauge do dispositivo
+(importado de Codes/). A diferenca para o replay escalar com a classe
+original e apenas de arredondamento de ponto flutuante (< 1e-9 %);
+use --check para conferir.
+
+Uso:
+    python gauge_replay.py ina_log_*.csv --check
+    python gauge_replay.py ina_log_*.csv \\
+        --sweep capacity_mAh=10000:16000:13 blend_alpha=0.01,0.05,0.1 \\
+        --workers 8
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+from battery_gauge import BatteryGauge, OCV_LUT_STEP_C  # noqa: E402
+from log_io import report_damage  # noqa: E402
+from log_reader import COLUMNS as CSV_COLUMNS, read_csv  # noqa: E402
+
+# Tolerancia documentada entre replay vetorizado e BatteryGauge.update
+REPLAY_TOLERANCE_PCT = 1e-9
+
+_BIG = 1e18
+
+# Parametros aceitos por replay() e seus valores padrao (iguais ao dispositivo)
+DEFAULT_PARAMS = {
+    "capacity_mAh": 15000.0,
+    "v_full": 3.75,
+    "v_empty": 2.90,
+    "rest_current_thresh_C": 0.02,
+    "blend_alpha": 0.05,
+    "sample_interval_s": None,   # None = intervalo mediano do log
+    "ocv_points": None,
+    "ocv_curves": None,
+}
+
+def load_csv(paths):
+    """
+    Le um ou mais ina_log_NNN.csv (na ordem dada) em colunas NumPy.
+    Aceita tambem os comprimidos pelo Pico (.csv.gz, .csv.dv); cada
+    arquivo e lido uma vez e depois vem do cache (log_reader.read_csv).
+
+    Returns:
+        dict {nome_da_coluna: np.ndarray float64}, nomes de CSV_COLUMNS
+    """
+    parts = []
+    for path in paths:
+        # Blocos danificados (CRC) sao pulados e avisados, sem abortar
+        damaged = []
+        data = read_csv(path, damaged=damaged)
+        report_damage(damaged)
+        if data.size:
+            parts.append(data)
+    if not parts:
+        return {name: np.empty(0) for name in CSV_COLUMNS}
+    data = np.concatenate(parts)
+    return {name: data[:, i] for i, name in enumerate(CSV_COLUMNS)}
+
+
+def battery_temperature(cols):
+    """Mesma regra do main.py: Temp_ext, ou Temp_int se o HDC1080 falhou."""
+    ext = cols["Temp_ext"]
+    return np.where(np.isnan(ext), cols["Temp_int"], ext)
+
+
+def sample_interval(cols):
+    """SAMPLE_INTERVAL do log: intervalo mediano entre amostras (1 s sem dados)."""
+    d = np.diff(cols["timestamp"])
+    d = d[d > 0]
+    return float(np.median(d)) if d.size else 1.0
+
+
+def _make_gauge(params, cols=None):
+    """
+    Instancia o BatteryGauge do dispositivo com os parametros dados.
+    Sem sample_interval_s, o limite de salto de tempo sai do intervalo
+    mediano de cols (como no dispositivo, que recebe SAMPLE_INTERVAL).
+    """
+    p = dict(DEFAULT_PARAMS)
+    p.update(params)
+    interval = p["sample_interval_s"]
+    if interval is None:
+        interval = sample_interval(cols) if cols is not None else 1.0
+    g = BatteryGauge(capacity_mAh=p["capacity_mAh"],
+                     v_full=p["v_full"],
+                     v_empty=p["v_empty"],
+                     rest_current_thresh_C=p["rest_current_thresh_C"],
+                     blend_alpha=p["blend_alpha"],
+                     ocv_curves=p["ocv_curves"],
+                     sample_interval_s=interval)
+    if p["ocv_points"] is not None:
+        g.ocv_points = list(p["ocv_points"])
+        g.compile_ocv()
+    return g
+
+
+def soc_from_ocv(gauge, v, temp_c=None):
+    """Versao vetorizada de BatteryGauge._soc_from_ocv (mesma aritmetica)."""
+    lut = np.frombuffer(gauge._ocv_lut, dtype=np.uint16).astype(np.float64)
+    n_v = gauge._ocv_n_v
+    n_t = gauge._ocv_n_t
+    x = (np.asarray(v, dtype=np.float64) - gauge._ocv_v_min) * gauge._ocv_inv_step
+
+    def at_row(row, x):
+        i = np.clip(x.astype(np.int64), 0, n_v - 2) if n_v > 1 else np.zeros_like(x, dtype=np.int64)
+        base = row * n_v + i
+        s0 = lut[base]
+        s1 = lut[np.minimum(base + 1, lut.size - 1)]
+        mid = (s0 + (x - i) * (s1 - s0)) * 0.01
+        first = lut[row * n_v] * 0.01
+        last = lut[row * n_v + n_v - 1] * 0.01
+        return np.where(x <= 0.0, first, np.where(x >= n_v - 1, last, mid))
+
+    if n_t == 1 or temp_c is None:
+        row = 0
+        if n_t > 1:
+            row = int((25.0 - gauge._ocv_t_min) / OCV_LUT_STEP_C + 0.5)
+            row = max(0, min(n_t - 1, row))
+        return at_row(np.full(x.shape, row, dtype=np.int64), x)
+
+    t = np.broadcast_to(np.asarray(temp_c, dtype=np.float64), x.shape)
+    no_t = np.isnan(t)
+    row25 = max(0, min(n_t - 1, int((25.0 - gauge._ocv_t_min) / OCV_LUT_STEP_C + 0.5)))
+    y = (np.where(no_t, 0.0, t) - gauge._ocv_t_min) / OCV_LUT_STEP_C
+    j = np.clip(np.floor(y).astype(np.int64), 0, n_t - 1)
+    j1 = np.minimum(j + 1, n_t - 1)
+    s0 = at_row(j, x)
+    s1 = at_row(j1, x)
+    out = s0 + (y - j) * (s1 - s0)
+    out = np.where(y <= 0.0, at_row(np.zeros_like(j), x), out)
+    out = np.where(y >= n_t - 1, at_row(np.full_like(j, n_t - 1), x), out)
+    return np.where(no_t, at_row(np.full_like(j, row25), x), out)
+
+
+def _compose(first, then):
+    """Composicao then(first(x)) de funcoes clip(a*x + b, L, H)."""
+    a1, b1, l1, h1 = first
+    a2, b2, l2, h2 = then
+    lo = np.clip(a2 * l1 + b2, l2, h2)
+    hi = np.clip(a2 * h1 + b2, l2, h2)
+    return (a2 * a1, a2 * b1 + b2, lo, hi)
+
+
+def _step_functions(t, v, i_mA, temp_c, gauge):
+    """Constroi, por amostra, a funcao de transicao do gauge."""
+    n = t.size
+    ocv = soc_from_ocv(gauge, v, temp_c)
+
+    prev_t = np.empty(n)
+    prev_t[0] = t[0]
+    prev_t[1:] = t[:-1]
+    # Dispositivo usa (self._last_t or t): _last_t == 0.0 conta como ausente
+    prev_t = np.where(prev_t == 0.0, t, prev_t)
+    dt = t - prev_t
+    reset = (dt < 0) | (dt > gauge._max_reasonable_dt)
+    reset[0] = True
+    dt = np.clip(dt, 0.0, gauge._max_reasonable_dt)
+
+    dq_mAh = (i_mA * dt) / 3600.0
+    d = 100.0 * (dq_mAh / gauge.capacity_mAh)
+
+    ones = np.ones(n)
+    f = (ones, -d, np.full(n, -_BIG), np.full(n, _BIG))
+
+    full = v >= (gauge.v_full - 0.02)
+    f = _compose(f, (ones, np.zeros(n), np.where(full, 99.0, -_BIG), np.full(n, _BIG)))
+    empty = v <= (gauge.v_empty + 0.02)
+    f = _compose(f, (ones, np.zeros(n), np.full(n, -_BIG), np.where(empty, 1.0, _BIG)))
+
+    alpha = gauge.blend_alpha
+    rest = np.abs(i_mA) <= gauge.rest_thresh_mA
+    f = _compose(f, (np.where(rest, 1.0 - alpha, 1.0),
+                     np.where(rest, alpha * ocv, 0.0),
+                     np.full(n, -_BIG), np.full(n, _BIG)))
+    f = _compose(f, (ones, np.zeros(n), np.zeros(n), np.full(n, 100.0)))
+
+    # Inicializacao/reset: SoC = OCV, ignora o estado anterior
+    a, b, lo, hi = f
+    a = np.where(reset, 0.0, a)
+    b = np.where(reset, ocv, b)
+    lo = np.where(reset, -_BIG, lo)
+    hi = np.where(reset, _BIG, hi)
+    return a, b, lo, hi, reset
+
+
+def replay(cols, params=None, gauge=None):
+    """
+    Reprocessa um log inteiro com o algoritmo do gauge, sem laco por amostra.
+
+    Args:
+        cols: dict de colunas (ver load_csv)
+        params: dict de parametros (ver DEFAULT_PARAMS)
+        gauge: BatteryGauge ja configurado (opcional, substitui params)
+
+    Returns:
+        np.ndarray com o SoC [%] em cada amostra
+    """
+    if gauge is None:
+        gauge = _make_gauge(params or {}, cols)
+    t = cols["timestamp"]
+    if t.size == 0:
+        return np.empty(0)
+    a, b, lo, hi, _ = _step_functions(t, cols["Vbatt"], cols["Ibatt_mA"],
+                                      battery_temperature(cols), gauge)
+
+    # Scan inclusivo de Hillis-Steele: F[i] = f[i] o ... o f[0]
+    n = t.size
+    k = 1
+    while k < n:
+        a[k:], b[k:], lo[k:], hi[k:] = _compose((a[:-k], b[:-k], lo[:-k], hi[:-k]),
+                                                (a[k:], b[k:], lo[k:], hi[k:]))
+        k <<= 1
+
+    # f[0] e constante (inicializacao pelo OCV), entao F[i](0) e o SoC
+    return np.clip(b, lo, hi)
+
+
+def replay_reference(cols, params=None):
+    """Replay escalar com a classe original do dispositivo (para conferencia)."""
+    gauge = _make_gauge(params or {}, cols)
+    temp = battery_temperature(cols)
+    out = np.empty(cols["timestamp"].size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for k in range(out.size):
+            out[k] = gauge.update(voltage_V=float(cols["Vbatt"][k]),
+                                  current_mA=float(cols["Ibatt_mA"][k]),
+                                  now_s=float(cols["timestamp"][k]),
+                                  temp_c=float(temp[k]))
+    return out
+
+
+def rest_error(cols, soc, params=None, min_rest_samples=30):
+    """
+    Erro RMS entre SoC reproduzido e SoC pela OCV nas amostras em repouso
+    prolongado (|Ibatt| abaixo do limiar por min_rest_samples seguidas).
+    """
+    gauge = _make_gauge(params or {})
+    rest = np.abs(cols["Ibatt_mA"]) <= gauge.rest_thresh_mA
+    # Comprimento da sequencia de repouso terminando em cada amostra
+    idx = np.arange(rest.size)
+    last_break = np.maximum.accumulate(np.where(rest, -1, idx))
+    run = idx - last_break
+    mask = rest & (run >= min_rest_samples)
+    if not mask.any():
+        return float("nan")
+    ocv = soc_from_ocv(gauge, cols["Vbatt"][mask], battery_temperature(cols)[mask])
+    return float(np.sqrt(np.mean((soc[mask] - ocv) ** 2)))
+
+
+# Colunas e referencia do sweep em cada processo do Pool: enviadas uma vez
+# pelo initializer, nao a cada combinacao
+_shared = {}
+
+
+def _init_worker(cols, reference):
+    _shared["cols"] = cols
+    _shared["reference"] = reference
+
+
+def _evaluate(params):
+    cols, reference = _shared["cols"], _shared["reference"]
+    soc = replay(cols, params)
+    if reference is not None:
+        err = float(np.sqrt(np.nanmean((soc - reference) ** 2)))
+    else:
+        err = rest_error(cols, soc, params)
+    return err, params
+
+
+def sweep(cols, grid, reference=None, workers=None, chunksize=16):
+    """
+    Avalia todas as combinacoes de parametros em paralelo.
+
+    Args:
+        cols: dict de colunas (ver load_csv)
+        grid: dict {parametro: lista de valores}
+        reference: SoC de referencia (ex.: ensaio de bancada); sem ele,
+            usa o erro em repouso contra a OCV (rest_error)
+        workers: numero de processos (padrao: todos os nucleos)
+
+    Returns:
+        lista de (erro, params) ordenada do melhor para o pior
+    """
+    names = sorted(grid)
+    combos = [dict(zip(names, values))
+              for values in itertools.product(*(grid[n] for n in names))]
+    if workers == 1 or len(combos) < 2:
+        _init_worker(cols, reference)
+        try:
+            results = [_evaluate(p) for p in combos]
+        finally:
+            _shared.clear()
+    else:
+        with Pool(processes=workers, initializer=_init_worker,
+                  initargs=(cols, reference)) as pool:
+            results = pool.map(_evaluate, combos, chunksize=chunksize)
+    return sorted(results, key=lambda r: (np.isnan(r[0]), r[0]))
+
+
+def _parse_grid(specs):
+    """Converte 'nome=ini:fim:n' ou 'nome=v1,v2,...' em dict de listas."""
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in DEFAULT_PARAMS or name.startswith("ocv_"):
+            raise ValueError("Parametro desconhecido: {}".format(name))
+        if ":" in values:
+            start, stop, num = values.split(":")
+            grid[name] = [float(x) for x in np.linspace(float(start), float(stop), int(num))]
+        else:
+            grid[name] = [float(x) for x in values.split(",")]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay/ajuste do BatteryGauge sobre CSVs")
+    parser.add_argument("files", nargs="+", help="ina_log_NNN.csv, em ordem")
+    parser.add_argument("--check", action="store_true",
+                        help="compara com o replay escalar da classe original")
+    parser.add_argument("--sweep", nargs="*", default=[],
+                        help="nome=ini:fim:n ou nome=v1,v2,...")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    cols = load_csv(args.files)
+    print("Amostras: {}".format(cols["timestamp"].size))
+
+    soc = replay(cols)
+    print("SoC final (replay): {:.2f}%".format(soc[-1] if soc.size else float("nan")))
+
+    if args.check:
+        ref = replay_reference(cols)
+        err = float(np.max(np.abs(ref - soc))) if soc.size else 0.0
+        status = "OK" if err <= REPLAY_TOLERANCE_PCT else "DIVERGENTE"
+        print("Max |vetorizado - escalar|: {:.3g}% ({})".format(err, status))
+
+    if args.sweep:
+        grid = _parse_grid(args.sweep)
+        results = sweep(cols, grid, workers=args.workers)
+        print("\n{} combinacoes avaliadas. Melhores:".format(len(results)))
+        for err, params in results[:args.top]:
+            print("  erro {:.3f}% | {}".format(err, params))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
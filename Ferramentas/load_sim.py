@@ -0,0 +1,195 @@
+# load_sim.py
+"""
+Simulacao do escalonador de cargas (PC)
+---------------------------------------
+Roda o LoadScheduler do dispositivo (Codes/load_scheduler.py), com o
+SocForecaster e o BatteryGauge, contra um perfil sintetico de sol e
+consumo, e compara com as cargas sempre ligadas. Serve para ajustar
+limiares e cotas antes de gravar no Pico.
+
+Modelo (passo --dt, o SAMPLE_INTERVAL do Pico):
+    - painel: corrente de carga de pico * sin(pi * (h - 6) / 12) entre
+      6 h e 18 h, vezes o fator de nuvens do dia (--clouds, ciclico)
+    - consumo fixo do no (--base-mA) + cargas ligadas, na bateria
+    - bateria: SoC verdadeiro pela corrente liquida (consumo - painel);
+      tensao = OCV(SoC) - corrente liquida * --r-int (a curva do gauge)
+    - o gauge ve o que o Pico ve: essa tensao e so a corrente de consumo
+      (o painel nao e medido); escalonador e previsao usam o SoC do gauge
+    - SoC verdadeiro = 0 e brownout: o no e as cargas desligam e so
+      voltam com SoC >= --restart-soc (gauge novo, pela OCV)
+
+Uso:
+    python load_sim.py --days 7 --clouds 1,0.3,0.1,0.1,0.8
+    python load_sim.py --load camera:600:40:50:0.25:0 --load pc:350:25:35:1:1:6
+"""
+
+import argparse
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+from battery_gauge import BatteryGauge  # noqa: E402
+from console import set_level, SILENT  # noqa: E402
+from load_scheduler import Load, LoadScheduler  # noqa: E402
+from soc_forecast import SocForecaster  # noqa: E402
+
+# Mesmas politicas padrao de LOADS em main.py:
+# nome:mA:soc_off:soc_on:duty:prioridade[:reserva_h]
+DEFAULT_LOADS = ("camera:600:40:50:0.25:0", "pc:350:25:35:1:1")
+R_INT_OHM = 0.10            # resistencia interna (como em power_fault.py)
+
+
+def parse_load(spec):
+    """'nome:mA:soc_off:soc_on:duty:prioridade[:reserva_h]' -> (Load, mA)."""
+    parts = spec.split(":")
+    if len(parts) not in (6, 7):
+        raise ValueError("carga invalida: {}".format(spec))
+    reserve_h = float(parts[6]) if len(parts) == 7 else 0.0
+    load = Load(parts[0], priority=int(parts[5]), soc_off=float(parts[2]),
+                soc_on=float(parts[3]), duty=float(parts[4]),
+                reserve_s=reserve_h * 3600)
+    return load, float(parts[1])
+
+
+def solar_mA(t_s, peak_mA, clouds):
+    """Corrente do painel no instante t_s (dia 0 comeca a meia-noite)."""
+    day = int(t_s // 86400)
+    h = (t_s % 86400) / 3600.0
+    if not 6.0 <= h <= 18.0:
+        return 0.0
+    return peak_mA * clouds[day % len(clouds)] * math.sin(math.pi * (h - 6.0) / 12.0)
+
+
+def ocv(soc, points):
+    """Tensao de circuito aberto pela curva (V, SoC) do gauge."""
+    for k in range(1, len(points)):
+        v1, s1 = points[k]
+        if soc <= s1:
+            v0, s0 = points[k - 1]
+            return v0 + (v1 - v0) * (soc - s0) / (s1 - s0)
+    return points[-1][0]
+
+
+def simulate(specs, days, clouds, peak_mA, base_mA, capacity_mAh, soc0,
+             dt=60.0, restart_soc=2.0, scheduled=True, r_int=R_INT_OHM):
+    """
+    Simula days dias.
+
+    Returns:
+        dict com listas por dia (soc_min verdadeiro, erro maximo do gauge,
+        horas ligadas por carga, horas sem energia) e totais (brownouts,
+        trocas)
+    """
+    points = sorted(BatteryGauge().ocv_points, key=lambda p: p[1])
+
+    def boot():
+        # Como no Pico: tudo novo a cada boot, cargas desligadas
+        parsed = [parse_load(s) for s in specs]
+        fc = SocForecaster(capacity_mAh=capacity_mAh)
+        gauge = BatteryGauge(capacity_mAh=capacity_mAh, sample_interval_s=dt)
+        return [p[0] for p in parsed], [p[1] for p in parsed], fc, \
+            LoadScheduler([p[0] for p in parsed], forecast=fc), gauge
+
+    loads, draw, forecast, sched, gauge = boot()
+    switches = 0
+    soc = soc0
+    alive = True
+    brownouts = 0
+    per_day = []
+    day_stats = None
+    steps = int(days * 86400 / dt)
+    for k in range(steps):
+        t = k * dt
+        if k % int(86400 / dt) == 0:
+            day_stats = {"soc_min": soc, "gauge_err": 0.0,
+                         "on_h": [0.0] * len(loads), "dead_h": 0.0}
+            per_day.append(day_stats)
+
+        solar = solar_mA(t, peak_mA, clouds)
+        if alive:
+            # Medicao com o estado anterior das chaves, como no Pico: o
+            # gauge so ve a tensao e o consumo
+            iload = base_mA + sum(d for ld, d in zip(loads, draw) if ld.on)
+            vbatt = ocv(soc, points) - (iload - solar) * r_int / 1000.0
+            soc_est = gauge.update(voltage_V=vbatt, current_mA=iload, now_s=t)
+            day_stats["gauge_err"] = max(day_stats["gauge_err"], abs(soc_est - soc))
+            if scheduled:
+                forecast.update(soc_est, iload, t)
+                switches += sched.update(soc_est, iload, t)
+                on = [ld.on for ld in loads]
+            else:
+                on = [True] * len(loads)
+            iload = base_mA + sum(d for d, o in zip(draw, on) if o)
+            for i, o in enumerate(on):
+                if o:
+                    day_stats["on_h"][i] += dt / 3600.0
+        else:
+            iload = 0.0
+            day_stats["dead_h"] += dt / 3600.0
+
+        soc -= (iload - solar) * dt / 3600.0 / capacity_mAh * 100.0
+        soc = max(0.0, min(100.0, soc))
+        day_stats["soc_min"] = min(day_stats["soc_min"], soc)
+
+        if alive and soc <= 0.0:
+            alive = False
+            brownouts += 1
+        elif not alive and soc >= restart_soc:
+            alive = True
+            loads, draw, forecast, sched, gauge = boot()
+
+    return {"names": [ld.name for ld in loads], "days": per_day,
+            "brownouts": brownouts, "switches": switches, "soc_end": soc}
+
+
+def report(title, res):
+    print("\n== {}".format(title))
+    names = res["names"]
+    print("dia  SoC_min  erro_gauge  " + "  ".join("{:>8}".format(n + "_h") for n in names)
+          + "  sem_energia_h")
+    for i, d in enumerate(res["days"]):
+        print("{:>3}  {:>6.1f}%  {:>9.1f}%  ".format(i, d["soc_min"], d["gauge_err"])
+              + "  ".join("{:>8.1f}".format(h) for h in d["on_h"])
+              + "  {:>13.1f}".format(d["dead_h"]))
+    print("brownouts: {} | trocas: {} | SoC final: {:.1f}%".format(
+        res["brownouts"], res["switches"], res["soc_end"]))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Escalonador de cargas contra perfil solar simulado")
+    ap.add_argument("--days", type=float, default=7)
+    ap.add_argument("--clouds", default="1,0.3,0.1,0.1,0.8",
+                    help="fator de sol por dia, ciclico (1 = ceu limpo)")
+    ap.add_argument("--solar-peak-mA", type=float, default=2500.0)
+    ap.add_argument("--base-mA", type=float, default=25.0, help="consumo do proprio no")
+    ap.add_argument("--capacity", type=float, default=15000.0, help="mAh")
+    ap.add_argument("--soc0", type=float, default=60.0)
+    ap.add_argument("--dt", type=float, default=60.0, help="intervalo de amostragem do Pico (s)")
+    ap.add_argument("--r-int", type=float, default=R_INT_OHM, help="resistencia interna (ohm)")
+    ap.add_argument("--load", action="append",
+                    help="nome:mA:soc_off:soc_on:duty:prioridade[:reserva_h]")
+    args = ap.parse_args(argv)
+
+    set_level(SILENT)
+    specs = args.load or list(DEFAULT_LOADS)
+    try:
+        clouds = [float(c) for c in args.clouds.split(",")]
+        common = dict(days=args.days, clouds=clouds, peak_mA=args.solar_peak_mA,
+                      base_mA=args.base_mA, capacity_mAh=args.capacity,
+                      soc0=args.soc0, dt=args.dt, r_int=args.r_int)
+        res = simulate(specs, scheduled=True, **common)
+        base = simulate(specs, scheduled=False, **common)
+    except ValueError as e:
+        print("ERRO {}".format(e))
+        return 1
+    report("Com escalonador", res)
+    report("Cargas sempre ligadas", base)
+    dead = sum(d["dead_h"] for d in res["days"])
+    dead_base = sum(d["dead_h"] for d in base["days"])
+    print("\nSem energia: {:.1f} h com escalonador, {:.1f} h sem".format(dead, dead_base))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# log_io.py
+"""
+Leitura transparente dos logs do Pico (PC)
+------------------------------------------
+Os arquivos rotacionados chegam comprimidos pela retencao do Pico
+(Codes/retention.py): ina_log_NNN.csv.gz (deflate/gzip) ou
+ina_log_NNN.csv.dv (delta + varint, Codes/log_codec.py). open_log()
+devolve um fluxo de texto com o CSV original em qualquer dos casos:
+
+    from log_io import open_log
+    data = np.loadtxt(open_log("ina_log_003.csv.dv"), delimiter=",", skiprows=1)
+
+read_lines() confere os blocos (marcadores #B/#R do data_logger.py) e
+entrega so as linhas integras; blocos danificados sao pulados e anotados,
+sem abortar a leitura:
+
+    damaged = []
+    data = np.loadtxt(read_lines(path, damaged), delimiter=",", skiprows=1)
+
+Pela linha de comando, descomprime para .csv ao lado do original e
+confere o CRC32 com o log_manifest.csv da mesma pasta, se houver:
+    python log_io.py dados/ina_log_003.csv.gz dados/ina_log_004.csv.dv
+ou so confere os blocos, sem gravar nada:
+    python log_io.py --check dados/ina_log_*
+"""
+
+import argparse
+import gzip
+import io
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+from log_codec import DvReader, DV_SUFFIX, GZIP_SUFFIX, MANIFEST_NAME, read_manifest  # noqa: E402
+from data_logger import BLOCK_MARK, RECOVER_MARK, valid_line  # noqa: E402
+
+
+def open_binary(path):
+    """Fluxo binario com o conteudo original do CSV."""
+    if path.endswith(GZIP_SUFFIX):
+        return gzip.open(path, "rb")
+    if path.endswith(DV_SUFFIX):
+        return io.BufferedReader(_RawDv(DvReader(open(path, "rb"))))
+    return open(path, "rb")
+
+
+def open_log(path):
+    """Fluxo de texto com o CSV original (.csv, .csv.gz ou .csv.dv)."""
+    return io.TextIOWrapper(open_binary(path), encoding="ascii", errors="replace", newline="")
+
+
+def read_lines(path, damaged=None):
+    """
+    Gera as linhas (str) integras de um log: cabecalho, linhas de blocos
+    com CRC conferido e, no fim sem marcador (arquivo ativo ou de firmware
+    antigo), as linhas completas e bem formadas. Os marcadores nao saem.
+
+    Args:
+        damaged: lista que recebe (arquivo, primeira linha, ultima linha,
+                 motivo) de cada trecho pulado (linhas contadas a partir de 1)
+    """
+    def skip(first, last, reason):
+        if damaged is not None:
+            damaged.append((path, first, last, reason))
+
+    with open_binary(path) as f:
+        header = f.readline()
+        if not header:
+            return
+        yield header.decode("ascii", "replace")
+        offset = len(header)
+        lineno = 1
+        pending = []   # (offset, numero da linha, linha)
+        crc = 0
+        for line in f:
+            lineno += 1
+            start = offset
+            offset += len(line)
+            if line.startswith(BLOCK_MARK):
+                digits = line[len(BLOCK_MARK):].strip()
+                try:
+                    expected = int(digits, 16) if len(digits) == 8 else None
+                except ValueError:
+                    expected = None
+                if expected is None:
+                    # Marcador cortado por queda de energia: e lixo como
+                    # uma linha cortada (o #R seguinte o descarta)
+                    pending.append((start, lineno, line))
+                    crc = zlib.crc32(line, crc)
+                    continue
+                if crc == expected:
+                    for _, _, data in pending:
+                        yield data.decode()
+                elif pending:
+                    skip(pending[0][1], pending[-1][1], "CRC do bloco nao confere")
+                pending = []
+                crc = 0
+            elif line.startswith(RECOVER_MARK):
+                try:
+                    cut = int(line[len(RECOVER_MARK):].strip())
+                except ValueError:
+                    cut = offset
+                bad = [p for p in pending if p[0] >= cut]
+                if bad:
+                    skip(bad[0][1], bad[-1][1], "gravacao interrompida")
+                pending = [p for p in pending if p[0] < cut]
+                crc = 0
+                for _, _, data in pending:
+                    crc = zlib.crc32(data, crc)
+            else:
+                pending.append((start, lineno, line))
+                crc = zlib.crc32(line, crc)
+        for _, n, data in pending:
+            if valid_line(data):
+                yield data.decode()
+            else:
+                skip(n, n, "linha incompleta ou invalida")
+
+
+def original_name(path):
+    """ina_log_003.csv.gz -> ina_log_003.csv"""
+    for suffix in (GZIP_SUFFIX, DV_SUFFIX):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+class _RawDv(io.RawIOBase):
+    """Adapta DvReader para io.BufferedReader."""
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        return self._reader.readinto(buf)
+
+    def close(self):
+        if not self.closed:
+            self._reader.close()
+        super().close()
+
+
+def decompress(path):
+    """
+    Descomprime path para o .csv original.
+
+    Returns:
+        (nome de saida, bytes, crc32, crc esperado pelo manifesto ou None)
+    """
+    out = original_name(path)
+    if out == path:
+        raise ValueError("{} nao esta comprimido".format(path))
+    crc = 0
+    size = 0
+    with open_binary(path) as src, open(out + ".tmp", "wb") as dst:
+        while True:
+            chunk = src.read(65536)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            dst.write(chunk)
+    os.replace(out + ".tmp", out)
+    manifest = read_manifest(os.path.join(os.path.dirname(path), MANIFEST_NAME))
+    entry = manifest.get(os.path.basename(path))
+    return out, size, crc, entry[1] if entry else None
+
+
+def check(paths):
+    """Confere os blocos de cada arquivo e imprime os trechos danificados."""
+    status = 0
+    for path in paths:
+        damaged = []
+        try:
+            n = sum(1 for _ in read_lines(path, damaged)) - 1
+        except (OSError, ValueError, EOFError) as e:
+            print("ERRO {}: {}".format(path, e))
+            status = 1
+            continue
+        print("{}: {} linhas integras, {} trechos danificados".format(path, max(0, n), len(damaged)))
+        for _, first, last, reason in damaged:
+            print("  linhas {}-{}: {}".format(first, last, reason))
+        if damaged:
+            status = 1
+    return status
+
+
+def report_damage(damaged):
+    """AVISO no stderr para cada trecho pulado por read_lines()."""
+    for path, first, last, reason in damaged:
+        print("AVISO - {}: linhas {}-{} ignoradas ({})".format(path, first, last, reason),
+              file=sys.stderr)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Descomprime/confere logs do Pico")
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--check", action="store_true", help="so confere os blocos (CRC)")
+    args = ap.parse_args(argv)
+
+    if args.check:
+        return check(args.files)
+    status = 0
+    for path in args.files:
+        try:
+            out, size, crc, expected = decompress(path)
+        except (OSError, ValueError, EOFError) as e:
+            print("ERRO {}: {}".format(path, e))
+            status = 1
+            continue
+        if expected is None:
+            note = "sem entrada no manifesto"
+        elif expected == crc:
+            note = "CRC ok"
+        else:
+            note = "CRC NAO CONFERE (esperado {:08x}, lido {:08x})".format(expected, crc)
+            status = 1
+        print("{} -> {} ({} bytes, {})".format(path, out, size, note))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
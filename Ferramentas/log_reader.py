@@ -0,0 +1,414 @@
+# log_reader.py
+"""
+Leitor dos logs do Pico para NumPy (PC)
+---------------------------------------
+Le meses de dados de varios nos sem carregar tudo de uma vez:
+
+- CSV (ina_log_NNN.csv, .csv.gz, .csv.dv): parse em pedacos por gerador
+  (iter_csv), so com as linhas de blocos integros (log_io.read_lines).
+  O resultado de cada arquivo fica em cache (.cache/<arquivo>.<tam>.npy)
+  e as leituras seguintes sao np.load(mmap_mode="r"): visao sem copia.
+- Colunar (ina_col_NNN.<canal>): decodificado bloco a bloco
+  (column_logger.query), com o mesmo cache .npy.
+- Rajadas (burst_NNN.bin): np.memmap direto sobre as amostras int16.
+
+LogSet junta os arquivos rotacionados de uma pasta de forma preguicosa
+(so abre os que cruzam a janela pedida) e corrige o timestamp: depois de
+um reset o TimestampManager volta ao ultimo checkpoint, entao o arquivo
+seguinte pode comecar antes do fim do anterior. O trecho e deslocado para
+comecar um intervalo de amostragem depois, e o ponto fica em .resets.
+
+    logs = LogSet("dados/no07/")
+    cols = logs.load(["Vbatt", "SoC"], start=86400, end=2 * 86400)
+    for chunk in logs.iter_chunks(["Iload_mA"]):
+        ...
+
+Pela linha de comando (resumo e aquecimento do cache):
+    python log_reader.py dados/no07/
+"""
+
+import argparse
+import itertools
+import os
+import struct
+import sys
+
+import numpy as np
+
+from log_io import read_lines, report_damage
+from column_query import report_damage as report_col_damage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import column_logger as cl  # noqa: E402
+from log_codec import csv_time_range, read_manifest, MANIFEST_NAME  # noqa: E402
+
+# Cabecalho das rajadas, igual ao Codes/burst_capture.py (que so importa no Pico)
+BURST_MAGIC = b"FBRS"
+BURST_HEADER_FMT = "<4sHHHIfffHI"
+BURST_HEADER_SIZE = struct.calcsize(BURST_HEADER_FMT)
+
+# Colunas do CSV do DataLogger (mesma ordem)
+COLUMNS = ("timestamp", "Vbatt", "Vload", "Iload_mA", "Ibatt_mA",
+           "SoC", "Temp_int", "Temp_ext", "Humidity")
+
+CHUNK_ROWS = 65536
+CACHE_DIR = ".cache"
+CSV_SUFFIXES = (".csv", ".csv.gz", ".csv.dv")
+
+
+# ----------------------------------------------------------------------
+# Arquivos isolados
+# ----------------------------------------------------------------------
+
+def iter_csv(path, chunk_rows=CHUNK_ROWS, damaged=None):
+    """Gera matrizes (n, 9) float64 de ate chunk_rows linhas de um log CSV."""
+    lines = read_lines(path, damaged)
+    next(lines, None)   # cabecalho
+    while True:
+        chunk = list(itertools.islice(lines, chunk_rows))
+        if not chunk:
+            return
+        yield np.loadtxt(chunk, delimiter=",", dtype=np.float64, ndmin=2)
+
+
+def _cache_path(path, key):
+    folder = os.path.join(os.path.dirname(path), CACHE_DIR)
+    return os.path.join(folder, "{}.{}.npy".format(os.path.basename(path), key))
+
+
+def _cached(path, key, build, cache=True):
+    """Matriz do cache (memmap) ou construida por build() e gravada no cache."""
+    if not cache:
+        return build()
+    target = _cache_path(path, key)
+    if os.path.exists(target):
+        return np.load(target, mmap_mode="r")
+    data = build()
+    folder = os.path.dirname(target)
+    os.makedirs(folder, exist_ok=True)
+    # Versoes antigas do mesmo arquivo (cresceu desde a ultima leitura)
+    stem = os.path.basename(path) + "."
+    for name in os.listdir(folder):
+        if name.startswith(stem) and name.endswith(".npy") and name[len(stem):-4].isdigit():
+            os.remove(os.path.join(folder, name))
+    tmp = target + ".tmp.npy"
+    np.save(tmp, data)
+    os.replace(tmp, target)
+    return np.load(target, mmap_mode="r")
+
+
+def read_csv(path, cache=True, damaged=None):
+    """
+    Log CSV inteiro como matriz (n, 9) float64, colunas em COLUMNS.
+    Com cache, e um memmap somente leitura do .npy.
+    """
+    def build():
+        parts = list(iter_csv(path, damaged=damaged))
+        return np.concatenate(parts) if parts else np.empty((0, len(COLUMNS)))
+    return _cached(path, os.path.getsize(path), build, cache)
+
+
+def _columnar_paths(prefix, index):
+    return [cl.channel_file(prefix, index, c) for c in cl.CHANNEL_NAMES]
+
+
+def read_columnar(prefix, index, cache=True, damaged=None):
+    """Segmento colunar (prefixo com pasta, ex.: "dados/ina_col") como matriz (n, 9)."""
+    paths = _columnar_paths(prefix, index)
+    key = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    scales = np.array([10.0 ** cl.DECIMALS[c] for c in cl.CHANNEL_NAMES])
+
+    def build():
+        rows = [[np.nan if v is None else v for v in r]
+                for r in cl.query(prefix, index, cl.CHANNEL_NAMES[1:], damaged=damaged)]
+        data = np.array(rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+        return data / scales
+    return _cached(paths[0], key, build, cache)
+
+
+def read_burst(path):
+    """
+    Rajada burst_NNN.bin: dict com os campos do cabecalho e "counts",
+    um np.memmap int16 (sem copia) com pre + pos gatilho em ordem.
+    Corrente em mA: counts * lsb_mA.
+    """
+    with open(path, "rb") as f:
+        raw = f.read(BURST_HEADER_SIZE)
+    if len(raw) < BURST_HEADER_SIZE:
+        raise ValueError("{}: cabecalho incompleto".format(path))
+    (magic, version, n_pre, n_post, period_us, ts, lsb,
+     trigger_mA, log_index, log_line) = struct.unpack(BURST_HEADER_FMT, raw)
+    if magic != BURST_MAGIC:
+        raise ValueError("{}: nao e um arquivo de rajada".format(path))
+    n = min(n_pre + n_post, (os.path.getsize(path) - BURST_HEADER_SIZE) // 2)
+    counts = np.memmap(path, dtype="<i2", mode="r", offset=BURST_HEADER_SIZE, shape=(n,))
+    return {"path": path, "version": version, "n_pre": n_pre, "n_post": n_post,
+            "period_us": period_us, "timestamp": ts, "lsb_mA": lsb,
+            "trigger_mA": trigger_mA, "log_index": log_index, "log_line": log_line,
+            "counts": counts}
+
+
+# ----------------------------------------------------------------------
+# Conjunto de arquivos rotacionados
+# ----------------------------------------------------------------------
+
+def _index_of(name, prefix):
+    if not name.startswith(prefix):
+        return -1
+    digits = name[len(prefix):].split(".", 1)[0]
+    return int(digits) if digits.isdigit() else -1
+
+
+class LogSet:
+    """Concatenacao preguicosa dos logs de uma pasta, com tempo corrigido."""
+
+    def __init__(self, directory, base=None, cache=True, reset_gap_s=None, resume=None):
+        """
+        Args:
+            directory: pasta com os arquivos baixados de um no, ou lista de
+                       pastas do mesmo no (descargas que se sobrepoem: o
+                       mesmo arquivo vale uma vez, o .csv ou o maior)
+            base: "ina_log" (CSV) ou "ina_col" (colunar); None = o que houver
+            cache: guarda cada arquivo lido em .cache/*.npy
+            reset_gap_s: intervalo inserido num reset; None = intervalo
+                         mediano do inicio do arquivo anterior
+            resume: {indice: (deslocamento s, t_last corrigido)} de uma
+                    leitura anterior (fleet_ingest.py): esses arquivos
+                    mantem o deslocamento e os novos continuam do ultimo
+                    t_last conhecido, mesmo que os anteriores tenham sido
+                    apagados no Pico
+        """
+        if isinstance(directory, str):
+            directory = [directory]
+        self.directories = list(directory)
+        self.cache = cache
+        self.reset_gap_s = reset_gap_s
+        self.resume = resume or {}
+        self.damaged = []
+        self.resets = []   # (arquivo, tempo corrigido do inicio, deslocamento s)
+        names = [(d, n) for d in self.directories for n in sorted(os.listdir(d))]
+        if base is None:
+            base = "ina_log" if any(_index_of(n, "ina_log_") >= 0 for _, n in names) else "ina_col"
+        self.base = base
+        self.manifest = {}
+        for d in self.directories:
+            self.manifest.update(read_manifest(os.path.join(d, MANIFEST_NAME)))
+        self.segments = self._find(names)
+        self._plan()
+
+    # -- descoberta ----------------------------------------------------
+
+    def _find(self, names):
+        prefix = self.base + "_"
+        found = {}
+        for d, name in names:
+            i = _index_of(name, prefix)
+            if i < 0:
+                continue
+            if self.base == "ina_col":
+                if not name.endswith(".t"):
+                    continue
+                kind = "col"
+            elif name.endswith(CSV_SUFFIXES):
+                kind = "csv"
+            else:
+                continue
+            seg = {"index": i, "kind": kind, "name": name, "dir": d,
+                   "size": os.path.getsize(os.path.join(d, name))}
+            # .csv descomprimido tem preferencia sobre .gz/.dv; depois o maior
+            # (logs so crescem: a descarga maior contem a menor)
+            rank = (name.endswith((".csv", ".t")), seg["size"])
+            old = found.get(i)
+            if old is None or rank > (old["name"].endswith((".csv", ".t")), old["size"]):
+                found[i] = seg
+        return [found[i] for i in sorted(found)]
+
+    def _path(self, seg):
+        return os.path.join(seg["dir"], seg["name"])
+
+    def _prefix(self, seg):
+        return os.path.join(seg["dir"], self.base)
+
+    def _raw_range(self, seg):
+        """(t_first, t_last) no tempo do dispositivo, sem ler o arquivo inteiro."""
+        path = self._path(seg)
+        if seg["kind"] == "col":
+            hdrs = list(cl.read_headers(path))
+            if not hdrs:
+                return None
+            return hdrs[0][3] / 100.0, hdrs[-1][4] / 100.0
+        cached = _cache_path(path, os.path.getsize(path))
+        if os.path.exists(cached):
+            data = np.load(cached, mmap_mode="r")
+            return (data[0, 0], data[-1, 0]) if len(data) else None
+        entry = self.manifest.get(seg["name"])
+        if entry is not None and entry[2] and entry[3]:
+            return float(entry[2]), float(entry[3])
+        if seg["name"].endswith(".csv"):
+            t0, t1 = csv_time_range(path)
+            if t0 and t1:
+                return float(t0), float(t1)
+        data = self._matrix(seg)   # comprimido sem manifesto: le uma vez (vai para o cache)
+        return (data[0, 0], data[-1, 0]) if len(data) else None
+
+    def _head_interval(self, seg):
+        """Intervalo mediano entre as primeiras amostras do arquivo."""
+        if seg["kind"] == "col":
+            t = [r[0] for r in itertools.islice(
+                cl.query(self._prefix(seg), seg["index"], ()), 64)]
+            t = np.array(t, dtype=np.float64) / 100.0
+        else:
+            t = next(iter_csv(self._path(seg), chunk_rows=64), np.empty((0, 1)))[:, 0]
+        d = np.diff(t)
+        d = d[d > 0]
+        return float(np.median(d)) if d.size else 0.0
+
+    def _plan(self):
+        """Faixa de tempo e deslocamento de cada arquivo (so inicio/fim)."""
+        offset = 0.0
+        prev = None
+        kept = []
+        for seg in self.segments:
+            rng = self._raw_range(seg)
+            if rng is None:
+                continue
+            t0, t1 = rng
+            prev_last = None if prev is None else prev["t_last"]
+            known = self.resume.get(seg["index"])
+            if known is not None:
+                offset = known[0]
+            elif prev is None:
+                # Anteriores ja lidos (e talvez apagados): continua deles
+                before = [i for i in self.resume if i < seg["index"]]
+                if before:
+                    offset, prev_last = self.resume[max(before)]
+            if known is None and prev_last is not None and t0 + offset <= prev_last:
+                gap = self.reset_gap_s
+                if gap is None:
+                    gap = self._head_interval(prev if prev is not None else seg)
+                shift = prev_last + gap - (t0 + offset)
+                offset += shift
+                self.resets.append((seg["name"], float(t0 + offset), float(shift)))
+            seg["offset"] = offset
+            seg["t_first"] = t0 + offset
+            seg["t_last"] = t1 + offset
+            kept.append(seg)
+            prev = seg
+        self.segments = kept
+
+    # -- leitura -------------------------------------------------------
+
+    def _matrix(self, seg):
+        if seg["kind"] == "col":
+            return read_columnar(self._prefix(seg), seg["index"], self.cache, self.damaged)
+        return read_csv(self._path(seg), self.cache, self.damaged)
+
+    def read_segment(self, seg):
+        """Matriz (n, 9) de um item de .segments, timestamp ja corrigido (copia)."""
+        data = np.array(self._matrix(seg), dtype=np.float64)
+        data[:, 0] += seg["offset"]
+        self._report()
+        return data
+
+    def time_offset(self, index):
+        """Deslocamento (s) aplicado ao arquivo de indice index (0 se nao ha)."""
+        for seg in self.segments:
+            if seg["index"] == index:
+                return seg["offset"]
+        return 0.0
+
+    def iter_chunks(self, columns=None, start=None, end=None, chunk_rows=CHUNK_ROWS):
+        """
+        Gera dicts {coluna: array} de ate chunk_rows linhas, em ordem, so dos
+        arquivos que cruzam [start, end] (tempo corrigido, s). "timestamp"
+        sempre vem, ja corrigido; as demais colunas sao visoes sem copia
+        quando o arquivo esta no cache.
+        """
+        columns = [c for c in (columns or COLUMNS) if c != "timestamp"]
+        idx = [COLUMNS.index(c) for c in columns]
+        for seg in self.segments:
+            if (start is not None and seg["t_last"] < start) or (end is not None and seg["t_first"] > end):
+                continue
+            data = self._matrix(seg)
+            t = data[:, 0]
+            lo = 0 if start is None else int(np.searchsorted(t, start - seg["offset"], "left"))
+            hi = len(t) if end is None else int(np.searchsorted(t, end - seg["offset"], "right"))
+            for a in range(lo, hi, chunk_rows):
+                b = min(hi, a + chunk_rows)
+                chunk = {"timestamp": t[a:b] + seg["offset"]}
+                for c, i in zip(columns, idx):
+                    chunk[c] = data[a:b, i]
+                yield chunk
+        self._report()
+
+    def iter_raw(self, columns=None):
+        """
+        Gera (segmento, {coluna: array}) por arquivo, com o timestamp do
+        dispositivo (sem o deslocamento dos resets), para quem converte o
+        tempo por conta propria (time_align.py). Visoes sem copia.
+        """
+        columns = ["timestamp"] + [c for c in (columns or COLUMNS) if c != "timestamp"]
+        for seg in self.segments:
+            data = self._matrix(seg)
+            yield seg, {c: data[:, COLUMNS.index(c)] for c in columns}
+        self._report()
+
+    def _report(self):
+        if self.damaged:
+            report_damage([d for d in self.damaged if len(d) == 4])
+            report_col_damage([d for d in self.damaged if len(d) == 3])
+            del self.damaged[:]
+
+    def load(self, columns=None, start=None, end=None):
+        """Concatena iter_chunks() da janela em arrays (copia so o que foi pedido)."""
+        names = ["timestamp"] + [c for c in (columns or COLUMNS) if c != "timestamp"]
+        parts = {c: [] for c in names}
+        for chunk in self.iter_chunks(columns, start, end):
+            for c in names:
+                parts[c].append(chunk[c])
+        return {c: np.concatenate(p) if p else np.empty(0) for c, p in parts.items()}
+
+    def bursts(self):
+        """Rajadas da pasta (read_burst), com "time" no tempo corrigido."""
+        out = []
+        seen = set()
+        for d in self.directories:
+            for name in sorted(os.listdir(d)):
+                if _index_of(name, "burst_") < 0 or name in seen:
+                    continue
+                seen.add(name)
+                try:
+                    b = read_burst(os.path.join(d, name))
+                except ValueError as e:
+                    print("AVISO - {}".format(e), file=sys.stderr)
+                    continue
+                b["time"] = b["timestamp"] + self.time_offset(b["log_index"])
+                out.append(b)
+        return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Resumo dos logs de uma pasta (e aquece o cache)")
+    ap.add_argument("directory")
+    ap.add_argument("--base", choices=("ina_log", "ina_col"))
+    ap.add_argument("--no-cache", action="store_true")
+    args = ap.parse_args(argv)
+
+    logs = LogSet(args.directory, args.base, cache=not args.no_cache)
+    n = 0
+    for chunk in logs.iter_chunks(["Vbatt"]):
+        n += chunk["timestamp"].size
+    print("{}: {} arquivos, {} amostras".format(args.directory, len(logs.segments), n))
+    if logs.segments:
+        print("  tempo corrigido: {:.2f} s .. {:.2f} s".format(
+            logs.segments[0]["t_first"], logs.segments[-1]["t_last"]))
+    for name, t, shift in logs.resets:
+        print("  reset antes de {}: deslocado {:+.2f} s (inicio em {:.2f} s)".format(name, shift, t))
+    bursts = logs.bursts()
+    if bursts:
+        print("  {} rajadas".format(len(bursts)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
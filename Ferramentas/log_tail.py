@@ -0,0 +1,475 @@
+# log_tail.py
+"""
+Acompanhamento do log ativo (PC)
+--------------------------------
+Segue o ina_log_NNN.csv que o DataLogger esta gravando, sem parar o loop
+nem copiar o arquivo de novo: guarda o offset ja lido e, a cada poll(),
+pede so os bytes acrescentados. As linhas completas viram linhas de uma
+matriz (n, 9) num buffer circular (RollingBuffer) para graficos e
+alarmes ao vivo; o pedaco de linha ainda sem "\\n" espera o proximo poll.
+
+Fontes:
+- SerialSource: o proprio no, pelo comando TAIL de Codes/log_transfer.py
+  (um GET cujo CRC do EOF cobre so o trecho novo: o Pico nao rele o
+  arquivo inteiro a cada consulta).
+- DirSource: uma pasta (emulador, copia sincronizada, cartao montado).
+
+Rotacao: o nome segue DataLogger._get_filename ("ina_log_NNN.csv").
+Quando o arquivo atual para de crescer, o seguinte (indice + 1) e
+consultado; se ja existe, o atual e lido uma ultima vez (o marcador do
+flush da rotacao) e a leitura passa para o novo. Depois de um reset o
+timestamp volta ao ultimo checkpoint: como no LogSet, o arquivo novo e
+deslocado para continuar depois do anterior (.resets). Um arquivo que
+encolheu (fim cortado pela recuperacao do boot) retoma do novo tamanho.
+
+Os blocos (#B) sao conferidos na passagem, como em log_io.read_lines,
+mas as linhas saem assim que completas e validas, sem esperar o bloco
+fechar: um bloco que nao confere vai para .damaged (com AVISO).
+
+Uso como biblioteca:
+
+    tail = LogTail(SerialSource("/dev/ttyACM0"), capacity=3600)
+    while True:
+        rows = tail.poll()                  # (n, 9), so as linhas novas
+        v = tail.buffer.column("Vbatt")     # ultimas 3600 amostras
+        time.sleep(2)
+
+Pela linha de comando (uma linha por poll com dados novos e alarmes):
+    python log_tail.py /dev/ttyACM0 --alarm "Vbatt<3.4" --alarm "Iload_mA>800"
+    python log_tail.py --dir pasta_do_emulador --interval 1
+"""
+
+import argparse
+import operator
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from log_reader import COLUMNS, _index_of
+from offload_client import DEFAULT_BAUD, OffloadClient, SerialLink
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+from data_logger import BLOCK_MARK, RECOVER_MARK, valid_line  # noqa: E402
+
+DEFAULT_CAPACITY = 3600      # linhas no buffer (1 h com amostras de 1 s)
+BACKFILL_BYTES = 8192        # ao conectar, le so o fim do arquivo ativo
+HEAD_ROWS = 64               # amostras para o intervalo mediano num reset
+
+
+# ----------------------------------------------------------------------
+# Fontes
+# ----------------------------------------------------------------------
+
+class DirSource:
+    """Arquivos de uma pasta local."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def files(self):
+        """{nome: tamanho}"""
+        out = {}
+        for name in os.listdir(self.directory):
+            try:
+                out[name] = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                continue
+        return out
+
+    def read(self, name, offset):
+        """(bytes de offset ao fim, tamanho) ou None se nao existe."""
+        try:
+            f = open(os.path.join(self.directory, name), "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            size = f.seek(0, 2)
+            if offset >= size:
+                return b"", size
+            f.seek(offset)
+            return f.read(size - offset), size
+
+    def close(self):
+        pass
+
+
+class SerialSource:
+    """O no pela serial: LIST para achar o arquivo ativo, TAIL para ler."""
+
+    def __init__(self, path, baud=DEFAULT_BAUD):
+        self.link = SerialLink(path, baud)
+        self.client = OffloadClient(self.link)
+
+    def files(self):
+        return {f["name"]: f["size"] for f in self.client.list_files()}
+
+    def read(self, name, offset):
+        return self.client.tail(name, offset)
+
+    def close(self):
+        self.link.close()
+
+
+# ----------------------------------------------------------------------
+# Buffer circular
+# ----------------------------------------------------------------------
+
+class RollingBuffer:
+    """Ultimas 'capacity' linhas num vetor circular, sem realocar."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, columns=COLUMNS):
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.data = np.full((capacity, len(self.columns)), np.nan)
+        self.total = 0      # linhas recebidas desde o inicio
+        self._end = 0       # proxima posicao de escrita
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, rows):
+        """Acrescenta (n, colunas) linhas; custo proporcional a n."""
+        n = len(rows)
+        if not n:
+            return
+        self.total += n
+        cap = self.capacity
+        if n >= cap:
+            self.data[:] = rows[-cap:]
+            self._end = 0
+            self._count = cap
+            return
+        first = min(n, cap - self._end)
+        self.data[self._end:self._end + first] = rows[:first]
+        self.data[:n - first] = rows[first:]
+        self._end = (self._end + n) % cap
+        self._count = min(cap, self._count + n)
+
+    def _ordered(self, view):
+        if self._count < self.capacity:
+            return view[:self._count].copy()
+        return np.concatenate((view[self._end:], view[:self._end]))
+
+    def array(self):
+        """Copia (n, colunas) em ordem cronologica."""
+        return self._ordered(self.data)
+
+    def column(self, name):
+        """Uma coluna em ordem cronologica (copia)."""
+        return self._ordered(self.data[:, self.columns.index(name)])
+
+    def last(self, n=1):
+        """As n linhas mais recentes."""
+        n = min(n, self._count)
+        idx = (self._end - n + np.arange(n)) % self.capacity
+        return self.data[idx]
+
+
+# ----------------------------------------------------------------------
+# Acompanhamento
+# ----------------------------------------------------------------------
+
+class LogTail:
+    """Le so o que foi acrescentado ao log ativo e segue as rotacoes."""
+
+    def __init__(self, source, base="ina_log", capacity=DEFAULT_CAPACITY,
+                 backfill=BACKFILL_BYTES, reset_gap_s=None):
+        """
+        Args:
+            source: DirSource, SerialSource ou objeto com files()/read()
+            base: base_filename do DataLogger
+            capacity: linhas guardadas em .buffer
+            backfill: bytes do fim do arquivo ativo lidos ao conectar
+                      (None = o arquivo inteiro)
+            reset_gap_s: intervalo inserido num reset; None = mediano
+        """
+        self.source = source
+        self.base = base
+        self.backfill = backfill
+        self.reset_gap_s = reset_gap_s
+        self.buffer = RollingBuffer(capacity)
+        self.name = None
+        self.index = -1
+        self.pos = 0             # proximo byte a pedir
+        self.offset_s = 0.0      # deslocamento de tempo do arquivo atual
+        self.resets = []         # (arquivo, tempo corrigido do inicio, deslocamento s)
+        self.damaged = []        # (arquivo, offset, motivo)
+        self.bytes_read = 0
+        self.polls = 0
+        self.blocks_ok = 0
+        self._rest = b""         # linha incompleta no fim do ultimo trecho
+        self._pending = []       # (offset, linha) do bloco aberto
+        self._checked = True     # False: bloco comecou antes do backfill
+        self._skip_partial = False
+        self._new_file = False
+        self._last_t = None
+
+    def _filename(self, index):
+        """Mesmo formato de DataLogger._get_filename."""
+        return "{:s}_{:03d}.csv".format(self.base, index)
+
+    def _open(self, index, pos):
+        self.index = index
+        self.name = self._filename(index)
+        self.pos = pos
+        self._rest = b""
+        self._pending = []
+        self._checked = pos == 0
+        self._skip_partial = pos > 0
+        self._new_file = True
+
+    def attach(self):
+        """Acha o arquivo ativo (maior indice .csv). True se achou."""
+        prefix = self.base + "_"
+        files = self.source.files()
+        active = [(_index_of(n, prefix), n) for n in files if n.endswith(".csv")]
+        active = [a for a in active if a[0] >= 0]
+        if not active:
+            return False
+        index, name = max(active)
+        size = files[name]
+        start = 0 if self.backfill is None else max(0, size - self.backfill)
+        self._open(index, start)
+        return True
+
+    def poll(self):
+        """
+        Le os bytes novos (e segue uma rotacao, se houve).
+
+        Returns:
+            matriz (n, 9) so com as linhas novas, tempo ja corrigido
+        """
+        self.polls += 1
+        if self.name is None and not self.attach():
+            return np.empty((0, len(COLUMNS)))
+        parts = [self._read()]
+        if not len(parts[0]):
+            nxt = self.source.read(self._filename(self.index + 1), 0)
+            if nxt is not None:
+                # O atual ja fechou: pega o que o flush da rotacao gravou
+                parts.append(self._read())
+                self._finish()
+                self._open(self.index + 1, 0)
+                parts.append(self._feed(*nxt))
+        rows = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        self.buffer.extend(rows)
+        return rows
+
+    def _read(self):
+        got = self.source.read(self.name, self.pos)
+        if got is None:
+            # Apagado (retencao) ou comprimido: procura o ativo de novo
+            print("AVISO - {} sumiu; procurando o arquivo ativo".format(self.name), file=sys.stderr)
+            self.name = None
+            self.attach()
+            return np.empty((0, len(COLUMNS)))
+        return self._feed(*got)
+
+    def _feed(self, data, size):
+        """Processa data (bytes a partir de self.pos) de um arquivo com 'size' bytes."""
+        if size < self.pos:
+            self._truncated(size)
+            return np.empty((0, len(COLUMNS)))
+        self.bytes_read += len(data)
+        start = self.pos - len(self._rest)
+        self.pos += len(data)
+        buf = self._rest + data
+        cut = buf.rfind(b"\n") + 1
+        self._rest = buf[cut:]
+        if self._skip_partial and cut:
+            # Backfill: a primeira "linha" pode ser o fim de uma linha
+            first = buf.find(b"\n") + 1
+            start += first
+            buf = buf[first:]
+            cut -= first
+            self._skip_partial = False
+        good = []
+        for line in buf[:cut].splitlines(True):
+            at = start
+            start += len(line)
+            if line.startswith(BLOCK_MARK):
+                self._close_block(line, at)
+            elif line.startswith(RECOVER_MARK):
+                self._recover(line, at)
+            elif line.startswith(b"timestamp"):
+                continue   # cabecalho
+            else:
+                self._pending.append((at, line))
+                if valid_line(line):
+                    good.append(line.decode())
+        if not good:
+            return np.empty((0, len(COLUMNS)))
+        rows = np.loadtxt(good, delimiter=",", dtype=np.float64, ndmin=2)
+        self._correct_time(rows)
+        return rows
+
+    def _close_block(self, line, at):
+        digits = line[len(BLOCK_MARK):].strip()
+        if len(digits) != 8:
+            self._pending.append((at, line))   # marcador cortado: lixo
+            return
+        crc = 0
+        for _, data in self._pending:
+            crc = zlib.crc32(data, crc)
+        if self._checked and self._pending:
+            if "{:08x}".format(crc) == digits.decode("ascii", "replace"):
+                self.blocks_ok += 1
+            else:
+                self._damage(self._pending[0][0], "CRC do bloco nao confere")
+        self._pending = []
+        self._checked = True
+
+    def _recover(self, line, at):
+        try:
+            cut = int(line[len(RECOVER_MARK):].strip())
+        except ValueError:
+            cut = at
+        self._pending = [p for p in self._pending if p[0] < cut]
+
+    def _truncated(self, size):
+        """Arquivo encolheu (recuperacao cortou o fim): retoma do tamanho novo."""
+        print("AVISO - {} encolheu de {} para {} bytes".format(self.name, self.pos, size),
+              file=sys.stderr)
+        self._pending = [p for p in self._pending if p[0] + len(p[1]) <= size]
+        self._rest = b""
+        self.pos = size
+
+    def _damage(self, offset, reason):
+        self.damaged.append((self.name, offset, reason))
+        print("AVISO - {} (offset {}): {}".format(self.name, offset, reason), file=sys.stderr)
+
+    def _finish(self):
+        """Fim de um arquivo: o que sobrou sem marcador ja saiu (como read_lines)."""
+        if self._rest:
+            self._damage(self.pos - len(self._rest), "linha incompleta no fim do arquivo")
+        self._rest = b""
+        self._pending = []
+
+    def _correct_time(self, rows):
+        """Desloca um arquivo novo que comeca antes do fim do anterior (reset)."""
+        if self._new_file and self._last_t is not None:
+            t0 = rows[0, 0] + self.offset_s
+            if t0 <= self._last_t:
+                gap = self.reset_gap_s
+                if gap is None:
+                    t = self.buffer.column("timestamp")[-HEAD_ROWS:]
+                    d = np.diff(t)
+                    d = d[d > 0]
+                    gap = float(np.median(d)) if d.size else 0.0
+                shift = self._last_t + gap - t0
+                self.offset_s += shift
+                self.resets.append((self.name, float(t0 + shift), float(shift)))
+                print("AVISO - reset antes de {}: tempo deslocado {:.1f} s".format(
+                    self.name, shift), file=sys.stderr)
+        self._new_file = False
+        rows[:, 0] += self.offset_s
+        self._last_t = float(rows[-1, 0])
+
+
+# ----------------------------------------------------------------------
+# Alarmes
+# ----------------------------------------------------------------------
+
+_OPS = (("<=", operator.le), (">=", operator.ge), ("<", operator.lt), (">", operator.gt))
+
+
+class Alarm:
+    """Condicao "coluna<valor" avisada so na borda (entra/sai)."""
+
+    def __init__(self, text):
+        for sym, fn in _OPS:
+            if sym in text:
+                column, value = text.split(sym, 1)
+                column = column.strip()
+                if column not in COLUMNS:
+                    raise ValueError("coluna desconhecida: {}".format(column))
+                self.text = text
+                self.index = COLUMNS.index(column)
+                self.op = fn
+                self.value = float(value)
+                self.active = False
+                return
+        raise ValueError("alarme invalido (use coluna<valor): {}".format(text))
+
+    def update(self, rows):
+        """Lista de (timestamp, valor, ativo) das mudancas de estado em rows."""
+        if not len(rows):
+            return []
+        v = rows[:, self.index]
+        with np.errstate(invalid="ignore"):
+            on = self.op(v, self.value) & ~np.isnan(v)
+        prev = np.concatenate(([self.active], on[:-1]))
+        edges = np.flatnonzero(on != prev)
+        self.active = bool(on[-1])
+        return [(rows[i, 0], v[i], bool(on[i])) for i in edges]
+
+
+# ----------------------------------------------------------------------
+# Linha de comando
+# ----------------------------------------------------------------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Acompanha o log ativo de um no")
+    ap.add_argument("port", nargs="?", help="/dev/ttyACM0")
+    ap.add_argument("--dir", help="pasta local em vez da serial")
+    ap.add_argument("--baud", type=int, default=DEFAULT_BAUD)
+    ap.add_argument("--base", default="ina_log", help="base_filename do DataLogger")
+    ap.add_argument("--interval", type=float, default=2.0, help="s entre consultas")
+    ap.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="linhas no buffer")
+    ap.add_argument("--backfill", type=int, default=BACKFILL_BYTES,
+                    help="bytes do fim do arquivo ativo lidos ao conectar")
+    ap.add_argument("--columns", nargs="+", default=["Vbatt", "Iload_mA", "SoC"],
+                    help="colunas mostradas")
+    ap.add_argument("--alarm", action="append", default=[], metavar="COL<VALOR",
+                    help="ex.: 'Vbatt<3.4' (pode repetir)")
+    ap.add_argument("--polls", type=int, default=0, help="para apos N consultas (0 = sem fim)")
+    args = ap.parse_args(argv)
+
+    if bool(args.port) == bool(args.dir):
+        ap.error("informe a porta ou --dir")
+    try:
+        alarms = [Alarm(a) for a in args.alarm]
+        show = [COLUMNS.index(c) for c in args.columns]
+    except ValueError as e:
+        ap.error(str(e))
+    source = DirSource(args.dir) if args.dir else SerialSource(args.port, args.baud)
+    tail = LogTail(source, args.base, args.capacity, args.backfill)
+    status = 0
+    try:
+        while True:
+            t0 = time.monotonic()
+            try:
+                rows = tail.poll()
+            except (IOError, OSError) as e:
+                print("ERRO {}".format(e))
+                status = 1
+                rows = np.empty((0, len(COLUMNS)))
+            if len(rows):
+                last = rows[-1]
+                print("{:10.1f} s  {}  (+{} linhas, {})".format(
+                    last[0], "  ".join("{} {:.3f}".format(COLUMNS[i], last[i]) for i in show),
+                    len(rows), tail.name))
+            for alarm in alarms:
+                for t, v, on in alarm.update(rows):
+                    print("{} {:10.1f} s  {} ({:.3f})".format(
+                        "ALARME" if on else "normal", t, alarm.text, v))
+            if args.polls and tail.polls >= args.polls:
+                break
+            time.sleep(max(0.0, args.interval - (time.monotonic() - t0)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+    print("{} consultas, {} bytes lidos, {} linhas, {} blocos conferidos, "
+          "{} danificados, {} resets".format(
+              tail.polls, tail.bytes_read, tail.buffer.total, tail.blocks_ok,
+              len(tail.damaged), len(tail.resets)))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
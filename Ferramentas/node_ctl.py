@@ -0,0 +1,131 @@
+# node_ctl.py
+"""
+Comandos para um no em funcionamento (PC)
+-----------------------------------------
+Envia uma linha de comando em quadro EXEC (Codes/command_shell.py) e
+imprime a resposta. A amostragem do Pico continua normalmente.
+
+Uso:
+    python node_ctl.py /dev/ttyACM0 help
+    python node_ctl.py /dev/ttyACM0 stats
+    python node_ctl.py /dev/ttyACM0 set interval 30
+    python node_ctl.py /dev/ttyACM0 cal vbatt 3.712
+    python node_ctl.py /dev/ttyACM0 --sync-time   # acerta o relogio UTC do Pico
+    python node_ctl.py /dev/ttyACM0            # modo interativo
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from offload_client import SerialLink, DEFAULT_BAUD
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import log_transfer as lt  # noqa: E402
+
+# O Pico atende a porta a cada fatia do tempo ocioso (IDLE_SLICE_MS)
+# e durante a captura de uma rajada; o timeout cobre os dois
+REPLY_TIMEOUT_S = 5.0
+
+# Sincronia de relogio: rodadas de "clock now"; vale a de menor ida e volta
+SYNC_ROUNDS = 8
+SYNC_QUANTUM_MS = 50         # o ts do Pico tem resolucao de 1 ds
+
+
+def execute(link, parser, line, timeout=REPLY_TIMEOUT_S):
+    """Envia 'line' e retorna o texto da resposta (None se sem resposta)."""
+    # Tag aleatorio: respostas atrasadas de comandos anteriores sao ignoradas
+    tag = os.urandom(1)
+    link.write(lt.encode_frame(lt.CMD_EXEC, tag + line.encode()))
+    text = bytearray()
+    deadline = time.monotonic() + timeout
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return None
+        for ftype, payload in parser.feed(link.read(left)):
+            if ftype != lt.RSP_TEXT or payload[1:2] != tag:
+                continue
+            text.extend(payload[2:])
+            if payload[:1] == b"\x01":
+                return text.decode(errors="replace")
+
+
+def sync_time(link, parser, rounds=SYNC_ROUNDS, timeout=REPLY_TIMEOUT_S):
+    """
+    Manda ao Pico um ponto de sincronia com o relogio deste PC (que deve
+    estar em UTC por NTP). Como no NTP: o ts lido pelo Pico cai entre o
+    envio (t1) e a chegada da resposta (t4); usa o meio, com incerteza de
+    meia ida e volta, da rodada mais rapida.
+
+    Returns:
+        resposta do Pico ao clock sync (None se sem resposta)
+    """
+    best = None
+    for _ in range(rounds):
+        t1 = time.time()
+        reply = execute(link, parser, "clock now", timeout)
+        t4 = time.time()
+        if reply is None:
+            continue
+        if reply.startswith("ERRO"):
+            return reply
+        if best is None or t4 - t1 < best[0]:
+            best = (t4 - t1, int(reply), (t1 + t4) / 2)
+    if best is None:
+        return None
+    rtt, ts_ds, utc = best
+    err_ms = int(rtt * 500 + 0.5) + SYNC_QUANTUM_MS
+    return execute(link, parser, "clock sync {} {} {}".format(ts_ds, int(utc * 1000), err_ms), timeout)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Comandos para o no em funcionamento")
+    ap.add_argument("port")
+    ap.add_argument("command", nargs="*", help="comando e argumentos (vazio = interativo)")
+    ap.add_argument("--baud", type=int, default=DEFAULT_BAUD)
+    ap.add_argument("--timeout", type=float, default=REPLY_TIMEOUT_S)
+    ap.add_argument("--sync-time", action="store_true",
+                    help="acerta o relogio UTC do Pico pelo relogio deste PC")
+    ap.add_argument("--rounds", type=int, default=SYNC_ROUNDS, help="rodadas do --sync-time")
+    args = ap.parse_args(argv)
+
+    link = SerialLink(args.port, args.baud)
+    parser = lt.FrameParser()
+    try:
+        if args.sync_time:
+            reply = sync_time(link, parser, args.rounds, args.timeout)
+            if reply is None:
+                print("ERRO sem resposta de {}".format(args.port))
+                return 1
+            print(reply)
+            return 1 if reply.startswith("ERRO") else 0
+        if args.command:
+            reply = execute(link, parser, " ".join(args.command), args.timeout)
+            if reply is None:
+                print("ERRO sem resposta de {}".format(args.port))
+                return 1
+            print(reply)
+            return 1 if reply.startswith("ERRO") else 0
+
+        while True:
+            try:
+                line = input("{}> ".format(os.path.basename(args.port)))
+            except EOFError:
+                break
+            if line.strip() in ("exit", "quit"):
+                break
+            if not line.strip():
+                continue
+            reply = execute(link, parser, line, args.timeout)
+            print("(sem resposta)" if reply is None else reply)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        link.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,433 @@
+# offload_client.py
+"""
+Cliente de descarga de logs (PC)
+--------------------------------
+Baixa os arquivos do dispositivo pelo protocolo de Codes/log_transfer.py
+(quadros com CRC32, janela com ACK, retomada por offset). Varios
+dispositivos sao atendidos em paralelo, uma thread por porta.
+
+- Arquivos parciais ficam como NOME.part e sao retomados de onde pararam.
+- Ao final, o CRC32 do arquivo inteiro e conferido antes de renomear.
+- Logs so crescem: se o arquivo local e menor que o remoto, a descarga
+  continua a partir do tamanho local.
+- Arquivos reescritos no lugar (anel de eventos) vem com o CRC32 no
+  LIST: se o local difere, sao baixados de novo do offset 0 (o tamanho
+  sozinho nao diz se mudaram).
+- Quadro perdido: os seguintes ficam guardados e o ACK repetido pede so
+  o que falta (o Pico reenvia um quadro, nao a janela).
+
+- --since/--until escolhem os arquivos pelo intervalo de tempo que o
+  LIST informa (timestamp do dispositivo, s); arquivos sem intervalo
+  (eventos, rajadas, manifesto) sempre vem.
+
+Uso:
+    python offload_client.py /dev/ttyACM0 /dev/ttyACM1 --dest logs/
+    python offload_client.py /dev/ttyACM0 --list
+    python offload_client.py /dev/ttyACM0 --since 86400 --until 172800
+
+Teste sem hardware (o mesmo LogTransfer do dispositivo roda num pty):
+    python offload_client.py --emulate-device pasta_com_logs --dest saida/
+"""
+
+import argparse
+import io
+import os
+import random
+import select
+import subprocess
+import sys
+import termios
+import time
+import tty
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import log_transfer as lt  # noqa: E402
+
+DEFAULT_BAUD = 115200
+RX_TIMEOUT_S = 3.0
+MAX_RETRIES = 5
+MAX_AHEAD = 64          # quadros fora de ordem guardados ate o buraco fechar
+
+
+class SerialLink:
+    """Porta serial em modo bruto (termios), sem dependencias externas."""
+
+    def __init__(self, path, baud=DEFAULT_BAUD):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        if os.isatty(self.fd):
+            tty.setraw(self.fd)
+            speed = getattr(termios, "B{}".format(baud), None)
+            if speed is not None:
+                attrs = termios.tcgetattr(self.fd)
+                attrs[4] = attrs[5] = speed
+                termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+            termios.tcflush(self.fd, termios.TCIOFLUSH)
+
+    def read(self, timeout):
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return b""
+        try:
+            return os.read(self.fd, 65536)
+        except OSError:
+            return b""
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class OffloadClient:
+    """Sessao com um dispositivo: LIST e GET com retomada."""
+
+    def __init__(self, link, timeout=RX_TIMEOUT_S):
+        self.link = link
+        self.timeout = timeout
+        self.parser = lt.FrameParser()
+        self._pending = []
+
+    def _send(self, ftype, payload=b""):
+        self.link.write(lt.encode_frame(ftype, payload))
+
+    def _recv(self):
+        """Proximo quadro valido, ou None apos o timeout."""
+        deadline = time.monotonic() + self.timeout
+        while not self._pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            data = self.link.read(left)
+            if data:
+                self._pending.extend(self.parser.feed(data))
+        return self._pending.pop(0)
+
+    def list_files(self):
+        """Retorna lista de dicts {name, size, t_first, t_last, crc}."""
+        for _ in range(MAX_RETRIES):
+            self._send(lt.CMD_LIST)
+            text = bytearray()
+            while True:
+                frame = self._recv()
+                if frame is None:
+                    break
+                ftype, payload = frame
+                if ftype != lt.RSP_FILES:
+                    continue
+                text.extend(payload[1:])
+                if payload[:1] == b"\x01":
+                    return _parse_listing(text.decode())
+        raise IOError("{}: sem resposta ao LIST".format(self.link.path))
+
+    def fetch(self, name, size, dest_dir, crc=None):
+        """
+        Baixa 'name' para dest_dir. Retoma de NOME.part (ou do arquivo
+        local menor que o remoto) e confere o CRC32 no final.
+
+        Com crc (arquivo reescrito no lugar, CRC32 do LIST) nao ha
+        retomada: a copia local so fica se o CRC bater; senao o arquivo
+        vem inteiro e substitui a copia ao final.
+
+        Returns:
+            bytes recebidos nesta chamada
+        """
+        final = os.path.join(dest_dir, name)
+        part = final + ".part"
+        if crc is not None:
+            if os.path.exists(final) and os.path.getsize(final) == size \
+                    and _file_crc(final) == crc:
+                return 0
+            if os.path.exists(part):
+                os.remove(part)
+        elif os.path.exists(final):
+            if os.path.getsize(final) >= size:
+                return 0
+            os.replace(final, part)
+
+        received = 0
+        for _ in range(MAX_RETRIES):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            with open(part, "ab") as out:
+                result = self._transfer(name, offset, out)
+            if result is None:
+                continue
+            remote_size, remote_crc, n = result
+            received += n
+            if _file_crc(part) == remote_crc and os.path.getsize(part) == remote_size:
+                os.replace(part, final)
+                self._send(lt.CMD_ACK, remote_size.to_bytes(4, "little"))
+                return received
+            # CRC divergente: recomeca do zero
+            os.remove(part)
+        self._send(lt.CMD_ABORT)
+        raise IOError("{}: falha ao baixar {}".format(self.link.path, name))
+
+    def tail(self, name, offset):
+        """
+        Bytes de 'name' a partir de offset, pelo TAIL (o CRC do EOF cobre
+        so o trecho: o Pico nao rele o arquivo ativo a cada consulta).
+
+        Returns:
+            (bytes, tamanho remoto) ou None se o arquivo nao existe;
+            tamanho menor que offset = arquivo encolheu (nada e lido)
+        """
+        for _ in range(MAX_RETRIES):
+            out = io.BytesIO()
+            try:
+                result = self._transfer(name, offset, out, lt.CMD_TAIL)
+            except IOError:
+                return None   # ERR: nao existe (ou nao permitido)
+            if result is None:
+                continue
+            size, crc, _ = result
+            # Encerra sem ACK final: nao conta como arquivo descarregado
+            self._send(lt.CMD_ABORT)
+            data = out.getvalue()
+            if size <= offset or zlib.crc32(data) & 0xFFFFFFFF == crc:
+                return data, size
+        self._send(lt.CMD_ABORT)
+        raise IOError("{}: falha ao ler o fim de {}".format(self.link.path, name))
+
+    def _transfer(self, name, offset, out, cmd=lt.CMD_GET):
+        """Um GET (ou TAIL) ate o EOF. Retorna (tamanho, crc, bytes) ou None."""
+        self._send(cmd, offset.to_bytes(4, "little") + name.encode())
+        expected = offset
+        n = 0
+        stalls = 0
+        ahead = {}      # offset -> dados recebidos alem do buraco
+        eof = None      # EOF chegou antes de fechar o ultimo buraco
+        while True:
+            frame = self._recv()
+            if frame is None:
+                stalls += 1
+                if stalls > MAX_RETRIES:
+                    return None
+                # Sessao pode ter caido: pede de novo a partir do esperado
+                # (o TAIL recomeca do offset, onde o seu CRC comeca)
+                if cmd == lt.CMD_TAIL:
+                    out.seek(0)
+                    out.truncate()
+                    expected = offset
+                    n = 0
+                    ahead.clear()
+                self._send(cmd, expected.to_bytes(4, "little") + name.encode())
+                continue
+            stalls = 0
+            ftype, payload = frame
+            if ftype == lt.RSP_DATA:
+                pos = int.from_bytes(payload[:4], "little")
+                data = payload[4:]
+                if pos > expected and len(ahead) < MAX_AHEAD:
+                    ahead[pos] = data
+                while pos == expected:
+                    out.write(data)
+                    expected += len(data)
+                    n += len(data)
+                    data = ahead.pop(expected, None)
+                    pos = expected if data is not None else -1
+                # ACK sempre com o proximo byte esperado (duplicado => o
+                # Pico reenvia so o quadro desse offset)
+                self._send(lt.CMD_ACK, expected.to_bytes(4, "little"))
+                if eof is not None and expected >= eof[0]:
+                    out.flush()
+                    return eof[0], eof[1], n
+            elif ftype == lt.RSP_EOF:
+                size = int.from_bytes(payload[:4], "little")
+                crc = int.from_bytes(payload[4:8], "little")
+                eof = (size, crc)
+                if expected < size:
+                    self._send(lt.CMD_ACK, expected.to_bytes(4, "little"))
+                    continue
+                out.flush()
+                return size, crc, n
+            elif ftype == lt.RSP_ERR:
+                raise IOError("{}: {}".format(self.link.path, payload.decode(errors="replace")))
+
+
+def _parse_listing(text):
+    files = []
+    for line in text.splitlines():
+        parts = line.split(",")
+        if len(parts) < 4:
+            continue
+        # 5o campo: CRC32 dos arquivos reescritos (vazio/ausente nos demais)
+        crc = int(parts[4]) if len(parts) > 4 and parts[4] else None
+        files.append({"name": parts[0], "size": int(parts[1]),
+                      "t_first": parts[2], "t_last": parts[3], "crc": crc})
+    return files
+
+
+def select_range(files, since=None, until=None):
+    """
+    Arquivos cujo intervalo [t_first, t_last] cruza [since, until].
+    Sem intervalo conhecido o arquivo entra.
+    """
+    out = []
+    for f in files:
+        try:
+            t0, t1 = float(f["t_first"]), float(f["t_last"])
+        except ValueError:
+            out.append(f)
+            continue
+        if (since is not None and t1 < since) or (until is not None and t0 > until):
+            continue
+        out.append(f)
+    return out
+
+
+def _file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            crc = zlib.crc32(block, crc)
+    return crc & 0xFFFFFFFF
+
+
+def offload_device(path, dest_root, baud=DEFAULT_BAUD, prefixes=None, list_only=False,
+                   since=None, until=None):
+    """Baixa os arquivos de um dispositivo para dest_root/<porta>/."""
+    link = SerialLink(path, baud)
+    try:
+        client = OffloadClient(link)
+        files = client.list_files()
+        if prefixes:
+            files = [f for f in files if f["name"].startswith(tuple(prefixes))]
+        if since is not None or until is not None:
+            files = select_range(files, since, until)
+        if list_only:
+            return path, files, 0
+        dest_dir = os.path.join(dest_root, os.path.basename(path))
+        os.makedirs(dest_dir, exist_ok=True)
+        total = 0
+        for f in files:
+            t0 = time.monotonic()
+            n = client.fetch(f["name"], f["size"], dest_dir, f["crc"])
+            total += n
+            if n:
+                dt = max(time.monotonic() - t0, 1e-6)
+                print("{}: {} ({} bytes, {:.1f} kB/s)".format(
+                    path, f["name"], n, n / dt / 1024.0))
+        return path, files, total
+    finally:
+        link.close()
+
+
+# ----------------------------------------------------------------------
+# Emulacao do dispositivo (pty) para teste sem hardware
+# ----------------------------------------------------------------------
+
+class _FdPort:
+    """Porta do LogTransfer sobre descritores (stdin/stdout do emulador)."""
+
+    is_console = False
+
+    def __init__(self, fd_in, fd_out, drop=0.0):
+        self.fd_in = fd_in
+        self.fd_out = fd_out
+        self.drop = drop
+
+    def read_available(self, limit=256):
+        r, _, _ = select.select([self.fd_in], [], [], 0)
+        return os.read(self.fd_in, limit) if r else b""
+
+    def write(self, data):
+        if self.drop and random.random() < self.drop:
+            return
+        view = memoryview(bytes(data))
+        while view:
+            n = os.write(self.fd_out, view)
+            view = view[n:]
+
+
+def serve_device(directory, drop=0.0):
+    """Roda o LogTransfer do dispositivo sobre stdin/stdout."""
+    os.chdir(directory)
+    transfer = lt.LogTransfer(_FdPort(0, 1, drop))
+    while True:
+        if not transfer.poll(100):
+            time.sleep(0.01)
+
+
+def emulate_device(directory, drop=0.0):
+    """
+    Inicia o emulador no lado mestre de um pty.
+    Retorna (caminho do lado escravo, processo, fd do escravo).
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-device", directory,
+         "--drop", str(drop)],
+        stdin=master, stdout=master, stderr=subprocess.DEVNULL, close_fds=True)
+    os.close(master)
+    # O escravo fica aberto ate o fim para o mestre nao receber EIO
+    return os.ttyname(slave), proc, slave
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Descarga de logs pela serial")
+    parser.add_argument("ports", nargs="*", help="/dev/ttyACM0 ...")
+    parser.add_argument("--dest", default="offload", help="pasta de destino")
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUD)
+    parser.add_argument("--prefix", nargs="*", default=None,
+                        help="so arquivos com estes prefixos")
+    parser.add_argument("--list", action="store_true", help="apenas lista")
+    parser.add_argument("--since", type=float, default=None,
+                        help="so arquivos com dados a partir deste timestamp (s)")
+    parser.add_argument("--until", type=float, default=None,
+                        help="so arquivos com dados ate este timestamp (s)")
+    parser.add_argument("--emulate-device", metavar="DIR",
+                        help="emula um dispositivo servindo DIR num pty")
+    parser.add_argument("--drop", type=float, default=0.0,
+                        help="(emulacao) fracao de escritas descartadas")
+    parser.add_argument("--serve-device", metavar="DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve_device:
+        serve_device(args.serve_device, args.drop)
+        return 0
+
+    procs = []
+    ports = list(args.ports)
+    if args.emulate_device:
+        path, proc, keep_fd = emulate_device(args.emulate_device, args.drop)
+        ports.append(path)
+        procs.append((proc, keep_fd))
+    if not ports:
+        parser.error("nenhuma porta informada")
+
+    status = 0
+    try:
+        with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+            jobs = [pool.submit(offload_device, p, args.dest, args.baud,
+                                args.prefix, args.list, args.since, args.until)
+                    for p in ports]
+            for job in jobs:
+                try:
+                    path, files, total = job.result()
+                except (IOError, OSError) as e:
+                    print("ERRO {}".format(e))
+                    status = 1
+                    continue
+                if args.list:
+                    print("{}:".format(path))
+                    for f in files:
+                        print("  {name:<20} {size:>10}  {t_first} .. {t_last}".format(**f))
+                else:
+                    print("{}: {} arquivos, {} bytes recebidos".format(path, len(files), total))
+    finally:
+        for proc, keep_fd in procs:
+            proc.terminate()
+            os.close(keep_fd)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,703 @@
+# power_fault.py
+"""
+Injecao de quedas de energia, falhas de I2C e watchdog (PC)
+-----------------------------------------------------------
+Roda o caminho de amostragem do main.py (TimestampManager, EventLog +
+ResetLogger, Ina219Sensor, BatteryGauge, DataLogger) sobre a flash
+emulada do flash_wear.py, milhares de vezes, cortando a energia num
+ponto sorteado e religando. Cada ciclo = boot + loop ate a falha:
+
+    - queda de energia: numa fronteira de gravacao sorteada (write(),
+      fechamento/commit, remove, rename), ate --max-writes fronteiras
+      depois do boot (o proprio boot pode cair). Depois, --max-off
+      segundos (no maximo) desligado
+    - watchdog: o barramento I2C trava alem do WATCHDOG_TIMEOUT_MS, ou
+      o INA219 nao responde na inicializacao (o main.py espera o
+      watchdog). Religa na hora, com reset_cause() = WDT
+
+Sistema de arquivos (--fs):
+    littlefs  commit atomico no fechamento/flush: o que nao foi fechado
+              some na queda (o arquivo volta ao ultimo commit)
+    torn      gravacao direta, sem commit (como FAT sem journal): o que
+              foi gravado fica, e a gravacao cortada fica pela metade
+              (exercita a recuperacao #R do DataLogger e o checkpoint
+              truncado pelo open("w"))
+
+O I2C emulado responde como um INA219 (registradores de tensao, shunt,
+corrente e calibracao) a partir de uma bateria "verdadeira" (SoC exato,
+tensao com queda na resistencia interna) e injeta NACK (EIO), timeout
+(ETIMEDOUT, gastando o timeout) e travamento. O watchdog e o relogio
+sao virtuais; apagar e programar a flash gastam o tempo do datasheet
+(W25Q16JV), entao a recuperacao no boot aparece no tempo ate a 1a amostra.
+
+Por ciclo, depois que o boot seguinte recuperou os arquivos:
+    perdidas      amostras passadas ao DataLogger que nao estao integras
+                  nos CSVs do ciclo (log_io.read_lines: CRC e #R)
+    corrompidos   CSVs do ciclo com trecho danificado que nao foi cercado
+                  pela recuperacao (ou cabecalho incompleto)
+    erro_soc      |SoC do gauge - SoC verdadeiro| na 1a amostra apos o
+                  reset (o gauge recomeca pela OCV sob carga)
+    t_1a_amostra  do religamento (ou do 1o de varios boots sem amostra)
+                  ate a 1a linha gravada
+    recuo         quanto o timestamp da 1a amostra volta em relacao a
+                  ultima amostra gravada (checkpoint a cada GC_INTERVAL)
+
+Os CSVs conferidos saem da flash emulada (como numa descarga), para a
+simulacao nao encher o disco. Sem retencao.
+
+Uso:
+    python power_fault.py                          # 1000 ciclos, littlefs e torn
+    python power_fault.py --cycles 5000 --fs littlefs --out ciclos.csv
+    python power_fault.py --p-nack 0.01 --p-hang 0.001 --gc-interval 10
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import types
+from contextlib import redirect_stdout
+
+# O firmware importa machine (reset_log) e micropython (ina219), que so
+# existem no MicroPython: o minimo para importar e controlar reset_cause()
+PWRON_RESET = 0
+WDT_RESET = 2
+_machine = types.ModuleType("machine")
+_machine.PWRON_RESET = PWRON_RESET
+_machine.WDT_RESET = WDT_RESET
+_machine.cause = PWRON_RESET
+_machine.reset_cause = lambda: _machine.cause
+sys.modules.setdefault("machine", _machine)
+_micropython = types.ModuleType("micropython")
+_micropython.const = lambda value: value
+sys.modules.setdefault("micropython", _micropython)
+
+# flash_wear instala o relogio virtual em time e poe Codes/ no sys.path
+from flash_wear import CLOCK, BlockDevice, EmulatedFile, LittleFsModel, mount  # noqa: E402
+import log_io  # noqa: E402
+import data_logger  # noqa: E402
+import ina_sensor  # noqa: E402
+from battery_gauge import BatteryGauge  # noqa: E402
+from console import set_level, SILENT  # noqa: E402
+from event_log import EventLog, EV_I2C_ERROR, EV_SENSOR_ERROR, source_id, err_code  # noqa: E402
+from reset_log import ResetLogger  # noqa: E402
+from timestamp_manager import TimestampManager  # noqa: E402
+
+# Como no main.py
+LOG_BASE = "ina_log"
+BATTERY_CAPACITY_MAH = 15000
+BOOST_ETA = 0.90
+INA_SAMPLES = 3
+INA_DELAY = 0.01
+WATCHDOG_TIMEOUT_MS = 60000
+EVENT_HOLDOFF_S = 60
+INA_FAILED = {'vbus': 0.0, 'current': 0.0, 'vshunt': 0.0, 'power': 0.0}
+
+# Flash (W25Q16JV, tipicos) e boot
+ERASE_MS = 45.0          # apagar um setor de 4 KB
+PROG_MS = 0.4            # programar uma pagina de 256 bytes
+BOOT_MS = 1500           # MicroPython + imports do main.py ate criar o WDT
+
+# Bateria e carga
+R_INT_OHM = 0.10
+VLOAD_V = 5.0
+LOAD_MA = 180.0
+
+# I2C do RP2040 (MicroPython): NACK => EIO, timeout padrao de 50 ms
+EIO = 5
+ETIMEDOUT = 110
+I2C_TIMEOUT_S = 0.05
+INA_ADDR = 0x40
+RSHUNT_OHM = 0.1
+
+# Motivo com que log_io.read_lines anota o trecho cercado por um #R
+RECOVERED_REASON = "gravacao interrompida"
+
+FIELDS = ("cycle", "fault", "stage", "generated", "lost", "corrupt", "recovered_bytes",
+          "soc_err_resume", "soc_err_end", "first_sample_s", "ts_back_s",
+          "checkpoint_lost", "events_lost")
+
+
+class PowerLoss(BaseException):
+    """Energia cortada (BaseException: os except Exception do firmware nao pegam)."""
+
+
+class WatchdogReset(BaseException):
+    """O watchdog virtual venceu."""
+
+
+class TimedBlockDevice(BlockDevice):
+    """BlockDevice que gasta no relogio virtual o tempo de apagar e programar."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._us = 0
+
+    def _spend(self, ms):
+        self._us += int(ms * 1000)
+        if self._us >= 1000:
+            CLOCK.advance(self._us // 1000 / 1000.0)
+            self._us %= 1000
+
+    def erase(self, block, tag):
+        super().erase(block, tag)
+        self._spend(ERASE_MS)
+
+    def prog(self, nbytes, tag):
+        n = super().prog(nbytes, tag)
+        self._spend(n // self.prog_size * PROG_MS)
+        return n
+
+
+class CrashFile(EmulatedFile):
+    """Arquivo cujo write() pode ser a fronteira em que a energia cai."""
+
+    def write(self, buf):
+        fs = self.fs
+        if fs.cut():
+            if fs.mode == "torn":
+                data = buf.encode() if isinstance(buf, str) else bytes(buf)
+                k = fs.rng.randrange(len(data)) if data else 0
+                if k:
+                    super().write(data[:k])
+                    fs.torn += 1
+            raise PowerLoss()
+        return super().write(buf)
+
+
+class PowerFs(LittleFsModel):
+    """LittleFsModel com estado gravado (commit) e corte de energia."""
+
+    file_class = CrashFile
+
+    def __init__(self, bd, mode, rng):
+        super().__init__(bd)
+        self.mode = mode
+        self.rng = rng
+        self.committed = {}    # nome -> conteudo do ultimo commit
+        self.born = {}         # nome -> ciclo que criou o arquivo
+        self.cycle = 0
+        self.writes = 0        # fronteiras de gravacao ate agora
+        self.cut_at = None
+        self.dead = False
+        self.torn = 0          # gravacoes que ficaram pela metade
+
+    def cut(self):
+        """Conta uma fronteira de gravacao; True se a energia cai nela."""
+        if self.dead:
+            raise PowerLoss()
+        self.writes += 1
+        if self.cut_at is not None and self.writes >= self.cut_at:
+            self.dead = True
+            return True
+        return False
+
+    def open(self, name, mode="r"):
+        if self.dead:
+            raise PowerLoss()
+        created = name not in self.files
+        f = super().open(name, mode)
+        if created:
+            self.born[name] = self.cycle
+        return f
+
+    def sync(self, f):
+        # Fechamento depois da queda (with/finally) nao grava nada
+        if f.dirty_from is None or self.dead:
+            return
+        if self.cut():
+            raise PowerLoss()
+        super().sync(f)
+        self.committed[f.name] = bytes(f.node.data)
+
+    def remove(self, name):
+        if self.cut():
+            raise PowerLoss()
+        super().remove(name)
+        self.committed.pop(name, None)
+
+    def rename(self, src, dst):
+        if self.cut():
+            raise PowerLoss()
+        super().rename(src, dst)
+        self.committed.pop(src, None)
+        self.committed[dst] = bytes(self.files[dst].data)
+
+    def power_loss(self):
+        """Religa: no littlefs, cada arquivo volta ao ultimo commit."""
+        if self.mode == "littlefs":
+            for name in list(self.files):
+                if name not in self.committed:
+                    self._release(self.files.pop(name))
+                elif self.files[name].data != self.committed[name]:
+                    self.files[name].data = bytearray(self.committed[name])
+        self.dead = False
+        self.cut_at = None
+
+    def discard(self, name):
+        """Tira um arquivo sem passar pelo firmware (descarga para o PC)."""
+        self._release(self.files.pop(name))
+        self.committed.pop(name, None)
+        self.born.pop(name, None)
+
+    def read_only(self, name, mode="rb"):
+        """open() para o log_io: conteudo atual, sem fronteiras de gravacao."""
+        return _BytesFile(bytes(self.files[name].data))
+
+
+class _BytesFile:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def readline(self):
+        end = self.data.find(b"\n", self.pos)
+        end = len(self.data) if end < 0 else end + 1
+        line = self.data[self.pos:end]
+        self.pos = end
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class VirtualWatchdog:
+    """machine.WDT sobre o relogio virtual; check() dispara o reset."""
+
+    def __init__(self, timeout_ms):
+        self.timeout_ms = timeout_ms
+        self.last = None       # None = desligado (antes do WDT(...) no boot)
+
+    def start(self):
+        self.last = CLOCK.now_ms
+
+    def stop(self):
+        self.last = None
+
+    def feed(self):
+        if self.last is not None:
+            self.last = CLOCK.now_ms
+
+    def check(self):
+        if self.last is not None and CLOCK.now_ms - self.last > self.timeout_ms:
+            raise WatchdogReset()
+
+
+class Battery:
+    """Bateria verdadeira: SoC integrado exato e tensao sob carga."""
+
+    def __init__(self, rng, soc, points, capacity_mAh=BATTERY_CAPACITY_MAH):
+        self.rng = rng
+        self.soc = soc
+        self.capacity_mAh = capacity_mAh
+        self.points = sorted((s, v) for v, s in points)
+        self.powered = True
+        self.iload = LOAD_MA
+        self._t_ms = CLOCK.now_ms
+
+    def ocv(self):
+        pts = self.points
+        for k in range(1, len(pts)):
+            s1, v1 = pts[k]
+            if self.soc <= s1:
+                s0, v0 = pts[k - 1]
+                return v0 + (v1 - v0) * (self.soc - s0) / (s1 - s0)
+        return pts[-1][1]
+
+    def ibatt(self):
+        return self.iload * VLOAD_V / (BOOST_ETA * self.ocv()) if self.powered else 0.0
+
+    def at(self, now_ms):
+        """Integra a carga ate now_ms."""
+        dt = (now_ms - self._t_ms) / 1000.0
+        self._t_ms = now_ms
+        if dt > 0.0:
+            self.soc = max(0.0, self.soc - 100.0 * self.ibatt() * dt / 3600.0 / self.capacity_mAh)
+
+    def next_load(self):
+        self.iload = max(20.0, LOAD_MA + self.rng.gauss(0.0, 25.0))
+
+    def vbatt(self):
+        """Leitura do ADC: OCV menos a queda na resistencia interna, com ruido."""
+        return self.ocv() - self.ibatt() * R_INT_OHM / 1000.0 + self.rng.gauss(0.0, 0.002)
+
+
+class FakeI2c:
+    """I2C com um INA219 na carga; injeta NACK, timeout e travamento."""
+
+    def __init__(self, rig, p_nack, p_timeout, p_hang):
+        self.rig = rig
+        self.p_nack = p_nack
+        self.p_timeout = p_timeout
+        self.p_hang = p_hang
+        self.regs = {}
+        self.nacks = self.timeouts = self.hangs = 0
+
+    def _fault(self, addr):
+        r = self.rig.rng.random()
+        if r < self.p_hang:
+            self.hangs += 1
+            while True:
+                self.rig.advance(1.0)   # barramento preso: so o watchdog tira
+        r -= self.p_hang
+        if r < self.p_timeout:
+            self.timeouts += 1
+            self.rig.advance(I2C_TIMEOUT_S)
+            raise OSError(ETIMEDOUT, "ETIMEDOUT")
+        if r - self.p_timeout < self.p_nack or addr != INA_ADDR:
+            self.nacks += 1
+            raise OSError(EIO, "EIO")
+
+    def _register(self, reg):
+        bat = self.rig.battery
+        # Shunt invertido na placa (main.py usa invert_polarity=True)
+        i_mA = -(bat.iload + self.rig.rng.gauss(0.0, 0.5))
+        if reg == 0x02:
+            return (int(VLOAD_V * 1000 + self.rig.rng.gauss(0.0, 4.0)) // 4) << 3
+        if reg == 0x01:
+            return int(round(i_mA * RSHUNT_OHM * 100))        # LSB 10 uV
+        if reg == 0x04:
+            cal = self.regs.get(0x05, 0)
+            return int(round(i_mA * cal * RSHUNT_OHM / 40.96)) if cal else 0
+        return self.regs.get(reg, 0)
+
+    def writeto_mem(self, addr, reg, buf):
+        self._fault(addr)
+        self.regs[reg] = (buf[0] << 8) | buf[1]
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        self._fault(addr)
+        value = max(-0x8000, min(0xFFFF, self._register(reg))) & 0xFFFF
+        buf[0] = value >> 8
+        buf[1] = value & 0xFF
+
+
+class Node:
+    """Objetos do firmware de um boot (preenchidos conforme o boot avanca)."""
+
+    def __init__(self):
+        self.ts = self.events = self.ina = self.gauge = self.logger = None
+
+
+class Rig:
+    """Ciclos de boot, amostragem e falha sobre a flash e o I2C emulados."""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.rng = random.Random(cfg["seed"])
+        CLOCK.now_ms = 0
+        self.fs = PowerFs(TimedBlockDevice(), cfg["fs"], self.rng)
+        mount(self.fs)
+        log_io.open = self.fs.read_only
+        ina_sensor.sleep = self.advance
+        self.wdt = VirtualWatchdog(cfg["wdt_ms"])
+        points = BatteryGauge().ocv_points
+        self.battery = Battery(self.rng, self.rng.uniform(30.0, 90.0), points)
+        self.i2c = FakeI2c(self, cfg["p_nack"], cfg["p_timeout"], cfg["p_hang"])
+        self.records = []
+        self.cause = PWRON_RESET
+        self.evaluated = 0          # ciclos anteriores a este ja conferidos
+        self.waiting_since = None   # 1o boot sem amostra gravada
+        self.last_ts = None         # timestamp da ultima linha gravada
+        self.events_written = 0
+        self.checkpoint = 0.0        # ultimo checkpoint gravado por inteiro
+
+    def advance(self, seconds):
+        """Passa o tempo com o no ligado (sleep do firmware)."""
+        self.battery.at(CLOCK.now_ms)
+        CLOCK.advance(seconds)
+        self.battery.at(CLOCK.now_ms)
+        self.wdt.check()
+
+    # -- um ciclo ----------------------------------------------------------
+
+    def run_cycle(self):
+        rec = dict.fromkeys(FIELDS)
+        rec.update(cycle=len(self.records), generated=0, lost=0, corrupt=0, good=0,
+                   recovered_bytes=0, checkpoint_lost=0, events_lost=0, samples=0)
+        self.records.append(rec)
+        self.fs.cycle = rec["cycle"]
+        self.fs.cut_at = self.fs.writes + self.rng.randint(1, self.cfg["max_writes"])
+        node = Node()
+        rec["stage"] = "boot"
+        try:
+            self.boot(node, rec)
+            rec["stage"] = "loop"
+            self.loop(node, rec)
+        except PowerLoss:
+            rec["fault"] = "energia"
+        except WatchdogReset:
+            rec["fault"] = "watchdog"
+        self.shutdown(node, rec)
+
+    def boot(self, node, rec):
+        _machine.cause = self.cause
+        if self.waiting_since is None:
+            self.waiting_since = CLOCK.now_ms
+        self.advance(self.cfg["boot_ms"] / 1000.0)
+        self.wdt.start()
+
+        node.ts = TimestampManager()
+        if node.ts.offset < self.checkpoint - 0.01:
+            rec["checkpoint_lost"] = 1   # arquivo vazio ou cortado: o relogio volta
+        node.events = EventLog(capacity=self.cfg["event_capacity"], clock=node.ts.get_timestamp_ds,
+                               holdoff_ds=EVENT_HOLDOFF_S * 10)
+        rec["events_lost"] = max(0, self.events_written - (node.events.seq - 1))
+        ResetLogger(node.events, node.ts.offset)
+
+        rec["stage"] = "ina"
+        try:
+            node.ina = ina_sensor.Ina219Sensor(self.i2c, invert_polarity=True)
+        except Exception:
+            node.events.log(EV_SENSOR_ERROR, source_id("INA219"))
+            while True:
+                self.advance(1.0)   # main.py: "Aguardando watchdog reiniciar..."
+        rec["stage"] = "boot"
+
+        node.gauge = BatteryGauge(capacity_mAh=BATTERY_CAPACITY_MAH,
+                                  sample_interval_s=self.cfg["interval"])
+        node.gauge.events = node.events
+        node.logger = data_logger.DataLogger(LOG_BASE, max_lines=self.cfg["max_lines"],
+                                             block_lines=self.cfg["block_lines"], events=node.events)
+        self.evaluate(node.logger)
+
+    def loop(self, node, rec):
+        count = 0
+        interval = self.cfg["interval"]
+        while True:
+            start = CLOCK.now_ms
+            self.wdt.feed()
+            t = self.sample(node, rec)
+            count += 1
+            if count % self.cfg["gc_interval"] == 0:
+                self.wdt.feed()
+                node.ts.save_checkpoint(t)
+                self.checkpoint = float("{:.2f}".format(t))
+                node.events.sync()
+            elapsed = (CLOCK.now_ms - start) / 1000.0
+            self.wdt.feed()
+            self.advance(max(0.05, interval - elapsed))
+
+    def read_ina(self, node):
+        """safe_i2c_read(read_ina, "INA219", INA_FAILED) do main.py."""
+        try:
+            self.wdt.feed()
+            return node.ina.average(n=INA_SAMPLES, delay=INA_DELAY)
+        except OSError as e:
+            node.events.log(EV_I2C_ERROR, source_id("INA219"), err_code(e))
+            return INA_FAILED
+
+    def sample(self, node, rec):
+        """sample_float() do main.py, sem HDC1080 e sem os opcionais."""
+        bat = self.battery
+        bat.next_load()
+        d = self.read_ina(node)
+        bat.at(CLOCK.now_ms)
+        vbatt = bat.vbatt()
+        ibatt = 0.0 if vbatt < 2.5 else d['vbus'] * d['current'] / (BOOST_ETA * vbatt)
+        t = node.ts.get_timestamp()
+        soc = node.gauge.update(voltage_V=vbatt, current_mA=ibatt, now_s=t)
+        err = abs(soc - bat.soc)
+        if rec["soc_err_resume"] is None:
+            rec["soc_err_resume"] = err
+        rec["soc_err_end"] = err
+        row = {"timestamp": t, "Vbatt": vbatt, "Vload": d['vbus'], "Iload_mA": d['current'],
+               "Ibatt_mA": ibatt, "SoC": soc, "Temp_int": 25.0,
+               "Temp_ext": float('nan'), "Humidity": float('nan')}
+        rec["generated"] += 1
+        node.logger.append(row)
+        if rec["samples"] == 0:
+            rec["first_sample_s"] = (CLOCK.now_ms - self.waiting_since) / 1000.0
+            self.waiting_since = None
+            if self.last_ts is not None:
+                rec["ts_back_s"] = self.last_ts - t
+        rec["samples"] += 1
+        self.last_ts = t
+        return t
+
+    def shutdown(self, node, rec):
+        self.battery.at(CLOCK.now_ms)
+        self.wdt.stop()
+        if node.events is not None:
+            self.events_written = node.events.seq - 1
+        self.fs.power_loss()
+        if rec["fault"] == "energia":
+            self.cause = PWRON_RESET
+            self.battery.powered = False
+            CLOCK.advance(self.rng.uniform(0.0, self.cfg["max_off"]))
+            self.battery.at(CLOCK.now_ms)
+            self.battery.powered = True
+        else:
+            self.cause = WDT_RESET
+
+    # -- conferencia ---------------------------------------------------------
+
+    def evaluate(self, logger):
+        """
+        Depois da recuperacao no boot: confere os CSVs fechados, credita
+        as linhas integras ao ciclo que criou cada arquivo e os retira.
+        """
+        if logger.recovered_bytes:
+            prev = "{:s}_{:03d}.csv".format(LOG_BASE, logger.current_file_index - 1)
+            if prev in self.fs.born:
+                self.records[self.fs.born[prev]]["recovered_bytes"] += logger.recovered_bytes
+        prefix = LOG_BASE + "_"
+        for name in sorted(self.fs.files):
+            if not name.startswith(prefix) or name == logger.filename:
+                continue
+            rec = self.records[self.fs.born[name]]
+            damaged = []
+            lines = list(log_io.read_lines(name, damaged))
+            rec["good"] += max(0, len(lines) - 1)
+            if (not lines or not lines[0].endswith("\n")
+                    or any(d[3] != RECOVERED_REASON for d in damaged)):
+                rec["corrupt"] += 1
+            self.fs.discard(name)
+        current = self.fs.cycle
+        for rec in self.records[self.evaluated:current]:
+            rec["lost"] = rec["generated"] - rec["good"]
+        self.evaluated = current
+
+    def finish(self):
+        """Um ultimo boot so do DataLogger, para recuperar e conferir o ultimo ciclo."""
+        self.fs.cycle = len(self.records)
+        logger = data_logger.DataLogger(LOG_BASE, max_lines=self.cfg["max_lines"],
+                                        block_lines=self.cfg["block_lines"])
+        self.evaluate(logger)
+
+
+def simulate(cfg):
+    rig = Rig(cfg)
+    with open(os.devnull, "w") as null, redirect_stdout(null):
+        for _ in range(cfg["cycles"]):
+            rig.run_cycle()
+        rig.finish()
+    return rig
+
+
+def _pct(values, q):
+    if not values:
+        return math.nan
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _stats(values, unit):
+    if not values:
+        return "sem dados"
+    return "media {:.2f}{u}, p95 {:.2f}{u}, max {:.2f}{u}".format(
+        sum(values) / len(values), _pct(values, 0.95), max(values), u=unit)
+
+
+def report(cfg, rig):
+    recs = rig.records
+    print("\n== {}: {} ciclos, intervalo {:g} s, checkpoint a cada {} amostras".format(
+        cfg["fs"], len(recs), cfg["interval"], cfg["gc_interval"]))
+    power = sum(1 for r in recs if r["fault"] == "energia")
+    wdt_ina = sum(1 for r in recs if r["fault"] == "watchdog" and r["stage"] == "ina")
+    in_boot = sum(1 for r in recs if r["stage"] != "loop")
+    print("falhas: {} quedas de energia, {} watchdog ({} na inicializacao do INA219); "
+          "{} durante o boot".format(power, len(recs) - power, wdt_ina, in_boot))
+    print("I2C: {} NACK, {} timeouts, {} travamentos; {} gravacoes cortadas ao meio".format(
+        rig.i2c.nacks, rig.i2c.timeouts, rig.i2c.hangs, rig.fs.torn))
+    gen = sum(r["generated"] for r in recs)
+    lost = [r["lost"] for r in recs]
+    print("amostras: {} geradas, {} perdidas ({:.3f}%); por ciclo media {:.2f}, max {}".format(
+        gen, sum(lost), 100.0 * sum(lost) / max(1, gen), sum(lost) / max(1, len(recs)), max(lost)))
+    print("arquivos: {} ciclos com CSV corrompido ({} arquivos), {} com fim recuperado (#R)".format(
+        sum(1 for r in recs if r["corrupt"]), sum(r["corrupt"] for r in recs),
+        sum(1 for r in recs if r["recovered_bytes"])))
+    back = [r["ts_back_s"] for r in recs if r["ts_back_s"] is not None]
+    print("relogio: {} checkpoints perdidos ou truncados; recuo na retomada {}".format(
+        sum(r["checkpoint_lost"] for r in recs), _stats(back, " s")))
+    print("eventos: {} registros perdidos na queda".format(sum(r["events_lost"] for r in recs)))
+    print("erro de SoC na retomada: {}".format(
+        _stats([r["soc_err_resume"] for r in recs if r["soc_err_resume"] is not None], "%")))
+    print("erro de SoC antes da falha: {}".format(
+        _stats([r["soc_err_end"] for r in recs if r["soc_err_end"] is not None], "%")))
+    print("reset ate a 1a amostra: {}".format(
+        _stats([r["first_sample_s"] for r in recs if r["first_sample_s"] is not None], " s")))
+    worst = sorted((r for r in recs if r["lost"] > 1 or r["corrupt"]),
+                   key=lambda r: (r["corrupt"], r["lost"]), reverse=True)[:5]
+    for r in worst:
+        print("  ciclo {}: {} no {}, {} amostras perdidas, {} CSV corrompidos".format(
+            r["cycle"], r["fault"], r["stage"], r["lost"], r["corrupt"]))
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return str(value)
+
+
+def write_cycles(path, runs):
+    """Um CSV com uma linha por ciclo (coluna fs para comparar os modos)."""
+    with open(path, "w") as f:
+        f.write("fs," + ",".join(FIELDS) + "\n")
+        for cfg, rig in runs:
+            for r in rig.records:
+                f.write(cfg["fs"] + "," + ",".join(_cell(r[k]) for k in FIELDS) + "\n")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Quedas de energia, I2C e watchdog sobre o firmware emulado")
+    ap.add_argument("--cycles", type=int, default=1000)
+    ap.add_argument("--fs", default="littlefs,torn", help="littlefs e/ou torn (lista)")
+    ap.add_argument("--interval", type=float, default=1.0, help="SAMPLE_INTERVAL [s]")
+    ap.add_argument("--gc-interval", type=int, default=100, help="amostras entre checkpoints")
+    ap.add_argument("--block-lines", type=int, default=32, help="LOG_BLOCK_LINES")
+    ap.add_argument("--max-lines", type=int, default=15000, help="LOG_MAX_LINES")
+    ap.add_argument("--event-capacity", type=int, default=256, help="EVENT_CAPACITY")
+    ap.add_argument("--max-writes", type=int, default=400,
+                    help="fronteiras de gravacao ate a queda (sorteio uniforme)")
+    ap.add_argument("--max-off", type=float, default=300.0, help="tempo maximo desligado [s]")
+    ap.add_argument("--p-nack", type=float, default=0.002, help="probabilidade por transacao I2C")
+    ap.add_argument("--p-timeout", type=float, default=0.001)
+    ap.add_argument("--p-hang", type=float, default=0.0002)
+    ap.add_argument("--boot-ms", type=int, default=BOOT_MS)
+    ap.add_argument("--wdt-ms", type=int, default=WATCHDOG_TIMEOUT_MS)
+    ap.add_argument("--out", help="CSV com uma linha por ciclo")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    modes = args.fs.split(",")
+    for mode in modes:
+        if mode not in ("littlefs", "torn"):
+            print("ERRO sistema de arquivos invalido: {}".format(mode))
+            return 1
+
+    set_level(SILENT)
+    runs = []
+    for mode in modes:
+        cfg = {
+            "fs": mode, "cycles": args.cycles, "interval": args.interval,
+            "gc_interval": args.gc_interval, "block_lines": args.block_lines,
+            "max_lines": args.max_lines, "event_capacity": args.event_capacity,
+            "max_writes": args.max_writes, "max_off": args.max_off, "p_nack": args.p_nack,
+            "p_timeout": args.p_timeout, "p_hang": args.p_hang, "boot_ms": args.boot_ms,
+            "wdt_ms": args.wdt_ms, "seed": args.seed,
+        }
+        rig = simulate(cfg)
+        report(cfg, rig)
+        runs.append((cfg, rig))
+    if args.out:
+        write_cycles(args.out, runs)
+        print("\nCiclos gravados em {}".format(args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+# soh_estimate.py
+"""
+Estado de saude (SoH) das baterias pelo historico dos logs (PC)
+---------------------------------------------------------------
+O BatteryGauge conta carga contra uma capacidade fixa
+(BATTERY_CAPACITY_MAH = 15000), mas as celulas perdem capacidade e ganham
+resistencia: o SoC deriva mais a cada mes. Este script varre o historico
+inteiro de Vbatt, Ibatt_mA e temperatura e estima, por janela de tempo:
+
+- capacidade efetiva: pontos de SoC conhecido ("ancoras") sao o inicio
+  relaxado e o fim de repousos longos (|Ibatt| < rest_C * C por
+  rest_min_s: tensao ~ OCV, SoC pela mesma tabela OCV do gauge) e os
+  extremos da curva (tensao compensada pela queda em R cruzando o topo
+  ou o fundo da curva, com o SoC da curva nesse ponto). Dentro de um trecho de descarga (sem lacuna nas
+  amostras nem carga), o SoC das ancoras cai linearmente com a carga
+  retirada Q:
+      SoC = SoC0 - 100 * Q / C
+  e a inclinacao da regressao do trecho da C; a janela usa a mediana das
+  inclinacoes, ponderada pela variancia de Q (robusta a trechos
+  contaminados). Ibatt so ve a descarga (carga solar nao e medida), entao
+  o trecho termina quando a tensao compensada (Vbatt + Ibatt*R) sobe
+  acima do minimo da ultima hora ou quando o SoC de uma ancora sobe em
+  relacao a anterior.
+- resistencia interna: R = -dV/dI nos degraus de corrente entre amostras
+  vizinhas (cargas ligando/desligando). Com amostras de 60 s e a
+  resistencia "de 1 minuto" (inclui parte da polarizacao).
+
+Tudo vetorizado (np.bincount por trecho, sem laco por amostra); um no por
+processo. Anos de dados de 1 minuto de uma frota em poucos minutos.
+
+Uso:
+    python soh_estimate.py offload/ --out gauge_params.csv --history soh.csv
+    python soh_estimate.py --store frota/ --window-days 30 --workers 8
+    python soh_estimate.py dados/no07/ --capacity 15000
+
+gauge_params.csv: uma linha por no com capacity_mAh (para
+BATTERY_CAPACITY_MAH do main.py), SoH e r_int_mohm da janela mais recente
+com estimativa.
+"""
+
+import argparse
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from gauge_replay import DEFAULT_PARAMS, _make_gauge, battery_temperature, soc_from_ocv
+from fleet_ingest import FleetStore, find_nodes
+from log_reader import LogSet
+
+COLUMNS = ("Vbatt", "Ibatt_mA", "Temp_int", "Temp_ext")
+
+REST_C = 0.005            # repouso para OCV: |I| < C/200 (mais rigido que o gauge)
+REST_MIN_S = 1800         # tempo de relaxacao antes de ler a OCV
+GAP_S = 300               # intervalo sem amostras que interrompe a integral
+R_INIT_OHM = 0.10         # R para compensar a tensao se nao ha degraus
+R_SMOOTH_S = 7 * 86400    # mediana de R por semana (compensacao da tensao)
+CHARGE_RISE_V = 0.03      # subida da tensao compensada que indica carga
+CHARGE_WINDOW_S = 3600
+ANCHOR_MARGIN_V = 0.02    # margem nos extremos da curva OCV (como o gauge)
+MIN_DSOC = 3.0            # faixa minima de SoC de um trecho (%)
+SOC_RISE = 1.0            # subida entre ancoras que indica carga nao vista (%)
+STEP_MA = 100.0           # degrau minimo de corrente para R
+R_MAX_OHM = 2.0
+WINDOW_DAYS = 30
+MIN_RUNS = 3              # trechos por janela para valer como estimativa
+
+
+def weighted_median(x, w):
+    """Mediana ponderada (NaN se vazio)."""
+    if x.size == 0:
+        return float("nan")
+    order = np.argsort(x)
+    cw = np.cumsum(w[order])
+    return float(x[order][np.searchsorted(cw, cw[-1] / 2.0)])
+
+
+def _runs(mask):
+    """(inicios, fins) inclusivos das sequencias True de mask."""
+    m = np.concatenate(([False], mask, [False])).astype(np.int8)
+    d = np.diff(m)
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1) - 1
+
+
+def _rolling_min(x, n):
+    """Minimo das ultimas n amostras (inclusive) de cada posicao."""
+    if n <= 1 or x.size == 0:
+        return x.copy()
+    padded = np.concatenate((np.full(n - 1, np.inf), x))
+    return np.lib.stride_tricks.sliding_window_view(padded, n).min(axis=1)
+
+
+def analyze(cols, capacity_mAh=None, params=None, rest_C=REST_C, rest_min_s=REST_MIN_S,
+            gap_s=GAP_S, r_init=R_INIT_OHM, charge_rise_v=CHARGE_RISE_V, min_dsoc=MIN_DSOC,
+            step_mA=STEP_MA):
+    """
+    Trechos de descarga com capacidade estimada e degraus de resistencia.
+
+    Args:
+        cols: dict com timestamp, Vbatt, Ibatt_mA (e Temp_int/Temp_ext)
+        capacity_mAh: capacidade nominal (define o limiar de repouso)
+        params: parametros do gauge (ver gauge_replay.DEFAULT_PARAMS)
+
+    Returns:
+        dict com "runs" (t, capacity_mAh, dsoc, weight, anchors, temp por
+        trecho),
+        "steps" (t, r_ohm) e "anchors" (t, soc, tipo)
+    """
+    p = dict(params or {})
+    if capacity_mAh is not None:
+        p["capacity_mAh"] = capacity_mAh
+    gauge = _make_gauge(p)
+    t = np.asarray(cols["timestamp"], dtype=np.float64)
+    v = np.asarray(cols["Vbatt"], dtype=np.float64)
+    i = np.asarray(cols["Ibatt_mA"], dtype=np.float64)
+    temp = battery_temperature(cols) if "Temp_ext" in cols else None
+    empty = {"runs": {k: np.empty(0) for k in ("t", "capacity_mAh", "dsoc", "weight", "anchors", "temp")},
+             "steps": {"t": np.empty(0), "r_ohm": np.empty(0)},
+             "anchors": {"t": np.empty(0), "soc": np.empty(0), "kind": np.empty(0, np.int8)}}
+    ok = np.isfinite(t) & np.isfinite(v) & np.isfinite(i)
+    t, v, i = t[ok], v[ok], i[ok]
+    if temp is not None:
+        temp = temp[ok]
+    if t.size < 3:
+        return empty
+
+    dt = np.diff(t)
+    interval = float(np.median(dt[dt > 0])) if np.any(dt > 0) else 60.0
+    gap = np.concatenate(([True], (dt > gap_s) | (dt <= 0)))
+
+    # Carga retirada acumulada (mAh, trapezios; lacunas nao contam)
+    dq = np.where(gap[1:], 0.0, (i[1:] + i[:-1]) * 0.5 * dt / 3600.0)
+    q = np.concatenate(([0.0], np.cumsum(dq)))
+
+    # Resistencia: degraus de corrente entre amostras vizinhas. A carga
+    # solar muda devagar e quase nao entra no dV de um passo
+    di = np.diff(i)
+    dv = np.diff(v)
+    step = (np.abs(di) >= step_mA) & ~gap[1:] & (dt <= 2.0 * interval)
+    r_ohm = -dv[step] / di[step] * 1000.0
+    valid_r = (r_ohm > 0) & (r_ohm < R_MAX_OHM)
+    t_r = t[1:][step][valid_r]
+    r_ohm = r_ohm[valid_r]
+
+    # R(t) pelas medianas semanais (r_init sem degraus) compensa a tensao:
+    # com R fixo, a queda de uma celula envelhecida parece SoC mais baixo
+    r_t = np.full(t.size, r_init)
+    if r_ohm.size:
+        b = np.floor(t_r / R_SMOOTH_S).astype(np.int64)
+        bins, start = np.unique(b, return_index=True)
+        med = np.array([np.median(x) for x in np.split(r_ohm, start[1:])])
+        r_t = np.interp(t, (bins + 0.5) * R_SMOOTH_S, med)
+
+    # Carga (nao medida): tensao compensada sobe acima do minimo recente
+    vc = v + i * r_t / 1000.0
+    window = max(1, int(round(CHARGE_WINDOW_S / interval)))
+    seg = np.cumsum(gap)
+    # Minimo recomecado a cada lacuna: desloca cada trecho para baixo
+    shifted = vc - seg * 100.0
+    charging = (shifted - _rolling_min(shifted, window)) > charge_rise_v
+
+    # Ancoras: fim de repouso longo (OCV), extremos da curva OCV
+    top = gauge._ocv_v_min + (gauge._ocv_n_v - 1) / gauge._ocv_inv_step
+    rest = np.abs(i) <= rest_C * gauge.capacity_mAh
+    s0, s1 = _runs(rest)
+    long_rest = (t[s1] - t[s0] >= rest_min_s) & (seg[s0] == seg[s1])
+    relaxed = np.searchsorted(t, t[s0[long_rest]] + rest_min_s)
+    a_rest = np.unique(np.concatenate((relaxed, s1[long_rest])))
+    full_s, full_e = _runs(vc >= top - ANCHOR_MARGIN_V)
+    empty_s, _ = _runs(vc <= gauge._ocv_v_min + ANCHOR_MARGIN_V)
+    idx = np.concatenate((a_rest, full_e, empty_s))
+    kind = np.concatenate((np.zeros(a_rest.size, np.int8), np.ones(full_e.size, np.int8),
+                           np.full(empty_s.size, 2, np.int8)))
+    soc = np.concatenate((soc_from_ocv(gauge, v[a_rest], None if temp is None else temp[a_rest]),
+                          np.full(full_e.size, soc_from_ocv(gauge, top - ANCHOR_MARGIN_V)),
+                          np.full(empty_s.size, soc_from_ocv(gauge, gauge._ocv_v_min + ANCHOR_MARGIN_V))))
+    keep = ~charging[idx]
+    order = np.argsort(idx[keep], kind="stable")
+    idx, kind, soc = idx[keep][order], kind[keep][order], soc[keep][order]
+
+    # Trechos de descarga: quebram em lacuna, carga ou SoC subindo
+    run = np.cumsum(gap | charging)[idx]
+    new = np.ones(idx.size, dtype=bool)
+    new[1:] = (run[1:] != run[:-1]) | (soc[1:] - soc[:-1] > SOC_RISE)
+    inv = np.cumsum(new) - 1
+    uniq = np.flatnonzero(new)
+    n = np.bincount(inv).astype(np.float64)
+    qa = q[idx]
+    # Regressao SoC ~ Q por trecho, centrada para nao perder precisao
+    mq = np.bincount(inv, qa) / n
+    ms = np.bincount(inv, soc) / n
+    dqa = qa - mq[inv]
+    dsa = soc - ms[inv]
+    sqq = np.bincount(inv, dqa * dqa)
+    sqs = np.bincount(inv, dqa * dsa)
+    smax = np.full(uniq.size, -np.inf)
+    smin = np.full(uniq.size, np.inf)
+    np.maximum.at(smax, inv, soc)
+    np.minimum.at(smin, inv, soc)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = sqs / sqq
+        cap = -100.0 / slope
+    dsoc = smax - smin
+    good = (n >= 2) & (dsoc >= min_dsoc) & (slope < 0) & np.isfinite(cap)
+    t_mid = np.bincount(inv, t[idx]) / n
+    temps = np.full(uniq.size, np.nan)
+    if temp is not None:
+        ta = temp[idx]
+        fin = np.isfinite(ta)
+        cnt = np.bincount(inv[fin], minlength=uniq.size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            temps = np.bincount(inv[fin], ta[fin], minlength=uniq.size) / cnt
+
+    return {"runs": {"t": t_mid[good], "capacity_mAh": cap[good], "dsoc": dsoc[good],
+                     "weight": sqq[good], "anchors": n[good], "temp": temps[good]},
+            "steps": {"t": t_r, "r_ohm": r_ohm},
+            "anchors": {"t": t[idx], "soc": soc, "kind": kind}}
+
+
+def windows(result, window_s, min_runs=MIN_RUNS):
+    """
+    Estimativas por janela: lista de dicts com t0, capacity_mAh (mediana
+    ponderada pela variancia de Q dos trechos), runs, r_mohm (mediana), steps, temp.
+    """
+    runs, steps = result["runs"], result["steps"]
+    times = np.concatenate((runs["t"], steps["t"]))
+    if times.size == 0:
+        return []
+    w_run = np.floor(runs["t"] / window_s).astype(np.int64)
+    w_step = np.floor(steps["t"] / window_s).astype(np.int64)
+    out = []
+    for w in np.unique(np.floor(times / window_s).astype(np.int64)):
+        m = w_run == w
+        s = w_step == w
+        n_runs = int(np.count_nonzero(m))
+        cap = weighted_median(runs["capacity_mAh"][m], runs["weight"][m]) if n_runs >= min_runs \
+            else float("nan")
+        temps = runs["temp"][m]
+        temps = temps[np.isfinite(temps)]
+        out.append({"t0": float(w * window_s), "capacity_mAh": cap, "runs": n_runs,
+                    "r_mohm": float(np.median(steps["r_ohm"][s]) * 1000.0) if np.any(s) else float("nan"),
+                    "steps": int(np.count_nonzero(s)),
+                    "temp": float(np.median(temps)) if temps.size else float("nan")})
+    return out
+
+
+def fade_per_year(rows, nominal):
+    """Perda de capacidade (% da nominal por ano) pela regressao das janelas."""
+    t = np.array([r["t0"] for r in rows if np.isfinite(r["capacity_mAh"])])
+    c = np.array([r["capacity_mAh"] for r in rows if np.isfinite(r["capacity_mAh"])])
+    if t.size < 2 or np.ptp(t) <= 0:
+        return float("nan")
+    slope = np.polyfit(t, c, 1)[0]
+    return float(-slope * 365.0 * 86400.0 / nominal * 100.0)
+
+
+def estimate_node(task):
+    """Um no (roda num processo): le, analisa e resume. Returns (no, linhas, params, erro)."""
+    node, source, opts = task
+    try:
+        if isinstance(source, str):   # pasta do armazenamento
+            cols = FleetStore(source).query(["timestamp"] + list(COLUMNS), nodes=[node]).get(node)
+            if cols is None:
+                return node, [], None, "sem dados"
+        else:
+            cols = LogSet(source).load(list(COLUMNS))
+        nominal = opts["capacity_mAh"]
+        result = analyze(cols, nominal, rest_C=opts["rest_C"], rest_min_s=opts["rest_min_s"],
+                         gap_s=opts["gap_s"], charge_rise_v=opts["charge_rise_v"],
+                         min_dsoc=opts["min_dsoc"])
+        rows = windows(result, opts["window_days"] * 86400.0, opts["min_runs"])
+        caps = [r for r in rows if np.isfinite(r["capacity_mAh"])]
+        res = [r for r in rows if np.isfinite(r["r_mohm"])]
+        runs = result["runs"]
+        if caps:
+            cap = caps[-1]["capacity_mAh"]
+        else:
+            cap = weighted_median(runs["capacity_mAh"], runs["weight"])
+        params = {"capacity_mAh": cap, "soh": cap / nominal * 100.0,
+                  "r_int_mohm": res[-1]["r_mohm"] if res else float("nan"),
+                  "fade_pct_year": fade_per_year(rows, nominal),
+                  "runs": int(runs["t"].size), "steps": int(result["steps"]["t"].size),
+                  "samples": int(cols["timestamp"].size),
+                  "anchors": int(result["anchors"]["t"].size)}
+        return node, rows, params, None
+    except (OSError, ValueError) as e:
+        return node, [], None, str(e)
+
+
+def _fmt(x, spec):
+    return "" if x is None or not np.isfinite(x) else spec.format(x)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Capacidade efetiva e resistencia interna pelo historico")
+    ap.add_argument("roots", nargs="*", help="pastas de descarga (um no ou uma subpasta por no)")
+    ap.add_argument("--store", help="armazenamento do fleet_ingest.py (em vez das pastas)")
+    ap.add_argument("--nodes", nargs="*", help="so estes nos")
+    ap.add_argument("--capacity", type=float, default=DEFAULT_PARAMS["capacity_mAh"],
+                    help="capacidade nominal (mAh)")
+    ap.add_argument("--window-days", type=float, default=WINDOW_DAYS)
+    ap.add_argument("--min-runs", type=int, default=MIN_RUNS)
+    ap.add_argument("--min-dsoc", type=float, default=MIN_DSOC, help="faixa minima de SoC de um trecho (%%)")
+    ap.add_argument("--rest-c", type=float, default=REST_C, help="repouso: |I| < isso * C")
+    ap.add_argument("--rest-min", type=float, default=REST_MIN_S / 60.0, help="repouso minimo (min)")
+    ap.add_argument("--gap", type=float, default=GAP_S, help="lacuna que interrompe a integral (s)")
+    ap.add_argument("--charge-rise", type=float, default=CHARGE_RISE_V,
+                    help="subida da tensao compensada que indica carga (V)")
+    ap.add_argument("--workers", type=int, default=None, help="processos (padrao: todos os nucleos)")
+    ap.add_argument("--out", help="CSV com os parametros do gauge por no")
+    ap.add_argument("--history", help="CSV com as estimativas por janela")
+    args = ap.parse_args(argv)
+
+    if args.store:
+        nodes = {n: args.store for n in FleetStore(args.store).nodes()}
+    elif args.roots:
+        nodes = find_nodes(args.roots)
+    else:
+        ap.error("informe as pastas de descarga ou --store")
+    if args.nodes:
+        nodes = {n: s for n, s in nodes.items() if n in args.nodes}
+    opts = {"capacity_mAh": args.capacity, "window_days": args.window_days,
+            "min_runs": args.min_runs, "min_dsoc": args.min_dsoc, "rest_C": args.rest_c,
+            "rest_min_s": args.rest_min * 60.0, "gap_s": args.gap, "charge_rise_v": args.charge_rise}
+    tasks = [(node, src, opts) for node, src in sorted(nodes.items())]
+    if args.workers == 1 or len(tasks) < 2:
+        results = [estimate_node(t) for t in tasks]
+    else:
+        with Pool(processes=args.workers) as pool:
+            results = list(pool.imap_unordered(estimate_node, tasks))
+    results.sort(key=lambda r: r[0])
+
+    status = 0
+    for node, rows, params, error in results:
+        if error:
+            print("ERRO {}: {}".format(node, error))
+            status = 1
+            continue
+        print("{:<12} capacidade {} mAh (SoH {}%), R {} mOhm, perda {} %/ano "
+              "[{} trechos, {} degraus, {} amostras]".format(
+                  node, _fmt(params["capacity_mAh"], "{:.0f}"), _fmt(params["soh"], "{:.1f}"),
+                  _fmt(params["r_int_mohm"], "{:.0f}"), _fmt(params["fade_pct_year"], "{:.1f}"),
+                  params["runs"], params["steps"], params["samples"]))
+
+    ok = [r for r in results if r[3] is None]
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write("node,capacity_mAh,soh_pct,r_int_mohm,fade_pct_year,runs,steps\n")
+            for node, _, p, _ in ok:
+                f.write("{},{},{},{},{},{},{}\n".format(
+                    node, _fmt(p["capacity_mAh"], "{:.0f}"), _fmt(p["soh"], "{:.1f}"),
+                    _fmt(p["r_int_mohm"], "{:.1f}"), _fmt(p["fade_pct_year"], "{:.2f}"),
+                    p["runs"], p["steps"]))
+    if args.history:
+        with open(args.history, "w") as f:
+            f.write("node,t0,capacity_mAh,runs,r_mohm,steps,temp\n")
+            for node, rows, _, _ in ok:
+                for r in rows:
+                    f.write("{},{:.0f},{},{},{},{},{}\n".format(
+                        node, r["t0"], _fmt(r["capacity_mAh"], "{:.0f}"), r["runs"],
+                        _fmt(r["r_mohm"], "{:.1f}"), r["steps"], _fmt(r["temp"], "{:.1f}")))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# telemetry_client.py
+"""
+Receptor de telemetria (PC / computador de bordo)
+-------------------------------------------------
+Biblioteca asyncio para os quadros de Codes/telemetry.py. Le a porta
+serial em modo bruto sem bloquear o event loop (add_reader), descarta
+o texto do console que vier misturado e entrega registros como dict,
+com unidades convertidas (V, mA, %, C) e contagem de perdas por seq.
+
+Uso como biblioteca:
+
+    async with TelemetryReceiver("/dev/ttyACM0") as rx:
+        async for rec in rx:
+            if rec["type"] == "gauge" and rec["SoC"] < 20:
+                adiar_captura()
+            # Previsao pessimista de autonomia (None = sem limite)
+            if rec["type"] == "forecast" and rec["tte_lo_s"] is not None \
+                    and rec["tte_lo_s"] < 8 * 3600:
+                adiar_captura()
+
+Uso pela linha de comando (uma linha JSON por registro):
+    python telemetry_client.py /dev/ttyACM0 [/dev/ttyACM1 ...]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from offload_client import SerialLink, DEFAULT_BAUD
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+import log_transfer as lt  # noqa: E402
+import telemetry as tm  # noqa: E402
+
+# Campo inteiro -> (nome convertido, divisor)
+UNITS = {
+    "timestamp_ds": ("timestamp", 10.0),
+    "Vbatt_uV": ("Vbatt", 1e6),
+    "Vload_uV": ("Vload", 1e6),
+    "Iload_uA": ("Iload_mA", 1e3),
+    "Ibatt_uA": ("Ibatt_mA", 1e3),
+    "SoC_mp": ("SoC", 1e3),
+    "Temp_int_cC": ("Temp_int", 100.0),
+    "Temp_ext_cC": ("Temp_ext", 100.0),
+    "Humidity_cp": ("Humidity", 100.0),
+    "rate_uA": ("rate_mA", 1e3),
+    "slope_mp_h": ("slope_pct_h", 1e3),
+}
+
+
+def convert(record):
+    """Troca os campos inteiros pelos valores em unidades de engenharia."""
+    out = {}
+    for key, value in record.items():
+        unit = UNITS.get(key)
+        if unit is None:
+            out[key] = value
+        else:
+            out[unit[0]] = None if value is None else value / unit[1]
+    return out
+
+
+class TelemetryReceiver:
+    """Fluxo assincrono de registros de um dispositivo."""
+
+    def __init__(self, path, baud=DEFAULT_BAUD, raw=False, queue_len=1024):
+        """
+        Args:
+            path: porta serial (ou pty)
+            raw: True entrega os inteiros originais, sem conversao
+            queue_len: registros guardados se o consumidor atrasar
+                       (descarta os mais antigos, como o dispositivo)
+        """
+        self.path = path
+        self.baud = baud
+        self.raw = raw
+        self.parser = lt.FrameParser()
+        self.queue = asyncio.Queue(queue_len)
+        self.link = None
+        self.received = 0
+        self.lost = 0
+        self.dropped = 0
+        self._last_seq = None
+        self._closed = False
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def open(self):
+        self.link = SerialLink(self.path, self.baud)
+        asyncio.get_running_loop().add_reader(self.link.fd, self._on_readable)
+
+    def close(self):
+        if self.link is not None:
+            asyncio.get_running_loop().remove_reader(self.link.fd)
+            self.link.close()
+            self.link = None
+        self._closed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.link.fd, 65536)
+        except OSError:
+            data = b""
+        if not data:
+            self.close()
+            return
+        for ftype, payload in self.parser.feed(data):
+            record = tm.decode(ftype, payload)
+            if record is None:
+                continue
+            seq = record["seq"]
+            if self._last_seq is not None:
+                self.lost += (seq - self._last_seq - 1) & 0xFFFF
+            self._last_seq = seq
+            self.received += 1
+            record["port"] = self.path
+            if not self.raw:
+                record = convert(record)
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(record)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed and self.queue.empty():
+            raise StopAsyncIteration
+        record = await self.queue.get()
+        if record is None:
+            raise StopAsyncIteration
+        return record
+
+
+async def _print_port(path, baud, raw):
+    async with TelemetryReceiver(path, baud, raw) as rx:
+        async for record in rx:
+            print(json.dumps(record), flush=True)
+    print("{}: {} registros, {} perdidos".format(path, rx.received, rx.lost), file=sys.stderr)
+
+
+async def _main_async(args):
+    await asyncio.gather(*[_print_port(p, args.baud, args.raw) for p in args.ports])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receptor de telemetria binaria")
+    parser.add_argument("ports", nargs="+")
+    parser.add_argument("--baud", type=int, default=DEFAULT_BAUD)
+    parser.add_argument("--raw", action="store_true", help="inteiros sem conversao")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_main_async(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
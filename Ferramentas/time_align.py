@@ -0,0 +1,428 @@
+# time_align.py
+"""
+Tempo do Pico em UTC e juncoes "as-of" (PC)
+-------------------------------------------
+O timestamp dos logs e relativo (segundos desde o primeiro boot) e volta
+ao ultimo checkpoint a cada queda de energia. O time_sync.csv gravado
+pelo Pico (Codes/time_sync.py, pontos mandados por node_ctl.py
+--sync-time) divide a historia em epocas, uma por boot, cada uma com o
+arquivo de log em que comecou e o seq do seu evento BOOT. ClockModel
+ajusta cada epoca por minimos quadrados ponderados (peso 1/incerteza^2):
+
+    utc = utc_ref + (ts - ts_ref) * (1 + deriva)
+
+Epoca com um so ponto (ou pontos proximos demais) usa a deriva mediana
+das outras; epoca sem ponto fica sem UTC (NaN). A conversao e
+vetorizada: o arquivo de cada amostra da a epoca (searchsorted nos
+indices de inicio) e um multiply-add da o UTC.
+
+As juncoes "as-of" (cada captura recebe a ultima amostra antes dela) sao
+np.searchsorted sobre o UTC ordenado; a energia de uma janela sai da
+integral acumulada da potencia (trapezios), interpolada nas bordas: sem
+laco por captura, milhoes de amostras contra milhares de imagens em
+poucos segundos. Com SAMPLE_INTERVAL = 60 s, uma captura curta cai
+dentro de um intervalo e o valor e interpolado; para medir a captura em
+si, use intervalo menor ou as rajadas.
+
+Uso:
+    python time_align.py dados/no07/                       # epocas e ajuste
+    python time_align.py dados/no07/ --captures imagens.csv --window 20 --out custo.csv
+    python time_align.py dados/no07/ --captures imagens.csv --end-col fim --baseline-s 300
+    python time_align.py dados/no07/ --events --out eventos.csv
+    python time_align.py dados/no07/ --export amostras_utc.npz
+
+imagens.csv: CSV com cabecalho; a coluna de tempo (--time-col, padrao
+utc/time/timestamp ou a primeira) em segundos Unix ou ISO 8601 UTC.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+from log_reader import LogSet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Codes"))
+from event_log import EVENT_FILE, EVENT_NAMES, format_event, read_file  # noqa: E402
+from time_sync import SYNC_FILE, DRIFT_TOL_PPM  # noqa: E402
+
+TIME_COLUMNS = ("utc", "time", "timestamp")
+DEFAULT_WINDOW_S = 30.0
+DEFAULT_MAX_GAP_S = 300.0   # intervalo maior que isso nao entra na energia
+
+
+# ----------------------------------------------------------------------
+# Pontos de sincronia e modelo por epoca
+# ----------------------------------------------------------------------
+
+def read_sync(directories):
+    """
+    Linhas de time_sync.csv de uma ou mais pastas (descargas do mesmo no:
+    a compactacao do Pico corta o inicio, a uniao recupera). Returns lista
+    de (kind, log_index, boot_seq, ts, utc, err_ms, drift_ppm) sem repeticao.
+    """
+    if isinstance(directories, str):
+        directories = [directories]
+    rows = set()
+    for d in directories:
+        path = os.path.join(d, SYNC_FILE)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="") as f:
+            for rec in csv.DictReader(f):
+                try:
+                    rows.add((rec["kind"], int(rec["log_index"]), int(rec["boot_seq"]),
+                              float(rec["ts"]), float(rec["utc"]), int(rec["err_ms"]),
+                              float(rec["drift_ppm"])))
+                except (KeyError, TypeError, ValueError):
+                    continue   # linha cortada por queda de energia
+    return sorted(rows, key=lambda r: (r[1], r[2], r[3]))
+
+
+class ClockModel:
+    """utc = u_ref + (ts - t_ref) * slope, por epoca (boot)."""
+
+    def __init__(self, rows):
+        epochs = {}
+        for kind, index, seq, ts, utc, err, drift in rows:
+            ep = epochs.setdefault((index, seq), {"log_index": index, "boot_seq": seq,
+                                                  "ts": [], "utc": [], "err": [], "drift": drift})
+            ep["drift"] = drift
+            if kind != "boot" and np.isfinite(utc):
+                ep["ts"].append(ts)
+                ep["utc"].append(utc)
+                ep["err"].append(max(err, 1) / 1000.0)
+        self.epochs = [epochs[k] for k in sorted(epochs)]
+        for ep in self.epochs:
+            self._fit(ep)
+        fitted = [ep["drift_fit"] for ep in self.epochs if ep["drift_fit"] is not None]
+        if fitted:
+            self.drift_ppm = float(np.median(fitted))
+        elif self.epochs:
+            self.drift_ppm = self.epochs[-1]["drift"]   # estimativa do proprio Pico
+        else:
+            self.drift_ppm = 0.0
+        for ep in self.epochs:
+            if ep["drift_fit"] is None and ep["n"]:
+                self._fit(ep, self.drift_ppm)
+
+        self.log_index = np.array([ep["log_index"] for ep in self.epochs], dtype=np.int64)
+        self.t_ref = np.array([ep["t_ref"] for ep in self.epochs], dtype=np.float64)
+        self.u_ref = np.array([ep["u_ref"] for ep in self.epochs], dtype=np.float64)
+        self.slope = np.array([ep["slope"] for ep in self.epochs], dtype=np.float64)
+        by_seq = [i for i, ep in enumerate(self.epochs) if ep["boot_seq"] > 0]
+        by_seq.sort(key=lambda i: self.epochs[i]["boot_seq"])
+        self._seq_epoch = np.array(by_seq, dtype=np.int64)
+        self._seq = np.array([self.epochs[i]["boot_seq"] for i in by_seq], dtype=np.int64)
+
+    @staticmethod
+    def _fit(ep, drift_ppm=None):
+        """Minimos quadrados ponderados de utc - ts em ts (deriva = inclinacao)."""
+        ts = np.array(ep["ts"], dtype=np.float64)
+        utc = np.array(ep["utc"], dtype=np.float64)
+        w = 1.0 / np.square(np.array(ep["err"], dtype=np.float64))
+        ep["n"] = ts.size
+        ep["drift_fit"] = None
+        ep["rms_ms"] = None
+        if ts.size == 0:
+            ep["t_ref"] = ep["u_ref"] = ep["slope"] = np.nan
+            return
+        t_ref = float(np.average(ts, weights=w))
+        x = ts - t_ref
+        y = utc - ts
+        y_ref = float(np.average(y, weights=w))
+        d = None
+        if drift_ppm is None:
+            # Incerteza da inclinacao (erro dos extremos sobre o intervalo)
+            span = x.max() - x.min()
+            if ts.size >= 2 and span > 0 and (ep["err"][int(np.argmin(x))]
+                                               + ep["err"][int(np.argmax(x))]) * 1e6 <= DRIFT_TOL_PPM * span:
+                d = float(np.sum(w * x * (y - y_ref)) / np.sum(w * x * x))
+                ep["drift_fit"] = d * 1e6
+            else:
+                d = 0.0   # refeito depois com a deriva mediana
+        else:
+            d = drift_ppm * 1e-6
+        ep["t_ref"] = t_ref
+        ep["u_ref"] = t_ref + y_ref
+        ep["slope"] = 1.0 + d
+        resid = y - (y_ref + d * x)
+        ep["rms_ms"] = float(np.sqrt(np.average(np.square(resid), weights=w))) * 1000.0
+
+    def epoch_of_file(self, index):
+        """Epoca (indice em .epochs, -1 se antes da primeira) do arquivo de log index."""
+        return np.searchsorted(self.log_index, index, "right") - 1
+
+    def epoch_of_seq(self, seq):
+        """Epoca de um evento pelo seq (a ultima cujo BOOT veio antes; -1 se nenhuma)."""
+        if not self._seq.size:
+            return np.full(np.shape(seq), -1)
+        k = np.searchsorted(self._seq, seq, "right") - 1
+        return np.where(k >= 0, self._seq_epoch[np.maximum(k, 0)], -1)
+
+    def to_utc(self, ts, epoch):
+        """UTC (s Unix, float64) de ts do dispositivo na epoca (escalar ou array); NaN sem ajuste."""
+        ts = np.asarray(ts, dtype=np.float64)
+        epoch = np.asarray(epoch)
+        if not self.epochs:
+            return np.full(np.broadcast(ts, epoch).shape, np.nan)
+        e = np.maximum(epoch, 0)
+        out = self.u_ref[e] + (ts - self.t_ref[e]) * self.slope[e]
+        return np.where(epoch >= 0, out, np.nan)
+
+    def summary(self):
+        lines = ["{} epocas, deriva mediana {:+.1f} ppm".format(len(self.epochs), self.drift_ppm)]
+        for ep in self.epochs:
+            head = "  arquivo {:3d} (BOOT #{}):".format(ep["log_index"], ep["boot_seq"])
+            if not ep["n"]:
+                lines.append(head + " sem sincronia (sem UTC)")
+                continue
+            lines.append("{} {} pontos, deriva {:+.1f} ppm{}, residuo {:.1f} ms, primeiro ponto {}".format(
+                head, ep["n"], (ep["slope"] - 1.0) * 1e6,
+                "" if ep["drift_fit"] is not None else " (mediana)", ep["rms_ms"],
+                iso(ep["u_ref"] + (min(ep["ts"]) - ep["t_ref"]) * ep["slope"])))
+        return "\n".join(lines)
+
+
+def iso(utc):
+    """'2026-10-19T12:00:00.250Z' (vazio se NaN)."""
+    if not np.isfinite(utc):
+        return ""
+    return "{}Z".format(np.datetime64(int(round(utc * 1000)), "ms"))
+
+
+# ----------------------------------------------------------------------
+# Amostras em UTC e juncoes
+# ----------------------------------------------------------------------
+
+def load_utc(logs, model, columns):
+    """
+    Todas as amostras de um LogSet com "utc" (s Unix), ordenadas; as de
+    epocas sem sincronia ficam de fora. Returns (dict de arrays, descartadas).
+    """
+    names = ["utc"] + list(columns)
+    parts = {c: [] for c in names}
+    dropped = 0
+    for seg, chunk in logs.iter_raw(columns):
+        e = model.epoch_of_file(seg["index"])
+        utc = model.to_utc(chunk["timestamp"], e)
+        ok = np.isfinite(utc)
+        dropped += int(ok.size - np.count_nonzero(ok))
+        parts["utc"].append(utc[ok])
+        for c in columns:
+            parts[c].append(np.asarray(chunk[c])[ok])
+    out = {c: np.concatenate(p) if p else np.empty(0) for c, p in parts.items()}
+    if out["utc"].size > 1 and np.any(np.diff(out["utc"]) < 0):
+        # Epocas que se sobrepoem (relogio do PC acertado para tras, ...)
+        order = np.argsort(out["utc"], kind="stable")
+        out = {c: a[order] for c, a in out.items()}
+    return out, dropped
+
+
+def asof(t, ref_t, tolerance=None):
+    """
+    Indice em ref_t (ordenado) da ultima referencia <= cada t; -1 se nao
+    ha nenhuma ou se esta mais longe que tolerance (s).
+    """
+    i = np.searchsorted(ref_t, t, "right") - 1
+    if tolerance is not None:
+        ok = i >= 0
+        i[ok & (np.asarray(t) - ref_t[np.maximum(i, 0)] > tolerance)] = -1
+    return i
+
+
+def cumulative_energy(t, p, max_gap=DEFAULT_MAX_GAP_S):
+    """
+    Energia (J) e tempo coberto (s) acumulados desde a primeira amostra
+    (trapezios); intervalos maiores que max_gap (sem dados) valem zero.
+    """
+    dt = np.diff(t)
+    valid = dt <= max_gap
+    e = np.where(valid, (p[1:] + p[:-1]) * 0.5 * dt, 0.0)
+    covered = np.where(valid, dt, 0.0)
+    return (np.concatenate(([0.0], np.cumsum(e))),
+            np.concatenate(([0.0], np.cumsum(covered))))
+
+
+def window_energy(t, energy, covered, t0, t1):
+    """(energia J, fracao coberta) de cada janela [t0, t1] (arrays)."""
+    e = np.interp(t1, t, energy) - np.interp(t0, t, energy)
+    c = np.interp(t1, t, covered) - np.interp(t0, t, covered)
+    span = np.asarray(t1) - np.asarray(t0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(span > 0, c / span, np.nan)
+    return e, np.clip(frac, 0.0, 1.0)
+
+
+def parse_times(values):
+    """Segundos Unix (float64) de uma lista de textos: numeros ou ISO 8601 UTC."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        pass
+    text = [v.strip().rstrip("Zz").replace(" ", "T") for v in values]
+    ms = np.array(text, dtype="datetime64[ms]").astype(np.int64)
+    return ms / 1000.0
+
+
+def read_captures(path, time_col=None, end_col=None, duration_col=None):
+    """
+    (cabecalho, linhas, inicio, fim ou None) de um CSV de capturas;
+    fim vem de end_col (instante) ou de duration_col (s).
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [r for r in reader if r]
+
+    def column(name):
+        if name not in header:
+            raise ValueError("{}: sem coluna {} (ha {})".format(path, name, ", ".join(header)))
+        i = header.index(name)
+        return [r[i] for r in rows]
+
+    if time_col is None:
+        time_col = next((c for c in TIME_COLUMNS if c in header), header[0])
+    start = parse_times(column(time_col))
+    end = None
+    if end_col:
+        end = parse_times(column(end_col))
+    elif duration_col:
+        end = start + np.array(column(duration_col), dtype=np.float64)
+    return header, rows, start, end
+
+
+def capture_costs(samples, start, end, rail="load", baseline_s=0.0, max_gap=DEFAULT_MAX_GAP_S):
+    """
+    Energia de cada janela de captura, vetorizado. Returns dict de arrays:
+    energy_J, coverage, baseline_W, excess_J (energia acima da potencia
+    media dos baseline_s anteriores) e o estado antes da captura
+    (soc_before, vbatt_before, lag_s da amostra usada).
+    """
+    t = samples["utc"]
+    if rail == "load":
+        p = samples["Vload"] * samples["Iload_mA"] / 1000.0
+    else:
+        p = samples["Vbatt"] * samples["Ibatt_mA"] / 1000.0
+    energy, covered = cumulative_energy(t, p, max_gap)
+    e, frac = window_energy(t, energy, covered, start, end)
+    inside = (start >= t[0]) & (end <= t[-1]) if t.size else np.zeros(start.shape, bool)
+    e = np.where(inside, e, np.nan)
+    out = {"energy_J": e, "coverage": np.where(inside, frac, 0.0)}
+    if baseline_s > 0:
+        b0 = start - baseline_s
+        eb, fb = window_energy(t, energy, covered, b0, start)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            base = np.where((b0 >= t[0]) & (fb > 0), eb / (fb * baseline_s), np.nan)
+        out["baseline_W"] = base
+        out["excess_J"] = e - base * (end - start)
+    i = asof(start, t, tolerance=max_gap)
+    ok = i >= 0
+    j = np.maximum(i, 0)
+    out["soc_before"] = np.where(ok, samples["SoC"][j], np.nan)
+    out["vbatt_before"] = np.where(ok, samples["Vbatt"][j], np.nan)
+    out["lag_s"] = np.where(ok, start - t[j], np.nan)
+    return out
+
+
+def event_times(path, model):
+    """(registros, utc) dos eventos de um events.bin; NaN fora das epocas sincronizadas."""
+    _, recs = read_file(path)
+    if not recs:
+        return recs, np.empty(0)
+    seq = np.array([r[0] for r in recs], dtype=np.int64)
+    t = np.array([r[1] for r in recs], dtype=np.float64) / 10.0
+    return recs, model.to_utc(t, model.epoch_of_seq(seq))
+
+
+def _fmt(v):
+    if isinstance(v, float) or isinstance(v, np.floating):
+        return "" if not np.isfinite(v) else "{:.6g}".format(v)
+    return str(v)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tempo do Pico em UTC e juncoes com capturas/eventos")
+    ap.add_argument("directory", nargs="+", help="pasta(s) de descarga do mesmo no")
+    ap.add_argument("--base", choices=("ina_log", "ina_col"))
+    ap.add_argument("--captures", help="CSV de capturas do mini-computador")
+    ap.add_argument("--time-col", help="coluna do inicio da captura (padrao: utc/time/timestamp)")
+    ap.add_argument("--end-col", help="coluna do fim da captura")
+    ap.add_argument("--duration-col", help="coluna da duracao da captura (s)")
+    ap.add_argument("--window", type=float, default=DEFAULT_WINDOW_S,
+                    help="duracao da captura sem --end-col/--duration-col (s)")
+    ap.add_argument("--pre", type=float, default=0.0, help="comeca a janela antes da captura (s)")
+    ap.add_argument("--baseline-s", type=float, default=0.0,
+                    help="desconta a potencia media desse tempo antes da captura")
+    ap.add_argument("--rail", choices=("load", "batt"), default="load",
+                    help="potencia da carga (Vload*Iload) ou da bateria (Vbatt*Ibatt)")
+    ap.add_argument("--max-gap", type=float, default=DEFAULT_MAX_GAP_S,
+                    help="intervalo sem amostras que nao entra na energia (s)")
+    ap.add_argument("--events", nargs="?", const="", help="events.bin (padrao: o da pasta)")
+    ap.add_argument("--export", help="grava as amostras com utc em .npz")
+    ap.add_argument("--out", help="CSV de saida (padrao: stdout)")
+    args = ap.parse_args(argv)
+
+    model = ClockModel(read_sync(args.directory))
+    print(model.summary(), file=sys.stderr)
+    if not model.epochs:
+        print("ERRO sem {} em {}".format(SYNC_FILE, ", ".join(args.directory)), file=sys.stderr)
+        return 1
+    if args.captures is None and args.events is None and args.export is None:
+        return 0
+
+    t_load = time.perf_counter()
+    logs = LogSet(args.directory, args.base)
+    columns = ["Vbatt", "Vload", "Iload_mA", "Ibatt_mA", "SoC"]
+    samples, dropped = load_utc(logs, model, columns)
+    print("{} amostras em UTC ({} sem sincronia) em {:.1f} s".format(
+        samples["utc"].size, dropped, time.perf_counter() - t_load), file=sys.stderr)
+    if args.export:
+        np.savez(args.export, **samples)
+
+    header, rows = None, None
+    if args.captures is not None:
+        t_join = time.perf_counter()
+        header, rows, start, end = read_captures(args.captures, args.time_col,
+                                                 args.end_col, args.duration_col)
+        if end is None:
+            end = start + args.window
+        start = start - args.pre
+        cost = capture_costs(samples, start, end, args.rail, args.baseline_s, args.max_gap)
+        header = header + ["utc_start", "utc_end"] + list(cost)
+        rows = [r + [iso(a), iso(b)] + [_fmt(cost[k][n]) for k in cost]
+                for n, (r, a, b) in enumerate(zip(rows, start, end))]
+        print("{} capturas, energia media {:.3f} J, em {:.2f} s".format(
+            len(rows), float(np.nanmean(cost["energy_J"])) if len(rows) else 0.0,
+            time.perf_counter() - t_join), file=sys.stderr)
+    elif args.events is not None:
+        path = args.events or os.path.join(args.directory[0], EVENT_FILE)
+        recs, utc = event_times(path, model)
+        i = asof(utc, samples["utc"], tolerance=args.max_gap) if samples["utc"].size else \
+            np.full(utc.shape, -1)
+        j = np.maximum(i, 0)
+        header = ["utc", "seq", "event", "detail", "SoC", "Vbatt"]
+        rows = []
+        for n, rec in enumerate(recs):
+            soc = samples["SoC"][j[n]] if i[n] >= 0 else np.nan
+            vb = samples["Vbatt"][j[n]] if i[n] >= 0 else np.nan
+            rows.append([iso(utc[n]), rec[0], EVENT_NAMES.get(rec[2], rec[2]),
+                         format_event(rec).split(" ", 3)[-1], _fmt(soc), _fmt(vb)])
+    if rows is None:
+        return 0
+    f = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+    finally:
+        if args.out:
+            f.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())